@@ -1 +1,3 @@
 from .annoy_handler import AnnoyHandler
+from .async_handler import AsyncHandler, HandlerSaturatedError
+from .partitioned_handler import Partition, PartitionedHandler
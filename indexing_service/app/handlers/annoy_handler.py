@@ -1,15 +1,31 @@
-from gptcache.embedding import SentenceEmbedding
-from gptcache.embedding_storage import AnnoyEmbeddingStorage
+import logging
+from typing import List, Optional
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.embedding_storage import AnnoyEmbeddingStorage, SnapshotManager
+from gptcache.utils.metrics import BATCH_SIZE, QUERY_RESULTS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+_SEARCH_SECONDS = STAGE_SECONDS.labels("search")
+_QUERY_BATCH_SIZE = BATCH_SIZE.labels("query")
+_ADD_BATCH_SIZE = BATCH_SIZE.labels("add")
+_HITS = QUERY_RESULTS.labels("hit")
+_REJECTED = QUERY_RESULTS.labels("rejected")
+_EMPTY = QUERY_RESULTS.labels("empty")
 
 
 class AnnoyHandler:
     def __init__(
         self,
-        embedding: SentenceEmbedding,
+        embedding: BaseEmbedding,
         storage: AnnoyEmbeddingStorage,
+        snapshots: Optional[SnapshotManager] = None,
     ):
         self.s = embedding
         self.a = storage
+        self.snapshots = snapshots
 
     def handle_add(self, id: int, context: str) -> dict:
         """
@@ -33,7 +49,8 @@ class AnnoyHandler:
         """
         try:
             # Create embedding for the query
-            query_embedding = self.s.to_embedding(context)
+            with _ENCODE_SECONDS.time():
+                query_embedding = self.s.to_embedding(context)
 
             # Add the query to the Annoy index
             self.a.add_item(id, query_embedding)
@@ -42,56 +59,184 @@ class AnnoyHandler:
 
         return {"status": "success", "message": None}
 
-    def handle_query(self, context: str, distance_threshold: float) -> dict:
+    def handle_query(
+        self,
+        context: str,
+        distance_threshold: float,
+        similarity_threshold: Optional[float] = None,
+    ) -> dict:
         """
         Handles a query request by generating an embedding for the given context and querying
         the Annoy index to find the closest neighbor and its distance.
 
-        TODO: Currently does not throw ay errors, but should be updated to handle exceptions.
-        However, note that we do not need a fallback flow nessasarily, as this is meant for performance.
-        If something goes wrong and we get a cache miss, we can live with it. Howver need to investigate
-        error conditions here.
-
         Parameters:
         - context (str): The textual content for which to find the closest matching item
         in the Annoy index based on embedding similarity.
         - distance_threshold (float, optional): The maximum distance between the query
         embedding and a neighbor's embedding for the neighbor to be considered
-        sufficiently close. Defaults to 0.2.
+        sufficiently close. Defaults to 0.2. With the "dot" metric, whose values grow
+        as neighbors get closer, it is the minimum inner product instead.
+        - similarity_threshold (float, optional): The minimum cosine similarity for a
+        neighbor to be considered sufficiently close. When given, it is used instead of
+        `distance_threshold` and means the same for every index backend and metric.
 
         Returns:
         - dict: A dictionary containing the 'id' of the closest matching item (or `None`
-        if no such item is found within the threshold) and the 'distance' to this item
-        (or `None` if no item is within the threshold).
-        """
-        print(f"Querying with distance threshold: {distance_threshold}")
+        if no such item is found within the threshold), and the 'distance' and cosine
+        'similarity' to this item (or `None` if no item is within the threshold).
 
+        Raises:
+        - Exception: Errors of the model or the index are not caught, unlike in
+        `handle_add`, and the endpoint reports them as a 500. Saturated workers (429)
+        are raised before this method runs, by `AsyncHandler`.
+        """
         # Create embedding for the query
-        query_embedding = self.s.to_embedding(context)
+        with _ENCODE_SECONDS.time():
+            query_embedding = self.s.to_embedding(context)
+
+        with _SEARCH_SECONDS.time():
+            nn_ids, distances = self.a.get_nns_by_vector(query_embedding, n=1)
+        # Check if the closest neighbor is within the acceptable distance
+        result = self._match(nn_ids, distances, distance_threshold, similarity_threshold)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Query served.",
+                extra={
+                    "hit": result["id"] is not None,
+                    "nearest_id": nn_ids[0] if nn_ids else None,
+                    "nearest_distance": distances[0] if nn_ids else None,
+                    "distance_threshold": distance_threshold,
+                    "similarity_threshold": similarity_threshold,
+                },
+            )
+        return result
+
+    def handle_add_batch(self, ids: List[int], contexts: List[str]) -> List[dict]:
+        """
+        Adds several queries' embeddings to the Annoy index, encoding all contexts in a
+        single batched model call.
+
+        Parameters:
+        - ids (List[int]): The unique IDs of the queries, used as keys in the index.
+        - contexts (List[str]): The textual content of each query, in the same order.
+
+        Returns:
+        - List[dict]: One result per item, in the same form as `handle_add`. The batch
+        is added as a whole, so either every item succeeds or every item reports the
+        same error.
+        """
+        if len(ids) != len(contexts):
+            raise ValueError("Expected one context per ID.")
+        if not ids:
+            return []
 
-        nn_ids, distances = self.a.get_nns_by_vector(query_embedding, n=1)
+        _ADD_BATCH_SIZE.observe(len(ids))
+        try:
+            with _ENCODE_SECONDS.time():
+                vectors = self.s.to_embeddings(contexts)
+            self.a.add_items(ids, vectors)
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in ids]
+
+        return [{"status": "success", "message": None} for _ in ids]
+
+    def handle_query_batch(
+        self,
+        contexts: List[str],
+        distance_threshold: float,
+        similarity_threshold: Optional[float] = None,
+    ) -> List[dict]:
+        """
+        Handles several query requests at once, encoding all contexts in a single
+        batched model call.
+
+        Parameters:
+        - contexts (List[str]): The textual contents to find the closest matches for.
+        - distance_threshold (float): The maximum distance for a neighbor to count as a
+        match, or the minimum inner product with the "dot" metric.
+        - similarity_threshold (float, optional): The minimum cosine similarity for a
+        neighbor to count as a match, used instead of `distance_threshold` when given.
+
+        Returns:
+        - List[dict]: One result per context, in the same form as `handle_query`.
+        """
+        if not contexts:
+            return []
+
+        _QUERY_BATCH_SIZE.observe(len(contexts))
+        with _ENCODE_SECONDS.time():
+            vectors = self.s.to_embeddings(contexts)
+        with _SEARCH_SECONDS.time():
+            neighbours = self.a.get_nns_by_vectors(vectors, n=1)
+
+        results = [
+            self._match(nn_ids, distances, distance_threshold, similarity_threshold)
+            for nn_ids, distances in neighbours
+        ]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Batch of %d queries, %d within the threshold.",
+                len(contexts),
+                sum(result["id"] is not None for result in results),
+            )
+        return results
+
+    def _match(
+        self,
+        nn_ids: List[int],
+        distances: List[float],
+        distance_threshold: float,
+        similarity_threshold: Optional[float],
+    ) -> dict:
+        """
+        Returns the query result for the nearest neighbor, or an empty result if there
+        is none or it is not within the threshold.
+        """
         if len(nn_ids) > 0:
-            print(f"Nearest neighbor ID: {nn_ids[0]}")
-            print(f"Distance: {distances[0]}")
-            # Check if the closest neighbor is within the acceptable distance
-            if distances[0] <= distance_threshold:
-                print("Nearest neighbor found within the distance threshold.")
-                return {"id": nn_ids[0], "distance": distances[0]}
+            similarity = self.a.similarity(distances[0])
+            if similarity_threshold is not None:
+                matched = similarity >= similarity_threshold
+            elif self.a.metric == "dot":
+                # Inner products grow as neighbours get closer
+                matched = distances[0] >= distance_threshold
             else:
-                print("No neighbors found within the distance threshold.")
-                return {"id": None, "distance": None}
+                matched = distances[0] <= distance_threshold
+            if matched:
+                _HITS.inc()
+                return {"id": nn_ids[0], "distance": distances[0], "similarity": similarity}
+            _REJECTED.inc()
         else:
-            # Handles cases where the index is empty
-            print("No neighbors found in the index.")
-            return {"id": None, "distance": None}
+            _EMPTY.inc()
+        return {"id": None, "distance": None, "similarity": None}
+
+    def handle_remove(self, ids: List[int]) -> dict:
+        """
+        Removes entries from the Annoy index. Annoy cannot delete items, so the IDs are
+        tombstoned and filtered out of query results.
+
+        Parameters:
+        - ids (List[int]): The IDs to remove. Unknown IDs are ignored.
+
+        Returns:
+        - dict: {"status": "success", "removed": n} with the number of entries actually
+        removed, or {"status": "error", "message": str(e)} if the removal failed.
+        """
+        try:
+            removed = self.a.remove_ids(ids)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+        return {"status": "success", "removed": removed}
 
     def rebuild_index(self):
         """
-        Rebuilds the Annoy index in the background after adding a new item.
+        Builds every entry into a new Annoy forest now, and persists it as a new snapshot
+        when a `SnapshotManager` was given. Adds are searchable without it, and the
+        storage also rebuilds in the background once enough of them accumulate.
         """
         try:
             self.a.build_index(num_trees=10)
-        except Exception as e:
-            print(f"An error occurred while rebuilding the index: {str(e)}")
-        # TODO: Persist index?
-        # annoy.save('your_index_file.ann')
+            if self.snapshots is not None:
+                self.snapshots.save(self.a)
+        except Exception:
+            logger.exception("An error occurred while rebuilding the index.")
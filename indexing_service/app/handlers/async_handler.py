@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+class HandlerSaturatedError(Exception):
+    """
+    Raised when the executor already holds `max_pending` requests, so the caller can
+    reject the request immediately instead of queueing behind the backlog.
+    """
+
+
+class AsyncHandler:
+    """
+    Runs the blocking methods of a handler (embedding and index search) on a bounded
+    thread pool so they never block the asyncio event loop.
+
+    Threads rather than processes are used because both the model forward pass and
+    the FAISS search release the GIL, and the model and index can then be shared
+    instead of being copied into every worker.
+
+    Parameters:
+    - handler: A `FaissHandler` or `AnnoyHandler` whose methods are offloaded.
+    - max_workers (int): Number of threads executing handler calls concurrently.
+    - max_pending (int): Maximum number of requests either running or waiting for a
+    thread. Further requests raise `HandlerSaturatedError` straight away.
+    """
+
+    def __init__(self, handler, max_workers: int = 8, max_pending: int = 64):
+        if max_pending < max_workers:
+            raise ValueError("max_pending must be at least max_workers.")
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="index-worker"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise HandlerSaturatedError(
+                f"Too many pending requests (limit {self.max_pending})."
+            )
+        with self._lock:
+            self._pending += 1
+
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        # Release the slot when the work finishes, not when the awaiting coroutine
+        # does, so cancelled requests still count until their thread is free.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def _release(self, _):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    async def handle_add(self, id: int, context: str, **kwargs) -> dict:
+        return await self._run(self.handler.handle_add, id, context, **kwargs)
+
+    async def handle_query(self, context: str, distance_threshold: float, **kwargs) -> dict:
+        return await self._run(
+            self.handler.handle_query, context, distance_threshold, **kwargs
+        )
+
+    async def handle_add_batch(self, ids: List[int], contexts: List[str], **kwargs) -> List[dict]:
+        return await self._run(self.handler.handle_add_batch, ids, contexts, **kwargs)
+
+    async def handle_query_batch(
+        self, contexts: List[str], distance_threshold: float, **kwargs
+    ) -> List[dict]:
+        return await self._run(
+            self.handler.handle_query_batch, contexts, distance_threshold, **kwargs
+        )
+
+    async def handle_remove(self, ids: List[int], **kwargs) -> dict:
+        return await self._run(self.handler.handle_remove, ids, **kwargs)
+
+    async def handle_encode(self, contexts: List[str], **kwargs):
+        return await self._run(self.handler.handle_encode, contexts, **kwargs)
+
+    async def handle_scan(self, after: int, limit: int, **kwargs) -> dict:
+        return await self._run(self.handler.handle_scan, after, limit, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -1,17 +1,44 @@
-from gptcache.embedding import SentenceEmbedding
+import logging
+import math
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
 from gptcache.embedding_storage import FaissEmbeddingStorage
+from gptcache.fingerprint import FingerprintTier
+from gptcache.rerank import ExactReranker, RerankingSearch
+from gptcache.utils.metrics import BATCH_SIZE, QUERY_RESULTS, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_ENCODE_SECONDS = STAGE_SECONDS.labels("encode")
+_QUERY_BATCH_SIZE = BATCH_SIZE.labels("query")
+_ADD_BATCH_SIZE = BATCH_SIZE.labels("add")
+_HITS = QUERY_RESULTS.labels("hit")
+_REJECTED = QUERY_RESULTS.labels("rejected")
+_EMPTY = QUERY_RESULTS.labels("empty")
 
 
 class FaissHandler:
     def __init__(
         self,
-        embedding: SentenceEmbedding,
+        embedding: BaseEmbedding,
         storage: FaissEmbeddingStorage,
+        search: Optional[RerankingSearch] = None,
+        fingerprints: Optional[FingerprintTier] = None,
     ):
         self.s = embedding
         self.a = storage
+        # Candidate search and re-ranking; by default only the nearest neighbor is used
+        self.search = search or RerankingSearch(storage, k=1)
+        # Repeated texts are answered before the model and the index, when enabled
+        self.fingerprints = fingerprints
+        # Measures the entries the fingerprint tier found near a query
+        self._exact = ExactReranker(storage)
 
-    def handle_add(self, id: int, context: str) -> dict:
+    def handle_add(self, id: int, context: str, ttl_seconds: Optional[float] = None) -> dict:
         """
         Adds a new query's embedding to the Faiss index using the query's unique ID as the key.
 
@@ -19,6 +46,8 @@ class FaissHandler:
         - query (Query): An instance of the Query model containing the 'id' and 'context'
         of the query. The 'id' is used as the key in the Faiss index, and the 'context'
         is the textual content from which the embedding is generated.
+        - ttl_seconds (float, optional): How long the entry stays in the index before the
+        sweeper removes it. Defaults to no expiry.
 
         Returns:
         - dict: A dictionary indicating the result of the operation. It returns
@@ -33,54 +62,365 @@ class FaissHandler:
         """
         try:
             # Create embedding for the query
-            query_embedding = self.s.to_embedding(context)
+            with _ENCODE_SECONDS.time():
+                query_embedding = self.s.to_embedding(context)
 
             # Add the query to the Faiss index
-            self.a.add_item(id, query_embedding)
+            expires_at = time.time() + ttl_seconds if ttl_seconds else None
+            self.a.add_item(id, query_embedding, expires_at=expires_at)
+            self.search.remember([id], [context])
+            if self.fingerprints is not None:
+                self.fingerprints.add([id], [context])
         except Exception as e:
             return {"status": "error", "message": str(e)}
 
         return {"status": "success", "message": None}
 
-    def handle_query(self, context: str, distance_threshold: float) -> dict:
+    def handle_query(
+        self,
+        context: str,
+        distance_threshold: float,
+        similarity_threshold: Optional[float] = None,
+        return_candidates: bool = False,
+    ) -> dict:
         """
         Handles a query request by generating an embedding for the given context and querying
         the Faiss index to find the closest neighbor and its distance.
 
-        TODO: Currently does not throw ay errors, but should be updated to handle exceptions.
-        However, note that we do not need a fallback flow nessasarily, as this is meant for performance.
-        If something goes wrong and we get a cache miss, we can live with it. Howver need to investigate
-        error conditions here.
-
         Parameters:
         - context (str): The textual content for which to find the closest matching item
         in the Faiss index based on embedding similarity.
         - distance_threshold (float, optional): The maximum distance between the query
         embedding and a neighbor's embedding for the neighbor to be considered
         sufficiently close. Defaults to 0.2.
+        - similarity_threshold (float, optional): The minimum cosine similarity for a
+        neighbor to be considered sufficiently close. When given, it is used instead of
+        `distance_threshold` and means the same for every index backend and metric.
+        - return_candidates (bool): Whether to include the ranked candidates, with their
+        distances and scores, under 'candidates'.
 
         Returns:
         - dict: A dictionary containing the 'id' of the closest matching item (or `None`
-        if no such item is found within the threshold) and the 'distance' to this item
-        (or `None` if no item is within the threshold).
+        if no such item is found within the threshold), and the 'distance' and cosine
+        'similarity' to this item (or `None` if no item is within the threshold).
+        The best candidate is the first after re-ranking, if a reranker is configured.
+        Texts matched exactly by the fingerprint tier are served at distance 0 without
+        being encoded or searched, and near matches within the threshold without being
+        searched, unless the candidates were asked for.
+
+        Raises:
+        - Exception: Errors of the model or the index are not caught, unlike in
+        `handle_add`, and the endpoint reports them as a 500. Entries removed while the
+        query runs are not errors: a candidate removed before re-ranking is dropped, and
+        a near fingerprint match removed since the lookup is searched for instead.
+        Saturated workers (429) and unreachable shards (503) are raised before this
+        method runs, by `AsyncHandler` and `ShardedHandler`.
         """
-        print(f"Querying with distance threshold: {distance_threshold}")
+        near = None
+        if self.fingerprints is not None and not return_candidates:
+            result, near = self._match_fingerprint(context)
+            if result is not None:
+                return result
 
         # Create embedding for the query
-        query_embedding = self.s.to_embedding(context)
-
-        nn_ids, distances = self.a.get_nns_by_vector(query_embedding, n=1)
-        if len(nn_ids) > 0:
-            print(f"Nearest neighbor ID: {nn_ids[0]}")
-            print(f"Distance: {distances[0]}")
-            # Check if the closest neighbor is within the acceptable distance
-            if distances[0] <= distance_threshold:
-                print("Nearest neighbor found within the distance threshold.")
-                return {"id": nn_ids[0], "distance": distances[0]}
+        with _ENCODE_SECONDS.time():
+            query_embedding = self.s.to_embedding(context)
+        if near is not None:
+            result = self._verify_near(
+                near, context, query_embedding, distance_threshold, similarity_threshold
+            )
+            if result is not None:
+                return result
+
+        candidates = self.search.search(context, query_embedding)
+        # Check if the best candidate is within the acceptable distance
+        result = self._match(candidates, distance_threshold, similarity_threshold)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Query served.",
+                extra={
+                    "hit": result["id"] is not None,
+                    "nearest_id": candidates[0]["id"] if candidates else None,
+                    "nearest_distance": candidates[0]["distance"] if candidates else None,
+                    "distance_threshold": distance_threshold,
+                    "similarity_threshold": similarity_threshold,
+                },
+            )
+
+        if return_candidates:
+            result["candidates"] = candidates
+        return result
+
+    def handle_add_batch(
+        self,
+        ids: List[int],
+        contexts: List[str],
+        ttl_seconds: Optional[List[Optional[float]]] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Adds several queries' embeddings to the Faiss index, encoding all contexts in a
+        single batched model call and adding them in a single index call.
+
+        Parameters:
+        - ids (List[int]): The unique IDs of the queries, used as keys in the index.
+        - contexts (List[str]): The textual content of each query, in the same order.
+        - ttl_seconds (List[Optional[float]], optional): Per-item lifetime in the index,
+        as for `handle_add`.
+        - vectors (np.ndarray, optional): Embeddings computed by the caller with the same
+        model, one row per ID, added instead of encoding the contexts. Contexts may then
+        be empty, in which case they are not fingerprinted.
+
+        Returns:
+        - List[dict]: One result per item, in the same form as `handle_add`. The batch
+        is added as a whole, so either every item succeeds or every item reports the
+        same error.
+        """
+        if len(ids) != len(contexts):
+            raise ValueError("Expected one context per ID.")
+        if not ids:
+            return []
+
+        _ADD_BATCH_SIZE.observe(len(ids))
+        try:
+            if vectors is None:
+                with _ENCODE_SECONDS.time():
+                    vectors = self.s.to_embeddings(contexts)
+            now = time.time()
+            expires_at = [
+                now + ttl if ttl else None for ttl in ttl_seconds or [None] * len(ids)
+            ]
+            self.a.add_items(ids, vectors, expires_at=expires_at)
+            self.search.remember(ids, contexts)
+            if self.fingerprints is not None:
+                texts = [(i, c) for i, c in zip(ids, contexts) if c]
+                self.fingerprints.add([i for i, _ in texts], [c for _, c in texts])
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in ids]
+
+        return [{"status": "success", "message": None} for _ in ids]
+
+    def handle_query_batch(
+        self,
+        contexts: List[str],
+        distance_threshold: float,
+        similarity_threshold: Optional[float] = None,
+        return_candidates: bool = False,
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Handles several query requests at once: all contexts are encoded in a single
+        batched model call and searched in a single index call.
+
+        Parameters:
+        - contexts (List[str]): The textual contents to find the closest matches for.
+        - distance_threshold (float): The maximum distance for a neighbor to count as a match.
+        - similarity_threshold (float, optional): The minimum cosine similarity for a
+        neighbor to count as a match, used instead of `distance_threshold` when given.
+        - return_candidates (bool): Whether to include each query's ranked candidates.
+        - vectors (np.ndarray, optional): Embeddings computed by the caller with the same
+        model, one row per context, searched instead of encoding the contexts. Empty
+        contexts then skip the fingerprint tier.
+
+        Returns:
+        - List[dict]: One result per context, in the same form as `handle_query`.
+        """
+        if not contexts:
+            return []
+        if vectors is not None and len(vectors) != len(contexts):
+            raise ValueError("Expected one vector per context.")
+
+        _QUERY_BATCH_SIZE.observe(len(contexts))
+        results = [None] * len(contexts)
+        near = {}
+        if self.fingerprints is not None and not return_candidates:
+            for i, context in enumerate(contexts):
+                if context or vectors is None:
+                    results[i], near_id = self._match_fingerprint(context)
+                    if near_id is not None:
+                        near[i] = near_id
+        # Only the contexts the fingerprint tier did not answer are encoded and searched
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            pending_contexts = [contexts[i] for i in pending]
+            if vectors is None:
+                with _ENCODE_SECONDS.time():
+                    pending_vectors = self.s.to_embeddings(pending_contexts)
+            elif len(pending) == len(contexts):
+                pending_vectors = vectors
             else:
-                print("No neighbors found within the distance threshold.")
-                return {"id": None, "distance": None}
+                pending_vectors = vectors[pending]
+            if near:
+                for row, i in enumerate(pending):
+                    if i in near:
+                        results[i] = self._verify_near(
+                            near[i],
+                            contexts[i],
+                            pending_vectors[row],
+                            distance_threshold,
+                            similarity_threshold,
+                        )
+                rows = [row for row, i in enumerate(pending) if results[i] is None]
+                if len(rows) < len(pending):
+                    pending = [pending[row] for row in rows]
+                    pending_contexts = [contexts[i] for i in pending]
+                    pending_vectors = np.asarray(pending_vectors, dtype="float32")[rows]
+        if pending:
+            neighbours = self.search.search_batch(pending_contexts, pending_vectors)
+            for i, candidates in zip(pending, neighbours):
+                result = self._match(candidates, distance_threshold, similarity_threshold)
+                if return_candidates:
+                    result["candidates"] = candidates
+                results[i] = result
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Batch of %d queries, %d within the threshold.",
+                len(contexts),
+                sum(result["id"] is not None for result in results),
+            )
+        return results
+
+    def _match_fingerprint(self, context: str) -> Tuple[Optional[dict], Optional[int]]:
+        """
+        Looks a query up in the fingerprint tier. An entry added with the same text has
+        the same vector, so an exact match is returned as the query result, at distance
+        0 whatever the threshold. A near-identical text can still differ in meaning, so
+        a near match is only returned by ID, for `_verify_near` to measure.
+
+        Returns:
+        - Tuple[dict, int]: The result of an exact match, or the ID of a near match.
+        """
+        match = self.fingerprints.lookup(context, self.a)
+        if match is None:
+            return None, None
+        item_id, kind = match
+        if kind != "exact":
+            return None, item_id
+        _HITS.inc()
+        self.a.record_hit(item_id)
+        return {"id": item_id, "distance": 0.0, "similarity": self.a.similarity(0.0)}, None
+
+    def _verify_near(
+        self,
+        item_id: int,
+        context: str,
+        vector,
+        distance_threshold: float,
+        similarity_threshold: Optional[float],
+    ) -> Optional[dict]:
+        """
+        Returns the query result for an entry the fingerprint tier found near the query
+        if its exact distance is within the threshold, sparing the index search, or
+        `None` if the query has to be searched. The tier counts the match as a hit only
+        in the first case.
+        """
+        rescored = self._exact.rerank(context, vector, [{"id": item_id}], math.inf)
+        # Empty if the entry was removed since the lookup
+        hit = bool(rescored) and self._within(
+            rescored[0], distance_threshold, similarity_threshold
+        )
+        self.fingerprints.record_near(hit)
+        if not hit:
+            return None
+        candidate = rescored[0]
+        _HITS.inc()
+        self.a.record_hit(item_id)
+        return {
+            "id": item_id,
+            "distance": candidate["distance"],
+            "similarity": candidate["similarity"],
+        }
+
+    @staticmethod
+    def _within(
+        candidate: dict, distance_threshold: float, similarity_threshold: Optional[float]
+    ) -> bool:
+        if similarity_threshold is not None:
+            return candidate["similarity"] >= similarity_threshold
+        return candidate["distance"] <= distance_threshold
+
+    def _match(
+        self,
+        candidates: List[dict],
+        distance_threshold: float,
+        similarity_threshold: Optional[float],
+    ) -> dict:
+        """
+        Returns the query result for the best candidate, or an empty result if there
+        is none or it is not within the threshold.
+        """
+        if len(candidates) > 0:
+            best = candidates[0]
+            if self._within(best, distance_threshold, similarity_threshold):
+                _HITS.inc()
+                self.a.record_hit(best["id"])
+                return {
+                    "id": best["id"],
+                    "distance": best["distance"],
+                    "similarity": best["similarity"],
+                }
+            _REJECTED.inc()
         else:
-            # Handles cases where the index is empty
-            print("No neighbors found in the index.")
-            return {"id": None, "distance": None}
+            _EMPTY.inc()
+        return {"id": None, "distance": None, "similarity": None}
+
+    def handle_encode(self, contexts: List[str]) -> np.ndarray:
+        """
+        Encodes texts with the handler's model, e.g. for reader processes that share the
+        writer's model instead of loading their own.
+
+        Returns:
+        - np.ndarray: A float32 (N, d) matrix of embeddings, one row per context.
+        """
+        with _ENCODE_SECONDS.time():
+            return np.asarray(self.s.to_embeddings(contexts), dtype="float32")
+
+    def handle_scan(self, after: int, limit: int) -> dict:
+        """
+        Pages through the entries of the index in increasing ID order, e.g. to move
+        them to another shard.
+
+        Parameters:
+        - after (int): Only IDs above it are returned; -1 or less starts from the first.
+        - limit (int): Maximum number of entries returned.
+
+        Returns:
+        - dict: {"ids": [...], "ttl_seconds": [...], "vectors": np.ndarray} with the
+        remaining lifetime of each entry (None if it never expires) and its stored
+        vector, as returned by `get_vectors`.
+        """
+        ids = self.a.ids
+        ids = ids[ids > after]
+        if len(ids) > limit:
+            ids = np.partition(ids, limit - 1)[:limit]
+        ids = np.sort(ids).tolist()
+        vectors = self.a.get_vectors(ids) if ids else np.empty((0, self.a.dimension), "float32")
+        now = time.time()
+        ttl_seconds = []
+        for item_id in ids:
+            expires_at = self.a.metadata.expiry(item_id)
+            # Entries about to expire keep a short lifetime rather than none at all
+            ttl_seconds.append(max(expires_at - now, 1e-3) if expires_at else None)
+        return {"ids": ids, "ttl_seconds": ttl_seconds, "vectors": vectors}
+
+    def handle_remove(self, ids: List[int]) -> dict:
+        """
+        Removes entries from the Faiss index, e.g. after their responses were evicted or
+        expired from Redis.
+
+        Parameters:
+        - ids (List[int]): The IDs to remove. Unknown IDs are ignored.
+
+        Returns:
+        - dict: {"status": "success", "removed": n} with the number of entries actually
+        removed, or {"status": "error", "message": str(e)} if the removal failed.
+        """
+        try:
+            removed = self.a.remove_ids(ids)
+            self.search.forget(ids)
+            if self.fingerprints is not None:
+                self.fingerprints.remove(ids)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+
+        return {"status": "success", "removed": removed}
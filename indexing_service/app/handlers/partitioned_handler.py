@@ -0,0 +1,333 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from gptcache.embedding_storage import (
+    BaseEmbeddingStorage,
+    SnapshotFollower,
+    SnapshotManager,
+    TTLSweeper,
+    WriteAheadLog,
+)
+
+logger = logging.getLogger(__name__)
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def partition_dirname(namespace: str) -> str:
+    """
+    Returns a directory name for a namespace: the namespace itself if it is a short,
+    filesystem-safe name, otherwise a hash of it.
+    """
+    if _SAFE_NAME.match(namespace) and namespace not in (".", ".."):
+        return namespace
+    return "ns-" + hashlib.blake2b(namespace.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Partition:
+    """
+    One namespace's index, together with the handler serving it and the background
+    components persisting and maintaining it.
+
+    Parameters:
+    - name (str): The namespace.
+    - handler: A `FaissHandler` or `AnnoyHandler` over `storage`.
+    - storage (BaseEmbeddingStorage): The partition's index.
+    - snapshots (SnapshotManager, optional): Stopped on close, writing a final snapshot.
+    - sweeper (TTLSweeper, optional): Stopped on close.
+    - wal (WriteAheadLog, optional): Closed on close.
+    - publisher (SnapshotManager, optional): Publishes the index to reader processes;
+    stopped on close, publishing a final generation.
+    - follower (SnapshotFollower, optional): Keeps a reader's replica of the index up to
+    date; stopped on close.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler,
+        storage: BaseEmbeddingStorage,
+        snapshots: Optional[SnapshotManager] = None,
+        sweeper: Optional[TTLSweeper] = None,
+        wal: Optional[WriteAheadLog] = None,
+        publisher: Optional[SnapshotManager] = None,
+        follower: Optional[SnapshotFollower] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.storage = storage
+        self.snapshots = snapshots
+        self.sweeper = sweeper
+        self.wal = wal
+        self.publisher = publisher
+        self.follower = follower
+        self.active = 0  # Requests currently using the partition
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.follower is not None:
+            self.follower.stop()
+        if self.sweeper is not None:
+            self.sweeper.stop()
+        if self.snapshots is not None:
+            self.snapshots.stop(self.storage)
+        if self.publisher is not None:
+            self.publisher.stop(self.storage)
+        if self.wal is not None:
+            self.wal.close()
+
+    def snapshot(self) -> dict:
+        stats = {
+            "size": len(self.storage),
+            "tombstones": len(getattr(self.storage, "tombstones", ())),
+            "capacity": getattr(self.storage, "capacity", None),
+            "evicted": getattr(self.storage, "evicted", 0),
+            "idle_seconds": time.monotonic() - self.last_used,
+        }
+        if self.sweeper is not None:
+            stats["expired_removed"] = self.sweeper.removed
+            stats["compactions"] = self.sweeper.compactions
+        if self.publisher is not None:
+            latest = self.publisher.latest()
+            stats["published_generation"] = latest[0] if latest is not None else None
+        if self.follower is not None:
+            stats["generation"] = self.follower.generation
+            stats["reloads"] = self.follower.reloads
+        search = getattr(self.handler, "search", None)
+        if search is not None:
+            stats["search"] = search.stats.snapshot()
+        fingerprints = getattr(self.handler, "fingerprints", None)
+        if fingerprints is not None:
+            stats["fingerprint"] = fingerprints.stats.snapshot()
+        return stats
+
+
+class PartitionedHandler:
+    """
+    Routes every request to the index of its namespace, so entries cached for one
+    model, system prompt or tenant are never returned for another, and each query only
+    searches its own partition.
+
+    Partitions are built by `factory` the first time their namespace is used, which
+    typically restores them from their own snapshot directory. Partitions unused for
+    `idle_seconds` are closed, writing a final snapshot, and dropped from memory; the
+    next request for them loads them again. The default namespace is never unloaded.
+
+    Parameters:
+    - factory (callable): Builds the `Partition` of a namespace.
+    - idle_seconds (float, optional): Time after which an unused partition is
+    unloaded. Partitions stay loaded forever without it.
+    - max_loaded (int, optional): Maximum number of loaded partitions. Beyond it the
+    least recently used idle partitions are unloaded straight away.
+    - default_namespace (str): Namespace of requests that do not name one.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Partition],
+        idle_seconds: Optional[float] = None,
+        max_loaded: Optional[int] = None,
+        default_namespace: str = "default",
+    ):
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self.max_loaded = max_loaded
+        self.default_namespace = default_namespace
+        self.unloaded = 0
+
+        self._lock = threading.Lock()
+        self._partitions: Dict[str, Partition] = {}
+        # Serialises loading and unloading of each namespace
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # Evictions of partitions that were unloaded before they were drained
+        self._evictions: List[int] = []
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def partitions(self) -> Dict[str, Partition]:
+        with self._lock:
+            return dict(self._partitions)
+
+    def _acquire(self, name: str) -> Partition:
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is not None:
+                partition.active += 1
+                return partition
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                partition = self._partitions.get(name)
+                if partition is not None:
+                    partition.active += 1
+                    return partition
+            # Loading can take a while, so other namespaces are served meanwhile
+            logger.info("Loading index partition %s.", name)
+            partition = self.factory(name)
+            with self._lock:
+                partition.active += 1
+                self._partitions[name] = partition
+
+        if self.max_loaded is not None and len(self._partitions) > self.max_loaded:
+            self._unload(self._least_recently_used(len(self._partitions) - self.max_loaded))
+        return partition
+
+    @contextmanager
+    def partition(self, namespace: Optional[str] = None):
+        """
+        Yields the partition of `namespace`, loading it if needed. It is not unloaded
+        while in use.
+        """
+        partition = self._acquire(namespace or self.default_namespace)
+        try:
+            yield partition
+        finally:
+            with self._lock:
+                partition.active -= 1
+                partition.last_used = time.monotonic()
+
+    def handle_add(self, id: int, context: str, namespace: Optional[str] = None, **kwargs) -> dict:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_add(id, context, **kwargs)
+
+    def handle_query(
+        self, context: str, distance_threshold: float, namespace: Optional[str] = None, **kwargs
+    ) -> dict:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_query(context, distance_threshold, **kwargs)
+
+    def handle_add_batch(
+        self, ids: List[int], contexts: List[str], namespace: Optional[str] = None, **kwargs
+    ) -> List[dict]:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_add_batch(ids, contexts, **kwargs)
+
+    def handle_query_batch(
+        self,
+        contexts: List[str],
+        distance_threshold: float,
+        namespace: Optional[str] = None,
+        **kwargs,
+    ) -> List[dict]:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_query_batch(contexts, distance_threshold, **kwargs)
+
+    def handle_remove(self, ids: List[int], namespace: Optional[str] = None) -> dict:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_remove(ids)
+
+    def handle_encode(self, contexts: List[str], namespace: Optional[str] = None):
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_encode(contexts)
+
+    def handle_scan(self, after: int, limit: int, namespace: Optional[str] = None) -> dict:
+        with self.partition(namespace) as partition:
+            return partition.handler.handle_scan(after, limit)
+
+    def drain_evictions(self, limit: Optional[int] = None) -> List[int]:
+        """
+        Returns and forgets the IDs evicted from any partition since the last call.
+        """
+        with self._lock:
+            drained = self._evictions[:limit]
+            del self._evictions[: len(drained)]
+            partitions = list(self._partitions.values())
+        for partition in partitions:
+            if limit is not None and len(drained) >= limit:
+                break
+            drain = getattr(partition.storage, "drain_evictions", None)
+            if drain is not None:
+                drained.extend(drain(None if limit is None else limit - len(drained)))
+        return drained
+
+    def _least_recently_used(self, count: int) -> List[str]:
+        with self._lock:
+            candidates = sorted(
+                (p for p in self._partitions.values() if p.name != self.default_namespace),
+                key=lambda p: p.last_used,
+            )
+            return [p.name for p in candidates[:count]]
+
+    def _unload(self, names: List[str], idle_since: Optional[float] = None) -> List[str]:
+        unloaded = []
+        for name in names:
+            with self._lock:
+                load_lock = self._load_locks.setdefault(name, threading.Lock())
+            with load_lock:
+                with self._lock:
+                    partition = self._partitions.get(name)
+                    if partition is None or partition.active > 0:
+                        continue
+                    if idle_since is not None and partition.last_used > idle_since:
+                        continue
+                    del self._partitions[name]
+                try:
+                    partition.close()
+                except Exception:
+                    logger.exception("An error occurred while unloading index partition %s.", name)
+                drain = getattr(partition.storage, "drain_evictions", None)
+                if drain is not None:
+                    with self._lock:
+                        self._evictions.extend(drain())
+                logger.info("Unloaded idle index partition %s.", name)
+                self.unloaded += 1
+                unloaded.append(name)
+        return unloaded
+
+    def unload_idle(self, now: Optional[float] = None) -> List[str]:
+        """
+        Unloads the partitions unused for `idle_seconds` and returns their names.
+        """
+        if self.idle_seconds is None:
+            return []
+        idle_since = (time.monotonic() if now is None else now) - self.idle_seconds
+        return self._unload(self._least_recently_used(len(self._partitions)), idle_since)
+
+    def start(self, preload: Optional[List[str]] = None):
+        """
+        Loads the `preload` namespaces and starts unloading idle partitions.
+        """
+        for name in preload or []:
+            with self.partition(name):
+                pass
+        if self._thread is not None or self.idle_seconds is None:
+            return
+
+        def run():
+            while not self._stop.wait(min(self.idle_seconds, 10.0)):
+                try:
+                    self.unload_idle()
+                except Exception:
+                    logger.exception("An error occurred while unloading idle partitions.")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="partition-unloader", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops unloading idle partitions and closes every loaded partition.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        for name, partition in self.partitions.items():
+            try:
+                partition.close()
+            except Exception:
+                logger.exception("An error occurred while closing index partition %s.", name)
+
+    def snapshot(self) -> dict:
+        return {
+            "loaded": {name: p.snapshot() for name, p in self.partitions.items()},
+            "unloaded": self.unloaded,
+        }
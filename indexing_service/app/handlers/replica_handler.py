@@ -0,0 +1,92 @@
+from typing import List, Optional
+
+from app.handlers.async_handler import HandlerSaturatedError
+from app.transport import protocol
+from app.transport.client import BinaryProtocolError
+from app.transport.remote import ClientPool
+
+
+class ReplicaHandler:
+    """
+    Serves a reader process: queries are answered from the local, read-only replica of
+    the index, while adds and removals are forwarded to the writer process over the
+    binary protocol. The writer owns every mutation and publishes them in the next
+    generation of its snapshots, which the replica then maps, so a forwarded add is
+    visible to queries after at most one publish interval.
+
+    Parameters:
+    - handler: A `PartitionedHandler` over the replicated partitions.
+    - writer (ClientPool): Connections to the writer process.
+    """
+
+    def __init__(self, handler, writer: ClientPool):
+        self.handler = handler
+        self.writer = writer
+
+    def _forward(self, fn):
+        """
+        Calls `fn` with a client of the writer. A busy writer is reported as this
+        process being saturated, so callers back off the same way.
+        """
+        try:
+            return self.writer.call(fn)
+        except BinaryProtocolError as e:
+            if e.status == protocol.STATUS_BUSY:
+                raise HandlerSaturatedError(str(e))
+            raise
+
+    def handle_add(
+        self,
+        id: int,
+        context: str,
+        namespace: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> dict:
+        return self.handle_add_batch(
+            [id], [context], namespace=namespace, ttl_seconds=[ttl_seconds]
+        )[0]
+
+    def handle_add_batch(
+        self,
+        ids: List[int],
+        contexts: List[str],
+        namespace: Optional[str] = None,
+        ttl_seconds: Optional[List[Optional[float]]] = None,
+        vectors=None,
+    ) -> List[dict]:
+        if len(ids) != len(contexts):
+            raise ValueError("Expected one context per ID.")
+        if not ids:
+            return []
+        try:
+            self._forward(
+                lambda client: client.add(ids, contexts, ttl_seconds, namespace, vectors)
+            )
+        except HandlerSaturatedError:
+            raise
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in ids]
+        return [{"status": "success", "message": None} for _ in ids]
+
+    def handle_remove(self, ids: List[int], namespace: Optional[str] = None) -> dict:
+        try:
+            removed = self._forward(lambda client: client.remove(ids, namespace))
+        except HandlerSaturatedError:
+            raise
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+        return {"status": "success", "removed": removed}
+
+    def handle_query(self, context: str, distance_threshold: float, **kwargs) -> dict:
+        return self.handler.handle_query(context, distance_threshold, **kwargs)
+
+    def handle_query_batch(
+        self, contexts: List[str], distance_threshold: float, **kwargs
+    ) -> List[dict]:
+        return self.handler.handle_query_batch(contexts, distance_threshold, **kwargs)
+
+    def handle_encode(self, contexts: List[str], **kwargs):
+        return self.handler.handle_encode(contexts, **kwargs)
+
+    def handle_scan(self, after: int, limit: int, **kwargs) -> dict:
+        return self.handler.handle_scan(after, limit, **kwargs)
@@ -0,0 +1,514 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.utils.metrics import REGISTRY
+
+from app.sharding.placement import Placement
+from app.transport.client import BinaryClient
+from app.transport.remote import ClientPool, parse_address
+
+logger = logging.getLogger(__name__)
+
+SHARD_REQUEST_SECONDS = REGISTRY.histogram(
+    "gptcache_shard_request_seconds",
+    "Time for a shard to answer a request of the coordinator.",
+    ("op", "outcome"),
+)
+
+
+class ShardsUnavailableError(Exception):
+    """
+    Raised when none of the shards a query was sent to answered it.
+    """
+
+
+class ShardStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.last_error: Optional[str] = None
+
+    def record(self, error: Optional[Exception] = None, timed_out: bool = False):
+        with self._lock:
+            self.requests += 1
+            if timed_out:
+                self.timeouts += 1
+            elif error is not None:
+                self.errors += 1
+            if error is not None:
+                self.last_error = str(error)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "last_error": self.last_error,
+            }
+
+
+class ShardedHandler:
+    """
+    Serves an index split across several shard processes, each a standalone indexing
+    service reached over the binary protocol, for indexes larger than one process's
+    memory or CPU.
+
+    Texts are encoded once, here, and shards are sent the vectors, so they never run
+    their model. A query is sent concurrently to the shards its placement targets and
+    each shard's answer is awaited for at most `timeout_seconds`: a shard that is slow
+    or down only costs its own matches, counted in its stats, and the query fails only
+    if no shard answered. The best match of the answering shards wins. Adds go to the
+    owner of each entry; removals too when the placement can tell it from the ID.
+
+    `reshard` moves to a new placement, e.g. with more shards, while serving: adds go to
+    their new owners straight away, and until every entry is moved queries and
+    removals also reach every shard of the old placement.
+
+    Parameters:
+    - embedding (BaseEmbedding): The model shared with the shards.
+    - placement (Placement): Which shard owns each entry.
+    - timeout_seconds (float): How long each shard may take to answer.
+    - max_workers (int): Number of threads sending requests to shards.
+    """
+
+    def __init__(
+        self,
+        embedding: BaseEmbedding,
+        placement: Placement,
+        timeout_seconds: float = 1.0,
+        max_workers: int = 32,
+    ):
+        self.embedding = embedding
+        self.placement = placement
+        self.timeout_seconds = timeout_seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="shard-fanout"
+        )
+        self._lock = threading.Lock()
+        self._pools: Dict[str, ClientPool] = {}
+        self._stats: Dict[str, ShardStats] = {}
+        # Namespaces seen since startup, moved by `reshard` by default
+        self.namespaces: Set[Optional[str]] = {None}
+
+        # Shards of the previous placement while `reshard` moves their entries, and
+        # the IDs added or removed meanwhile, whose older copies are not carried over.
+        # All three, and the placement, change together under `_routing`, which also
+        # counts the writes routed by the placement alone that are still running.
+        self._routing = threading.Condition()
+        self._draining: List[str] = []
+        self._added: Set[int] = set()
+        self._removed: Set[int] = set()
+        self._writes = 0
+        self._reshard_lock = threading.Lock()
+        self.rebalance: Optional[dict] = None
+
+    def _pool(self, shard: str) -> ClientPool:
+        with self._lock:
+            pool = self._pools.get(shard)
+            if pool is None:
+                pool = self._pools[shard] = ClientPool(
+                    parse_address(shard), timeout=self.timeout_seconds
+                )
+                self._stats[shard] = ShardStats()
+            return pool
+
+    def _fan_out(self, op: str, calls: Dict[str, Callable[[BinaryClient], object]]) -> dict:
+        """
+        Runs each shard's call concurrently and returns its result, or the exception it
+        raised, by shard. Calls still running after `timeout_seconds` are abandoned
+        with a `TimeoutError`.
+        """
+
+        def timed(shard, fn):
+            started = time.perf_counter()
+            try:
+                result = self._pool(shard).call(fn)
+            except Exception as e:
+                outcome = "timeout" if isinstance(e, TimeoutError) else "error"
+                SHARD_REQUEST_SECONDS.labels(op, outcome).observe(time.perf_counter() - started)
+                raise
+            SHARD_REQUEST_SECONDS.labels(op, "ok").observe(time.perf_counter() - started)
+            return result
+
+        for shard in calls:
+            self._pool(shard)
+        futures = {shard: self.executor.submit(timed, shard, fn) for shard, fn in calls.items()}
+        done, _ = wait(futures.values(), timeout=self.timeout_seconds)
+        results = {}
+        for shard, future in futures.items():
+            stats = self._stats[shard]
+            if future not in done:
+                future.cancel()
+                error = TimeoutError(f"Shard {shard} did not answer in time.")
+                SHARD_REQUEST_SECONDS.labels(op, "timeout").observe(self.timeout_seconds)
+                stats.record(error, timed_out=True)
+                results[shard] = error
+            elif future.exception() is not None:
+                # The connection's own timeout can expire just before the wait does
+                error = future.exception()
+                stats.record(error, timed_out=isinstance(error, TimeoutError))
+                results[shard] = error
+            else:
+                stats.record()
+                results[shard] = future.result()
+        return results
+
+    def _encode(self, contexts: List[str], vectors: Optional[np.ndarray]) -> np.ndarray:
+        if vectors is None:
+            return np.asarray(self.embedding.to_embeddings(contexts), dtype="float32")
+        if len(vectors) != len(contexts):
+            raise ValueError("Expected one vector per context.")
+        return np.asarray(vectors, dtype="float32")
+
+    def handle_query(
+        self, context: str, distance_threshold: float, namespace: Optional[str] = None, **kwargs
+    ) -> dict:
+        return self.handle_query_batch(
+            [context], distance_threshold, namespace=namespace, **kwargs
+        )[0]
+
+    def handle_query_batch(
+        self,
+        contexts: List[str],
+        distance_threshold: float,
+        namespace: Optional[str] = None,
+        similarity_threshold: Optional[float] = None,
+        return_candidates: bool = False,
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Searches the targeted shards for every context and returns, per context, the
+        match with the highest similarity among their answers, in the same form as
+        `FaissHandler.handle_query_batch`. Candidates are not returned by shards.
+        """
+        if not contexts:
+            return []
+        vectors = self._encode(contexts, vectors)
+        self.namespaces.add(namespace)
+        with self._routing:
+            placement, draining = self.placement, self._draining
+
+        targets = placement.targets(vectors)
+        rows_by_shard = {
+            shard: np.flatnonzero(targets[:, column])
+            for column, shard in enumerate(placement.shards)
+        }
+        # Entries not moved yet may still be on any shard of the old placement
+        for shard in draining:
+            rows_by_shard[shard] = np.arange(len(contexts))
+
+        def query(rows):
+            return lambda client: client.query(
+                [contexts[row] for row in rows],
+                distance_threshold if similarity_threshold is None else None,
+                similarity_threshold,
+                namespace,
+                vectors[rows],
+            )
+
+        calls = {shard: query(rows) for shard, rows in rows_by_shard.items() if len(rows)}
+        answers = self._fan_out("query", calls)
+        if all(isinstance(answer, Exception) for answer in answers.values()):
+            raise ShardsUnavailableError(f"No shard answered: {next(iter(answers.values()))}")
+
+        results = [{"id": None, "distance": None, "similarity": None} for _ in contexts]
+        for shard, answer in answers.items():
+            if isinstance(answer, Exception):
+                continue
+            for row, result in zip(rows_by_shard[shard], answer):
+                best = results[row]
+                if result["id"] is not None and (
+                    best["id"] is None or result["similarity"] > best["similarity"]
+                ):
+                    results[row] = result
+        return results
+
+    def handle_add(
+        self,
+        id: int,
+        context: str,
+        namespace: Optional[str] = None,
+        ttl_seconds: Optional[float] = None,
+    ) -> dict:
+        return self.handle_add_batch(
+            [id], [context], namespace=namespace, ttl_seconds=[ttl_seconds]
+        )[0]
+
+    def handle_add_batch(
+        self,
+        ids: List[int],
+        contexts: List[str],
+        namespace: Optional[str] = None,
+        ttl_seconds: Optional[List[Optional[float]]] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Adds each item to the shard owning it. Items whose shard failed report its error.
+        """
+        if len(ids) != len(contexts):
+            raise ValueError("Expected one context per ID.")
+        if vectors is not None and len(vectors) != len(ids):
+            raise ValueError("Expected one vector per ID.")
+        if not ids:
+            return []
+        try:
+            vectors = self._encode(contexts, vectors)
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in ids]
+        self.namespaces.add(namespace)
+        ttl_seconds = ttl_seconds or [None] * len(ids)
+        placement, draining = self._route_write(ids, added=True)
+        try:
+            return self._add_to_owners(ids, contexts, namespace, ttl_seconds, vectors, placement)
+        finally:
+            self._write_done(draining)
+
+    def _route_write(self, ids: List[int], added: bool) -> Tuple[Placement, List[str]]:
+        """
+        Returns the placement and draining shards a write goes to, recording its IDs
+        while a reshard runs, or counting it as running otherwise, until `_write_done`.
+        """
+        with self._routing:
+            if self._draining:
+                if added:
+                    self._added.update(ids)
+                    self._removed.difference_update(ids)
+                else:
+                    self._removed.update(ids)
+            else:
+                self._writes += 1
+            return self.placement, self._draining
+
+    def _write_done(self, draining: List[str]):
+        if not draining:
+            with self._routing:
+                self._writes -= 1
+                self._routing.notify_all()
+
+    def _add_to_owners(
+        self,
+        ids: List[int],
+        contexts: List[str],
+        namespace: Optional[str],
+        ttl_seconds: List[Optional[float]],
+        vectors: np.ndarray,
+        placement: Placement,
+    ) -> List[dict]:
+        owners = placement.owners(ids, vectors)
+        rows_by_shard = {
+            shard: np.flatnonzero(owners == column) for column, shard in enumerate(placement.shards)
+        }
+
+        def add(rows):
+            return lambda client: client.add(
+                [ids[row] for row in rows],
+                [contexts[row] for row in rows],
+                [ttl_seconds[row] for row in rows],
+                namespace,
+                vectors[rows],
+            )
+
+        answers = self._fan_out(
+            "add", {shard: add(rows) for shard, rows in rows_by_shard.items() if len(rows)}
+        )
+        results = [None] * len(ids)
+        for shard, answer in answers.items():
+            result = (
+                {"status": "error", "message": str(answer)}
+                if isinstance(answer, Exception)
+                else {"status": "success", "message": None}
+            )
+            for row in rows_by_shard[shard]:
+                results[row] = result
+        return results
+
+    def handle_remove(self, ids: List[int], namespace: Optional[str] = None) -> dict:
+        placement, draining = self._route_write(ids, added=False)
+        try:
+            return self._remove_from_shards(ids, namespace, placement, draining)
+        finally:
+            self._write_done(draining)
+
+    def _remove_from_shards(
+        self,
+        ids: List[int],
+        namespace: Optional[str],
+        placement: Placement,
+        draining: List[str],
+    ) -> dict:
+        if placement.routes_ids and not draining:
+            owners = placement.owners(ids, None)
+            ids_by_shard = {
+                shard: [item_id for item_id, owner in zip(ids, owners) if owner == column]
+                for column, shard in enumerate(placement.shards)
+            }
+        else:
+            # The owner cannot be told from the ID, so every shard is asked
+            ids_by_shard = {shard: ids for shard in placement.shards + draining}
+
+        def remove(shard_ids):
+            return lambda client: client.remove(shard_ids, namespace)
+
+        answers = self._fan_out(
+            "remove",
+            {shard: remove(shard_ids) for shard, shard_ids in ids_by_shard.items() if shard_ids},
+        )
+        errors = [str(answer) for answer in answers.values() if isinstance(answer, Exception)]
+        if errors:
+            return {"status": "error", "message": "; ".join(errors)}
+        return {"status": "success", "removed": sum(answers.values())}
+
+    def handle_encode(self, contexts: List[str], **kwargs) -> np.ndarray:
+        return np.asarray(self.embedding.to_embeddings(contexts), dtype="float32")
+
+    def sample_vectors(self, size: int, namespace: Optional[str] = None) -> np.ndarray:
+        """
+        Returns up to `size` vectors taken evenly from the shards, e.g. to fit a
+        `ClusterPlacement`.
+        """
+        with self._routing:
+            shards = self.placement.shards + self._draining
+        limit = max(1, size // len(shards))
+        samples = []
+        for shard in shards:
+            _, _, vectors = self._pool(shard).call(
+                lambda client: client.scan(-1, limit, namespace)
+            )
+            samples.append(vectors)
+        return np.concatenate(samples)
+
+    @property
+    def resharding(self) -> bool:
+        return self._reshard_lock.locked()
+
+    def reshard(
+        self,
+        placement: Placement,
+        namespaces: Optional[List[Optional[str]]] = None,
+        batch_size: int = 256,
+    ) -> dict:
+        """
+        Switches to `placement` and moves every entry of the previous placement's
+        shards that belongs elsewhere to its new owner, copying it before removing
+        it, so it can always be found. Blocks until done; progress is reported by
+        `rebalance`. Entries keep their vectors and lifetimes but not their texts.
+
+        Parameters:
+        - placement (Placement): The new placement, e.g. with a shard added.
+        - namespaces (List[str], optional): The namespaces moved. Defaults to those
+        seen since startup and the default one.
+        - batch_size (int): Entries scanned and moved per request.
+
+        Returns:
+        - dict: The final progress, with the number of entries scanned and moved.
+        """
+        if not self._reshard_lock.acquire(blocking=False):
+            raise RuntimeError("A reshard is already running.")
+        try:
+            with self._routing:
+                previous = self.placement
+                self._draining = list(previous.shards)
+                self._added = set()
+                self._removed = set()
+                self.placement = placement
+                # Writes routed by the previous placement alone are not recorded, so
+                # they must have reached the shards before any entry is scanned
+                self._routing.wait_for(lambda: not self._writes)
+            status = {
+                "state": "running",
+                "from": previous.snapshot(),
+                "to": placement.snapshot(),
+                "scanned": 0,
+                "moved": 0,
+                "started_at": time.time(),
+            }
+            self.rebalance = status
+            for namespace in namespaces if namespaces is not None else list(self.namespaces):
+                for shard in previous.shards:
+                    self._move_off(shard, namespace, placement, batch_size, status)
+            # Every entry is on its owner now
+            with self._routing:
+                self._draining = []
+                self._added = set()
+                self._removed = set()
+            status["state"] = "done"
+            status["finished_at"] = time.time()
+            return status
+        except Exception as e:
+            # The old shards keep being searched, so nothing becomes unreachable
+            logger.exception("An error occurred while resharding.")
+            self.rebalance["state"] = "failed"
+            self.rebalance["error"] = str(e)
+            raise
+        finally:
+            self._reshard_lock.release()
+
+    def _move_off(
+        self,
+        shard: str,
+        namespace: Optional[str],
+        placement: Placement,
+        batch_size: int,
+        status: dict,
+    ):
+        pool = self._pool(shard)
+        column = placement.shards.index(shard) if shard in placement.shards else -1
+        after = -1
+        while True:
+            ids, ttls, vectors = pool.call(lambda client: client.scan(after, batch_size, namespace))
+            if not ids:
+                return
+            after = ids[-1]
+            status["scanned"] += len(ids)
+            owners = placement.owners(ids, vectors)
+            moved = np.flatnonzero(owners != column)
+            if not len(moved):
+                continue
+
+            # Entries added since the reshard started are already on their owner, and
+            # those removed since are not wanted anywhere
+            with self._routing:
+                skipped = self._added | self._removed
+            copied = [row for row in moved if ids[row] not in skipped]
+            for target in set(owners[copied].tolist()):
+                rows = [row for row in copied if owners[row] == target]
+                target_pool = self._pool(placement.shards[target])
+                target_pool.call(
+                    lambda client: client.add(
+                        [ids[row] for row in rows],
+                        [""] * len(rows),
+                        [ttls[row] for row in rows],
+                        namespace,
+                        vectors[rows],
+                    )
+                )
+                # A removal that reached the target before this copy did missed it
+                with self._routing:
+                    missed = [ids[row] for row in rows if ids[row] in self._removed]
+                if missed:
+                    target_pool.call(lambda client: client.remove(missed, namespace))
+            pool.call(lambda client: client.remove([ids[row] for row in moved], namespace))
+            status["moved"] += len(moved)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = {shard: s.snapshot() for shard, s in self._stats.items()}
+        return {
+            "placement": self.placement.snapshot(),
+            "timeout_seconds": self.timeout_seconds,
+            "draining": list(self._draining),
+            "shards": stats,
+            "rebalance": self.rebalance,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
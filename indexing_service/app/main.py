@@ -1,37 +1,794 @@
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, List, Optional
 
-from gptcache.embedding import SentenceEmbedding
-from gptcache.embedding_storage import FaissEmbeddingStorage
+import numpy as np
 
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from gptcache.embedding import (
+    BatchingEmbedding,
+    CachedEmbedding,
+    HashEmbedding,
+    OnnxEmbedding,
+    SentenceEmbedding,
+)
+from gptcache.embedding_storage import (
+    FaissEmbeddingStorage,
+    SnapshotFollower,
+    SnapshotManager,
+    TTLSweeper,
+    WriteAheadLog,
+)
+
+from gptcache.fingerprint import FingerprintTable, FingerprintTier, SimHashIndex
+from gptcache.rerank import (
+    CrossEncoderReranker,
+    ExactReranker,
+    LexicalReranker,
+    RerankingSearch,
+    TextStore,
+)
+from gptcache.utils.log import configure_logging
+from gptcache.utils.metrics import REGISTRY, STAGE_SECONDS
+
+from app.config import env_bool, env_float, env_int, env_str
+from app.handlers.async_handler import AsyncHandler, HandlerSaturatedError
 from app.handlers.faiss_handler import FaissHandler
-from app.models.request_model import AddRequest, QueryRequest
-from app.models.response_model import AddResponse, QueryResponse
+from app.handlers.partitioned_handler import (
+    Partition,
+    PartitionedHandler,
+    partition_dirname,
+)
+from app.handlers.replica_handler import ReplicaHandler
+from app.handlers.sharded_handler import ShardedHandler, ShardsUnavailableError
+from app.models.request_model import (
+    AddBatchRequest,
+    AddRequest,
+    QueryBatchRequest,
+    QueryRequest,
+    RemoveRequest,
+    ReshardRequest,
+)
+from app.models.response_model import (
+    AddBatchResponse,
+    AddResponse,
+    EvictionsResponse,
+    QueryBatchResponse,
+    QueryResponse,
+    RemoveResponse,
+    ReshardResponse,
+)
+from app.sharding import ClusterPlacement, HashPlacement, Placement
+from app.startup import Startup
+from app.transport import BinaryProtocolError, BinaryServer
+from app.transport.remote import ClientPool, RemoteEmbedding, parse_address
+
+
+DEFAULT_NAMESPACE = "default"
+
+configure_logging(env_str("LOG_LEVEL", "INFO"), env_str("LOG_FORMAT", "json"))
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "gptcache_request_seconds", "Time to serve a request.", ("endpoint", "status")
+)
+INDEX_ENTRIES = REGISTRY.gauge(
+    "gptcache_index_entries", "Live entries in the index.", ("namespace",)
+)
+INDEX_TOMBSTONES = REGISTRY.gauge(
+    "gptcache_index_tombstones", "Removed entries awaiting compaction.", ("namespace",)
+)
+INDEX_CAPACITY = REGISTRY.gauge(
+    "gptcache_index_capacity", "Maximum live entries, when bounded.", ("namespace",)
+)
+INDEX_EVICTED = REGISTRY.gauge(
+    "gptcache_index_evicted", "Entries evicted since the partition was loaded.", ("namespace",)
+)
+PENDING_REQUESTS = REGISTRY.gauge(
+    "gptcache_pending_requests", "Requests running or queued for an index worker."
+)
+READY = REGISTRY.gauge("gptcache_ready", "Whether startup has finished.")
+_PARSE_SECONDS = STAGE_SECONDS.labels("parse")
+
+
+partition_dir = env_str("PARTITION_DIR", "data/partitions")
+embedding_backend = env_str("EMBEDDING_BACKEND", "sentence_transformers")
+if embedding_backend not in ("sentence_transformers", "onnx", "hash"):
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {embedding_backend}")
+reranker_name = env_str("RERANKER", "none")
+if reranker_name not in ("none", "exact", "lexical", "cross_encoder"):
+    raise ValueError(f"Unknown RERANKER: {reranker_name}")
+
+# Several processes can serve one index: a single writer owns every mutation and the
+# model, and publishes the index to PUBLISH_DIR, ideally on tmpfs. Readers map the
+# published generations read only, encode with the writer's model and forward their
+# adds and removals to it, so they can run as many uvicorn workers. A coordinator
+# holds no index itself and spreads it across shards, standalone services.
+index_role = env_str("INDEX_ROLE", "standalone")
+if index_role not in ("standalone", "writer", "reader", "coordinator"):
+    raise ValueError(f"Unknown INDEX_ROLE: {index_role}")
+publish_dir = env_str("PUBLISH_DIR", "/dev/shm/gptcache")
+writer = None
+if index_role == "reader":
+    if reranker_name in ("lexical", "cross_encoder"):
+        raise ValueError("Readers cannot re-rank on texts, which only the writer keeps.")
+    if not env_str("WRITER_ADDR", ""):
+        raise ValueError("INDEX_ROLE=reader needs the WRITER_ADDR of the writer.")
+    writer = ClientPool(
+        parse_address(env_str("WRITER_ADDR", "")),
+        timeout=env_float("WRITER_TIMEOUT_SECONDS", 10.0),
+    )
+
+shard_centroids_path = env_str("SHARD_CENTROIDS", "data/shard_centroids.npy")
+
+
+def new_placement(
+    kind: str, shards: List[str], probe: int = 1, centroids: Optional[np.ndarray] = None
+) -> Placement:
+    """
+    Builds a placement of entries over `shards`. A cluster placement uses `centroids`,
+    or those saved to SHARD_CENTROIDS by the last reshard.
+    """
+    if kind == "hash":
+        return HashPlacement(shards)
+    if kind == "cluster":
+        if centroids is None:
+            if not os.path.exists(shard_centroids_path):
+                raise ValueError(
+                    "Cluster placement needs SHARD_CENTROIDS; reshard to it from hash first."
+                )
+            centroids = np.load(shard_centroids_path)
+        return ClusterPlacement(shards, centroids, probe=probe)
+    raise ValueError(f"Unknown SHARD_PLACEMENT: {kind}")
+
+
+sharded = None
+if index_role == "coordinator":
+    shard_addrs = [addr.strip() for addr in env_str("SHARD_ADDRS", "").split(",") if addr.strip()]
+    if not shard_addrs:
+        raise ValueError("INDEX_ROLE=coordinator needs the SHARD_ADDRS of its shards.")
+    # The model is attached once loaded
+    sharded = ShardedHandler(
+        None,
+        new_placement(
+            env_str("SHARD_PLACEMENT", "hash"), shard_addrs, probe=env_int("SHARD_PROBE", 1)
+        ),
+        timeout_seconds=env_float("SHARD_TIMEOUT_MS", 1000) / 1000,
+        max_workers=env_int("SHARD_FANOUT_WORKERS", 32),
+    )
+
+# Models and indexes are loaded by the lifespan hook, after the server is listening
+batching = None
+embedding = None
+cross_encoder = None
+# Indexes restored ahead of building their partition, by namespace
+restored = {}
+startup = Startup()
+
+
+def wait_for(ready: Callable[[], bool], what: str):
+    """
+    Waits until `ready` returns true, e.g. for the writer to finish starting, failing
+    startup after WRITER_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + env_float("WRITER_WAIT_SECONDS", 300)
+    while not ready():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Timed out waiting for {what}.")
+        time.sleep(0.5)
+
+
+def writer_ready() -> bool:
+    try:
+        writer.call(lambda client: client.encode([""]))
+    except (OSError, BinaryProtocolError):
+        return False
+    return True
+
+
+def load_embedding():
+    global batching, embedding
+    # The model runs either in PyTorch or, without it, as an exported ONNX graph;
+    # the hash backend needs no model and is only meant for benchmarks. Readers
+    # use the writer's model.
+    if index_role == "reader":
+        wait_for(writer_ready, "the writer")
+        model = RemoteEmbedding(writer)
+    elif embedding_backend == "sentence_transformers":
+        model = SentenceEmbedding(model_name="all-MiniLM-L6-v2")
+    elif embedding_backend == "hash":
+        model = HashEmbedding(dimension=384)
+    else:
+        model = OnnxEmbedding(
+            env_str("ONNX_MODEL_DIR", "models/all-MiniLM-L6-v2-onnx"),
+            model_file=env_str("ONNX_MODEL_FILE", "model.onnx"),
+            threads=env_int("ONNX_THREADS", 0) or None,
+        )
+
+    # Concurrent requests are coalesced into a single model call
+    batching = BatchingEmbedding(
+        model,
+        max_batch_size=env_int("EMBEDDING_MAX_BATCH_SIZE", 32),
+        max_wait_ms=env_float("EMBEDDING_MAX_WAIT_MS", 5.0),
+    )
+    # Repeated texts (e.g. a query miss followed by its add) are only encoded once
+    embedding = CachedEmbedding(
+        batching,
+        max_entries=env_int("EMBEDDING_CACHE_SIZE", 10000),
+        max_bytes=env_int("EMBEDDING_CACHE_MAX_MB", 64) * 1024 * 1024,
+        ttl_seconds=env_float("EMBEDDING_CACHE_TTL_SECONDS", 0) or None,
+        normalization=env_str("EMBEDDING_CACHE_NORMALIZATION", "whitespace"),
+    )
+
+
+def load_cross_encoder():
+    global cross_encoder
+    # The cross-encoder model is loaded once and shared by every partition
+    if reranker_name == "cross_encoder":
+        from sentence_transformers import CrossEncoder
+
+        cross_encoder = CrossEncoder(
+            env_str("CROSS_ENCODER_MODEL", "cross-encoder/stsb-distilroberta-base")
+        )
+
+
+default_ttl_seconds = env_float("INDEX_DEFAULT_TTL_SECONDS", 0) or None
+
+
+def restore_index(name: str) -> tuple:
+    """
+    Builds the index of a namespace and restores it from its snapshots and log. The
+    default namespace keeps the original, unpartitioned directories and limits, so
+    existing deployments keep their data.
+
+    Returns:
+    - tuple: The index, its write-ahead log (or `None`) and its snapshot manager.
+    """
+    if name == DEFAULT_NAMESPACE:
+        snapshot_dir = env_str("SNAPSHOT_DIR", "data/snapshots")
+        wal_dir = env_str("WAL_DIR", "data/wal")
+        vector_dir = env_str("RESCORE_VECTOR_DIR", "data/vectors")
+        max_entries = env_int("INDEX_MAX_ENTRIES", 0)
+        max_mb = env_int("INDEX_MAX_MB", 0)
+    else:
+        root = os.path.join(partition_dir, partition_dirname(name))
+        snapshot_dir = os.path.join(root, "snapshots")
+        wal_dir = os.path.join(root, "wal")
+        vector_dir = os.path.join(root, "vectors")
+        max_entries = env_int("PARTITION_MAX_ENTRIES", env_int("INDEX_MAX_ENTRIES", 0))
+        max_mb = env_int("PARTITION_MAX_MB", env_int("INDEX_MAX_MB", 0))
+
+    faiss = FaissEmbeddingStorage(
+        dimension=384,
+        index_type=env_str("FAISS_INDEX_TYPE", "flat"),
+        metric=env_str("FAISS_METRIC", "l2"),
+        nlist=env_int("FAISS_NLIST", 1024),
+        pq_m=env_int("FAISS_PQ_M", 48),
+        pq_nbits=env_int("FAISS_PQ_NBITS", 8),
+        hnsw_m=env_int("FAISS_HNSW_M", 32),
+        nprobe=env_int("FAISS_NPROBE", 16),
+        ef_search=env_int("FAISS_EF_SEARCH", 64),
+        ef_construction=env_int("FAISS_EF_CONSTRUCTION", 0) or None,
+        train_size=env_int("FAISS_TRAIN_SIZE", 0) or None,
+        max_entries=max_entries or None,
+        max_bytes=max_mb * 1024 * 1024 or None,
+        eviction_policy=env_str("EVICTION_POLICY", "lru"),
+        eviction_batch=env_int("EVICTION_BATCH", 64),
+        rescore_k=env_int("RESCORE_K", 0) or None,
+        vector_dir=vector_dir,
+    )
+
+    # Adds are logged so those made since the last snapshot survive a crash
+    wal = None
+    if env_bool("WAL_ENABLED", True):
+        wal = WriteAheadLog(
+            wal_dir,
+            dimension=384,
+            sync_interval_ms=env_float("WAL_SYNC_INTERVAL_MS", 10.0),
+            sync_batch=env_int("WAL_SYNC_BATCH", 64),
+            wait_for_sync=env_bool("WAL_WAIT_FOR_SYNC", True),
+        )
+
+    # Restore the semantic cache from the latest snapshot and the log written after it
+    snapshots = SnapshotManager(snapshot_dir, keep=env_int("SNAPSHOT_KEEP", 2), wal=wal)
+    snapshots.load_latest(faiss, mmap=env_bool("SNAPSHOT_MMAP", True))
+    faiss.wal = wal
+    return faiss, wal, snapshots
+
+
+def new_replica() -> FaissEmbeddingStorage:
+    # The index type must match the writer's, whose files the replica maps
+    return FaissEmbeddingStorage(
+        dimension=384,
+        index_type=env_str("FAISS_INDEX_TYPE", "flat"),
+        metric=env_str("FAISS_METRIC", "l2"),
+        nlist=env_int("FAISS_NLIST", 1024),
+        pq_m=env_int("FAISS_PQ_M", 48),
+        pq_nbits=env_int("FAISS_PQ_NBITS", 8),
+        hnsw_m=env_int("FAISS_HNSW_M", 32),
+        nprobe=env_int("FAISS_NPROBE", 16),
+        ef_search=env_int("FAISS_EF_SEARCH", 64),
+        rescore_k=env_int("RESCORE_K", 0) or None,
+    )
+
+
+def restore_replica(name: str) -> tuple:
+    """
+    Builds a reader's replica of the index of a namespace, mapping the latest
+    generation the writer published. The default namespace waits for the writer's
+    first one.
+
+    Returns:
+    - tuple: The replica, `None` for its write-ahead log, and its follower.
+    """
+    faiss = new_replica()
+    follower = SnapshotFollower(
+        SnapshotManager(os.path.join(publish_dir, partition_dirname(name))),
+        faiss,
+        interval_seconds=env_float("FOLLOW_INTERVAL_SECONDS", 0.5),
+    )
+    if name == DEFAULT_NAMESPACE:
+        wait_for(lambda: follower.poll() or follower.generation is not None, "a published index")
+    else:
+        follower.poll()
+    return faiss, None, follower
+
+
+def build_search(faiss: FaissEmbeddingStorage) -> RerankingSearch:
+    # Queries fetch the top-k candidates from the index, optionally re-ranked
+    texts = None
+    reranker = None
+    if reranker_name == "exact":
+        reranker = ExactReranker(faiss)
+    elif reranker_name in ("lexical", "cross_encoder"):
+        texts = TextStore(max_entries=env_int("RERANK_TEXT_STORE_SIZE", 100000))
+        if reranker_name == "lexical":
+            reranker = LexicalReranker(
+                texts,
+                weight=env_float("LEXICAL_WEIGHT", 0.5),
+                min_overlap=env_float("LEXICAL_MIN_OVERLAP", 0.0),
+            )
+        else:
+            reranker = CrossEncoderReranker(
+                texts,
+                min_score=env_float("CROSS_ENCODER_MIN_SCORE", 0.5),
+                model=cross_encoder,
+            )
+    search = RerankingSearch(
+        faiss,
+        reranker=reranker,
+        k=env_int("RERANK_K", 10 if reranker is not None else 1),
+        candidate_budget_ms=env_float("RERANK_CANDIDATE_BUDGET_MS", 0) or None,
+        rerank_budget_ms=env_float("RERANK_BUDGET_MS", 20) or None,
+        texts=texts,
+    )
+    return search
+
+
+def build_partition(name: str) -> Partition:
+    """
+    Builds the partition of a namespace around its restored index.
+    """
+    if index_role == "reader":
+        faiss, _, follower = restored.pop(name, None) or restore_replica(name)
+        follower.start()
+        # Expiry, persistence and fingerprints of adds are left to the writer
+        return Partition(
+            name, FaissHandler(embedding, faiss, build_search(faiss)), faiss, follower=follower
+        )
+
+    faiss, wal, snapshots = restored.pop(name, None) or restore_index(name)
+    snapshots.start(
+        faiss,
+        env_float("SNAPSHOT_INTERVAL_SECONDS", 300),
+        compact_bytes=env_int("WAL_COMPACT_MB", 64) * 1024 * 1024,
+    )
+
+    # Readers follow the index as it is published
+    publisher = None
+    if index_role == "writer":
+        publisher = SnapshotManager(
+            os.path.join(publish_dir, partition_dirname(name)), keep=env_int("PUBLISH_KEEP", 3)
+        )
+        publisher.save(faiss)
+        publisher.start(faiss, env_float("PUBLISH_INTERVAL_SECONDS", 1.0))
+
+    # Expired entries are removed in the background
+    sweeper = TTLSweeper(
+        faiss,
+        interval_seconds=env_float("SWEEP_INTERVAL_SECONDS", 30),
+        batch_size=env_int("SWEEP_BATCH_SIZE", 1024),
+        rebuild_threshold=env_float("TOMBSTONE_REBUILD_RATIO", 0.2),
+    )
+    sweeper.start()
+
+    search = build_search(faiss)
 
+    # Repeated texts are answered from their fingerprint, before the model and the index
+    fingerprints = None
+    if env_bool("FINGERPRINT_ENABLED", True):
+        max_fingerprints = env_int("FINGERPRINT_MAX_ENTRIES", 100000)
+        near = None
+        if env_bool("SIMHASH_ENABLED", False):
+            near = SimHashIndex(
+                max_distance=env_int("SIMHASH_MAX_DISTANCE", 3),
+                max_entries=max_fingerprints,
+            )
+        fingerprints = FingerprintTier(
+            FingerprintTable(
+                max_entries=max_fingerprints,
+                normalization=env_str("FINGERPRINT_NORMALIZATION", "whitespace"),
+            ),
+            near=near,
+        )
 
-app = FastAPI()
+    return Partition(
+        name,
+        FaissHandler(embedding, faiss, search, fingerprints=fingerprints),
+        faiss,
+        snapshots=snapshots,
+        sweeper=sweeper,
+        wal=wal,
+        publisher=publisher,
+    )
 
-embedding = SentenceEmbedding(model_name="all-MiniLM-L6-v2")
-faiss = FaissEmbeddingStorage(dimension=384)
 
-handler = FaissHandler(embedding, faiss)
+# Each namespace (model, system prompt, tenant) has its own index, loaded on first use
+partitions = PartitionedHandler(
+    build_partition,
+    idle_seconds=env_float("PARTITION_IDLE_SECONDS", 0) or None,
+    max_loaded=env_int("PARTITION_MAX_LOADED", 0) or None,
+    default_namespace=DEFAULT_NAMESPACE,
+)
+
+# Embedding and search run on a bounded thread pool, off the event loop. Readers
+# forward mutations to the writer, and a coordinator everything to its shards.
+if index_role == "reader":
+    served = ReplicaHandler(partitions, writer)
+elif index_role == "coordinator":
+    served = sharded
+else:
+    served = partitions
+handler = AsyncHandler(
+    served,
+    max_workers=env_int("INDEX_WORKERS", 8),
+    max_pending=env_int("INDEX_MAX_PENDING", 64),
+)
+max_batch_size = env_int("INDEX_MAX_BATCH_SIZE", 1024)
+
+# Local clients such as the proxy can skip HTTP and JSON with the binary protocol
+binary_server = None
+if env_str("BINARY_SOCKET_PATH", "") or env_int("BINARY_PORT", 0):
+    binary_server = BinaryServer(
+        handler,
+        lambda: startup.ready,
+        socket_path=env_str("BINARY_SOCKET_PATH", "") or None,
+        host=env_str("BINARY_HOST", "0.0.0.0"),
+        port=env_int("BINARY_PORT", 0) or None,
+        max_in_flight=env_int("BINARY_MAX_IN_FLIGHT", 32),
+        max_batch_size=max_batch_size,
+        default_ttl_seconds=default_ttl_seconds,
+    )
+if index_role == "writer" and binary_server is None:
+    raise ValueError("INDEX_ROLE=writer needs BINARY_SOCKET_PATH or BINARY_PORT for its readers.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    def restore_default():
+        restore = restore_replica if index_role == "reader" else restore_index
+        restored[DEFAULT_NAMESPACE] = restore(DEFAULT_NAMESPACE)
+
+    def attach_embedding():
+        sharded.embedding = embedding
+
+    def start_partitions():
+        partitions.start(preload=[DEFAULT_NAMESPACE])
+
+    # Models load while the default index is restored, in the background so the port
+    # is bound and health checks are answered meanwhile. A coordinator only needs
+    # the model.
+    if index_role == "coordinator":
+        steps = {"embedding": load_embedding}
+        then = attach_embedding
+    else:
+        steps = {
+            "embedding": load_embedding,
+            "cross_encoder": load_cross_encoder,
+            "index": restore_default,
+        }
+        then = start_partitions
+    warmup = asyncio.create_task(startup.run(steps, then=then))
+    if binary_server is not None:
+        await binary_server.start()
+    yield
+    if binary_server is not None:
+        await binary_server.stop()
+    # Loading threads cannot be interrupted, so let them finish before cleaning up
+    await warmup
+    handler.shutdown()
+    if sharded is not None:
+        sharded.shutdown()
+    partitions.stop()
+    for _, wal, _ in restored.values():
+        if wal is not None:
+            wal.close()
+    if batching is not None:
+        batching.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    request.state.received_at = time.perf_counter()
+    response = await call_next(request)
+    # The route template rather than the raw path, so unknown paths share one label
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(
+        getattr(route, "path", "other"), str(response.status_code)
+    ).observe(time.perf_counter() - request.state.received_at)
+    return response
+
+
+def observe_parse(request: Request):
+    """
+    Records the time from the request's arrival until its body was parsed and
+    validated, i.e. until the endpoint runs.
+    """
+    _PARSE_SECONDS.observe(time.perf_counter() - request.state.received_at)
+
+
+def ensure_ready():
+    """
+    Rejects requests with a 503 until startup has finished, so callers can bypass the
+    cache instead of waiting on a service that cannot answer yet.
+    """
+    if startup.ready:
+        return
+    if startup.error is not None:
+        detail = f"Service failed to start: {startup.error}"
+    else:
+        detail = "Service is warming up"
+    raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "1"})
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: fails only if startup failed, so the process is restarted.
+    """
+    status_code = 500 if startup.error is not None else 200
+    return JSONResponse(status_code=status_code, content=startup.snapshot())
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: succeeds once the model and default index are loaded.
+    """
+    status_code = 200 if startup.ready else 503
+    return JSONResponse(status_code=status_code, content=startup.snapshot())
 
 
 @app.post("/queryIndex", response_model=QueryResponse)
-async def query_index(query: QueryRequest):
-    res = handler.handle_query(query.context, query.distance_threshold)
-    if res["id"] is not None:
-        return QueryResponse(id=res["id"], distance=res["distance"])
+async def query_index(query: QueryRequest, request: Request):
+    ensure_ready()
+    observe_parse(request)
+    try:
+        res = await handler.handle_query(
+            query.context,
+            query.distance_threshold,
+            namespace=query.namespace,
+            similarity_threshold=query.similarity_threshold,
+            return_candidates=query.return_candidates,
+        )
+    except HandlerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ShardsUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    # Misses only have a body when the candidates were asked for
+    if res["id"] is not None or query.return_candidates:
+        return QueryResponse(**res)
     else:
         raise HTTPException(status_code=204, detail="No similar context found")
 
 
 @app.post("/addIndex", response_model=AddResponse)
-async def add_index(query: AddRequest):
+async def add_index(query: AddRequest, request: Request):
+    ensure_ready()
+    observe_parse(request)
     try:
-        res = handler.handle_add(query.id, query.context)
-        if res["status"] == "success":
-            return AddResponse(status="success")
-        else:
-            raise HTTPException(status_code=500, detail=res["message"])
+        res = await handler.handle_add(
+            query.id,
+            query.context,
+            namespace=query.namespace,
+            ttl_seconds=query.ttl_seconds or default_ttl_seconds,
+        )
+    except HandlerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    if res["status"] == "success":
+        return AddResponse(status="success")
+    else:
+        raise HTTPException(status_code=500, detail=res["message"])
+
+
+@app.post("/queryIndexBatch", response_model=QueryBatchResponse)
+async def query_index_batch(query: QueryBatchRequest, request: Request):
+    ensure_ready()
+    observe_parse(request)
+    if len(query.contexts) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {max_batch_size} items")
+    try:
+        res = await handler.handle_query_batch(
+            query.contexts,
+            query.distance_threshold,
+            namespace=query.namespace,
+            similarity_threshold=query.similarity_threshold,
+            return_candidates=query.return_candidates,
+        )
+    except HandlerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except ShardsUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    return QueryBatchResponse(results=[QueryResponse(**r) for r in res])
+
+
+@app.post("/addIndexBatch", response_model=AddBatchResponse)
+async def add_index_batch(query: AddBatchRequest, request: Request):
+    ensure_ready()
+    observe_parse(request)
+    if len(query.items) > max_batch_size:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {max_batch_size} items")
+    if any(item.namespace not in (None, query.namespace) for item in query.items):
+        raise HTTPException(status_code=400, detail="Batch items must share the batch's namespace")
+    try:
+        res = await handler.handle_add_batch(
+            [item.id for item in query.items],
+            [item.context for item in query.items],
+            namespace=query.namespace,
+            ttl_seconds=[item.ttl_seconds or default_ttl_seconds for item in query.items],
+        )
+    except HandlerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return AddBatchResponse(results=[AddResponse(**r) for r in res])
+
+
+@app.post("/removeIndex", response_model=RemoveResponse)
+async def remove_index(query: RemoveRequest, request: Request):
+    ensure_ready()
+    observe_parse(request)
+    try:
+        res = await handler.handle_remove(query.ids, namespace=query.namespace)
+    except HandlerSaturatedError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    if res["status"] == "success":
+        return RemoveResponse(status="success", removed=res["removed"])
+    else:
+        raise HTTPException(status_code=500, detail=res["message"])
+
+
+@app.post("/drainEvictions", response_model=EvictionsResponse)
+async def drain_evictions(limit: Optional[int] = None):
+    """
+    Returns the IDs evicted to respect the index capacity since the last call, so their
+    cached responses can be dropped too. Evictions of every partition are returned.
+    """
+    ensure_ready()
+    if index_role == "reader":
+        raise HTTPException(status_code=409, detail="Evictions are drained from the writer")
+    if index_role == "coordinator":
+        raise HTTPException(status_code=409, detail="Evictions are drained from the shards")
+    return EvictionsResponse(ids=partitions.drain_evictions(limit))
+
+
+def run_reshard(
+    kind: str,
+    shards: List[str],
+    probe: int,
+    sample_size: int,
+    namespaces: Optional[List[str]],
+):
+    try:
+        centroids = None
+        if kind == "cluster":
+            # Centroids are fitted on the entries as currently placed
+            centroids = ClusterPlacement.fit(
+                shards, sharded.sample_vectors(sample_size), probe
+            ).centroids
+        placement = new_placement(kind, shards, probe, centroids)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.exception("An error occurred while preparing a reshard.")
+        sharded.rebalance = {"state": "failed", "error": str(e)}
+        return
+    try:
+        sharded.reshard(placement, namespaces=namespaces)
+    except Exception:
+        return  # Reported by the rebalance status
+    if centroids is not None:
+        placement.save(shard_centroids_path)
+
+
+@app.post("/reshard", response_model=ReshardResponse, status_code=202)
+async def reshard(query: ReshardRequest, background_tasks: BackgroundTasks):
+    """
+    Moves a coordinator to a new list of shards and/or placement, moving the entries
+    in the background. Progress is reported under shards.rebalance in /stats.
+    """
+    ensure_ready()
+    if sharded is None:
+        raise HTTPException(status_code=409, detail="Only a coordinator has shards")
+    if sharded.resharding:
+        raise HTTPException(status_code=409, detail="A reshard is already running")
+    kind = query.placement or sharded.placement.kind
+    try:
+        # Checks the shard list before anything is moved
+        HashPlacement(query.shards)
+        if kind not in ("hash", "cluster"):
+            raise ValueError(f"Unknown placement: {kind}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    background_tasks.add_task(
+        run_reshard,
+        kind,
+        query.shards,
+        query.probe or getattr(sharded.placement, "probe", 1),
+        query.sample_size,
+        query.namespaces,
+    )
+    return ReshardResponse(status="started")
+
+
+@app.get("/stats")
+async def stats():
+    ensure_ready()
+    return {
+        "role": index_role,
+        "startup": startup.snapshot(),
+        "embedding": batching.stats.snapshot(),
+        "embedding_cache": embedding.stats.snapshot(),
+        "partitions": partitions.snapshot(),
+        "executor": {
+            "workers": handler.max_workers,
+            "pending": handler.pending,
+            "max_pending": handler.max_pending,
+        },
+        "shards": sharded.snapshot() if sharded is not None else None,
+        "binary": {
+            "addresses": binary_server.addresses if binary_server is not None else [],
+            "connections": binary_server.connections if binary_server is not None else 0,
+        },
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Exposes the metrics in the Prometheus text format.
+    """
+    READY.set(1 if startup.ready else 0)
+    PENDING_REQUESTS.set(handler.pending)
+    # Only loaded partitions are reported, so unloaded ones drop out of the gauges
+    for gauge in (INDEX_ENTRIES, INDEX_TOMBSTONES, INDEX_CAPACITY, INDEX_EVICTED):
+        gauge.clear()
+    for name, partition in partitions.partitions.items():
+        storage = partition.storage
+        INDEX_ENTRIES.labels(name).set(len(storage))
+        INDEX_TOMBSTONES.labels(name).set(len(storage.tombstones))
+        if storage.capacity is not None:
+            INDEX_CAPACITY.labels(name).set(storage.capacity)
+        INDEX_EVICTED.labels(name).set(storage.evicted)
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
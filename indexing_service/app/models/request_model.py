@@ -1,11 +1,44 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
 class AddRequest(BaseModel):
     id: int
     context: str
+    ttl_seconds: Optional[float] = None
+    namespace: Optional[str] = None
 
 
 class QueryRequest(BaseModel):
     context: str
     distance_threshold: float = 0.2
+    similarity_threshold: Optional[float] = None
+    return_candidates: bool = False
+    namespace: Optional[str] = None
+
+
+class AddBatchRequest(BaseModel):
+    items: List[AddRequest]
+    namespace: Optional[str] = None
+
+
+class QueryBatchRequest(BaseModel):
+    contexts: List[str]
+    distance_threshold: float = 0.2
+    similarity_threshold: Optional[float] = None
+    return_candidates: bool = False
+    namespace: Optional[str] = None
+
+
+class RemoveRequest(BaseModel):
+    ids: List[int]
+    namespace: Optional[str] = None
+
+
+class ReshardRequest(BaseModel):
+    shards: List[str]
+    placement: Optional[str] = None
+    probe: Optional[int] = None
+    sample_size: int = 10000
+    namespaces: Optional[List[str]] = None
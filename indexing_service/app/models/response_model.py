@@ -1,11 +1,43 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 
+class Candidate(BaseModel):
+    id: int
+    distance: float
+    similarity: float
+    score: float
+
+
 class QueryResponse(BaseModel):
-    id: int = None
-    distance: float = None
+    id: Optional[int] = None
+    distance: Optional[float] = None
+    similarity: Optional[float] = None
+    candidates: Optional[List[Candidate]] = None
 
 
 class AddResponse(BaseModel):
     status: str
-    message: str = None
+    message: Optional[str] = None
+
+
+class QueryBatchResponse(BaseModel):
+    results: List[QueryResponse]
+
+
+class AddBatchResponse(BaseModel):
+    results: List[AddResponse]
+
+
+class RemoveResponse(BaseModel):
+    status: str
+    removed: int = 0
+
+
+class EvictionsResponse(BaseModel):
+    ids: List[int] = []
+
+
+class ReshardResponse(BaseModel):
+    status: str
@@ -0,0 +1 @@
+from .placement import ClusterPlacement, HashPlacement, Placement
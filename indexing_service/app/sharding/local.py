@@ -0,0 +1,152 @@
+"""
+Runs shards of the indexing service as local processes, for tests, benchmarks and
+trying out a sharded deployment on one machine:
+
+    python -m app.sharding.local --shards 3 --directory /tmp/shards
+
+prints the SHARD_ADDRS of a coordinator and serves until interrupted.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from app.transport import BinaryClient, BinaryProtocolError
+
+SERVICE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LocalShards:
+    """
+    Standalone indexing services, each serving the binary protocol on a Unix socket and
+    HTTP on another, with its data under `<directory>/shard-<n>`.
+
+    Without an EMBEDDING_BACKEND in `env` the shards use the hash embedding, which
+    loads no model: a coordinator sends them vectors, never texts to encode.
+
+    Parameters:
+    - directory (str): Where the shards' sockets and data are kept.
+    - env (dict, optional): Extra environment of every shard, e.g. the index type.
+    - ready_timeout (float): How long a shard may take to start.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        env: Optional[Dict[str, str]] = None,
+        ready_timeout: float = 60.0,
+    ):
+        self.directory = directory
+        self.env = env or {}
+        self.ready_timeout = ready_timeout
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self._count = 0
+
+    @property
+    def addresses(self) -> List[str]:
+        return list(self.processes)
+
+    def start(self, count: int = 1) -> List[str]:
+        """
+        Starts `count` more shards and returns their addresses once they are ready.
+        """
+        started = [self._spawn() for _ in range(count)]
+        for address in started:
+            self._wait_ready(address)
+        return started
+
+    def _spawn(self) -> str:
+        root = os.path.join(self.directory, f"shard-{self._count}")
+        self._count += 1
+        os.makedirs(root, exist_ok=True)
+        socket_path = os.path.join(root, "index.sock")
+        env = {
+            **os.environ,
+            "EMBEDDING_BACKEND": "hash",
+            "LOG_LEVEL": "WARNING",
+            "INDEX_ROLE": "standalone",
+            **self.env,
+            "BINARY_SOCKET_PATH": socket_path,
+            "SNAPSHOT_DIR": os.path.join(root, "snapshots"),
+            "WAL_DIR": os.path.join(root, "wal"),
+            "PARTITION_DIR": os.path.join(root, "partitions"),
+            "RESCORE_VECTOR_DIR": os.path.join(root, "vectors"),
+        }
+        address = f"unix:{socket_path}"
+        self.processes[address] = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "app.main:app",
+                "--uds",
+                os.path.join(root, "http.sock"),
+                "--log-level",
+                "warning",
+            ],
+            cwd=SERVICE_ROOT,
+            env=env,
+        )
+        return address
+
+    def _wait_ready(self, address: str):
+        deadline = time.monotonic() + self.ready_timeout
+        while True:
+            if self.processes[address].poll() is not None:
+                raise RuntimeError(f"Shard {address} exited during startup.")
+            try:
+                with BinaryClient(address[len("unix:") :], timeout=1.0) as client:
+                    # Answered UNAVAILABLE until the shard has finished starting
+                    client.scan(limit=1)
+                    return
+            except (OSError, BinaryProtocolError):
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shard {address} was not ready after {self.ready_timeout}s.")
+            time.sleep(0.1)
+
+    def stop(self, address: str, timeout: float = 30.0):
+        """
+        Stops a shard, which writes its final snapshot first.
+        """
+        process = self.processes.pop(address)
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def close(self):
+        for address in self.addresses:
+            self.stop(address)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--directory", default="data/shards")
+    args = parser.parse_args()
+
+    with LocalShards(args.directory) as shards:
+        addresses = shards.start(args.shards)
+        print("SHARD_ADDRS=" + ",".join(addresses), flush=True)
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            while all(p.poll() is None for p in shards.processes.values()):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import hashlib
+from abc import ABC, abstractmethod
+from typing import List, Sequence
+
+import faiss
+import numpy as np
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """
+    The splitmix64 finalizer: a fast, well distributed hash of 64-bit integers.
+    """
+    values = values.astype(np.uint64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def _seed(shard: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shard.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class Placement(ABC):
+    """
+    Decides which shard owns each entry and which shards a query is sent to.
+
+    Shards are identified by their address, so a placement over a changed list of
+    shards keeps the entries of the unchanged ones where they are as far as it can.
+    """
+
+    kind: str
+    # Whether the owner of an entry follows from its ID alone, so removals can be
+    # routed; otherwise they are sent to every shard
+    routes_ids: bool
+
+    def __init__(self, shards: Sequence[str]):
+        if not shards:
+            raise ValueError("At least one shard is needed.")
+        if len(set(shards)) != len(shards):
+            raise ValueError("Shards must be distinct.")
+        self.shards: List[str] = list(shards)
+
+    @abstractmethod
+    def owners(self, ids: Sequence[int], vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns the index in `shards` of the owner of each entry.
+        """
+
+    def targets(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns a (queries, shards) boolean matrix of the shards searched for each query
+        vector. Every shard by default.
+        """
+        return np.ones((len(vectors), len(self.shards)), dtype=bool)
+
+    def snapshot(self) -> dict:
+        return {"kind": self.kind, "shards": list(self.shards)}
+
+
+class HashPlacement(Placement):
+    """
+    Places entries by rendezvous hashing of their ID: each entry belongs to the shard
+    with the highest hash of the pair, so adding or removing a shard only moves the
+    entries that it gains or loses, about 1/N of them. Queries search every shard.
+
+    Parameters:
+    - shards (Sequence[str]): The addresses of the shards.
+    """
+
+    kind = "hash"
+    routes_ids = True
+
+    def __init__(self, shards: Sequence[str]):
+        super().__init__(shards)
+        self._seeds = np.array([_seed(shard) for shard in self.shards], dtype=np.uint64)
+
+    def owners(self, ids: Sequence[int], vectors: np.ndarray = None) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64).view(np.uint64)
+        scores = _mix(ids[:, None] ^ self._seeds[None, :])
+        return np.argmax(scores, axis=1)
+
+
+class ClusterPlacement(Placement):
+    """
+    Places entries on the shard of their nearest centroid, so similar prompts share a
+    shard and a query only needs to search the `probe` shards nearest to it, as an IVF
+    index does with its cells. A query whose match sits just across a boundary can miss
+    it unless `probe` is raised.
+
+    Parameters:
+    - shards (Sequence[str]): The addresses of the shards.
+    - centroids (np.ndarray): One centroid per shard, e.g. from `fit`.
+    - probe (int): Number of shards searched per query.
+    """
+
+    kind = "cluster"
+    routes_ids = False
+
+    def __init__(self, shards: Sequence[str], centroids: np.ndarray, probe: int = 1):
+        super().__init__(shards)
+        centroids = np.ascontiguousarray(centroids, dtype="float32")
+        if centroids.ndim != 2 or len(centroids) != len(self.shards):
+            raise ValueError("Expected one centroid per shard.")
+        if not 1 <= probe <= len(self.shards):
+            raise ValueError("probe must be between 1 and the number of shards.")
+        self.centroids = centroids
+        self.probe = probe
+        self._index = faiss.IndexFlatL2(centroids.shape[1])
+        self._index.add(centroids)
+
+    @classmethod
+    def fit(
+        cls, shards: Sequence[str], vectors: np.ndarray, probe: int = 1, seed: int = 1234
+    ) -> "ClusterPlacement":
+        """
+        Clusters a sample of the vectors with k-means, one cluster per shard.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(vectors) < len(shards):
+            raise ValueError("Clustering needs at least one vector per shard.")
+        kmeans = faiss.Kmeans(vectors.shape[1], len(shards), niter=20, seed=seed)
+        kmeans.train(vectors)
+        return cls(shards, kmeans.centroids, probe)
+
+    @classmethod
+    def load(cls, filepath: str, shards: Sequence[str], probe: int = 1) -> "ClusterPlacement":
+        return cls(shards, np.load(filepath), probe)
+
+    def save(self, filepath: str):
+        np.save(filepath, self.centroids)
+
+    def owners(self, ids: Sequence[int], vectors: np.ndarray) -> np.ndarray:
+        if len(vectors) == 0:
+            return np.empty(0, dtype=np.int64)
+        _, nearest = self._index.search(np.ascontiguousarray(vectors, dtype="float32"), 1)
+        return nearest[:, 0]
+
+    def targets(self, vectors: np.ndarray) -> np.ndarray:
+        mask = np.zeros((len(vectors), len(self.shards)), dtype=bool)
+        if len(vectors):
+            _, nearest = self._index.search(
+                np.ascontiguousarray(vectors, dtype="float32"), self.probe
+            )
+            np.put_along_axis(mask, nearest, True, axis=1)
+        return mask
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "probe": self.probe}
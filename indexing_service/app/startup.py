@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+
+class Startup:
+    """
+    Runs the slow parts of service startup (loading models, restoring indexes) in the
+    background and tracks their progress, so the server can bind its port and answer
+    health checks while it warms up.
+
+    Steps run concurrently on threads; they are independent by contract. Once they have
+    all finished, `then` runs, e.g. to wire the loaded components together, and the
+    service becomes ready. If any step raises, the service is marked as failed.
+    """
+
+    def __init__(self):
+        self.state = STARTING
+        self.error: Optional[str] = None
+        self.started_at = time.monotonic()
+        self.durations: Dict[str, float] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    async def run(self, steps: Dict[str, Callable], then: Optional[Callable] = None):
+        loop = asyncio.get_running_loop()
+
+        def timed(name: str, step: Callable):
+            start = time.monotonic()
+            step()
+            self.durations[name] = time.monotonic() - start
+            logger.info(
+                "Startup step %s finished in %.2fs.", name, self.durations[name]
+            )
+
+        try:
+            await asyncio.gather(
+                *(loop.run_in_executor(None, timed, name, step) for name, step in steps.items())
+            )
+            if then is not None:
+                await loop.run_in_executor(None, timed, "finish", then)
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            logger.exception("An error occurred during startup.")
+            return
+
+        self.state = READY
+        logger.info("Service ready after %.2fs.", time.monotonic() - self.started_at)
+
+    def snapshot(self) -> dict:
+        return {
+            "status": self.state,
+            "error": self.error,
+            "uptime_seconds": time.monotonic() - self.started_at,
+            "steps": dict(self.durations),
+        }
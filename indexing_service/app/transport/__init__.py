@@ -0,0 +1,3 @@
+from .client import BinaryClient, BinaryProtocolError
+from .protocol import ProtocolError
+from .server import BinaryServer
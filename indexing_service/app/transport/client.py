@@ -0,0 +1,176 @@
+import itertools
+import socket
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from app.transport import protocol
+
+
+class BinaryProtocolError(Exception):
+    """
+    Raised for a response with a status other than OK.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class BinaryClient:
+    """
+    A blocking client of the binary protocol over one persistent connection, for
+    benchmarks, tests and Python callers. Not thread-safe: use one client per thread.
+
+    Single calls send a request and wait for its response. `pipeline` sends several
+    requests before reading any response, so they are served concurrently and cost one
+    round trip rather than one each.
+
+    Parameters:
+    - address: A Unix socket path, or a (host, port) tuple for TCP.
+    - timeout (float, optional): Socket timeout in seconds.
+    """
+
+    def __init__(self, address: Union[str, Tuple[str, int]], timeout: Optional[float] = 10.0):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self._ids = itertools.count(1)
+        # Responses read while waiting for another one, by request ID
+        self._received: Dict[int, Tuple[int, int, bytes]] = {}
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _receive_exactly(self, size: int) -> bytearray:
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("The server closed the connection.")
+            received += count
+        return buffer
+
+    def send(self, op: int, payload: bytes = b"", flags: int = 0) -> int:
+        """
+        Sends a request without waiting for its response and returns its ID.
+        """
+        request_id = next(self._ids) & 0xFFFFFFFF
+        self.sock.sendall(protocol.pack_frame(request_id, op, payload, flags=flags))
+        return request_id
+
+    def receive(self, request_id: int) -> Tuple[int, bytes]:
+        """
+        Returns the op and payload of the response to `request_id`, keeping responses
+        to other requests read meanwhile. Raises `BinaryProtocolError` for an error.
+        """
+        while request_id not in self._received:
+            header = self._receive_exactly(protocol.HEADER.size)
+            length, response_id, op, status, _ = protocol.HEADER.unpack(header)
+            self._received[response_id] = (op, status, self._receive_exactly(length))
+        op, status, payload = self._received.pop(request_id)
+        if status != protocol.STATUS_OK:
+            raise BinaryProtocolError(status, str(payload, "utf-8", "replace"))
+        return op, payload
+
+    def pipeline(self, requests: Sequence[Tuple[int, bytes, int]]) -> List[bytes]:
+        """
+        Sends every (op, payload, flags) request, then returns their response payloads
+        in the same order.
+        """
+        request_ids = [self.send(op, payload, flags) for op, payload, flags in requests]
+        return [self.receive(request_id)[1] for request_id in request_ids]
+
+    def ping(self):
+        self.receive(self.send(protocol.OP_PING))
+
+    def query(
+        self,
+        contexts: List[str],
+        distance_threshold: Optional[float] = None,
+        similarity_threshold: Optional[float] = None,
+        namespace: Optional[str] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Returns one result per context, as `handle_query_batch` does. With `vectors`,
+        one row per context, the index is searched for them rather than for the
+        contexts' embeddings.
+        """
+        payload, flags = self.encode_query(
+            contexts, distance_threshold, similarity_threshold, namespace, vectors
+        )
+        _, response = self.receive(self.send(protocol.OP_QUERY, payload, flags))
+        return protocol.decode_query_results(response)
+
+    @staticmethod
+    def encode_query(
+        contexts: List[str],
+        distance_threshold: Optional[float] = None,
+        similarity_threshold: Optional[float] = None,
+        namespace: Optional[str] = None,
+        vectors: Optional[np.ndarray] = None,
+    ) -> Tuple[bytes, int]:
+        """
+        Returns the payload and flags of a query request, e.g. for `pipeline`.
+        """
+        if (distance_threshold is None) == (similarity_threshold is None):
+            raise ValueError(
+                "Exactly one of distance_threshold and similarity_threshold must be given."
+            )
+        flags = 0
+        threshold = distance_threshold
+        if similarity_threshold is not None:
+            flags |= protocol.FLAG_SIMILARITY
+            threshold = similarity_threshold
+        if vectors is not None:
+            flags |= protocol.FLAG_VECTORS
+        return protocol.encode_query(contexts, threshold, namespace, vectors), flags
+
+    def add(
+        self,
+        ids: List[int],
+        contexts: List[str],
+        ttl_seconds: Optional[List[Optional[float]]] = None,
+        namespace: Optional[str] = None,
+        vectors: Optional[np.ndarray] = None,
+    ):
+        flags = protocol.FLAG_VECTORS if vectors is not None else 0
+        payload = protocol.encode_add(ids, contexts, ttl_seconds, namespace, vectors)
+        self.receive(self.send(protocol.OP_ADD, payload, flags))
+
+    def encode(self, contexts: List[str]) -> np.ndarray:
+        """
+        Returns the server's embeddings of `contexts`, one row each.
+        """
+        _, response = self.receive(self.send(protocol.OP_ENCODE, protocol.encode_texts(contexts)))
+        return protocol.decode_embeddings(response)
+
+    def scan(
+        self, after: int = -1, limit: int = 1024, namespace: Optional[str] = None
+    ) -> Tuple[List[int], List[Optional[float]], np.ndarray]:
+        """
+        Returns the IDs, remaining lifetimes and vectors of up to `limit` entries with
+        IDs above `after`, in increasing ID order. Passing the last ID returned as
+        `after` pages through the whole index.
+        """
+        payload = protocol.encode_scan(after, limit, namespace)
+        _, response = self.receive(self.send(protocol.OP_SCAN, payload))
+        return protocol.decode_entries(response)
+
+    def remove(self, ids: List[int], namespace: Optional[str] = None) -> int:
+        payload = protocol.encode_remove(ids, namespace)
+        _, response = self.receive(self.send(protocol.OP_REMOVE, payload))
+        return protocol.decode_removed(response)
@@ -0,0 +1,321 @@
+"""
+A compact binary protocol for the indexing service, for clients such as the proxy that
+sit next to it and would otherwise pay for HTTP and JSON on every lookup.
+
+Every message is a frame: a 12-byte header followed by its payload. All integers and
+floats are little-endian.
+
+    header   = length:u32  request_id:u32  op:u8  status:u8  flags:u16
+    string   = length:u32  utf-8 bytes
+    vectors  = dimension:u32  count * dimension float32
+
+`length` is that of the payload. A response carries the request ID and op of its
+request, so a client can pipeline requests on one connection: responses may come back
+in any order. `status` is 0 in requests.
+
+Requests, by op:
+
+    QUERY   threshold:f64  namespace:string  count:u32  count * context:string  [vectors]
+    ADD     namespace:string  count:u32  count * id:i64  count * ttl_seconds:f64
+            count * context:string  [vectors]
+    REMOVE  namespace:string  count:u32  count * id:i64
+    PING    (empty)
+    ENCODE  count:u32  count * context:string
+    SCAN    namespace:string  after:i64  limit:u32
+
+With the SIMILARITY flag the threshold of a query is a cosine similarity rather than a
+distance. With the VECTORS flag the request carries precomputed embeddings, one per
+context, which are used instead of encoding the contexts; contexts may then be empty.
+An empty namespace is the default one, and a ttl of 0 means no expiry.
+
+Responses with status OK:
+
+    QUERY   count:u32  count * (id:i64  distance:f64  similarity:f64), id -1 if no match
+    ADD     (empty)
+    REMOVE  removed:u32
+    PING    (empty)
+    ENCODE  count:u32  vectors, the embeddings of the contexts in order
+    SCAN    count:u32  count * id:i64  count * ttl_seconds:f64  vectors, the live
+            entries with the smallest IDs above `after`, in increasing ID order
+
+Any other status carries an error message as its whole payload.
+"""
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+HEADER = struct.Struct("<IIBBH")
+RESULT = struct.Struct("<qdd")
+_U32 = struct.Struct("<I")
+_F64 = struct.Struct("<d")
+_I64 = struct.Struct("<q")
+
+# Frames larger than this are rejected and their connection closed
+MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+
+OP_QUERY = 1
+OP_ADD = 2
+OP_REMOVE = 3
+OP_PING = 4
+OP_ENCODE = 5
+OP_SCAN = 6
+OPS = {
+    OP_QUERY: "query",
+    OP_ADD: "add",
+    OP_REMOVE: "remove",
+    OP_PING: "ping",
+    OP_ENCODE: "encode",
+    OP_SCAN: "scan",
+}
+
+FLAG_SIMILARITY = 1
+FLAG_VECTORS = 2
+
+STATUS_OK = 0
+STATUS_ERROR = 1  # The request failed
+STATUS_BAD_REQUEST = 2  # The request could not be decoded
+STATUS_BUSY = 3  # Too many pending requests, as HTTP 429
+STATUS_UNAVAILABLE = 4  # Still starting, as HTTP 503
+
+
+class ProtocolError(ValueError):
+    """
+    Raised for a malformed frame.
+    """
+
+
+def pack_frame(
+    request_id: int, op: int, payload: bytes = b"", status: int = 0, flags: int = 0
+) -> bytes:
+    return HEADER.pack(len(payload), request_id, op, status, flags) + payload
+
+
+def pack_string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return _U32.pack(len(data)) + data
+
+
+def pack_vectors(vectors: np.ndarray) -> bytes:
+    vectors = np.ascontiguousarray(vectors, dtype="<f4")
+    if vectors.ndim != 2:
+        raise ValueError("Expected a (count, dimension) matrix of vectors.")
+    return _U32.pack(vectors.shape[1]) + vectors.tobytes()
+
+
+class Reader:
+    """
+    Decodes the fields of a payload in order, without copying vectors.
+    """
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.offset = 0
+
+    def _take(self, size: int) -> int:
+        start = self.offset
+        if start + size > len(self.payload):
+            raise ProtocolError("Truncated payload.")
+        self.offset += size
+        return start
+
+    def u32(self) -> int:
+        return _U32.unpack_from(self.payload, self._take(4))[0]
+
+    def i64(self) -> int:
+        return _I64.unpack_from(self.payload, self._take(8))[0]
+
+    def f64(self) -> float:
+        return _F64.unpack_from(self.payload, self._take(8))[0]
+
+    def string(self) -> str:
+        size = self.u32()
+        start = self._take(size)
+        try:
+            return str(self.payload[start : start + size], "utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("Invalid UTF-8 string.")
+
+    def strings(self, count: int) -> List[str]:
+        return [self.string() for _ in range(count)]
+
+    def array(self, dtype: str, count: int) -> np.ndarray:
+        size = np.dtype(dtype).itemsize * count
+        return np.frombuffer(self.payload, dtype=dtype, count=count, offset=self._take(size))
+
+    def vectors(self, count: int) -> np.ndarray:
+        """
+        Returns a read-only (count, dimension) view of the payload.
+        """
+        dimension = self.u32()
+        return self.array("<f4", count * dimension).reshape(count, dimension)
+
+    def end(self):
+        if self.offset != len(self.payload):
+            raise ProtocolError("Unexpected trailing bytes.")
+
+
+def encode_query(
+    contexts: List[str],
+    threshold: float,
+    namespace: Optional[str] = None,
+    vectors: Optional[np.ndarray] = None,
+) -> bytes:
+    payload = [_F64.pack(threshold), pack_string(namespace or ""), _U32.pack(len(contexts))]
+    payload.extend(pack_string(context) for context in contexts)
+    if vectors is not None:
+        payload.append(pack_vectors(vectors))
+    return b"".join(payload)
+
+
+def decode_query(payload: bytes, flags: int) -> Tuple[float, str, List[str], Optional[np.ndarray]]:
+    reader = Reader(payload)
+    threshold = reader.f64()
+    namespace = reader.string()
+    count = reader.u32()
+    contexts = reader.strings(count)
+    vectors = reader.vectors(count) if flags & FLAG_VECTORS else None
+    reader.end()
+    return threshold, namespace, contexts, vectors
+
+
+def encode_query_results(results: List[dict]) -> bytes:
+    payload = [_U32.pack(len(results))]
+    for result in results:
+        if result["id"] is None:
+            payload.append(RESULT.pack(-1, float("nan"), float("nan")))
+        else:
+            payload.append(RESULT.pack(result["id"], result["distance"], result["similarity"]))
+    return b"".join(payload)
+
+
+def decode_query_results(payload: bytes) -> List[dict]:
+    reader = Reader(payload)
+    count = reader.u32()
+    results = []
+    for _ in range(count):
+        item_id, distance, similarity = RESULT.unpack_from(payload, reader._take(RESULT.size))
+        if item_id < 0:
+            results.append({"id": None, "distance": None, "similarity": None})
+        else:
+            results.append({"id": item_id, "distance": distance, "similarity": similarity})
+    reader.end()
+    return results
+
+
+def encode_add(
+    ids: List[int],
+    contexts: List[str],
+    ttl_seconds: Optional[List[Optional[float]]] = None,
+    namespace: Optional[str] = None,
+    vectors: Optional[np.ndarray] = None,
+) -> bytes:
+    if len(ids) != len(contexts):
+        raise ValueError("Expected one context per ID.")
+    ttls = [ttl or 0.0 for ttl in ttl_seconds] if ttl_seconds else [0.0] * len(ids)
+    payload = [
+        pack_string(namespace or ""),
+        _U32.pack(len(ids)),
+        np.asarray(ids, dtype="<i8").tobytes(),
+        np.asarray(ttls, dtype="<f8").tobytes(),
+    ]
+    payload.extend(pack_string(context) for context in contexts)
+    if vectors is not None:
+        payload.append(pack_vectors(vectors))
+    return b"".join(payload)
+
+
+def decode_add(
+    payload: bytes, flags: int
+) -> Tuple[str, List[int], List[str], List[Optional[float]], Optional[np.ndarray]]:
+    reader = Reader(payload)
+    namespace = reader.string()
+    count = reader.u32()
+    ids = reader.array("<i8", count).tolist()
+    ttls = [ttl or None for ttl in reader.array("<f8", count).tolist()]
+    contexts = reader.strings(count)
+    vectors = reader.vectors(count) if flags & FLAG_VECTORS else None
+    reader.end()
+    return namespace, ids, contexts, ttls, vectors
+
+
+def encode_remove(ids: List[int], namespace: Optional[str] = None) -> bytes:
+    ids = np.asarray(ids, dtype="<i8")
+    return pack_string(namespace or "") + _U32.pack(len(ids)) + ids.tobytes()
+
+
+def decode_remove(payload: bytes) -> Tuple[str, List[int]]:
+    reader = Reader(payload)
+    namespace = reader.string()
+    ids = reader.array("<i8", reader.u32()).tolist()
+    reader.end()
+    return namespace, ids
+
+
+def encode_removed(removed: int) -> bytes:
+    return _U32.pack(removed)
+
+
+def decode_removed(payload: bytes) -> int:
+    reader = Reader(payload)
+    removed = reader.u32()
+    reader.end()
+    return removed
+
+
+def encode_texts(contexts: List[str]) -> bytes:
+    return _U32.pack(len(contexts)) + b"".join(pack_string(context) for context in contexts)
+
+
+def decode_texts(payload: bytes) -> List[str]:
+    reader = Reader(payload)
+    contexts = reader.strings(reader.u32())
+    reader.end()
+    return contexts
+
+
+def encode_embeddings(vectors: np.ndarray) -> bytes:
+    return _U32.pack(len(vectors)) + pack_vectors(vectors)
+
+
+def decode_embeddings(payload: bytes) -> np.ndarray:
+    reader = Reader(payload)
+    vectors = reader.vectors(reader.u32())
+    reader.end()
+    return vectors
+
+
+def encode_scan(after: int, limit: int, namespace: Optional[str] = None) -> bytes:
+    return pack_string(namespace or "") + _I64.pack(after) + _U32.pack(limit)
+
+
+def decode_scan(payload: bytes) -> Tuple[str, int, int]:
+    reader = Reader(payload)
+    namespace = reader.string()
+    after = reader.i64()
+    limit = reader.u32()
+    reader.end()
+    return namespace, after, limit
+
+
+def encode_entries(
+    ids: List[int], ttl_seconds: List[Optional[float]], vectors: np.ndarray
+) -> bytes:
+    return b"".join(
+        [
+            _U32.pack(len(ids)),
+            np.asarray(ids, dtype="<i8").tobytes(),
+            np.asarray([ttl or 0.0 for ttl in ttl_seconds], dtype="<f8").tobytes(),
+            pack_vectors(vectors),
+        ]
+    )
+
+
+def decode_entries(payload: bytes) -> Tuple[List[int], List[Optional[float]], np.ndarray]:
+    reader = Reader(payload)
+    count = reader.u32()
+    ids = reader.array("<i8", count).tolist()
+    ttls = [ttl or None for ttl in reader.array("<f8", count).tolist()]
+    vectors = reader.vectors(count)
+    reader.end()
+    return ids, ttls, vectors
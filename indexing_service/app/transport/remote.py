@@ -0,0 +1,95 @@
+import threading
+from typing import Callable, List, Tuple, TypeVar, Union
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+
+from app.transport.client import BinaryClient
+
+T = TypeVar("T")
+Address = Union[str, Tuple[str, int]]
+
+
+def parse_address(value: str) -> Address:
+    """
+    Parses "host:port" as a TCP address; anything else, optionally prefixed with
+    "unix:", is a Unix socket path.
+    """
+    if value.startswith("unix:"):
+        return value[len("unix:") :]
+    host, _, port = value.rpartition(":")
+    if host and port.isdigit() and "/" not in value:
+        return host, int(port)
+    return value
+
+
+class ClientPool:
+    """
+    Gives every thread its own `BinaryClient` to one server, connected on first use,
+    so the blocking client can be shared by a thread pool. A call that finds its
+    connection broken, e.g. because the server restarted, is retried once on a new one.
+
+    Parameters:
+    - address: A Unix socket path, or a (host, port) tuple for TCP.
+    - timeout (float): Socket timeout in seconds.
+    """
+
+    def __init__(self, address: Address, timeout: float = 10.0):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _client(self) -> BinaryClient:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = BinaryClient(self.address, timeout=self.timeout)
+            self._local.client = client
+        return client
+
+    def _discard(self):
+        client = getattr(self._local, "client", None)
+        self._local.client = None
+        if client is not None:
+            client.close()
+
+    def call(self, fn: Callable[[BinaryClient], T]) -> T:
+        """
+        Returns `fn` applied to this thread's client.
+        """
+        try:
+            return fn(self._client())
+        except TimeoutError:
+            # The late response could still arrive on this connection, so it is
+            # dropped, but the request is not sent twice
+            self._discard()
+            raise
+        except OSError:  # Including ConnectionError
+            self._discard()
+        return fn(self._client())
+
+    def close(self):
+        """
+        Closes the calling thread's connection.
+        """
+        self._discard()
+
+
+class RemoteEmbedding(BaseEmbedding):
+    """
+    Encodes texts with the model of another process over the binary protocol, so
+    reader processes serve queries without loading a model of their own. The server
+    coalesces the requests of every reader into its batched model calls.
+
+    Parameters:
+    - pool (ClientPool): Connections to the process owning the model.
+    """
+
+    def __init__(self, pool: ClientPool):
+        self.pool = pool
+
+    def to_embedding(self, text: str) -> np.ndarray:
+        return self.to_embeddings([text])[0]
+
+    def to_embeddings(self, texts: List[str]) -> np.ndarray:
+        return self.pool.call(lambda client: client.encode(texts))
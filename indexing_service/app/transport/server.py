@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Callable, List, Optional
+
+from gptcache.utils.metrics import REGISTRY
+
+from app.handlers.async_handler import AsyncHandler, HandlerSaturatedError
+from app.transport import protocol
+from app.transport.protocol import ProtocolError
+
+logger = logging.getLogger(__name__)
+
+BINARY_REQUEST_SECONDS = REGISTRY.histogram(
+    "gptcache_binary_request_seconds",
+    "Time to serve a request of the binary protocol.",
+    ("op", "status"),
+)
+_STATUS_NAMES = {
+    protocol.STATUS_OK: "ok",
+    protocol.STATUS_ERROR: "error",
+    protocol.STATUS_BAD_REQUEST: "bad_request",
+    protocol.STATUS_BUSY: "busy",
+    protocol.STATUS_UNAVAILABLE: "unavailable",
+}
+
+
+class RequestError(Exception):
+    """
+    Raised while serving a request to answer it with `status` and the message.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class BinaryServer:
+    """
+    Serves the index over the binary protocol of `app.transport.protocol`, on a Unix
+    socket and/or a TCP port, next to the HTTP API and through the same handler.
+
+    Connections are persistent and pipelined: a client may send further requests
+    before the earlier ones are answered, up to `max_in_flight` per connection, and
+    each response is written as soon as its request is served. Beyond that the
+    connection is simply not read until a request finishes, which pushes back on the
+    client; the handler's own `max_pending` limit still answers BUSY when the service
+    as a whole is saturated.
+
+    Parameters:
+    - handler (AsyncHandler): Serves the requests, as for the HTTP API.
+    - ready (callable): Returns whether startup has finished; requests other than
+    pings are answered UNAVAILABLE until it does.
+    - socket_path (str, optional): The Unix socket to listen on.
+    - host (str): The TCP address to listen on.
+    - port (int, optional): The TCP port to listen on.
+    - max_in_flight (int): Maximum requests being served per connection.
+    - max_batch_size (int): Maximum items of a query or add request.
+    - default_ttl_seconds (float, optional): Lifetime of entries added without one.
+    """
+
+    def __init__(
+        self,
+        handler: AsyncHandler,
+        ready: Callable[[], bool],
+        socket_path: Optional[str] = None,
+        host: str = "0.0.0.0",
+        port: Optional[int] = None,
+        max_in_flight: int = 32,
+        max_batch_size: int = 1024,
+        default_ttl_seconds: Optional[float] = None,
+    ):
+        if socket_path is None and port is None:
+            raise ValueError("Either socket_path or port must be given.")
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self.handler = handler
+        self.ready = ready
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.max_batch_size = max_batch_size
+        self.default_ttl_seconds = default_ttl_seconds
+        self.connections = 0
+        self._servers: List[asyncio.AbstractServer] = []
+        self._connections = set()
+
+    @property
+    def addresses(self) -> List[str]:
+        """
+        The addresses listened on, the Unix socket path or "host:port".
+        """
+        addresses = []
+        for server in self._servers:
+            for sock in server.sockets:
+                name = sock.getsockname()
+                addresses.append(name if isinstance(name, str) else f"{name[0]}:{name[1]}")
+        return addresses
+
+    async def start(self):
+        if self.socket_path is not None:
+            # A socket left behind by a previous process would make the bind fail
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._servers.append(
+                await asyncio.start_unix_server(self._serve, path=self.socket_path)
+            )
+        if self.port is not None:
+            self._servers.append(await asyncio.start_server(self._serve, self.host, self.port))
+        logger.info("Binary protocol listening on %s.", ", ".join(self.addresses))
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        # Connections close their transports before the loop may stop
+        await asyncio.gather(*connections, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Responses are small and written whole, so never hold them back
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        self.connections += 1
+        slots = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        requests = set()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(protocol.HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, request_id, op, _, flags = protocol.HEADER.unpack(header)
+                if length > protocol.MAX_PAYLOAD_BYTES:
+                    # The payload cannot be skipped safely, so the connection is closed
+                    await self._respond(
+                        writer,
+                        write_lock,
+                        protocol.pack_frame(
+                            request_id,
+                            op,
+                            b"Frame exceeds the maximum size.",
+                            protocol.STATUS_BAD_REQUEST,
+                        ),
+                    )
+                    break
+                try:
+                    payload = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    break
+                await slots.acquire()
+                request = asyncio.create_task(
+                    self._handle(writer, write_lock, request_id, op, flags, payload)
+                )
+                requests.add(request)
+                request.add_done_callback(requests.discard)
+                request.add_done_callback(lambda _: slots.release())
+            # Requests sent before the client stopped writing are still answered
+            if requests:
+                await asyncio.gather(*requests, return_exceptions=True)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            for request in requests:
+                request.cancel()
+            self.connections -= 1
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, write_lock: asyncio.Lock, frame: bytes):
+        async with write_lock:
+            writer.write(frame)
+            await writer.drain()
+
+    async def _handle(
+        self,
+        writer: asyncio.StreamWriter,
+        write_lock: asyncio.Lock,
+        request_id: int,
+        op: int,
+        flags: int,
+        payload: bytes,
+    ):
+        started = time.perf_counter()
+        try:
+            response = await self._dispatch(op, flags, payload)
+            status = protocol.STATUS_OK
+        except RequestError as e:
+            status, response = e.status, str(e).encode("utf-8")
+        except HandlerSaturatedError as e:
+            status, response = protocol.STATUS_BUSY, str(e).encode("utf-8")
+        except ValueError as e:  # Including ProtocolError
+            status, response = protocol.STATUS_BAD_REQUEST, str(e).encode("utf-8")
+        except Exception as e:
+            logger.exception("An error occurred while serving a binary request.")
+            status, response = protocol.STATUS_ERROR, str(e).encode("utf-8")
+        BINARY_REQUEST_SECONDS.labels(
+            protocol.OPS.get(op, "other"), _STATUS_NAMES[status]
+        ).observe(time.perf_counter() - started)
+        try:
+            await self._respond(
+                writer, write_lock, protocol.pack_frame(request_id, op, response, status)
+            )
+        except ConnectionError:
+            pass  # The client went away; the reading loop closes the connection
+
+    async def _dispatch(self, op: int, flags: int, payload: bytes) -> bytes:
+        if op == protocol.OP_PING:
+            return b""
+        if op not in protocol.OPS:
+            raise ProtocolError(f"Unknown op {op}.")
+        if not self.ready():
+            raise RequestError(protocol.STATUS_UNAVAILABLE, "Service is warming up")
+
+        if op == protocol.OP_QUERY:
+            threshold, namespace, contexts, vectors = protocol.decode_query(payload, flags)
+            self._check_batch_size(len(contexts))
+            if not contexts:
+                return protocol.encode_query_results([])
+            similarity = flags & protocol.FLAG_SIMILARITY
+            results = await self.handler.handle_query_batch(
+                contexts,
+                0.0 if similarity else threshold,
+                namespace=namespace or None,
+                similarity_threshold=threshold if similarity else None,
+                vectors=vectors,
+            )
+            return protocol.encode_query_results(results)
+
+        if op == protocol.OP_ADD:
+            namespace, ids, contexts, ttls, vectors = protocol.decode_add(payload, flags)
+            self._check_batch_size(len(ids))
+            if not ids:
+                return b""
+            results = await self.handler.handle_add_batch(
+                ids,
+                contexts,
+                namespace=namespace or None,
+                ttl_seconds=[ttl or self.default_ttl_seconds for ttl in ttls],
+                vectors=vectors,
+            )
+            # A batch is added as a whole, so its items all share one status
+            if results[0]["status"] != "success":
+                raise RequestError(protocol.STATUS_ERROR, results[0]["message"])
+            return b""
+
+        if op == protocol.OP_ENCODE:
+            contexts = protocol.decode_texts(payload)
+            self._check_batch_size(len(contexts))
+            vectors = await self.handler.handle_encode(contexts)
+            return protocol.encode_embeddings(vectors)
+
+        if op == protocol.OP_SCAN:
+            namespace, after, limit = protocol.decode_scan(payload)
+            self._check_batch_size(limit)
+            result = await self.handler.handle_scan(after, limit, namespace=namespace or None)
+            return protocol.encode_entries(
+                result["ids"], result["ttl_seconds"], result["vectors"]
+            )
+
+        namespace, ids = protocol.decode_remove(payload)
+        result = await self.handler.handle_remove(ids, namespace=namespace or None)
+        if result["status"] != "success":
+            raise RequestError(protocol.STATUS_ERROR, result["message"])
+        return protocol.encode_removed(result["removed"])
+
+    def _check_batch_size(self, size: int):
+        if size > self.max_batch_size:
+            raise ProtocolError(f"Batch exceeds {self.max_batch_size} items")
@@ -0,0 +1,5 @@
+"""
+Reproducible benchmarks of the indexing service: embedding throughput, index
+add/query performance per storage backend, and end-to-end HTTP load. See
+`python -m benchmarks --help`.
+"""
@@ -0,0 +1,284 @@
+"""
+Runs the benchmarks and writes their results as JSON, compares two results files, or
+evaluates hit quality over a labelled set to tune the similarity threshold.
+
+    python -m benchmarks run --size 10000 --output results/main.json
+    python -m benchmarks compare results/main.json results/branch.json
+    python -m benchmarks thresholds --pairs labelled.jsonl --precision-floor 0.95
+
+Run from the indexing_service directory.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from app.transport.remote import parse_address
+
+from benchmarks import embedding as embedding_bench
+from benchmarks import http_load, storage, thresholds, transport
+from benchmarks.corpus import (
+    generate_labelled_pairs,
+    generate_paraphrase_pairs,
+    generate_prompts,
+)
+from benchmarks.results import compare, write_results
+
+SUITES = ("embedding", "storage", "http", "transport")
+
+logger = logging.getLogger("benchmarks")
+
+
+def _csv(value: str):
+    return [item for item in value.split(",") if item]
+
+
+def run(args) -> int:
+    # Unseen prompts are generated with the corpus so they are distinct from it
+    prompts = generate_prompts(args.size + args.misses, seed=args.seed)
+    prompts, misses = prompts[: args.size], prompts[args.size :]
+    pairs = generate_paraphrase_pairs(prompts, args.queries, seed=args.seed + 1)
+    config = {key: value for key, value in vars(args).items() if key != "func"}
+    results = {}
+
+    embeddings = {}
+    for backend in args.embedding:
+        embeddings[backend] = embedding_bench.create_embedding(backend, args.onnx_model_dir)
+
+    if "embedding" in args.suites:
+        results["embedding"] = []
+        for backend, model in embeddings.items():
+            logger.info("Embedding benchmark: %s", backend)
+            results["embedding"].extend(
+                embedding_bench.bench_embedding(
+                    backend, model, prompts[: args.embedding_texts], args.batch_sizes
+                )
+            )
+
+    if "storage" in args.suites:
+        # Indexes are benchmarked on the vectors of the first embedding backend
+        model = embeddings[args.embedding[0]]
+        vectors = model.to_embeddings(prompts)
+        queries = model.to_embeddings([text for _, text in pairs])
+        results["storage"] = []
+        for backend in args.backends:
+            logger.info("Storage benchmark: %s", backend)
+            results["storage"].append(storage.bench_storage(backend, vectors, queries))
+
+    if "http" in args.suites or "transport" in args.suites:
+        addresses = [("uds", args.binary_socket)] if args.binary_socket else []
+        if args.binary_tcp:
+            addresses.append(("tcp", parse_address(args.binary_tcp)))
+        if args.url:
+            server = nullcontext(args.url)
+        else:
+            # The local service listens on both binary transports next to HTTP
+            port = http_load._free_port()
+            socket_path = os.path.join(tempfile.gettempdir(), f"gptcache-{os.getpid()}.sock")
+            addresses = [("uds", socket_path), ("tcp", ("127.0.0.1", port))]
+            server = http_load.local_server(
+                {"BINARY_SOCKET_PATH": socket_path, "BINARY_PORT": str(port)}
+            )
+        with server as url:
+            if "http" in args.suites:
+                logger.info("HTTP benchmark at concurrency %d", args.concurrency)
+                results["http"] = http_load.run(
+                    url, prompts, pairs, misses, args.concurrency, args.similarity_threshold
+                )
+            if "transport" in args.suites:
+                if not addresses:
+                    raise SystemExit("--binary-socket or --binary-tcp is needed with --url.")
+                logger.info("Transport benchmark at concurrency %d", args.concurrency)
+                results["transport"] = transport.run(
+                    url,
+                    addresses,
+                    embeddings[args.embedding[0]],
+                    prompts,
+                    pairs,
+                    misses,
+                    args.concurrency,
+                    args.similarity_threshold,
+                    args.depth,
+                )
+
+    write_results(args.output, config, results)
+    for suite, entries in results.items():
+        for entry in entries:
+            metrics = {k: v for k, v in entry.items() if k not in ("name", "params")}
+            print(f"{suite}/{entry['name']}: " + json.dumps(metrics, default=float))
+    print(f"Results written to {args.output}")
+    return 0
+
+
+def _threshold_range(value: str) -> np.ndarray:
+    """
+    Parses "start:stop:step", stop included, e.g. "0.5:0.99:0.01".
+    """
+    start, stop, step = (float(part) for part in value.split(":"))
+    return np.round(np.arange(start, stop + step / 2, step), 6)
+
+
+def tune_thresholds(args) -> int:
+    if args.pairs:
+        pairs = thresholds.load_pairs(args.pairs)
+        extra_cached = []
+    else:
+        # Without a labelled set, paraphrases and unseen prompts of the synthetic corpus
+        # are used, with the whole corpus cached
+        prompts = generate_prompts(args.size + args.misses, seed=args.seed)
+        extra_cached, misses = prompts[: args.size], prompts[args.size :]
+        pairs = generate_labelled_pairs(extra_cached, misses, args.queries, seed=args.seed)
+
+    embedding = embedding_bench.create_embedding(args.embedding, args.onnx_model_dir)
+    results, summary = thresholds.evaluate(
+        embedding,
+        pairs,
+        args.configs,
+        args.thresholds,
+        args.precision_floor,
+        extra_cached=extra_cached,
+        latency_queries=args.latency_queries,
+    )
+    config = {
+        key: value.tolist() if isinstance(value, np.ndarray) else value
+        for key, value in vars(args).items()
+        if key != "func"
+    }
+    write_results(args.output, config, {"thresholds": results}, summary)
+
+    print(f"{'config':<24} {'threshold':>9} {'precision':>9} {'recall':>7} {'fpr':>7} {'p50_ms':>8} {'p99_ms':>8}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['name']:<24} error: {result['error']}")
+            continue
+        selected = result["selected"]
+        if selected is None:
+            print(f"{result['name']:<24} no threshold reaches a precision of {args.precision_floor}")
+            continue
+        print(
+            f"{result['name']:<24} {selected['threshold']:>9.2f} {selected['precision']:>9.3f}"
+            f" {selected['recall']:>7.3f} {selected['false_positive_rate']:>7.3f}"
+            f" {result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}"
+        )
+    recommended = summary["recommended"]
+    if recommended is not None:
+        print(
+            f"Recommended: {recommended['config']} with similarity_threshold="
+            f"{recommended['threshold']:.2f}"
+        )
+    else:
+        print(f"No configuration reaches a precision of {args.precision_floor}.")
+    print(f"Results written to {args.output}")
+    return 0
+
+
+def compare_files(args) -> int:
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["environment"]["machine"] != candidate["environment"]["machine"]:
+        print("Warning: the runs were made on different machines.", file=sys.stderr)
+
+    rows = compare(baseline, candidate, args.tolerance)
+    for row in rows:
+        flag = "REGRESSED" if row["regressed"] else ""
+        print(
+            f"{row['metric']:<60} {row['baseline']:>14.4f} {row['candidate']:>14.4f}"
+            f" {row['change']:>+8.1%} {flag}"
+        )
+    regressions = sum(row["regressed"] for row in rows)
+    print(f"{regressions} of {len(rows)} metrics regressed by more than {args.tolerance:.0%}.")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="Run benchmarks and write their results.")
+    parser_run.add_argument("--suites", type=_csv, default=list(SUITES))
+    parser_run.add_argument("--size", type=int, default=10000, help="Prompts in the corpus.")
+    parser_run.add_argument("--queries", type=int, default=1000, help="Paraphrase queries.")
+    parser_run.add_argument("--misses", type=int, default=1000, help="Unseen prompts queried over HTTP.")
+    parser_run.add_argument("--seed", type=int, default=0)
+    parser_run.add_argument(
+        "--embedding",
+        type=_csv,
+        default=["hash"],
+        help="Embedding backends: hash, sentence_transformers, onnx or onnx:<model file>.",
+    )
+    parser_run.add_argument("--onnx-model-dir", default=None)
+    parser_run.add_argument("--embedding-texts", type=int, default=2000)
+    parser_run.add_argument(
+        "--batch-sizes", type=lambda v: [int(i) for i in _csv(v)],
+        default=list(embedding_bench.DEFAULT_BATCH_SIZES),
+    )
+    parser_run.add_argument("--backends", type=_csv, default=list(storage.DEFAULT_BACKENDS))
+    parser_run.add_argument("--url", default=None, help="Load this service instead of a local one.")
+    parser_run.add_argument("--binary-socket", default=None, help="The --url service's Unix socket.")
+    parser_run.add_argument("--binary-tcp", default=None, help="The --url service's binary host:port.")
+    parser_run.add_argument("--concurrency", type=int, default=32)
+    parser_run.add_argument("--depth", type=int, default=8, help="Pipelined binary requests.")
+    parser_run.add_argument("--similarity-threshold", type=float, default=0.8)
+    parser_run.add_argument(
+        "--output",
+        default=f"benchmarks/results/{time.strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    parser_run.set_defaults(func=run)
+
+    parser_compare = commands.add_parser("compare", help="Compare two results files.")
+    parser_compare.add_argument("baseline")
+    parser_compare.add_argument("candidate")
+    parser_compare.add_argument("--tolerance", type=float, default=0.1)
+    parser_compare.set_defaults(func=compare_files)
+
+    parser_thresholds = commands.add_parser(
+        "thresholds", help="Evaluate hit quality per threshold and index configuration."
+    )
+    parser_thresholds.add_argument(
+        "--pairs",
+        default=None,
+        help="Labelled pairs, .jsonl or .csv with query, cached and should_hit. "
+        "Defaults to a synthetic set.",
+    )
+    parser_thresholds.add_argument("--size", type=int, default=10000, help="Synthetic corpus size.")
+    parser_thresholds.add_argument("--queries", type=int, default=1000, help="Synthetic paraphrases.")
+    parser_thresholds.add_argument("--misses", type=int, default=1000, help="Synthetic unseen prompts.")
+    parser_thresholds.add_argument("--seed", type=int, default=0)
+    parser_thresholds.add_argument("--embedding", default="hash")
+    parser_thresholds.add_argument("--onnx-model-dir", default=None)
+    parser_thresholds.add_argument(
+        "--configs",
+        type=_csv,
+        default=list(thresholds.DEFAULT_CONFIGS),
+        help="Storage backends, optionally with +exact or +lexical re-ranking.",
+    )
+    parser_thresholds.add_argument(
+        "--thresholds", type=_threshold_range, default=thresholds.default_thresholds()
+    )
+    parser_thresholds.add_argument("--precision-floor", type=float, default=0.95)
+    parser_thresholds.add_argument("--latency-queries", type=int, default=500)
+    parser_thresholds.add_argument(
+        "--output",
+        default=f"benchmarks/results/thresholds-{time.strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    parser_thresholds.set_defaults(func=tune_thresholds)
+
+    args = parser.parse_args(argv)
+    unknown = set(getattr(args, "suites", ())) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import random
+from typing import List, Tuple
+
+TEMPLATES = (
+    "How do I {verb} a {noun} in {topic}?",
+    "What is the best way to {verb} the {noun} when working with {topic}?",
+    "Can you explain how to {verb} a {adjective} {noun} using {topic}?",
+    "Write a short guide on how to {verb} {adjective} {noun}s in {topic}.",
+    "Why does my {noun} fail when I {verb} it with {topic}?",
+    "Give me an example of a {adjective} {noun} in {topic}.",
+    "What are the differences between a {noun} and a {other} in {topic}?",
+    "Summarize the main steps to {verb} a {noun} for {topic}.",
+)
+
+VERBS = (
+    "create", "delete", "update", "sort", "parse", "validate", "serialize", "cache",
+    "optimize", "debug", "deploy", "configure", "migrate", "index", "compress", "merge",
+)
+NOUNS = (
+    "list", "dictionary", "table", "query", "request", "file", "string", "thread",
+    "process", "socket", "container", "database", "function", "class", "module",
+    "pipeline", "vector", "tensor", "image", "column", "schema", "service", "queue",
+)
+ADJECTIVES = (
+    "large", "nested", "sorted", "distributed", "immutable", "temporary", "remote",
+    "encrypted", "compressed", "concurrent", "partitioned", "cached",
+)
+TOPICS = (
+    "Python", "Go", "Rust", "JavaScript", "SQL", "Kubernetes", "Docker", "Redis",
+    "PostgreSQL", "FAISS", "PyTorch", "NumPy", "pandas", "Spark", "Linux", "AWS",
+)
+
+# Rewrites that keep the meaning of a prompt, applied at random to paraphrase it
+SYNONYMS = {
+    "How do I": ("How can I", "What's the way to", "How would I"),
+    "What is the best way to": ("What's the best way to", "How should I", "What is a good way to"),
+    "Can you explain how to": ("Could you explain how to", "Please explain how to", "Explain how to"),
+    "Write a short guide on how to": ("Write a brief guide on how to", "Write a small tutorial on how to"),
+    "Why does my": ("How come my", "For what reason does my"),
+    "Give me an example of": ("Show me an example of", "Provide an example of"),
+    "What are the differences between": ("What is the difference between", "How do you tell apart"),
+    "Summarize the main steps to": ("List the main steps to", "Outline the steps to"),
+    "create": ("make", "build"),
+    "delete": ("remove", "drop"),
+    "update": ("modify", "change"),
+    "large": ("big", "huge"),
+    "temporary": ("short-lived",),
+    "remote": ("distant",),
+    "when working with": ("when using", "with"),
+    "using": ("with", "in"),
+}
+
+
+def max_prompts() -> int:
+    """
+    Returns the number of distinct prompts the templates can produce.
+    """
+    slots = {
+        "verb": len(VERBS),
+        "noun": len(NOUNS),
+        "other": len(NOUNS) - 1,
+        "adjective": len(ADJECTIVES),
+        "topic": len(TOPICS),
+    }
+    total = 0
+    for template in TEMPLATES:
+        combinations = 1
+        for slot, count in slots.items():
+            if "{" + slot + "}" in template:
+                combinations *= count
+        total += combinations
+    return total
+
+
+def generate_prompts(n: int, seed: int = 0) -> List[str]:
+    """
+    Generates `n` distinct synthetic prompts from templates, the same ones for the same
+    seed.
+    """
+    if n > max_prompts():
+        raise ValueError(f"The templates only produce {max_prompts()} distinct prompts.")
+    rng = random.Random(seed)
+    prompts = []
+    seen = set()
+    while len(prompts) < n:
+        template = rng.choice(TEMPLATES)
+        noun, other = rng.sample(NOUNS, 2)
+        prompt = template.format(
+            verb=rng.choice(VERBS),
+            noun=noun,
+            other=other,
+            adjective=rng.choice(ADJECTIVES),
+            topic=rng.choice(TOPICS),
+        )
+        if prompt not in seen:
+            seen.add(prompt)
+            prompts.append(prompt)
+    return prompts
+
+
+def paraphrase(prompt: str, rng: random.Random) -> str:
+    """
+    Rewrites a prompt without changing its meaning: synonyms, casing, punctuation and
+    politeness prefixes. At least one rewrite is always applied.
+    """
+    text = prompt
+    phrases = [phrase for phrase in SYNONYMS if phrase in text]
+    rng.shuffle(phrases)
+    for phrase in phrases[: rng.randint(1, 2)] if phrases else []:
+        text = text.replace(phrase, rng.choice(SYNONYMS[phrase]), 1)
+
+    if rng.random() < 0.3:
+        text = rng.choice(("Please, ", "Quick question: ", "Hi! ")) + text[0].lower() + text[1:]
+    if rng.random() < 0.3:
+        text = text.rstrip("?.")
+    if rng.random() < 0.2:
+        text = text.lower()
+    if text == prompt:
+        text = "Please, " + text[0].lower() + text[1:]
+    return text
+
+
+def generate_paraphrase_pairs(
+    prompts: List[str], n: int, seed: int = 0
+) -> List[Tuple[int, str]]:
+    """
+    Picks `n` prompts at random and paraphrases each of them.
+
+    Returns:
+    - List[Tuple[int, str]]: The index of the original prompt in `prompts` and its
+    paraphrase, which should hit the cached original.
+    """
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        index = rng.randrange(len(prompts))
+        pairs.append((index, paraphrase(prompts[index], rng)))
+    return pairs
+
+
+def generate_labelled_pairs(
+    prompts: List[str], misses: List[str], n_hits: int, seed: int = 0
+) -> List[Tuple[str, str, bool]]:
+    """
+    Builds a labelled set for threshold tuning from a corpus: paraphrases of corpus
+    prompts, which should hit them, and prompts outside the corpus, which should not
+    hit the corpus prompt they are paired with (nor any other).
+
+    Returns:
+    - List[Tuple[str, str, bool]]: (query, cached query, should_hit) triples.
+    """
+    rng = random.Random(seed)
+    pairs = [
+        (text, prompts[index], True)
+        for index, text in generate_paraphrase_pairs(prompts, n_hits, seed=seed)
+    ]
+    pairs.extend((miss, rng.choice(prompts), False) for miss in misses)
+    return pairs
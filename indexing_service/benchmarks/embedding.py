@@ -0,0 +1,61 @@
+import time
+from typing import List, Sequence
+
+from gptcache.embedding import BaseEmbedding, HashEmbedding
+
+DEFAULT_BATCH_SIZES = (1, 8, 32, 128)
+
+
+def create_embedding(backend: str, onnx_model_dir: str = None) -> BaseEmbedding:
+    """
+    Creates the embedding of a backend as the service does: "hash" needs no model,
+    "sentence_transformers" downloads all-MiniLM-L6-v2 on first use, and "onnx" runs
+    the model exported by scripts/export_onnx.py.
+    """
+    if backend == "hash":
+        return HashEmbedding(dimension=384)
+    if backend == "sentence_transformers":
+        from gptcache.embedding import SentenceEmbedding
+
+        return SentenceEmbedding(model_name="all-MiniLM-L6-v2")
+    if backend.startswith("onnx"):
+        from gptcache.embedding import OnnxEmbedding
+
+        # "onnx:model_quantized.onnx" selects another model file in the directory
+        _, _, model_file = backend.partition(":")
+        return OnnxEmbedding(
+            onnx_model_dir or "models/all-MiniLM-L6-v2-onnx",
+            model_file=model_file or "model.onnx",
+        )
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def bench_embedding(
+    backend: str,
+    embedding: BaseEmbedding,
+    texts: List[str],
+    batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+) -> List[dict]:
+    """
+    Measures how many texts per second an embedding encodes at each batch size.
+
+    Returns:
+    - List[dict]: One result per batch size.
+    """
+    # The first call loads lazily initialized parts of the model
+    embedding.to_embeddings(texts[:1])
+
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            embedding.to_embeddings(texts[offset : offset + batch_size])
+        seconds = time.perf_counter() - start
+        results.append(
+            {
+                "name": f"{backend}/batch{batch_size}",
+                "params": {"texts": len(texts), "batch_size": batch_size},
+                "texts_per_second": len(texts) / seconds,
+            }
+        )
+    return results
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.results import latency_summary
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def local_server(env: Optional[dict] = None, ready_timeout: float = 120.0) -> Iterator[str]:
+    """
+    Serves the FastAPI app from a thread of this process, with its data directories in
+    a temporary directory, and yields its URL once it is ready.
+
+    The app reads its configuration when it is imported, so `env` (e.g. the embedding
+    backend or index type) is applied before the import and can only be set once per
+    process. Without an EMBEDDING_BACKEND the hash embedding is used, so no model is
+    downloaded.
+    """
+    import uvicorn
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.setdefault("EMBEDDING_BACKEND", "hash")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        for name in ("SNAPSHOT_DIR", "WAL_DIR", "PARTITION_DIR", "RESCORE_VECTOR_DIR"):
+            os.environ.setdefault(name, os.path.join(directory, name.lower()))
+        os.environ.update(env or {})
+
+        from app.main import app
+
+        port = _free_port()
+        server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+        )
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        url = f"http://127.0.0.1:{port}"
+        try:
+            wait_ready(url, ready_timeout)
+            yield url
+        finally:
+            server.should_exit = True
+            thread.join()
+
+
+def wait_ready(url: str, timeout: float):
+    """
+    Polls /readyz until the service has loaded its model and index.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = httpx.get(f"{url}/readyz")
+            if response.status_code == 200:
+                return
+            if response.json().get("status") == "failed":
+                raise RuntimeError(f"Service failed to start: {response.json()['error']}")
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{url} was not ready after {timeout}s.")
+        time.sleep(0.1)
+
+
+async def _load(
+    url: str, path: str, bodies: List[dict], concurrency: int
+) -> Tuple[float, List[float], List[int], List[Optional[dict]]]:
+    """
+    Sends every body to `path` from `concurrency` concurrent clients.
+
+    Returns:
+    - Tuple[float, List[float], List[int], List[Optional[dict]]]: The wall time of the
+    whole run, and the latency, status code and JSON body (of 200 responses) of each
+    request, in the order of `bodies`.
+    """
+    latencies = [0.0] * len(bodies)
+    statuses = [0] * len(bodies)
+    payloads: List[Optional[dict]] = [None] * len(bodies)
+    next_index = iter(range(len(bodies)))
+
+    async def worker(client: httpx.AsyncClient):
+        for index in next_index:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=bodies[index])
+                statuses[index] = response.status_code
+                if response.status_code == 200:
+                    payloads[index] = response.json()
+            except httpx.TransportError:
+                statuses[index] = -1
+            latencies[index] = time.perf_counter() - start
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return time.perf_counter() - start, latencies, statuses, payloads
+
+
+def _phase(name: str, concurrency: int, seconds: float, latencies, statuses, ok) -> dict:
+    return {
+        "name": f"{name}/c{concurrency}",
+        "params": {"requests": len(statuses), "concurrency": concurrency},
+        "requests_per_second": len(statuses) / seconds,
+        "errors": sum(status not in ok for status in statuses),
+        **latency_summary(latencies),
+    }
+
+
+def run(
+    url: str,
+    prompts: List[str],
+    pairs: List[Tuple[int, str]],
+    misses: List[str],
+    concurrency: int = 32,
+    similarity_threshold: float = 0.8,
+    batch_size: int = 32,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Loads a running service end to end over HTTP: adds every prompt, then queries the
+    paraphrases (expected hits) interleaved with unseen prompts (expected misses),
+    one per request and then in batches, and finally asks the original prompts again.
+
+    Parameters:
+    - url (str): The base URL of the service.
+    - prompts (List[str]): The prompts added, with their index as ID.
+    - pairs (List[Tuple[int, str]]): Paraphrases and the index of their original.
+    - misses (List[str]): Prompts that were never added.
+    - concurrency (int): Number of concurrent clients.
+    - similarity_threshold (float): The threshold sent with every query.
+    - batch_size (int): Number of contexts per /queryIndexBatch request.
+    - seed (int): Seeds the order in which queries are sent.
+
+    Returns:
+    - List[dict]: One result per phase. The query phase reports the fraction of
+    paraphrases that hit their original (`hit_rate`), and of unseen prompts that hit
+    anything (`false_positive_rate`). The query_repeat phase asks the originals of the
+    paraphrases again, and reports the fraction the fingerprint tier answered
+    (`fingerprint_hit_rate`) separately from its `hit_rate`.
+    """
+    results = []
+
+    bodies = [{"id": i, "context": prompt} for i, prompt in enumerate(prompts)]
+    seconds, latencies, statuses, _ = asyncio.run(
+        _load(url, "/addIndex", bodies, concurrency)
+    )
+    results.append(_phase("add", concurrency, seconds, latencies, statuses, {200}))
+
+    queries = [(text, index) for index, text in pairs] + [(text, None) for text in misses]
+    # Interleave hits and misses so neither is served in a burst of its own
+    random.Random(seed).shuffle(queries)
+    bodies = [
+        {"context": text, "similarity_threshold": similarity_threshold} for text, _ in queries
+    ]
+    seconds, latencies, statuses, payloads = asyncio.run(
+        _load(url, "/queryIndex", bodies, concurrency)
+    )
+    result = _phase("query", concurrency, seconds, latencies, statuses, {200, 204})
+    if pairs:
+        correct = sum(
+            payload is not None and payload["id"] == index
+            for (_, index), payload in zip(queries, payloads)
+            if index is not None
+        )
+        result["hit_rate"] = correct / len(pairs)
+    if misses:
+        false_positives = sum(
+            payload is not None
+            for (_, index), payload in zip(queries, payloads)
+            if index is None
+        )
+        result["false_positive_rate"] = false_positives / len(misses)
+    results.append(result)
+
+    texts = [text for text, _ in queries]
+    bodies = [
+        {
+            "contexts": texts[offset : offset + batch_size],
+            "similarity_threshold": similarity_threshold,
+        }
+        for offset in range(0, len(texts), batch_size)
+    ]
+    seconds, latencies, statuses, _ = asyncio.run(
+        _load(url, "/queryIndexBatch", bodies, concurrency)
+    )
+    result = _phase(f"query_batch{batch_size}", concurrency, seconds, latencies, statuses, {200})
+    result["queries_per_second"] = len(texts) / seconds
+    results.append(result)
+
+    # Prompts asked again verbatim, up to whitespace, as the fingerprint tier serves them
+    before = _fingerprint_stats(url)
+    repeats = [index for index, _ in pairs]
+    bodies = [
+        {"context": f" {prompts[index]} ", "similarity_threshold": similarity_threshold}
+        for index in repeats
+    ]
+    seconds, latencies, statuses, payloads = asyncio.run(
+        _load(url, "/queryIndex", bodies, concurrency)
+    )
+    result = _phase("query_repeat", concurrency, seconds, latencies, statuses, {200, 204})
+    if repeats:
+        result["hit_rate"] = sum(
+            payload is not None and payload["id"] == index
+            for index, payload in zip(repeats, payloads)
+        ) / len(repeats)
+    after = _fingerprint_stats(url)
+    if before is not None and after is not None and after["lookups"] > before["lookups"]:
+        hits = (after["exact_hits"] + after["near_hits"]) - (
+            before["exact_hits"] + before["near_hits"]
+        )
+        result["fingerprint_hit_rate"] = hits / (after["lookups"] - before["lookups"])
+    results.append(result)
+    return results
+
+
+def _fingerprint_stats(url: str) -> Optional[dict]:
+    """
+    Returns the fingerprint tier counters of the default partition, or `None` if the
+    service does not report them.
+    """
+    try:
+        stats = httpx.get(url + "/stats", timeout=10.0).json()
+        return stats["partitions"]["loaded"]["default"]["fingerprint"]
+    except (httpx.HTTPError, KeyError, ValueError):
+        return None
@@ -0,0 +1,147 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Metrics where a higher value is better; for every other metric lower is better
+HIGHER_IS_BETTER = ("per_second", "recall", "precision", "hit_rate")
+
+FORMAT_VERSION = 1
+
+
+def latency_summary(seconds: List[float]) -> dict:
+    """
+    Summarizes latencies measured in seconds as milliseconds percentiles.
+    """
+    if not seconds:
+        return {"p50_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+    milliseconds = np.asarray(seconds) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "mean_ms": float(milliseconds.mean()),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Returns the resident memory of the process, which, unlike tracemalloc, includes
+    what FAISS and Annoy allocate natively. Only available on Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    """
+    Describes where the benchmark ran, since results are only comparable on the same
+    machine and library versions.
+    """
+    versions = {}
+    for module in ("numpy", "faiss", "annoy", "fastapi", "sentence_transformers", "onnxruntime"):
+        try:
+            versions[module] = getattr(__import__(module), "__version__", "unknown")
+        except ImportError:
+            versions[module] = None
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def write_results(
+    path: str, config: dict, results: Dict[str, list], summary: Optional[dict] = None
+) -> dict:
+    """
+    Writes the results of a run as JSON, with the configuration and environment needed
+    to reproduce and compare them, and an optional free-form summary.
+    """
+    document = {
+        "format": FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "argv": sys.argv,
+        "environment": environment(),
+        "config": config,
+        "results": results,
+    }
+    if summary is not None:
+        document["summary"] = summary
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return document
+
+
+def _flatten(results: Dict[str, list]) -> Dict[str, float]:
+    """
+    Maps "<suite>/<name>/<metric>" to every numeric metric of a results document.
+    """
+    flat = {}
+    for suite, entries in results.items():
+        for entry in entries:
+            for metric, value in entry.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    flat[f"{suite}/{entry['name']}/{metric}"] = float(value)
+    return flat
+
+
+def compare(baseline: dict, candidate: dict, tolerance: float = 0.1) -> List[dict]:
+    """
+    Compares the metrics two runs have in common.
+
+    Parameters:
+    - baseline (dict): The results document of the reference run.
+    - candidate (dict): The results document of the run being checked.
+    - tolerance (float): The relative change beyond which a metric counts as a
+    regression (or improvement).
+
+    Returns:
+    - List[dict]: One entry per metric with both values, the relative change, and
+    whether it regressed, i.e. got worse by more than `tolerance`.
+    """
+    before = _flatten(baseline["results"])
+    after = _flatten(candidate["results"])
+    rows = []
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = (new - old) / abs(old) if old else 0.0
+        higher_is_better = any(marker in key for marker in HIGHER_IS_BETTER)
+        worse = -change if higher_is_better else change
+        rows.append(
+            {
+                "metric": key,
+                "baseline": old,
+                "candidate": new,
+                "change": change,
+                "regressed": worse > tolerance,
+            }
+        )
+    return rows
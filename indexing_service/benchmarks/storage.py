@@ -0,0 +1,147 @@
+import gc
+import math
+import time
+
+import numpy as np
+
+from gptcache.embedding_storage import (
+    AnnoyEmbeddingStorage,
+    BaseEmbeddingStorage,
+    FaissEmbeddingStorage,
+)
+
+from benchmarks.results import latency_summary, rss_bytes
+
+# Backends benchmarked by default: Annoy, and FAISS with each of its index presets
+DEFAULT_BACKENDS = (
+    "annoy",
+    "faiss:flat",
+    "faiss:hnsw",
+    "faiss:ivf_flat",
+    "faiss:ivf_pq",
+    "faiss:sq_fp16",
+    "faiss:sq8",
+    "faiss:pq",
+    "faiss:ivf_sq8",
+    "faiss:hnsw_sq8",
+)
+
+
+def _pq_m(dimension: int) -> int:
+    """
+    Returns the number of PQ sub-quantizers used for `dimension`: 8 dimensions each,
+    as the service's default of 48 for 384 dimensions, rounded to a divisor.
+    """
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def create_storage(backend: str, dimension: int, size: int) -> BaseEmbeddingStorage:
+    """
+    Creates an empty storage for a backend spec, "annoy" or "faiss:<index_type>", with
+    parameters scaled to the corpus size so every index type can be trained on it.
+    """
+    if backend == "annoy":
+        return AnnoyEmbeddingStorage(dimension=dimension)
+    kind, _, index_type = backend.partition(":")
+    if kind != "faiss" or not index_type:
+        raise ValueError(f"Unknown backend: {backend}")
+    # About sqrt(n) IVF cells, with enough vectors to train each of them
+    nlist = max(1, min(int(4 * math.sqrt(size)), size // 39))
+    return FaissEmbeddingStorage(
+        dimension=dimension,
+        index_type=index_type,
+        nlist=nlist,
+        nprobe=min(16, nlist),
+        pq_m=_pq_m(dimension),
+        # Trained explicitly by `build_index` once every vector is staged, so training
+        # is timed on its own
+        train_size=size + 1,
+    )
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    Returns the row of `vectors` nearest to each query, by brute force, as the ground
+    truth for recall.
+    """
+    nearest = np.empty(len(queries), dtype="int64")
+    for start in range(0, len(queries), 1024):
+        block = queries[start : start + 1024]
+        distances = (
+            (block**2).sum(axis=1)[:, None]
+            - 2.0 * block @ vectors.T
+            + (vectors**2).sum(axis=1)[None, :]
+        )
+        nearest[start : start + len(block)] = distances.argmin(axis=1)
+    return nearest
+
+
+def bench_storage(
+    backend: str,
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    batch_size: int = 256,
+) -> dict:
+    """
+    Measures one backend: add throughput, query latency and throughput, recall@1
+    against exact search, and memory.
+
+    Parameters:
+    - backend (str): "annoy" or "faiss:<index_type>".
+    - vectors (np.ndarray): The (n, d) vectors added, with IDs 0 to n - 1.
+    - queries (np.ndarray): The (q, d) query vectors.
+    - batch_size (int): Number of vectors per `add_items` call.
+
+    Returns:
+    - dict: The metrics of the backend. Add throughput includes training and, for
+    Annoy, building the trees, since both are needed before the first query; the time
+    they took is also reported on its own as `build_seconds`.
+    """
+    gc.collect()
+    rss_before = rss_bytes()
+    storage = create_storage(backend, vectors.shape[1], len(vectors))
+
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), batch_size):
+        block = vectors[offset : offset + batch_size]
+        storage.add_items(list(range(offset, offset + len(block))), block)
+    insert_seconds = time.perf_counter() - start
+    build_start = time.perf_counter()
+    storage.build_index(num_trees=10)
+    build_seconds = time.perf_counter() - build_start
+    add_seconds = insert_seconds + build_seconds
+    rss_after = rss_bytes()
+
+    latencies = []
+    found = np.full(len(queries), -1, dtype="int64")
+    for row, query in enumerate(queries):
+        start = time.perf_counter()
+        ids, _ = storage.get_nns_by_vector(query, n=1)
+        latencies.append(time.perf_counter() - start)
+        if len(ids) > 0:
+            found[row] = ids[0]
+
+    start = time.perf_counter()
+    storage.get_nns_by_vectors(queries, n=1)
+    batch_query_seconds = time.perf_counter() - start
+
+    truth = exact_neighbours(vectors, queries)
+    result = {
+        "name": backend,
+        "params": {"size": len(vectors), "queries": len(queries), "dimension": vectors.shape[1]},
+        "add_per_second": len(vectors) / add_seconds,
+        "build_seconds": build_seconds,
+        "query_per_second": len(queries) / sum(latencies),
+        "batch_query_per_second": len(queries) / batch_query_seconds,
+        "recall_at_1": float((found == truth).mean()),
+        **latency_summary(latencies),
+    }
+    if rss_before is not None and rss_after is not None:
+        result["rss_bytes"] = rss_after - rss_before
+    if isinstance(storage, FaissEmbeddingStorage):
+        result["entry_bytes"] = storage.entry_bytes
+    return result
+
@@ -0,0 +1,315 @@
+import csv
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.embedding_storage import FaissEmbeddingStorage
+from gptcache.rerank import ExactReranker, LexicalReranker, RerankingSearch, TextStore
+
+from app.handlers.annoy_handler import AnnoyHandler
+from app.handlers.faiss_handler import FaissHandler
+from benchmarks.results import latency_summary
+from benchmarks.storage import create_storage
+
+# A labelled pair: the incoming query, the query already cached, and whether the
+# cached response should be served for it
+LabelledPair = Tuple[str, str, bool]
+
+DEFAULT_CONFIGS = ("faiss:flat", "faiss:hnsw", "faiss:ivf_flat", "faiss:sq8", "annoy")
+
+
+def default_thresholds() -> np.ndarray:
+    return np.round(np.arange(0.5, 1.0, 0.01), 2)
+
+
+def load_pairs(path: str) -> List[LabelledPair]:
+    """
+    Reads labelled pairs from a JSON Lines file of
+    {"query": ..., "cached": ..., "should_hit": true} objects, or from a CSV file with
+    query, cached and should_hit columns (true/false, yes/no or 1/0).
+    """
+    pairs = []
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for number, row in enumerate(rows, start=1):
+        try:
+            should_hit = row["should_hit"]
+            if isinstance(should_hit, str):
+                should_hit = should_hit.strip().lower() in ("true", "yes", "1")
+            pairs.append((row["query"], row["cached"], bool(should_hit)))
+        except KeyError as e:
+            raise ValueError(f"Row {number} of {path} has no {e} field.")
+    return pairs
+
+
+class PrecomputedEmbedding(BaseEmbedding):
+    """
+    Serves vectors computed up front, so the handlers can be replayed under many
+    configurations without encoding any text twice.
+    """
+
+    def __init__(self, texts: Sequence[str], vectors: np.ndarray):
+        self.rows = {text: row for row, text in enumerate(texts)}
+        self.vectors = np.asarray(vectors, dtype="float32")
+
+    def to_embedding(self, text: str):
+        return self.vectors[self.rows[text]]
+
+    def to_embeddings(self, texts: List[str]):
+        return self.vectors[[self.rows[text] for text in texts]]
+
+
+def encode(embedding: BaseEmbedding, texts: List[str], batch_size: int = 256) -> np.ndarray:
+    """
+    Encodes every text once, in batches.
+    """
+    blocks = [
+        np.asarray(
+            embedding.to_embeddings(texts[offset : offset + batch_size]), dtype="float32"
+        )
+        for offset in range(0, len(texts), batch_size)
+    ]
+    return np.concatenate(blocks)
+
+
+def create_handler(config: str, embedding: BaseEmbedding, dimension: int, size: int):
+    """
+    Creates the handler of a configuration: a storage backend spec as for the storage
+    benchmark, optionally followed by "+exact" or "+lexical" to re-rank 10 candidates,
+    e.g. "faiss:sq8+exact".
+    """
+    backend, _, reranker_name = config.partition("+")
+    storage = create_storage(backend, dimension, size)
+    if not isinstance(storage, FaissEmbeddingStorage):
+        if reranker_name:
+            raise ValueError("Re-ranking is only supported with FAISS.")
+        return AnnoyHandler(embedding, storage)
+
+    texts = None
+    if reranker_name == "exact":
+        reranker = ExactReranker(storage)
+    elif reranker_name == "lexical":
+        texts = TextStore(max_entries=size)
+        reranker = LexicalReranker(texts)
+    elif not reranker_name:
+        reranker = None
+    else:
+        raise ValueError(f"Unknown reranker: {reranker_name}")
+    search = RerankingSearch(storage, reranker, k=10 if reranker else 1, texts=texts)
+    return FaissHandler(embedding, storage, search)
+
+
+def score(
+    similarities: np.ndarray,
+    found_ids: np.ndarray,
+    expected_ids: np.ndarray,
+    should_hit: np.ndarray,
+    thresholds: np.ndarray,
+) -> Dict[str, np.ndarray]:
+    """
+    Scores every threshold at once.
+
+    A query hits when its best candidate's similarity reaches the threshold. A hit is a
+    true positive only if the pair should hit and the candidate is its cached query;
+    serving any other entry is a false positive.
+
+    Parameters:
+    - similarities (np.ndarray): The similarity of each query's best candidate, NaN
+    when it had none.
+    - found_ids (np.ndarray): The ID of each query's best candidate.
+    - expected_ids (np.ndarray): The ID of each pair's cached query.
+    - should_hit (np.ndarray): The label of each pair.
+    - thresholds (np.ndarray): The similarity thresholds to score.
+
+    Returns:
+    - Dict[str, np.ndarray]: Counts and rates per threshold: "tp", "fp", "fn", "tn",
+    "precision", "recall" (of the pairs that should hit) and "false_positive_rate" (of
+    the pairs that should not hit, the fraction that hit anything).
+    """
+    # (thresholds, pairs); NaN compares False, so queries without candidates miss
+    with np.errstate(invalid="ignore"):
+        hits = similarities[None, :] >= thresholds[:, None]
+    correct = should_hit & (found_ids == expected_ids)
+
+    tp = (hits & correct).sum(axis=1)
+    fp = (hits & ~correct).sum(axis=1)
+    negative_hits = (hits & ~should_hit).sum(axis=1)
+    positives = int(should_hit.sum())
+    negatives = len(should_hit) - positives
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = tp / positives if positives else np.ones(len(thresholds))
+        false_positive_rate = (
+            negative_hits / negatives if negatives else np.zeros(len(thresholds))
+        )
+    return {
+        "tp": tp,
+        "fp": fp,
+        "fn": positives - tp,
+        "tn": negatives - negative_hits,
+        "precision": precision,
+        "recall": recall,
+        "false_positive_rate": false_positive_rate,
+    }
+
+
+def select_threshold(scores: Dict[str, np.ndarray], precision_floor: float) -> Optional[int]:
+    """
+    Returns the index of the threshold with the best recall among those meeting the
+    precision floor, preferring the lowest such threshold, or `None` if none does
+    with at least one true positive.
+    """
+    meets = np.flatnonzero((scores["precision"] >= precision_floor) & (scores["tp"] > 0))
+    if len(meets) == 0:
+        return None
+    return int(meets[np.argmax(scores["recall"][meets])])
+
+
+def evaluate_config(
+    config: str,
+    embedding: PrecomputedEmbedding,
+    cached: List[str],
+    queries: List[str],
+    expected_ids: np.ndarray,
+    should_hit: np.ndarray,
+    thresholds: np.ndarray,
+    precision_floor: float,
+    latency_queries: int = 500,
+) -> dict:
+    """
+    Replays the pairs through the handler of one configuration and scores its curve.
+    """
+    handler = create_handler(config, embedding, embedding.vectors.shape[1], len(cached))
+    results = handler.handle_add_batch(list(range(len(cached))), cached)
+    if results and results[0]["status"] != "success":
+        raise RuntimeError(results[0]["message"])
+    handler.a.build_index(num_trees=10)
+
+    # Every best candidate is returned, whatever its similarity, and thresholds are
+    # applied afterwards
+    start = time.perf_counter()
+    matches = handler.handle_query_batch(
+        queries, distance_threshold=np.inf, similarity_threshold=-np.inf
+    )
+    batch_seconds = time.perf_counter() - start
+    similarities = np.array(
+        [np.nan if m["similarity"] is None else m["similarity"] for m in matches]
+    )
+    found_ids = np.array([-1 if m["id"] is None else m["id"] for m in matches])
+
+    latencies = []
+    for query in queries[:latency_queries]:
+        start = time.perf_counter()
+        handler.handle_query(query, distance_threshold=np.inf, similarity_threshold=-np.inf)
+        latencies.append(time.perf_counter() - start)
+
+    scores = score(similarities, found_ids, expected_ids, should_hit, thresholds)
+    curve = [
+        {
+            "threshold": float(threshold),
+            **{key: float(values[row]) for key, values in scores.items()},
+        }
+        for row, threshold in enumerate(thresholds)
+    ]
+    selected = select_threshold(scores, precision_floor)
+    result = {
+        "name": config,
+        "params": {
+            "cached": len(cached),
+            "pairs": len(queries),
+            "precision_floor": precision_floor,
+        },
+        "batch_query_per_second": len(queries) / batch_seconds,
+        **latency_summary(latencies),
+        "selected": curve[selected] if selected is not None else None,
+        "curve": curve,
+    }
+    if selected is not None:
+        result["recall_at_floor"] = curve[selected]["recall"]
+    return result
+
+
+def evaluate(
+    embedding: BaseEmbedding,
+    pairs: List[LabelledPair],
+    configs: Sequence[str] = DEFAULT_CONFIGS,
+    thresholds: Optional[np.ndarray] = None,
+    precision_floor: float = 0.95,
+    extra_cached: Sequence[str] = (),
+    latency_queries: int = 500,
+) -> Tuple[List[dict], dict]:
+    """
+    Evaluates hit quality and latency over a labelled set, for each configuration.
+
+    Every distinct cached query (and every text of `extra_cached`, which stand for the
+    rest of a real cache) is added to the index, then every query is searched, through
+    the same handlers as the service. All texts are encoded in one batched pass first,
+    and each threshold is scored with NumPy from the similarities of a single search
+    pass per configuration.
+
+    Parameters:
+    - embedding (BaseEmbedding): The model to evaluate with.
+    - pairs (List[LabelledPair]): The labelled (query, cached, should_hit) pairs.
+    - configs (Sequence[str]): The index configurations, see `create_handler`.
+    - thresholds (np.ndarray, optional): The similarity thresholds to score.
+    - precision_floor (float): The minimum precision of the selected threshold.
+    - extra_cached (Sequence[str]): Unlabelled texts added to the index as distractors.
+    - latency_queries (int): Number of queries timed one by one per configuration.
+
+    Returns:
+    - Tuple[List[dict], dict]: One result per configuration with its curve and the
+    threshold selected at the precision floor, and a summary of the encoding pass
+    and of the recommended configuration: the fastest at p50 whose selected
+    threshold meets the floor.
+    """
+    if thresholds is None:
+        thresholds = default_thresholds()
+    cached = list(dict.fromkeys([c for _, c, _ in pairs] + list(extra_cached)))
+    ids = {text: i for i, text in enumerate(cached)}
+    queries = [q for q, _, _ in pairs]
+    expected_ids = np.array([ids[c] for _, c, _ in pairs])
+    should_hit = np.array([label for _, _, label in pairs], dtype=bool)
+
+    texts = list(dict.fromkeys(cached + queries))
+    start = time.perf_counter()
+    vectors = encode(embedding, texts)
+    encode_seconds = time.perf_counter() - start
+    precomputed = PrecomputedEmbedding(texts, vectors)
+
+    results = []
+    for config in configs:
+        try:
+            results.append(
+                evaluate_config(
+                    config,
+                    precomputed,
+                    cached,
+                    queries,
+                    expected_ids,
+                    should_hit,
+                    thresholds,
+                    precision_floor,
+                    latency_queries,
+                )
+            )
+        except Exception as e:
+            results.append({"name": config, "error": str(e)})
+
+    eligible = [r for r in results if r.get("selected") is not None]
+    best = min(eligible, key=lambda r: r["p50_ms"]) if eligible else None
+    summary = {
+        "texts_encoded": len(texts),
+        "encode_texts_per_second": len(texts) / encode_seconds,
+        "recommended": (
+            {"config": best["name"], "p50_ms": best["p50_ms"], **best["selected"]}
+            if best is not None
+            else None
+        ),
+    }
+    return results, summary
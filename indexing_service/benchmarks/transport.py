@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.transport import BinaryClient, BinaryProtocolError
+from app.transport import protocol
+from app.transport.remote import Address
+from benchmarks import http_load
+from benchmarks.results import latency_summary
+
+
+def _binary_load(
+    address: Address, requests: List[Tuple[int, bytes, int]], concurrency: int, depth: int
+) -> Tuple[float, List[float], List[bool], List[Optional[bytes]]]:
+    """
+    Sends every request from `concurrency` connections, each with up to `depth`
+    requests in flight.
+
+    Returns:
+    - Tuple[float, List[float], List[bool], List[Optional[bytes]]]: The wall time of
+    the whole run, and the latency, success and response payload of each request, in
+    the order of `requests`.
+    """
+    latencies = [0.0] * len(requests)
+    succeeded = [False] * len(requests)
+    payloads: List[Optional[bytes]] = [None] * len(requests)
+    chunks = iter(range(0, len(requests), depth))
+    lock = threading.Lock()
+
+    def worker():
+        with BinaryClient(address, timeout=30.0) as client:
+            while True:
+                with lock:
+                    offset = next(chunks, None)
+                if offset is None:
+                    return
+                indexes = range(offset, min(offset + depth, len(requests)))
+                start = time.perf_counter()
+                sent = [(index, client.send(*requests[index])) for index in indexes]
+                for index, request_id in sent:
+                    try:
+                        payloads[index] = client.receive(request_id)[1]
+                        succeeded[index] = True
+                    except BinaryProtocolError:
+                        pass
+                    latencies[index] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, succeeded, payloads
+
+
+def _phase(
+    name: str,
+    concurrency: int,
+    depth: int,
+    seconds: float,
+    latencies: List[float],
+    errors: int,
+    request_bytes: float,
+) -> dict:
+    return {
+        "name": f"{name}/c{concurrency}" + (f"/p{depth}" if depth > 1 else ""),
+        "params": {"requests": len(latencies), "concurrency": concurrency, "depth": depth},
+        "requests_per_second": len(latencies) / seconds,
+        "errors": errors,
+        "request_bytes": request_bytes,
+        **latency_summary(latencies),
+    }
+
+
+def _hit_rate(expected: Sequence[Optional[int]], ids: Sequence[Optional[int]]) -> Optional[float]:
+    hits = [found == index for index, found in zip(expected, ids) if index is not None]
+    return sum(hits) / len(hits) if hits else None
+
+
+def run(
+    url: str,
+    addresses: Sequence[Tuple[str, Address]],
+    embedding,
+    prompts: List[str],
+    pairs: List[Tuple[int, str]],
+    misses: List[str],
+    concurrency: int = 32,
+    similarity_threshold: float = 0.8,
+    depth: int = 8,
+) -> List[dict]:
+    """
+    Compares the transports of a running service on the same queries: JSON over HTTP,
+    then the binary protocol on each of `addresses` with one request in flight per
+    connection, pipelined `depth` deep, and with raw float32 embeddings computed by
+    the client instead of texts.
+
+    The prompts are added over the first binary address first, unless the service
+    already holds them, e.g. after the HTTP suite.
+
+    Parameters:
+    - url (str): The base URL of the service.
+    - addresses (Sequence[Tuple[str, Address]]): Named binary addresses, e.g.
+    ("uds", "/run/gptcache.sock") and ("tcp", ("127.0.0.1", 9000)).
+    - embedding (BaseEmbedding): The service's model, to compute the raw embeddings.
+    - prompts (List[str]): The prompts added, with their index as ID.
+    - pairs (List[Tuple[int, str]]): Paraphrases and the index of their original.
+    - misses (List[str]): Prompts that were never added.
+    - concurrency (int): Number of concurrent connections.
+    - similarity_threshold (float): The threshold sent with every query.
+    - depth (int): Requests in flight per connection when pipelined.
+
+    Returns:
+    - List[dict]: One result per transport and mode, with throughput, latency, the
+    mean request size in bytes and the paraphrase `hit_rate`, which should be the
+    same for every transport.
+    """
+    results = []
+    name, address = addresses[0]
+    with BinaryClient(address) as client:
+        if client.query([prompts[0]], similarity_threshold=0.999)[0]["id"] != 0:
+            for offset in range(0, len(prompts), 256):
+                batch = prompts[offset : offset + 256]
+                client.add(list(range(offset, offset + len(batch))), batch)
+
+    queries = [(text, index) for index, text in pairs] + [(text, None) for text in misses]
+    expected = [index for _, index in queries]
+    texts = [text for text, _ in queries]
+
+    bodies = [{"context": text, "similarity_threshold": similarity_threshold} for text in texts]
+    seconds, latencies, statuses, payloads = asyncio.run(
+        http_load._load(url, "/queryIndex", bodies, concurrency)
+    )
+    result = _phase(
+        "json",
+        concurrency,
+        1,
+        seconds,
+        latencies,
+        sum(status not in (200, 204) for status in statuses),
+        float(np.mean([len(json.dumps(body)) for body in bodies])),
+    )
+    result["hit_rate"] = _hit_rate(
+        expected, [payload["id"] if payload else None for payload in payloads]
+    )
+    results.append(result)
+
+    vectors = np.asarray(embedding.to_embeddings(texts), dtype="float32")
+    modes = {
+        "text": [
+            (protocol.OP_QUERY, *BinaryClient.encode_query([text], None, similarity_threshold))
+            for text in texts
+        ],
+        "vectors": [
+            (
+                protocol.OP_QUERY,
+                *BinaryClient.encode_query(
+                    [""], None, similarity_threshold, vectors=vectors[i : i + 1]
+                ),
+            )
+            for i in range(len(texts))
+        ],
+    }
+    for (name, address), (mode, requests), pipeline_depth in itertools.product(
+        addresses, modes.items(), sorted({1, depth})
+    ):
+        seconds, latencies, succeeded, payloads = _binary_load(
+            address, requests, concurrency, pipeline_depth
+        )
+        result = _phase(
+            f"binary_{name}_{mode}",
+            concurrency,
+            pipeline_depth,
+            seconds,
+            latencies,
+            len(succeeded) - sum(succeeded),
+            float(np.mean([protocol.HEADER.size + len(payload) for _, payload, _ in requests])),
+        )
+        result["hit_rate"] = _hit_rate(
+            expected,
+            [
+                protocol.decode_query_results(payload)[0]["id"] if payload else None
+                for payload in payloads
+            ],
+        )
+        results.append(result)
+    return results
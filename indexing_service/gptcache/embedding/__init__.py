@@ -1,2 +1,6 @@
 from .base import BaseEmbedding
 from .sentence_embedding import SentenceEmbedding
+from .batching import BatchingEmbedding
+from .memo import CachedEmbedding
+from .onnx_embedding import OnnxEmbedding
+from .hash_embedding import HashEmbedding
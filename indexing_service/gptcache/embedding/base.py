@@ -1,8 +1,14 @@
 from abc import ABC, abstractmethod
+from typing import List, Sequence
 
 class BaseEmbedding(ABC):
     @abstractmethod
     def to_embedding(self, text: str) -> list:
         pass
 
-
+    def to_embeddings(self, texts: List[str]) -> Sequence:
+        """
+        Embeds a batch of texts. Implementations backed by a model should override this
+        with a single batched forward pass; the default falls back to one call per text.
+        """
+        return [self.to_embedding(text) for text in texts]
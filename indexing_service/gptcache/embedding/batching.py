@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.utils.metrics import BATCH_SIZE, STAGE_SECONDS
+
+
+_STOP = object()
+
+_BATCH_SIZE = BATCH_SIZE.labels("embedding")
+_QUEUE_SECONDS = STAGE_SECONDS.labels("embedding_queue")
+_MODEL_SECONDS = STAGE_SECONDS.labels("model")
+
+
+class BatchingStats:
+    """
+    Running counters for the batching engine, safe to update from the worker thread
+    while being read from request handlers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, batch_size: int, waits: List[float]):
+        _BATCH_SIZE.observe(batch_size)
+        for wait in waits:
+            _QUEUE_SECONDS.observe(wait)
+        with self._lock:
+            self.batches += 1
+            self.items += batch_size
+            self.max_batch_size = max(self.max_batch_size, batch_size)
+            self.total_wait += sum(waits)
+            self.max_wait = max(self.max_wait, max(waits))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "avg_queue_wait_ms": (
+                    self.total_wait / self.items * 1000 if self.items else 0.0
+                ),
+                "max_queue_wait_ms": self.max_wait * 1000,
+            }
+
+
+class BatchingEmbedding(BaseEmbedding):
+    """
+    Wraps another embedding and coalesces concurrent `to_embedding` calls into a single
+    batched `to_embeddings` call.
+
+    A background worker takes the first queued request, then keeps collecting requests
+    until either `max_batch_size` is reached or `max_wait_ms` has elapsed, encodes the
+    whole batch in one forward pass and resolves each caller's future.
+    """
+
+    def __init__(
+        self,
+        embedding: BaseEmbedding,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.embedding = embedding
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = BatchingStats()
+
+        self._queue = queue.Queue()
+        # Guards `_closed`, so nothing is queued behind the stop marker
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(
+            target=self._run, name="embedding-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        Queues a text for embedding and returns a future resolving to its vector.
+        Raises a RuntimeError once the engine is closed.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The batching engine is closed.")
+            self._queue.put((text, future, time.monotonic()))
+        return future
+
+    def to_embedding(self, text: str):
+        return self.submit(text).result()
+
+    def to_embeddings(self, texts: List[str]):
+        if len(texts) >= self.max_batch_size:
+            # Already a full batch: encode it in one call rather than splitting it up
+            self.stats.record(len(texts), [0.0])
+            with _MODEL_SECONDS.time():
+                return self.embedding.to_embeddings(texts)
+        futures = [self.submit(text) for text in texts]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """
+        Stops the worker once the requests already queued have been served.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._worker.join()
+
+    def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Window has closed, but take whatever is already waiting
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopping = self._collect(first)
+
+            started = time.monotonic()
+            texts = [text for text, _, _ in batch]
+            self.stats.record(len(batch), [started - queued for _, _, queued in batch])
+            try:
+                with _MODEL_SECONDS.time():
+                    vectors = self.embedding.to_embeddings(texts)
+                if len(vectors) != len(batch):
+                    raise RuntimeError(
+                        f"Expected {len(batch)} embeddings from the model, got {len(vectors)}."
+                    )
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
@@ -0,0 +1,55 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+
+_TOKEN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def _bucket(feature: str, dimension: int):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dimension, 1.0 if value >> 63 else -1.0
+
+
+class HashEmbedding(BaseEmbedding):
+    """
+    Embeds texts by feature hashing their words and word bigrams into a fixed number
+    of signed buckets. It needs no model and no network, and texts sharing most of their
+    words get close vectors, so it stands in for the real model in benchmarks and tests
+    that exercise the index rather than the quality of the embedding.
+
+    Hashes are stable across processes, so the same text always gets the same vector.
+
+    Parameters:
+    - dimension (int): The dimension of the vectors, 384 to match all-MiniLM-L6-v2.
+    - normalize (bool): Whether vectors are L2-normalized, as the real model does.
+    """
+
+    def __init__(self, dimension: int = 384, normalize: bool = True):
+        self.dimension = dimension
+        self.normalize = normalize
+
+    def to_embedding(self, text: str):
+        vector = np.zeros(self.dimension, dtype="float32")
+        words = _TOKEN.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            index, sign = _bucket(feature, self.dimension)
+            vector[index] += sign
+        if self.normalize:
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector /= norm
+        return vector
+
+    def to_embeddings(self, texts: List[str]):
+        vectors = np.empty((len(texts), self.dimension), dtype="float32")
+        for row, text in enumerate(texts):
+            vectors[row] = self.to_embedding(text)
+        return vectors
@@ -0,0 +1,172 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.utils import normalize_text
+
+
+class MemoStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def record(self, hits: int = 0, misses: int = 0, evictions: int = 0, expirations: int = 0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+            self.expirations += expirations
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Memoizes another embedding so that repeated texts cost a single forward pass.
+
+    Entries are keyed by a hash of the normalized text and the vectors are kept in one
+    preallocated float32 array, so the cache adds no per-entry array objects. When full,
+    the least recently used entry is evicted, and entries older than `ttl_seconds` are
+    treated as misses.
+
+    Parameters:
+    - embedding (BaseEmbedding): The embedding to memoize.
+    - max_entries (int): Maximum number of cached vectors.
+    - max_bytes (int, optional): Memory budget for the vector array. When set, the
+    capacity is the smaller of `max_entries` and what fits in the budget.
+    - ttl_seconds (float, optional): How long an entry stays valid. Defaults to forever.
+    - normalization (str): One of "exact", "whitespace" or "casefold", see
+    `gptcache.utils.normalize_text`.
+    """
+
+    def __init__(
+        self,
+        embedding: BaseEmbedding,
+        max_entries: int = 10000,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        normalization: str = "whitespace",
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        normalize_text("", normalization)  # Validate the mode early
+
+        self.embedding = embedding
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.normalization = normalization
+        self.stats = MemoStats()
+
+        self.capacity = 0
+        self._vectors = None  # Allocated once the dimension is known
+        self._stored_at = None
+        self._slots = OrderedDict()  # key -> slot, in LRU order
+        self._free = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _key(self, text: str) -> bytes:
+        normalized = normalize_text(text, self.normalization)
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def _allocate(self, dimension: int):
+        capacity = self.max_entries
+        if self.max_bytes is not None:
+            capacity = min(capacity, self.max_bytes // (dimension * 4))
+        if capacity < 1:
+            raise ValueError("max_bytes is too small to hold a single vector.")
+        self.capacity = capacity
+        self._vectors = np.zeros((capacity, dimension), dtype="float32")
+        self._stored_at = np.zeros(capacity, dtype="float64")
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def _lookup(self, key: bytes, now: float) -> Optional[np.ndarray]:
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        if self.ttl_seconds is not None and now - self._stored_at[slot] > self.ttl_seconds:
+            del self._slots[key]
+            self._free.append(slot)
+            self.stats.record(expirations=1)
+            return None
+        self._slots.move_to_end(key)
+        return self._vectors[slot].copy()
+
+    def _store(self, key: bytes, vector, now: float):
+        vector = np.asarray(vector, dtype="float32").reshape(-1)
+        if self._vectors is None:
+            self._allocate(vector.shape[0])
+        if vector.shape[0] != self._vectors.shape[1]:
+            raise ValueError("Vector dimension mismatch.")
+
+        slot = self._slots.get(key)
+        if slot is None:
+            if not self._free:
+                _, evicted = self._slots.popitem(last=False)
+                self._free.append(evicted)
+                self.stats.record(evictions=1)
+            slot = self._free.pop()
+        self._slots[key] = slot
+        self._slots.move_to_end(key)
+        self._vectors[slot] = vector
+        self._stored_at[slot] = now
+
+    def to_embedding(self, text: str):
+        return self.to_embeddings([text])[0]
+
+    def to_embeddings(self, texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}  # key -> (text, positions); duplicates are encoded once
+
+        with self._lock:
+            now = time.monotonic()
+            for i, key in enumerate(keys):
+                vector = self._lookup(key, now)
+                if vector is not None:
+                    results[i] = vector
+                else:
+                    missing.setdefault(key, (texts[i], []))[1].append(i)
+        self.stats.record(
+            hits=len(texts) - sum(len(p) for _, p in missing.values()),
+            misses=sum(len(p) for _, p in missing.values()),
+        )
+
+        if missing:
+            # The model runs outside the lock so hits are never stuck behind it
+            vectors = self.embedding.to_embeddings([text for text, _ in missing.values()])
+            with self._lock:
+                now = time.monotonic()
+                for (key, (_, positions)), vector in zip(missing.items(), vectors):
+                    self._store(key, vector, now)
+                    vector = np.asarray(vector, dtype="float32").reshape(-1)
+                    for i in positions:
+                        results[i] = vector.copy()
+
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._slots.clear()
+            if self._vectors is not None:
+                self._free = list(range(self.capacity - 1, -1, -1))
@@ -0,0 +1,90 @@
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from gptcache.embedding import BaseEmbedding
+from gptcache.utils.metrics import STAGE_SECONDS
+
+_TOKENIZE_SECONDS = STAGE_SECONDS.labels("tokenize")
+
+
+def mean_pool(hidden_states: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """
+    Averages the token embeddings of each text over its real tokens, ignoring padding,
+    as the sentence-transformers Pooling layer does.
+    """
+    mask = attention_mask[..., None].astype(hidden_states.dtype)
+    summed = (hidden_states * mask).sum(axis=1)
+    return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    Runs a sentence-transformers model exported to ONNX with ONNX Runtime and a fast
+    tokenizer, without PyTorch. Mean pooling and normalization are applied as in the
+    original model, so its vectors are interchangeable with `SentenceEmbedding`'s and
+    existing indexes keep working.
+
+    The model directory is produced by `scripts/export_onnx.py`: the exported
+    `model.onnx`, optionally an int8 `model_quantized.onnx`, and the `tokenizer.json`.
+
+    Parameters:
+    - model_dir (str): Directory holding the exported model and tokenizer.
+    - model_file (str): Which model file to run, e.g. "model_quantized.onnx".
+    - max_length (int): Texts are truncated to this many tokens, as the original model
+    does (256 for all-MiniLM-L6-v2).
+    - normalize (bool): Whether vectors are L2-normalized, as all-MiniLM-L6-v2 does.
+    - threads (int, optional): Intra-op threads of the session. Defaults to ONNX
+    Runtime's choice.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = "model.onnx",
+        max_length: int = 256,
+        normalize: bool = True,
+        threads: Optional[int] = None,
+    ):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+        self.normalize = normalize
+
+    def to_embedding(self, text: str):
+        return self.to_embeddings([text])[0]
+
+    def to_embeddings(self, texts: List[str]):
+        with _TOKENIZE_SECONDS.time():
+            encodings = self.tokenizer.encode_batch(texts)
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype="int64"),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype="int64"),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype="int64"),
+            }
+        hidden_states = self.session.run(
+            None, {name: value for name, value in inputs.items() if name in self.input_names}
+        )[0]
+        vectors = mean_pool(hidden_states, inputs["attention_mask"])
+        if self.normalize:
+            vectors = l2_normalize(vectors)
+        return vectors.astype("float32")
@@ -1,9 +1,17 @@
+from typing import List
+
 from gptcache.embedding import BaseEmbedding
-from sentence_transformers import SentenceTransformer
+
 
 class SentenceEmbedding(BaseEmbedding):
     def __init__(self, model_name: str):
+        # Imported here so deployments using the ONNX backend need no PyTorch
+        from sentence_transformers import SentenceTransformer
+
         self.model = SentenceTransformer(model_name)
 
     def to_embedding(self, text: str):
-        return self.model.encode(text)
\ No newline at end of file
+        return self.model.encode(text)
+
+    def to_embeddings(self, texts: List[str]):
+        return self.model.encode(texts)
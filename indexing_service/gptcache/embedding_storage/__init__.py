@@ -1,3 +1,7 @@
 from .base import BaseEmbeddingStorage
 from .annoy_embedding_storage import AnnoyEmbeddingStorage
 from .faiss_embedding_storage import FaissEmbeddingStorage
+from .wal import WriteAheadLog
+from .snapshot import SnapshotManager
+from .sweeper import TTLSweeper
+from .follower import SnapshotFollower
@@ -1,26 +1,465 @@
-from gptcache.embedding_storage import BaseEmbeddingStorage
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
 from annoy import AnnoyIndex
-from typing import List
+
+from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.embedding_storage.vector_file import VectorFile
+from gptcache.utils.rwlock import RWLock
+
+logger = logging.getLogger(__name__)
+
+# Metrics with a cosine similarity; Manhattan distance has none
+METRICS = ("angular", "euclidean", "dot")
 
 
 class AnnoyEmbeddingStorage(BaseEmbeddingStorage):
-    def __init__(self, dimension: int, metric: str = "angular"):
-        self.index = AnnoyIndex(dimension, metric)
+    """
+    Stores embeddings in an Annoy forest, with a brute-force delta for fresh items.
+
+    A built Annoy index cannot take new items, so adds go to a delta: a NumPy matrix
+    searched exhaustively, whose results are merged with the forest's. Items can be
+    found as soon as they are added. Once the delta and the tombstones reach
+    `rebuild_threshold` items, a new forest of every live vector is built in a
+    background thread and swapped in, and the delta keeps only the items added while
+    it was built. Searches use the previous forest until the swap, so they never wait
+    for a build; `build_index` builds one in the calling thread.
+
+    The vectors are kept in a memory-mapped `VectorFile`, which forests are built from,
+    and forests are built into a working file, so neither is held in process memory.
+    Annoy numbers its items densely, so the forest holds the live IDs in sorted order
+    and maps its item numbers back to them; IDs can be any non-negative integers.
+
+    Annoy cannot delete items: removed and re-added IDs are tombstoned and filtered out
+    of the forest's results until the next build.
+
+    Searches and snapshots share the read side of an `RWLock`; adds, removals and the
+    swap of a new forest take the write side.
+
+    Parameters:
+    - dimension (int): The dimension of the vectors.
+    - metric (str): "angular", "euclidean" or "dot", as for `AnnoyIndex`. Vectors are
+    normalized for all three, so they rank alike and `similarity` is the exact cosine;
+    they differ in the distance reported.
+    - num_trees (int): Number of trees of the forests built in the background.
+    - rebuild_threshold (int, optional): Number of delta items and tombstones that
+    starts a background build. `None` only builds on `build_index`.
+    - directory (str, optional): Where the vector and forest working files are created.
+    Defaults to the system temporary directory.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        metric: str = "angular",
+        num_trees: int = 10,
+        rebuild_threshold: Optional[int] = 1000,
+        directory: Optional[str] = None,
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"Unsupported metric: {metric}")
+        if rebuild_threshold is not None and rebuild_threshold < 1:
+            raise ValueError("rebuild_threshold must be at least 1.")
         self.dimension = dimension
+        self.metric = metric
+        self.num_trees = num_trees
+        self.rebuild_threshold = rebuild_threshold
+        self.directory = directory
+        # Incremented on every mutation, so unchanged indexes can skip snapshots
+        self.revision = 0
+        self.lock = RWLock()
+
+        self.vectors = VectorFile(dimension, directory)
+        # The current forest, the IDs of its items in item order, and its working file
+        self.index = None
+        self._forest_ids = np.empty(0, dtype="int64")
+        self._forest_path = None
+        # Forest IDs removed or re-added since it was built
+        self.tombstones = set()
+        self._reset_delta(np.empty(0, dtype="int64"), np.empty((0, dimension), dtype="float32"))
+
+        self._build_lock = threading.Lock()  # One build at a time
+        self._rebuild_thread = None
+        # IDs removed while a build reads the vectors, tombstoned once it is swapped in
+        self._removed_during_build = None
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def __contains__(self, item_id: int) -> bool:
+        return int(item_id) in self.vectors
+
+    def _reset_delta(self, ids: np.ndarray, vectors: np.ndarray):
+        capacity = max(64, len(ids))
+        self._delta_ids = np.empty(capacity, dtype="int64")
+        self._delta_vectors = np.empty((capacity, self.dimension), dtype="float32")
+        # Rows of superseded and removed items stay in place, marked invalid
+        self._delta_valid = np.zeros(capacity, dtype=bool)
+        self._delta_ids[: len(ids)] = ids
+        self._delta_vectors[: len(ids)] = vectors
+        self._delta_valid[: len(ids)] = True
+        self._delta_size = len(ids)
+        self._delta_rows = {item_id: row for row, item_id in enumerate(ids.tolist())}
+
+    def _prepare(self, vectors) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(-1, self.dimension)
+        # Annoy's angular distance is that of the normalized vectors, and the other
+        # metrics only give a cosine similarity between normalized vectors
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def _in_forest(self, item_id: int) -> bool:
+        row = np.searchsorted(self._forest_ids, item_id)
+        return row < len(self._forest_ids) and self._forest_ids[row] == item_id
+
+    @property
+    def delta_size(self) -> int:
+        """
+        Number of live items searched by brute force rather than through the forest.
+        """
+        return len(self._delta_rows)
 
     def add_item(self, item_id: int, vector: List[float]):
-        self.index.add_item(item_id, vector)
+        self.add_items([item_id], [vector])
+
+    def add_items(self, item_ids: List[int], vectors, expires_at=None):
+        if expires_at is not None:
+            raise ValueError("Annoy entries cannot expire.")
+        raw = np.ascontiguousarray(vectors, dtype="float32").reshape(-1, self.dimension)
+        ids = [int(i) for i in item_ids]
+        if len(ids) != len(raw):
+            raise ValueError("Expected one vector per ID.")
+        if any(i < 0 for i in ids):
+            raise ValueError("IDs must be non-negative.")
+        prepared = self._prepare(raw)
+
+        with self.lock.write():
+            self.vectors.put(ids, raw)
+            needed = self._delta_size + len(ids)
+            if needed > len(self._delta_ids):
+                self._grow_delta(needed)
+            for offset, item_id in enumerate(ids):
+                previous = self._delta_rows.get(item_id)
+                if previous is not None:
+                    self._delta_valid[previous] = False
+                elif self._in_forest(item_id):
+                    self.tombstones.add(item_id)
+                row = self._delta_size + offset
+                self._delta_rows[item_id] = row
+                self._delta_valid[row] = True
+            rows = slice(self._delta_size, needed)
+            self._delta_ids[rows] = ids
+            self._delta_vectors[rows] = prepared
+            self._delta_size = needed
+            self.revision += 1
+            self._maybe_rebuild()
+
+    def _grow_delta(self, needed: int):
+        capacity = max(needed, 2 * len(self._delta_ids))
+        for name in ("_delta_ids", "_delta_vectors", "_delta_valid"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[: self._delta_size] = old[: self._delta_size]
+            setattr(self, name, new)
 
     def get_nns_by_vector(
         self, vector: List[float], n: int = 10
     ) -> tuple[list[int], list[float]]:
-        return self.index.get_nns_by_vector(vector, n, include_distances=True)
+        return self.get_nns_by_vectors([vector], n=n)[0]
+
+    def get_nns_by_vectors(self, vectors, n: int = 10) -> List[Tuple[List[int], List[float]]]:
+        """
+        Searches the forest and the delta for each vector and merges their results.
+        """
+        queries = self._prepare(vectors)
+        with self.lock.read():
+            delta_ids, delta_distances = self._search_delta(queries, n)
+            results = []
+            for row, vector in enumerate(queries):
+                ids, distances = self._search_forest(vector, n)
+                if not delta_ids[row]:
+                    results.append((ids, distances))
+                    continue
+                if not ids:
+                    results.append((delta_ids[row], delta_distances[row]))
+                    continue
+                # Keep the best n candidates of either
+                ids += delta_ids[row]
+                distances += delta_distances[row]
+                keys = -np.asarray(distances) if self.metric == "dot" else distances
+                order = np.argsort(keys, kind="stable")[:n]
+                results.append(([ids[i] for i in order], [distances[i] for i in order]))
+        return results
+
+    def _search_forest(self, vector: np.ndarray, n: int) -> Tuple[List[int], List[float]]:
+        if self.index is None:
+            return [], []
+        rows, distances = self.index.get_nns_by_vector(
+            vector.tolist(), n + len(self.tombstones), include_distances=True
+        )
+        ids = self._forest_ids[rows].tolist()
+        if not self.tombstones:
+            return ids, distances
+        live = [(i, d) for i, d in zip(ids, distances) if i not in self.tombstones][:n]
+        return [i for i, _ in live], [d for _, d in live]
+
+    def _search_delta(self, queries: np.ndarray, n: int) -> Tuple[List[list], List[list]]:
+        """
+        Returns the best n valid delta items of each prepared query, by exhaustive
+        search.
+        """
+        size = self._delta_size
+        valid = np.flatnonzero(self._delta_valid[:size])
+        if len(valid) == 0:
+            return [[] for _ in queries], [[] for _ in queries]
+
+        stored = self._delta_vectors[valid]
+        products = queries @ stored.T
+        if self.metric == "dot":
+            distances = products
+        else:
+            # Both the angular and the Euclidean distance of unit vectors
+            distances = np.sqrt(np.maximum(2.0 - 2.0 * products, 0.0))
+
+        keys = -distances if self.metric == "dot" else distances
+        k = min(n, len(valid))
+        if k < len(valid):
+            best = np.argpartition(keys, k - 1, axis=1)[:, :k]
+        else:
+            best = np.broadcast_to(np.arange(k), (len(queries), k))
+        order = np.take_along_axis(
+            best, np.argsort(np.take_along_axis(keys, best, axis=1), axis=1, kind="stable"), axis=1
+        )
+        ids = self._delta_ids[valid][order]
+        best_distances = np.take_along_axis(distances, order, axis=1)
+        return ids.tolist(), best_distances.tolist()
+
+    def get_vectors(self, item_ids: List[int]) -> np.ndarray:
+        with self.lock.read():
+            found, vectors = self.vectors.get(item_ids)
+        if not found.all():
+            missing = [int(i) for i, f in zip(item_ids, found) if not f]
+            raise KeyError(f"Unknown IDs: {missing[:10]}")
+        return vectors
+
+    def similarity(self, distance: float) -> float:
+        # The vectors are normalized: their inner product is the cosine, and both the
+        # angular and the Euclidean distance are sqrt(2 - 2 cos(a, b))
+        if self.metric == "dot":
+            return distance
+        return 1.0 - distance**2 / 2.0
+
+    def remove_ids(self, item_ids: List[int]) -> int:
+        removed = 0
+        with self.lock.write():
+            for item_id in {int(i) for i in item_ids}:
+                if item_id not in self.vectors:
+                    continue
+                self.vectors.remove([item_id])
+                row = self._delta_rows.pop(item_id, None)
+                if row is not None:
+                    self._delta_valid[row] = False
+                if self._in_forest(item_id):
+                    self.tombstones.add(item_id)
+                if self._removed_during_build is not None:
+                    self._removed_during_build.add(item_id)
+                removed += 1
+            if removed:
+                self.revision += 1
+                self._maybe_rebuild()
+        return removed
+
+    def _maybe_rebuild(self):
+        """
+        Starts a background build once the delta and tombstones reach the threshold.
+        Called with the write lock held.
+        """
+        if self.rebuild_threshold is None:
+            return
+        if len(self._delta_rows) + len(self.tombstones) < self.rebuild_threshold:
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild_in_background, name="annoy-rebuild", daemon=True
+        )
+        self._rebuild_thread.start()
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild(self.num_trees)
+            failed = False
+        except Exception:
+            logger.exception("An error occurred while rebuilding the Annoy index.")
+            failed = True
+        with self.lock.write():
+            self._rebuild_thread = None
+            if not failed:
+                # Adds made during the build may have reached the threshold again
+                self._maybe_rebuild()
+
+    def wait_for_rebuild(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits for the background build, and those it starts, to finish. Returns whether
+        none is running anymore.
+        """
+        while True:
+            thread = self._rebuild_thread
+            if thread is None or thread is threading.current_thread():
+                return True
+            thread.join(timeout)
+            if thread.is_alive():
+                return False
+
+    def _rebuild(self, num_trees: int, chunk_size: int = 65536):
+        """
+        Builds a forest of every live vector without holding the lock, then swaps it in.
+        """
+        with self._build_lock:
+            with self.lock.read():
+                ids = np.sort(self.vectors.ids())
+                marker = self._delta_size
+                self._removed_during_build = set()
+
+            path = None
+            index = None
+            try:
+                if len(ids):
+                    fd, path = tempfile.mkstemp(
+                        prefix="forest-", suffix=".ann", dir=self.directory
+                    )
+                    os.close(fd)
+                    index = AnnoyIndex(self.dimension, self.metric)
+                    index.on_disk_build(path)
+                    for start in range(0, len(ids), chunk_size):
+                        block_ids = ids[start : start + chunk_size]
+                        with self.lock.read():
+                            found, block = self.vectors.get(block_ids)
+                        # IDs removed since are left out, and tombstoned on the swap
+                        block = self._prepare(block)
+                        for item, vector in zip(np.flatnonzero(found), block):
+                            index.add_item(start + int(item), vector)
+                    index.build(num_trees)
+            except BaseException:
+                self._removed_during_build = None
+                if path is not None:
+                    os.remove(path)
+                raise
+
+            with self.lock.write():
+                # The delta keeps the valid rows added since the IDs were read
+                rows = marker + np.flatnonzero(self._delta_valid[marker : self._delta_size])
+                delta_ids = self._delta_ids[rows]
+                self._reset_delta(delta_ids, self._delta_vectors[rows])
+
+                previous = self._forest_path
+                self.index = index
+                self._forest_ids = ids
+                self._forest_path = path
+                stale = self._removed_during_build | set(delta_ids.tolist())
+                self.tombstones = {i for i in stale if self._in_forest(i)}
+                self._removed_during_build = None
+                self.revision += 1
+            # No search uses the previous forest anymore; its pages stay mapped until
+            # Annoy unloads it
+            if previous is not None and os.path.exists(previous):
+                os.remove(previous)
 
     def build_index(self, num_trees: int):
-        self.index.build(num_trees)
+        """
+        Builds every item into a new forest in the calling thread, waiting for a
+        background build first if one is running.
+        """
+        self._rebuild(num_trees)
 
     def save_index(self, filepath: str):
-        self.index.save(filepath)
+        """
+        Writes the forest to `filepath`, and the vectors, the item IDs of the forest,
+        the delta and the tombstones next to it.
+        """
+        with self.lock.read():
+            if self._forest_path is not None:
+                # A forest is never modified once built, so its file is copied rather
+                # than saved through Annoy, which would reload it under running searches
+                shutil.copyfile(self._forest_path, filepath)
+            np.save(filepath + ".ids.npy", self._forest_ids)
+            self.vectors.save(filepath + ".vectors.npy")
+            delta = self._delta_ids[: self._delta_size][self._delta_valid[: self._delta_size]]
+            np.save(filepath + ".delta.npy", delta)
+            if self.tombstones:
+                np.save(
+                    filepath + ".tombstones.npy", np.fromiter(self.tombstones, dtype="int64")
+                )
+
+    def load_index(self, filepath: str, mmap: bool = True):
+        """
+        Restores a storage written by `save_index`. Annoy always memory maps the forest,
+        from a working copy so the snapshot can be deleted. Files of earlier versions,
+        an Annoy index whose item numbers are the IDs, are also read.
+        """
+        with self._build_lock, self.lock.write():
+            forest_ids = np.empty(0, dtype="int64")
+            index = None
+            path = None
+            if os.path.exists(filepath):
+                fd, path = tempfile.mkstemp(prefix="forest-", suffix=".ann", dir=self.directory)
+                os.close(fd)
+                shutil.copyfile(filepath, path)
+                index = AnnoyIndex(self.dimension, self.metric)
+                index.load(path)
+                forest_ids = np.arange(index.get_n_items(), dtype="int64")
+            if os.path.exists(filepath + ".ids.npy"):
+                forest_ids = np.load(filepath + ".ids.npy")
+
+            tombstones = set()
+            if os.path.exists(filepath + ".tombstones.npy"):
+                tombstones = set(np.load(filepath + ".tombstones.npy").tolist())
+
+            if os.path.exists(filepath + ".vectors.npy"):
+                self.vectors.load(filepath + ".vectors.npy")
+            else:
+                self.vectors.clear()
+                live = [i for i in forest_ids.tolist() if i not in tombstones]
+                if live:
+                    self.vectors.put(
+                        live, np.array([index.get_item_vector(i) for i in live], dtype="float32")
+                    )
+
+            delta_ids = np.empty(0, dtype="int64")
+            if os.path.exists(filepath + ".delta.npy"):
+                delta_ids = np.load(filepath + ".delta.npy")
+            _, delta_vectors = self.vectors.get(delta_ids)
+
+            previous = self._forest_path
+            self.index = index
+            self._forest_ids = forest_ids
+            self._forest_path = path
+            self.tombstones = tombstones
+            self._reset_delta(delta_ids, self._prepare(delta_vectors))
+            self.revision += 1
+        if previous is not None and os.path.exists(previous):
+            os.remove(previous)
+
+    def close(self):
+        """
+        Waits for a background build and deletes the working files.
+        """
+        self.wait_for_rebuild()
+        with self.lock.write():
+            self.index = None
+            if self._forest_path is not None and os.path.exists(self._forest_path):
+                os.remove(self._forest_path)
+            self._forest_path = None
+            self.vectors.close()
 
-    def load_index(self, filepath: str):
-        self.index.load(filepath)
+    def __del__(self):
+        try:
+            if self._forest_path is not None and os.path.exists(self._forest_path):
+                os.remove(self._forest_path)
+        except Exception:
+            pass
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from typing import List, Tuple
 
+import numpy as np
+
 class BaseEmbeddingStorage(ABC):
     @abstractmethod
     def add_item(self, item_id: int, vector: List[float]):
@@ -10,6 +12,50 @@ class BaseEmbeddingStorage(ABC):
     def get_nns_by_vector(self, vector: List[float], n: int = 10) -> List[Tuple[int, float]]:
         pass
 
+    def add_items(self, item_ids: List[int], vectors, expires_at=None):
+        """
+        Adds several vectors at once. `expires_at` is either one expiry for all of them
+        or one per vector. Storages that can add a matrix in one call override this;
+        the default adds them one by one.
+        """
+        if expires_at is None:
+            for item_id, vector in zip(item_ids, vectors):
+                self.add_item(item_id, vector)
+            return
+        if np.isscalar(expires_at):
+            expires_at = [expires_at] * len(item_ids)
+        for item_id, vector, expiry in zip(item_ids, vectors, expires_at):
+            self.add_item(item_id, vector, expires_at=expiry)
+
+    def get_nns_by_vectors(self, vectors, n: int = 10) -> List[Tuple[List[int], List[float]]]:
+        """
+        Searches several vectors at once and returns one (ids, distances) pair each.
+        Storages that can search a matrix in one call override this.
+        """
+        return [self.get_nns_by_vector(vector, n=n) for vector in vectors]
+
+    @abstractmethod
+    def similarity(self, distance: float) -> float:
+        """
+        Converts a distance returned by a search into cosine similarity, so thresholds
+        mean the same whatever the backend and its distance measure.
+        """
+        pass
+
+    @abstractmethod
+    def get_vectors(self, item_ids: List[int]) -> np.ndarray:
+        """
+        Returns the stored vectors of the given IDs as an (N, d) float32 array.
+        """
+        pass
+
+    @abstractmethod
+    def remove_ids(self, item_ids: List[int]) -> int:
+        pass
+
+    def remove_item(self, item_id: int) -> bool:
+        return self.remove_ids([item_id]) > 0
+
     @abstractmethod
     def build_index(self, num_trees: int):
         pass
@@ -19,5 +65,5 @@ class BaseEmbeddingStorage(ABC):
         pass
 
     @abstractmethod
-    def load_index(self, filepath: str):
+    def load_index(self, filepath: str, mmap: bool = False):
         pass
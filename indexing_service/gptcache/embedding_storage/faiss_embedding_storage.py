@@ -1,56 +1,921 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
 import numpy as np
 import faiss
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 
 from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.embedding_storage.metadata import EVICTION_POLICIES, EntryMetadata
+from gptcache.embedding_storage.vector_file import VectorFile
+from gptcache.utils.metrics import STAGE_SECONDS
+from gptcache.utils.rwlock import RWLock
+
+logger = logging.getLogger(__name__)
+
+_SEARCH_SECONDS = STAGE_SECONDS.labels("search")
+_RESCORE_SECONDS = STAGE_SECONDS.labels("rescore")
+_RESOLVE_SECONDS = STAGE_SECONDS.labels("resolve")
+
+
+# Named presets for faiss.index_factory. Any other factory string is passed through.
+# PQ presets end in "np": the factory otherwise trains polysemous codes, which searches
+# never use and which take minutes to train where the quantizer takes under a second.
+INDEX_FACTORIES = {
+    "flat": "Flat",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_pq": "IVF{nlist},PQ{pq_m}x{pq_nbits}np",
+    "hnsw": "HNSW{hnsw_m}",
+    # Compressed encodings searched exhaustively: 2x, 4x and dimension * 4 / pq_m
+    # times smaller than float32
+    "sq_fp16": "SQfp16",
+    "sq8": "SQ8",
+    "pq": "PQ{pq_m}x{pq_nbits}np",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "hnsw_sq8": "HNSW{hnsw_m},SQ8",
+}
+
+METRICS = {
+    "l2": faiss.METRIC_L2,
+    "cosine": faiss.METRIC_INNER_PRODUCT,
+}
 
 
 class FaissEmbeddingStorage(BaseEmbeddingStorage):
-    def __init__(self, dimension: int):
+    """
+    Stores embeddings in a FAISS index built from a configurable index factory.
+
+    The index is wrapped in an `IndexIDMap2`, so the caller's IDs are stored natively
+    as int64 and searches return them directly, whatever the size of the index.
+
+    Entries can be removed, and can carry an expiry time for `TTLSweeper`. Index types
+    that cannot delete in place through the ID map (HNSW, IVF) tombstone removed IDs
+    instead, and hide the previous vector of a re-added ID by its position in the
+    index: both are filtered out of results until `compact` rebuilds the index without
+    them.
+
+    The index can be bounded by an entry count and/or a byte budget. Once an add
+    exceeds it, the least valuable entries under `eviction_policy` are removed, at
+    least `eviction_batch` at a time so eviction does not run on every add. Evicted
+    IDs are queued for `drain_evictions`, so callers can drop what they cached for them.
+
+    With the "cosine" metric, vectors are L2-normalized on add and query and stored in
+    an inner-product index, and the distance reported is the cosine distance
+    1 - cos(a, b). Either way `similarity` turns a distance into cosine similarity, so
+    one similarity threshold means the same for every metric and backend.
+
+    Compressed index types (SQ, PQ) store lossy codes. With `rescore_k`, the float32
+    vectors are also kept in a memory-mapped `VectorFile` on disk, and the top
+    `rescore_k` candidates of every search are re-ranked by their exact distance, so
+    hits are decided on exact distances while the index itself stays small. The side
+    file is not counted in `entry_bytes`, since it lives in the page cache rather than
+    in process memory.
+
+    The storage is safe to use from several threads. Searches, snapshots and hit
+    counting share the read side of an `RWLock` and run in parallel; adds and removals
+    take the write side. Writers are preferred, so a write waits only for the searches
+    already running, and a search for at most one write. Training and compaction build
+    a new index without holding the lock, from a snapshot of the vectors, replay the
+    adds and removals made meanwhile, and take the write side only to swap it in.
+
+    Index types that need training (IVF, PQ, SQ8) cannot search until they are trained, so
+    vectors are staged in a flat index until `train_size` of them have accumulated.
+    The index is then trained on the staged vectors and they are moved into it; until
+    that point queries are answered exactly from the staging index.
+
+    Parameters:
+    - dimension (int): The dimension of the stored vectors.
+    - index_type (str): One of "flat", "ivf_flat", "ivf_pq", "hnsw", "sq_fp16",
+    "sq8", "pq", "ivf_sq8", "hnsw_sq8", or any faiss.index_factory string such as
+    "IVF4096,PQ32".
+    - metric (str): "l2" for squared Euclidean distance, or "cosine".
+    - nlist (int): Number of IVF cells.
+    - pq_m (int): Number of PQ sub-quantizers, must divide `dimension`.
+    - pq_nbits (int): Bits per PQ sub-quantizer code.
+    - hnsw_m (int): Number of neighbours per HNSW node.
+    - nprobe (int): Number of IVF cells visited per query.
+    - ef_search (int): Size of the HNSW candidate list per query.
+    - ef_construction (int, optional): Size of the HNSW candidate list while adding.
+    - train_size (int, optional): Number of vectors to accumulate before training.
+    Defaults to 39 vectors per IVF cell, the minimum FAISS trains without warning.
+    - max_entries (int, optional): Maximum number of live entries.
+    - max_bytes (int, optional): Memory budget for the entries, estimated per entry
+    from the index type (see `entry_bytes`).
+    - eviction_policy (str): "lru", "lfu" or "score"; see `EntryMetadata.victims`.
+    - eviction_batch (int): Minimum number of entries evicted at once.
+    - eviction_log_size (int): Maximum number of evicted IDs kept for
+    `drain_evictions`; the oldest are dropped first if nobody drains them.
+    - rescore_k (int, optional): Number of candidates re-scored against the exact
+    vectors per search. Without it no side file is kept.
+    - vector_dir (str, optional): Where the side file of exact vectors is created.
+    Defaults to the system temporary directory.
+    """
+
+    def __init__(
+        self,
+        dimension: int,
+        index_type: str = "flat",
+        metric: str = "l2",
+        nlist: int = 1024,
+        pq_m: int = 48,
+        pq_nbits: int = 8,
+        hnsw_m: int = 32,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        ef_construction: Optional[int] = None,
+        train_size: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        eviction_policy: str = "lru",
+        eviction_batch: int = 64,
+        eviction_log_size: int = 100000,
+        rescore_k: Optional[int] = None,
+        vector_dir: Optional[str] = None,
+    ):
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}.")
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(
+                f"eviction_policy must be one of {', '.join(EVICTION_POLICIES)}."
+            )
         self.dimension = dimension
-        # Determine the metric
-        self.index = faiss.IndexFlatL2(dimension)
-        self.id_map = []  # To keep track of IDs
-
-    def add_item(self, item_id: int, vector: List[float]):
-        print(f"Adding item {item_id} to the index.")
-        # Ensure vector is a numpy array of the correct shape (2D)
-        if not isinstance(vector, np.ndarray):
-            vector = np.array(vector, dtype="float32")
-        if vector.ndim == 1:  # If the vector is 1D, reshape it to 2D
-            vector = vector.reshape(1, -1)
-        if vector.shape[1] != self.dimension:
+        self.index_type = index_type
+        self.metric = metric
+        self.factory_string = INDEX_FACTORIES.get(index_type, index_type).format(
+            nlist=nlist, pq_m=pq_m, pq_nbits=pq_nbits, hnsw_m=hnsw_m
+        )
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+        self.ef_construction = ef_construction
+        self.index = self._new_index()
+
+        if train_size is None:
+            train_size = max(nlist * 39, 2**pq_nbits)
+        self.train_size = train_size
+
+        # Vectors are staged here until the index has been trained
+        self.staging = None if self.index.is_trained else self._new_staging()
+        self._apply_search_params()
+
+        # Searches and snapshots share the read side; mutations take the write side,
+        # which `with self.lock` also takes
+        self.lock = RWLock()
+        # Hits are recorded by concurrent readers
+        self._hits_lock = threading.Lock()
+        # Incremented on every mutation, so unchanged indexes can skip snapshots
+        self.revision = 0
+        self._mmapped = False
+        # Set while a shared mapping is loaded, which must never be written to
+        self.read_only = False
+        # Optional WriteAheadLog every add is appended to
+        self.wal = None
+        self._build_lock = threading.Lock()  # One training or compaction at a time
+        # Adds and removals made while a new index is built, replayed on it at the swap
+        self._replay = None
+
+        self.metadata = EntryMetadata()
+        self.tombstones = set()
+        self._tombstone_array = np.empty(0, dtype="int64")
+        # Sorted positions in the index of vectors replaced by a later add of their ID
+        self._superseded = np.empty(0, dtype="int64")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+        self.eviction_batch = eviction_batch
+        self.evicted = 0
+        self.evictions = deque(maxlen=eviction_log_size)
+
+        self.rescore_k = rescore_k
+        # Exact copies of the vectors for re-scoring, when the index is compressed
+        self.vectors = VectorFile(dimension, vector_dir) if rescore_k else None
+
+    @property
+    def is_trained(self) -> bool:
+        return self.staging is None
+
+    @property
+    def ids(self) -> np.ndarray:
+        """
+        The live IDs as an int64 array, staged vectors included.
+        """
+        with self.lock.read():
+            ids = faiss.vector_to_array(self.index.id_map)
+            if len(self._superseded):
+                ids = np.delete(ids, self._superseded)
+            if self.staging is not None:
+                ids = np.concatenate([ids, faiss.vector_to_array(self.staging.id_map)])
+            if self.tombstones:
+                ids = ids[~np.isin(ids, self._tombstone_array)]
+            return ids
+
+    def __len__(self) -> int:
+        # Read once, since training may drop the staging index concurrently
+        staging = self.staging
+        stored = self.index.ntotal + (staging.ntotal if staging is not None else 0)
+        return stored - len(self.tombstones) - len(self._superseded)
+
+    def __contains__(self, item_id: int) -> bool:
+        return int(item_id) in self.metadata
+
+    @property
+    def tombstone_ratio(self) -> float:
+        """
+        Fraction of the index taken by removed or replaced entries still awaiting
+        `compact`.
+        """
+        hidden = len(self.tombstones) + len(self._superseded)
+        return hidden / max(self.index.ntotal, 1)
+
+    @property
+    def entry_bytes(self) -> int:
+        """
+        Estimated memory per entry: the stored code, the graph links for HNSW, and the
+        ID map and metadata row.
+        """
+        base = self._base_index()
+        if hasattr(base, "hnsw"):
+            code_size = faiss.downcast_index(base.storage).code_size
+            code_size += base.hnsw.nb_neighbors(0) * 4
+        else:
+            code_size = getattr(base, "code_size", self.dimension * 4)
+        return int(code_size) + 16 + self.metadata.row_bytes
+
+    @property
+    def capacity(self) -> Optional[int]:
+        """
+        The maximum number of live entries, or `None` when unbounded.
+        """
+        limits = []
+        if self.max_entries is not None:
+            limits.append(self.max_entries)
+        if self.max_bytes is not None:
+            limits.append(self.max_bytes // self.entry_bytes)
+        return min(limits) if limits else None
+
+    def _new_index(self):
+        index = faiss.IndexIDMap2(
+            faiss.index_factory(self.dimension, self.factory_string, METRICS[self.metric])
+        )
+        base = faiss.downcast_index(index.index)
+        if self.ef_construction is not None and hasattr(base, "hnsw"):
+            base.hnsw.efConstruction = self.ef_construction
+        return index
+
+    def _new_staging(self):
+        return faiss.IndexIDMap2(faiss.IndexFlat(self.dimension, METRICS[self.metric]))
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("The index is a shared read-only mapping.")
+
+    def _prepare(self, vectors) -> np.ndarray:
+        """
+        Returns the vectors as a contiguous 2D float32 array, normalized for cosine.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if vectors.ndim == 1:  # A single 1D vector
+            vectors = vectors.reshape(1, -1)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
             raise ValueError("Vector dimension mismatch.")
-        self.index.add(vector)
-        self.id_map.append(item_id)
+        if self.metric == "cosine":
+            vectors = vectors.copy()
+            faiss.normalize_L2(vectors)  # In place
+        return vectors
+
+    def similarity(self, distance: float) -> float:
+        """
+        Converts a distance returned by a search into cosine similarity. For "l2" this
+        assumes unit-length vectors, as produced by the sentence-transformers models,
+        for which the squared distance is 2 - 2 cos(a, b).
+        """
+        if self.metric == "cosine":
+            return 1.0 - distance
+        return 1.0 - distance / 2.0
+
+    def _supports_remove(self) -> bool:
+        # The ID map assumes removal renumbers the remaining vectors, as flat indexes
+        # do. HNSW cannot remove at all, and IVF keeps its internal IDs unchanged, which
+        # would leave the ID map pointing at the wrong vectors.
+        base = self._base_index()
+        return not hasattr(base, "hnsw") and faiss.try_extract_index_ivf(base) is None
+
+    def _base_index(self):
+        return faiss.downcast_index(self.index.index)
+
+    def _apply_search_params(self):
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            faiss.ParameterSpace().set_index_parameter(self.index, "nprobe", self.nprobe)
+        base = self._base_index()
+        if hasattr(base, "hnsw"):
+            base.hnsw.efSearch = self.ef_search
+
+    def set_search_params(
+        self, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+    ):
+        """
+        Tunes the speed/recall trade-off of queries at runtime.
+        """
+        with self.lock:
+            if nprobe is not None:
+                self.nprobe = nprobe
+            if ef_search is not None:
+                self.ef_search = ef_search
+            self._apply_search_params()
+
+    def add_item(
+        self, item_id: int, vector: List[float], expires_at: Optional[float] = None
+    ) -> List[int]:
+        """
+        Adds a vector under `item_id`. `expires_at` is an optional `time.time()` after
+        which the entry is removed by the sweeper. Returns the IDs evicted to make room.
+        """
+        logger.debug("Adding item %d to the index.", item_id)
+        vector = np.asarray(vector, dtype="float32").reshape(1, -1)
+        return self.add_items([item_id], vector, [expires_at])
+
+    def add_items(
+        self,
+        item_ids: List[int],
+        vectors,
+        expires_at: Union[None, float, List[Optional[float]]] = None,
+    ) -> List[int]:
+        """
+        Adds an (N, d) matrix of vectors in one index call. `expires_at` is either one
+        expiry for all of them or one per vector. Adding an ID that is already stored
+        replaces its vector; within one call, its last vector wins. Returns the IDs
+        evicted to make room.
+        """
+        vectors = self._prepare(vectors)
+        ids = np.asarray(item_ids, dtype="int64").reshape(-1)
+        if len(ids) != len(vectors):
+            raise ValueError("Expected one ID per vector.")
+        if expires_at is None or np.isscalar(expires_at):
+            expires_at = [expires_at] * len(ids)
+        unique, last = np.unique(ids[::-1], return_index=True)
+        if len(unique) != len(ids):
+            keep = np.sort(len(ids) - 1 - last)
+            ids, vectors = ids[keep], vectors[keep]
+            expires_at = [expires_at[i] for i in keep]
+
+        ticket = None
+        with self.lock:
+            self._check_writable()
+            if self.wal is not None:
+                for item_id, vector, expiry in zip(ids.tolist(), vectors, expires_at):
+                    ticket = self.wal.append(item_id, vector, expiry)
+            if self._mmapped:
+                self._materialize()
+            replaced = np.fromiter(
+                (item_id for item_id in ids.tolist() if item_id in self.metadata), dtype="int64"
+            )
+            # The ID map does not dedupe, so the old vectors are dropped or hidden first
+            if self.staging is None and not self._supports_remove():
+                if self.tombstones:
+                    replaced = np.union1d(replaced, ids[np.isin(ids, self._tombstone_array)])
+                if len(replaced):
+                    self._supersede(replaced)
+            elif len(replaced):
+                self._drop(replaced)
+            now = time.time()
+            for item_id, expiry in zip(ids.tolist(), expires_at):
+                self.metadata.add(item_id, expiry, now=now)
+            if self.vectors is not None:
+                self.vectors.put(ids.tolist(), vectors)
+            if self.is_trained:
+                self.index.add_with_ids(vectors, ids)
+            else:
+                self.staging.add_with_ids(vectors, ids)
+            if self._replay is not None:
+                self._replay.append((ids, vectors))
+            self.revision += 1
+            train = not self.is_trained and self.staging.ntotal >= self.train_size
+
+        # Wait for the log outside the lock, so concurrent adds share one fsync
+        if ticket is not None:
+            self.wal.commit(ticket)
+        if train and not self._build_lock.locked():
+            self.build_index()
+        return self.evict()
+
+    def evict(self) -> List[int]:
+        """
+        Evicts entries while the index is over capacity and returns their IDs.
+        """
+        with self.lock:
+            capacity = self.capacity
+            if capacity is None or len(self) <= capacity:
+                return []
+            count = max(len(self) - capacity, self.eviction_batch)
+            victims = self.metadata.victims(count, self.eviction_policy, time.time())
+            self.remove_ids(victims)
+            evicted = victims.tolist()
+            self.evicted += len(evicted)
+            self.evictions.extend(evicted)
+            return evicted
+
+    def drain_evictions(self, limit: Optional[int] = None) -> List[int]:
+        """
+        Returns and forgets the IDs evicted since the last call, oldest first.
+        """
+        drained = []
+        while self.evictions and (limit is None or len(drained) < limit):
+            try:
+                drained.append(self.evictions.popleft())
+            except IndexError:
+                break
+        return drained
+
+    def record_hit(self, item_id: int):
+        """
+        Counts a cache hit on `item_id` for the eviction policy.
+        """
+        with self.lock.read(), self._hits_lock:
+            self.metadata.record_hit(item_id, time.time())
 
     def get_nns_by_vector(
         self, vector: List[float], n: int = 10
     ) -> Tuple[List[int], List[float]]:
-        if len(self.id_map) == 0:
-            print("Index is empty.")
+        if len(self) == 0:
+            logger.debug("Index is empty.")
             return ([], [])
 
-        if not isinstance(vector, np.ndarray):
-            vector = np.array(vector, dtype="float32").reshape(1, -1)
-        if vector.ndim == 1:  # If the vector is 1D, reshape it to 2D
-            vector = vector.reshape(1, -1)
-        distances, indices = self.index.search(vector, n)
+        ids, distances = self.get_nns_by_vectors(
+            np.asarray(vector, dtype="float32").reshape(1, -1), n=n
+        )[0]
+
+        logger.debug("Found %d neighbors: %s at distances %s.", len(ids), ids, distances)
+        return (ids, distances)
+
+    def get_nns_by_vectors(
+        self, vectors, n: int = 10
+    ) -> List[Tuple[List[int], List[float]]]:
+        """
+        Searches an (N, d) matrix of vectors in one index call and returns the
+        (ids, distances) of each.
+        """
+        vectors = self._prepare(vectors)
+        with self.lock.read():
+            return self._search(vectors, n)
+
+    def _search(self, vectors: np.ndarray, n: int) -> List[Tuple[List[int], List[float]]]:
+        if len(self) == 0:
+            return [([], []) for _ in range(len(vectors))]
+
+        index = self.index if self.is_trained else self.staging
+        # Staged vectors are exact already
+        rescore = self.vectors is not None and self.is_trained
+        fetch = max(n, self.rescore_k) if rescore else n
+        tombstones = self._tombstone_array
+        superseded = self._superseded if self.is_trained else self._superseded[:0]
+        hidden = len(tombstones) + len(superseded)
+        k = min(fetch + hidden, index.ntotal) if hidden else fetch
+        # The inner index returns positions, which tell the copies of an ID apart
+        searched = index.index if len(superseded) else index
+        with _SEARCH_SECONDS.time():
+            distances, indices = searched.search(vectors, k)
+
+        start = time.perf_counter()
+        # FAISS pads with -1 when fewer than n neighbours are found
+        found = indices >= 0
+        if len(superseded):
+            found &= ~np.isin(indices, superseded)
+            indices = faiss.rev_swig_ptr(index.id_map.data(), index.ntotal)[indices]
+        if self.metric == "cosine":
+            distances = 1.0 - distances  # Inner products of unit vectors are cosines
+        if len(tombstones):
+            found &= ~np.isin(indices, tombstones)
+        results = []
+        for i in range(len(vectors)):
+            ids, dists = indices[i][found[i]][:fetch], distances[i][found[i]][:fetch]
+            if rescore:
+                with _RESCORE_SECONDS.time():
+                    ids, dists = self._rescore(vectors[i], ids, dists)
+            results.append((ids[:n].tolist(), dists[:n].tolist()))
+        _RESOLVE_SECONDS.observe(time.perf_counter() - start)
+        return results
+
+    def _rescore(
+        self, query: np.ndarray, ids: np.ndarray, distances: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Replaces the approximate distances of the candidates with exact ones computed
+        from the side file, and sorts them again. Candidates without an exact vector
+        keep their approximate distance.
+        """
+        stored, exact = self.vectors.get(ids.tolist())
+        if len(exact) == 0:
+            return ids, distances
+        if self.metric == "cosine":
+            exact_distances = 1.0 - exact @ query
+        else:
+            diff = exact - query
+            exact_distances = np.einsum("ij,ij->i", diff, diff)
+        distances = distances.copy()
+        distances[stored] = exact_distances
+        order = np.argsort(distances, kind="stable")
+        return ids[order], distances[order]
+
+    def get_vectors(self, item_ids: List[int]) -> np.ndarray:
+        """
+        Returns the stored vectors of the given IDs, normalized with the cosine metric.
+        Quantized index types (PQ, SQ) return their lossy reconstruction, unless exact
+        copies are kept for re-scoring.
+        """
+        with self.lock.read():
+            if self.vectors is not None:
+                stored, exact = self.vectors.get(item_ids)
+                if stored.all():
+                    return exact
+            if not self._needs_direct_map():
+                return self._reconstruct(item_ids)
+        with self.lock:
+            if self._needs_direct_map():
+                # IVF can only reconstruct through a direct map, kept up to date on add
+                faiss.try_extract_index_ivf(self.index).make_direct_map()
+            return self._reconstruct(item_ids)
+
+    def _needs_direct_map(self) -> bool:
+        ivf = faiss.try_extract_index_ivf(self.index if self.is_trained else self.staging)
+        return ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap
+
+    def _reconstruct(self, item_ids: List[int]) -> np.ndarray:
+        index = self.index if self.is_trained else self.staging
+        vectors = np.empty((len(item_ids), self.dimension), dtype="float32")
+        for row, item_id in enumerate(item_ids):
+            vectors[row] = index.reconstruct(int(item_id))
+        return vectors
+
+    def remove_ids(self, item_ids: List[int]) -> int:
+        """
+        Removes the given IDs from the index and returns how many were present.
+        """
+        ids = np.unique(np.asarray(item_ids, dtype="int64"))
+        ticket = None
+        with self.lock:
+            self._check_writable()
+            removed = np.asarray(self.metadata.remove(ids), dtype="int64")
+            if len(removed) == 0:
+                return 0
+            if self.vectors is not None:
+                self.vectors.remove(removed.tolist())
+            if self.wal is not None:
+                ticket = self.wal.append_remove(removed)
+            if self._mmapped:
+                self._materialize()
+            self._drop(removed)
+            if self._replay is not None:
+                self._replay.append((removed, None))
+            self.revision += 1
+
+        if ticket is not None:
+            self.wal.commit(ticket)
+        return len(removed)
+
+    def _drop(self, ids: np.ndarray):
+        """
+        Deletes the vectors of `ids` from the index, or tombstones them where the
+        index type cannot delete in place. The caller holds the lock.
+        """
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        if self.staging is not None:
+            # Untrained: every vector is still staged
+            self.staging.remove_ids(selector)
+        elif self._supports_remove():
+            self.index.remove_ids(selector)
+        else:
+            self.tombstones.update(ids.tolist())
+            self._tombstone_array = np.fromiter(self.tombstones, dtype="int64")
+
+    def _supersede(self, ids: np.ndarray):
+        """
+        Hides the stored vectors of `ids`, which are about to be added again, by their
+        position in an index that cannot delete them, and lifts their tombstones. The
+        caller holds the lock.
+        """
+        id_map = faiss.rev_swig_ptr(self.index.id_map.data(), self.index.ntotal)
+        self._superseded = np.union1d(self._superseded, np.flatnonzero(np.isin(id_map, ids)))
+        if self.tombstones:
+            self.tombstones.difference_update(ids.tolist())
+            self._tombstone_array = np.fromiter(self.tombstones, dtype="int64")
 
-        print(f"Found {len(indices[0])} neighbors.")
-        print(f"Nearest neighbor IDs: {indices[0]}")
-        print(f"Distances: {distances[0]}")
-        print(f"ID map: {self.id_map}")
+    def expired_ids(self, now: Optional[float] = None, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the IDs whose expiry time has passed, at most `limit` of them.
+        """
+        with self.lock.read():
+            return self.metadata.expired(time.time() if now is None else now, limit)
 
-        return ([self.id_map[idx] for idx in indices[0]], distances[0].tolist())
+    def compact(self):
+        """
+        Rebuilds the index without its tombstoned and superseded entries. Only index
+        types without in-place deletion accumulate them; this is a no-op for the others.
+        """
+        with self._build_lock:
+            with self.lock:
+                if not self.tombstones and not len(self._superseded):
+                    return
+                self._check_writable()
+                ids = faiss.vector_to_array(self.index.id_map)
+                keep = ~np.isin(ids, self._tombstone_array)
+                keep[self._superseded] = False
+                ivf = faiss.try_extract_index_ivf(self.index) is not None
+                # Detaches the lists for a moment, so it is taken with the lock
+                shell = self._empty_ivf_copy() if ivf else None
+                self._replay = []
 
-    def build_index(self, num_trees: int):
-        # Not applicable for IndexFlatL2, but can be used with other FAISS indexes.
-        pass
+            try:
+                if shell is not None:
+                    index = self._compact_ivf(shell, ids, keep)
+                else:
+                    index = self._rebuild(ids, keep)
+            except BaseException:
+                with self.lock:
+                    self._replay = None
+                raise
+
+            with self.lock:
+                self._swap(index, ids[keep])
+
+    def _rebuild(self, ids: np.ndarray, keep: np.ndarray, chunk_size: int = 65536):
+        """
+        Builds a new index of the kept entries, reading their vectors in chunks under the
+        read lock and adding them without it.
+        """
+        kept = np.empty((int(keep.sum()), self.dimension), dtype="float32")
+        filled = 0
+        for start in range(0, len(ids), chunk_size):
+            block_keep = keep[start : start + chunk_size]
+            with self.lock.read():
+                block = self._base_index().reconstruct_n(start, len(block_keep))[block_keep]
+                if self.vectors is not None:
+                    # Exact copies spare compressed indexes re-encoding their codes
+                    stored, exact = self.vectors.get(ids[start : start + chunk_size][block_keep])
+                    block[stored] = exact
+            kept[filled : filled + len(block)] = block
+            filled += len(block)
+
+        index = self._new_index()
+        if not index.is_trained:
+            index.train(kept)
+        index.add_with_ids(kept, ids[keep])
+        return index
+
+    def _empty_ivf_copy(self):
+        """
+        Returns a copy of the inner IVF index, with its trained quantizer and encoder
+        but without entries. The caller holds the write lock, since the lists are
+        detached from the index while it is copied, so they are not copied too.
+        """
+        ivf = faiss.try_extract_index_ivf(self.index)
+        invlists, owned = ivf.invlists, ivf.own_invlists
+        empty = faiss.ArrayInvertedLists(invlists.nlist, invlists.code_size)
+        ivf.own_invlists = False
+        ivf.replace_invlists(empty, True)
+        empty.this.disown()  # Now owned by the index
+        try:
+            copy = faiss.clone_index(self.index.index)
+        finally:
+            ivf.replace_invlists(invlists, owned)
+        copied = faiss.try_extract_index_ivf(copy)
+        copied.set_direct_map_type(faiss.DirectMap.NoMap)
+        copied.ntotal = 0
+        copy.ntotal = 0
+        return copy
+
+    def _compact_ivf(self, shell, ids: np.ndarray, keep: np.ndarray):
+        """
+        Returns a copy of the IVF index with only the kept entries, built into the empty
+        `shell`. The kept codes are copied as they are, list by list under the read
+        lock, so the quantizer is not retrained and PQ codes are not re-encoded.
+        """
+        # The ID map numbers the vectors of the inner index sequentially
+        renumbered = np.cumsum(keep) - 1
+        invlists = None
+        for list_no in range(faiss.try_extract_index_ivf(shell).nlist):
+            with self.lock.read():
+                # Read again every time, since a write may have materialized the lists
+                source = faiss.try_extract_index_ivf(self.index).invlists
+                code_size = source.code_size
+                size = source.list_size(list_no)
+                if not size:
+                    continue
+                list_ids = faiss.rev_swig_ptr(source.get_ids(list_no), size).copy()
+                codes = faiss.rev_swig_ptr(source.get_codes(list_no), size * code_size).copy()
+            if invlists is None:
+                invlists = faiss.ArrayInvertedLists(source.nlist, code_size)
+            # Entries added since the snapshot are replayed at the swap
+            kept = list_ids < len(keep)
+            kept[kept] = keep[list_ids[kept]]
+            if kept.any():
+                new_ids = np.ascontiguousarray(renumbered[list_ids[kept]], dtype="int64")
+                new_codes = np.ascontiguousarray(codes.reshape(size, code_size)[kept])
+                invlists.add_entries(
+                    list_no, len(new_ids), faiss.swig_ptr(new_ids), faiss.swig_ptr(new_codes)
+                )
+
+        # Wrapped while still empty, as the ID map requires
+        index = faiss.IndexIDMap2(shell)
+        ivf = faiss.try_extract_index_ivf(shell)
+        if invlists is not None:
+            ivf.replace_invlists(invlists, True)
+            invlists.this.disown()  # Now owned by the index
+        total = int(keep.sum())
+        ivf.ntotal = total
+        shell.ntotal = total
+        faiss.copy_array_to_vector(ids[keep], index.id_map)
+        index.ntotal = total
+        index.construct_rev_map()
+        return index
+
+    def build_index(self, num_trees: int = None):
+        """
+        Trains the index on the vectors accumulated so far and moves them into it.
+
+        This is called automatically once `train_size` vectors have been added, and can
+        be called earlier to train on fewer vectors. It is a no-op for index types that
+        need no training (flat, HNSW). `num_trees` only applies to Annoy and is ignored.
+        Queries are answered from the staging index until the trained one is swapped in.
+        """
+        with self._build_lock:
+            with self.lock.read():
+                if self.is_trained:
+                    return
+                self._check_writable()
+                vectors = self.staging.index.reconstruct_n(0, self.staging.ntotal)
+                ids = faiss.vector_to_array(self.staging.id_map)
+                nlist = getattr(faiss.try_extract_index_ivf(self.index), "nlist", 0)
+                if len(vectors) < nlist:
+                    raise ValueError(
+                        f"Training needs at least {nlist} vectors, only {len(vectors)} added."
+                    )
+                self._replay = []
+
+            try:
+                index = self._new_index()
+                index.train(vectors)
+                index.add_with_ids(vectors, ids)
+            except BaseException:
+                with self.lock:
+                    self._replay = None
+                raise
+
+            with self.lock:
+                self._swap(index, ids)
+
+    def _swap(self, index, ids: np.ndarray):
+        """
+        Replaces the index, and the staging one, with `index`, built without the lock
+        from the vectors of `ids`, once the adds and removals made meanwhile have been
+        replayed on it. The caller holds the write lock.
+        """
+        replay, self._replay = self._replay, None
+        self.index = index
+        self.staging = None
+        self.tombstones = set()
+        self._tombstone_array = np.empty(0, dtype="int64")
+        self._superseded = np.empty(0, dtype="int64")
+        self._mmapped = False
+        if replay:
+            # The copies of IDs removed or added again since are outdated
+            touched = np.concatenate([item_ids for item_ids, _ in replay])
+            stale = np.unique(touched[np.isin(touched, ids)])
+            if len(stale) and self._supports_remove():
+                self._drop(stale)
+            elif len(stale):
+                self._superseded = np.flatnonzero(np.isin(ids, stale))
+
+            added = [(item_ids, vectors) for item_ids, vectors in replay if vectors is not None]
+            if added:
+                item_ids = np.concatenate([item_ids for item_ids, _ in added])
+                vectors = np.concatenate([vectors for _, vectors in added])
+                # The last vector of each ID, if the ID was not removed afterwards
+                unique, last = np.unique(item_ids[::-1], return_index=True)
+                live = np.fromiter((i in self.metadata for i in unique.tolist()), dtype=bool)
+                rows = np.sort(len(item_ids) - 1 - last[live])
+                if len(rows):
+                    index.add_with_ids(vectors[rows], item_ids[rows])
+        self.revision += 1
+        self._apply_search_params()
 
     def save_index(self, filepath: str):
-        faiss.write_index(self.index, filepath)
+        """
+        Writes the index to `filepath`, with the entry metadata and any vectors still
+        staged for training written next to it. Callers wanting crash safety should write to a
+        fresh path and rename it, as `SnapshotManager` does. Searches continue while the
+        index is written; mutations wait.
+        """
+        with self.lock.read():
+            faiss.write_index(self.index, filepath)
+            with open(filepath + ".meta.npz", "wb") as f:
+                np.savez(
+                    f,
+                    tombstones=self._tombstone_array,
+                    superseded=self._superseded,
+                    **self.metadata.to_arrays(),
+                )
+            if self.staging is not None:
+                faiss.write_index(self.staging, filepath + ".staging")
+            if self.vectors is not None:
+                self.vectors.save(filepath + ".vectors.npy")
+
+    def load_index(self, filepath: str, mmap: bool = False, shared: bool = False):
+        """
+        Restores the index and its IDs from `filepath`.
+
+        With `mmap` the index data is memory mapped rather than read, so even a large
+        index is ready almost immediately and its pages are loaded on first use. The
+        file must then never be overwritten in place while it is in use.
+
+        With `shared` the codes of every index type, not only the IVF lists, are
+        mapped in place rather than copied, as are the exact vectors, so processes
+        loading the same file share one copy of it in the page cache. FAISS releases
+        that cannot map codes in place copy those of non-IVF indexes. The storage is
+        then read only until another index is loaded: mutations raise `RuntimeError`.
+        """
+        with self._build_lock:
+            self._load_index(filepath, mmap, shared)
+
+    def _load_index(self, filepath: str, mmap: bool, shared: bool):
+        flags = 0
+        if shared:
+            # IVF lists are mapped by IO_FLAG_MMAP, with which in-place mapping of the
+            # other codes cannot be combined. The file holds the configured index type.
+            # FAISS releases without IO_FLAG_MMAP_IFC read the other codes into memory.
+            ivf = faiss.try_extract_index_ivf(self.index) is not None
+            in_place = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+            flags = faiss.IO_FLAG_MMAP if ivf or in_place is None else in_place
+        elif mmap:
+            flags = faiss.IO_FLAG_MMAP
+        index = faiss.read_index(filepath, flags)
+        if index.d != self.dimension:
+            raise ValueError(
+                f"Index dimension {index.d} does not match storage dimension {self.dimension}."
+            )
+
+        if not isinstance(index, faiss.IndexIDMap2):
+            raise ValueError("Only indexes saved by FaissEmbeddingStorage can be loaded.")
+        if index.metric_type != METRICS[self.metric]:
+            raise ValueError(f"Index was not built for the {self.metric} metric.")
+
+        staging = None
+        if os.path.exists(filepath + ".staging"):
+            staging = faiss.read_index(filepath + ".staging")
+        elif not index.is_trained:
+            staging = self._new_staging()
+
+        with self.lock:
+            self.index = index
+            self.staging = staging
+            if os.path.exists(filepath + ".meta.npz"):
+                with np.load(filepath + ".meta.npz") as arrays:
+                    self.metadata = EntryMetadata.from_arrays(arrays)
+                    self._tombstone_array = arrays["tombstones"]
+                    # Absent from snapshots written before re-adds were superseded
+                    self._superseded = (
+                        arrays["superseded"]
+                        if "superseded" in arrays
+                        else np.empty(0, dtype="int64")
+                    )
+            else:
+                self.tombstones = set()
+                self._tombstone_array = np.empty(0, dtype="int64")
+                self._superseded = np.empty(0, dtype="int64")
+                self.metadata = EntryMetadata()
+                now = time.time()
+                for item_id in self.ids.tolist():
+                    self.metadata.add(item_id, now=now)
+            self.tombstones = set(self._tombstone_array.tolist())
+            if self.vectors is not None:
+                if os.path.exists(filepath + ".vectors.npy"):
+                    self.vectors.load(filepath + ".vectors.npy", shared=shared)
+                else:
+                    # Entries without an exact copy are searched approximately
+                    self.vectors.clear()
+            self._mmapped = mmap and not shared
+            self.read_only = shared
+            self.revision += 1
+            self._apply_search_params()
 
-    def load_index(self, filepath: str):
-        self.index = faiss.read_index(filepath)
-        # Note: You will need to also save and load self.id_map to fully restore state.
+    def _materialize(self):
+        """
+        Memory-mapped IVF inverted lists are read only, so they are copied into memory
+        before the first write. Other index types copy on write by themselves.
+        """
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            source = ivf.invlists
+            invlists = faiss.ArrayInvertedLists(source.nlist, source.code_size)
+            for list_no in range(source.nlist):
+                size = source.list_size(list_no)
+                if size:
+                    invlists.add_entries(
+                        list_no, size, source.get_ids(list_no), source.get_codes(list_no)
+                    )
+            ivf.replace_invlists(invlists, True)
+            invlists.this.disown()  # Now owned by the index
+        self._mmapped = False
@@ -0,0 +1,86 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.embedding_storage.snapshot import SnapshotManager
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotFollower:
+    """
+    Keeps a read-only storage on the latest snapshot published by a writer process.
+
+    The writer saves snapshots of its storage to a shared directory, ideally on tmpfs
+    such as /dev/shm, with a `SnapshotManager`. The follower polls that directory and
+    loads each new generation with `load_index(..., shared=True)`, so every follower
+    maps the same files and the vectors are held in memory once for all processes.
+    The previous generation stays mapped until the swap, so searches never wait for a
+    reload.
+
+    Parameters:
+    - snapshots (SnapshotManager): The manager of the writer's published snapshots.
+    - storage (BaseEmbeddingStorage): The storage to keep up to date.
+    - interval_seconds (float): Time between polls.
+    """
+
+    def __init__(
+        self,
+        snapshots: SnapshotManager,
+        storage: BaseEmbeddingStorage,
+        interval_seconds: float = 1.0,
+    ):
+        self.snapshots = snapshots
+        self.storage = storage
+        self.interval_seconds = interval_seconds
+        self.generation: Optional[int] = None
+        self.reloads = 0
+
+        self._lock = threading.Lock()  # One reload at a time
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self) -> bool:
+        """
+        Loads the latest generation if it is newer than the loaded one. Returns whether
+        a generation was loaded.
+        """
+        with self._lock:
+            latest = self.snapshots.latest()
+            if latest is None or latest[0] == self.generation:
+                return False
+            generation, filepath = latest
+            try:
+                self.storage.load_index(filepath, mmap=True, shared=True)
+            except (OSError, RuntimeError):
+                if os.path.exists(filepath):
+                    raise
+                # Pruned by the writer while being loaded; the next poll finds a newer one
+                logger.debug("Snapshot generation %d vanished while loading.", generation)
+                return False
+            self.generation = generation
+            self.reloads += 1
+            return True
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("The follower is already running.")
+
+        def run():
+            while not self._stop.wait(self.interval_seconds):
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("An error occurred while loading a published snapshot.")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="snapshot-follower", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
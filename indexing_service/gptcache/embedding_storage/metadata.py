@@ -0,0 +1,170 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+EVICTION_POLICIES = ("lru", "lfu", "score")
+
+# Age, in seconds, added to every entry by the "score" policy so that brand new entries
+# are not ranked on a handful of seconds of history.
+SCORE_AGE_OFFSET = 300.0
+
+
+class EntryMetadata:
+    """
+    Per-entry bookkeeping for an index, stored column-wise in NumPy arrays so scans such
+    as "which entries have expired" are vectorized rather than Python loops.
+
+    Each ID owns a row; rows of removed IDs are recycled, and a mask tells the rows in
+    use from free ones, so any int64 is a valid ID. Times are wall-clock
+    (`time.time()`) so they stay meaningful across restarts. An expiry of 0 means never.
+    """
+
+    _COLUMNS = {
+        "ids": ("int64", -1),
+        "expires_at": ("float64", 0),
+        "added_at": ("float64", 0),
+        "last_hit": ("float64", 0),
+        "hits": ("int64", 0),
+    }
+
+    def __init__(self, capacity: int = 1024):
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        for name, (dtype, fill) in self._COLUMNS.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        self._used = np.zeros(capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @property
+    def row_bytes(self) -> int:
+        return sum(getattr(self, name).itemsize for name in self._COLUMNS) + self._used.itemsize
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._rows
+
+    def _grow(self):
+        for name, (dtype, fill) in self._COLUMNS.items():
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.full(len(column), fill, dtype=dtype)]))
+        self._used = np.concatenate([self._used, np.zeros(len(self._used), dtype=bool)])
+
+    def _clear_row(self, row: int):
+        for name, (_, fill) in self._COLUMNS.items():
+            getattr(self, name)[row] = fill
+
+    def add(self, item_id: int, expires_at: Optional[float] = None, now: float = 0.0):
+        row = self._rows.get(item_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._rows)
+                if row >= len(self.ids):
+                    self._grow()
+            self._rows[item_id] = row
+            self._used[row] = True
+        self._clear_row(row)
+        self.ids[row] = item_id
+        self.expires_at[row] = expires_at or 0
+        self.added_at[row] = now
+        self.last_hit[row] = now
+
+    def remove(self, item_ids) -> List[int]:
+        """
+        Drops the given IDs and returns the ones that were known.
+        """
+        removed = []
+        for item_id in item_ids:
+            row = self._rows.pop(int(item_id), None)
+            if row is not None:
+                self._clear_row(row)
+                self._used[row] = False
+                self._free.append(row)
+                removed.append(int(item_id))
+        return removed
+
+    def record_hit(self, item_id: int, now: float):
+        row = self._rows.get(item_id)
+        if row is not None:
+            self.hits[row] += 1
+            self.last_hit[row] = now
+
+    def hit_count(self, item_id: int) -> int:
+        row = self._rows.get(item_id)
+        return 0 if row is None else int(self.hits[row])
+
+    def expiry(self, item_id: int) -> Optional[float]:
+        row = self._rows.get(item_id)
+        if row is None or self.expires_at[row] == 0:
+            return None
+        return float(self.expires_at[row])
+
+    def expired(self, now: float, limit: Optional[int] = None) -> np.ndarray:
+        """
+        Returns the IDs whose expiry time has passed, at most `limit` of them.
+        """
+        rows = np.flatnonzero((self.expires_at > 0) & (self.expires_at <= now))
+        if limit is not None:
+            rows = rows[:limit]
+        return self.ids[rows]
+
+    def victims(self, count: int, policy: str, now: float) -> np.ndarray:
+        """
+        Returns the `count` least valuable IDs under an eviction policy:
+        - lru: least recently hit (or added) first.
+        - lfu: fewest hits first, least recently hit first among equals.
+        - score: lowest hit rate, hits per second of age, so entries that were popular
+        long ago lose to entries that are popular now.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        rows = np.flatnonzero(self._used)
+        count = min(count, len(rows))
+        if count <= 0:
+            return np.empty(0, dtype="int64")
+
+        # Only the victims are sorted, so a batch costs linear time in the entries
+        if policy == "lru":
+            order = _smallest(self.last_hit[rows], count)
+        elif policy == "lfu":
+            hits, last_hit = self.hits[rows], self.last_hit[rows]
+            bound = np.partition(hits, count - 1)[count - 1]
+            fewer = np.flatnonzero(hits < bound)
+            tied = np.flatnonzero(hits == bound)
+            tied = tied[_smallest(last_hit[tied], count - len(fewer))]
+            order = np.concatenate([fewer, tied])
+            order = order[np.lexsort((last_hit[order], hits[order]))]
+        else:
+            age = now - self.added_at[rows] + SCORE_AGE_OFFSET
+            order = _smallest((self.hits[rows] + 1) / age, count)
+        return self.ids[rows[order]]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        rows = np.fromiter(self._rows.values(), dtype="int64", count=len(self._rows))
+        return {name: getattr(self, name)[rows] for name in self._COLUMNS}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "EntryMetadata":
+        size = len(arrays["ids"])
+        metadata = cls(capacity=max(1024, size))
+        for name in cls._COLUMNS:
+            if name in arrays:
+                getattr(metadata, name)[:size] = arrays[name]
+        metadata._rows = {item_id: row for row, item_id in enumerate(arrays["ids"].tolist())}
+        metadata._used[:size] = True
+        return metadata
+
+
+def _smallest(keys: np.ndarray, count: int) -> np.ndarray:
+    """
+    Returns the positions of the `count` smallest keys, smallest first, selecting them
+    in linear time and sorting only those.
+    """
+    if count < len(keys):
+        selected = np.argpartition(keys, count - 1)[:count]
+    else:
+        selected = np.arange(len(keys))
+    return selected[np.argsort(keys[selected], kind="stable")]
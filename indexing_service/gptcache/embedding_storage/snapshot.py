@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import nullcontext
+from typing import List, Optional, Tuple
+
+from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.embedding_storage.wal import OP_ADD, OP_REMOVE, WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+
+_SNAPSHOT_DIR = re.compile(r"^snapshot-(\d{12})$")
+INDEX_FILENAME = "index.bin"
+META_FILENAME = "meta.json"
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SnapshotManager:
+    """
+    Writes numbered snapshots of an embedding storage to a directory and restores the
+    latest one on startup.
+
+    Every snapshot is written into a temporary directory which is fsynced and then
+    renamed into place, so a crash mid-write never leaves a partial snapshot behind and
+    a file that is memory mapped by a running index is never overwritten.
+
+    Layout:
+        <directory>/snapshot-000000000001/index.bin (+ sidecar files of the storage)
+        <directory>/snapshot-000000000001/meta.json
+        <directory>/snapshot-000000000002/...
+
+    With a write-ahead log, each snapshot records the last log segment it covers. On
+    startup the segments after it are replayed, and a snapshot doubles as log
+    compaction: once it is on disk the covered segments are deleted.
+
+    Parameters:
+    - directory (str): Where snapshots are kept. Created if missing.
+    - keep (int): Number of most recent snapshots retained.
+    - wal (WriteAheadLog, optional): The log the storage appends its adds to.
+    """
+
+    def __init__(
+        self, directory: str, keep: int = 2, wal: Optional[WriteAheadLog] = None
+    ):
+        if keep < 1:
+            raise ValueError("keep must be at least 1.")
+        self.directory = directory
+        self.keep = keep
+        self.wal = wal
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()  # One snapshot at a time
+        self._stop = threading.Event()
+        self._thread = None
+        self._saved_revision = None
+
+    def _path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{generation:012d}")
+
+    def generations(self) -> List[int]:
+        """
+        Returns the generations of the complete snapshots on disk, oldest first.
+        """
+        generations = []
+        for name in os.listdir(self.directory):
+            match = _SNAPSHOT_DIR.match(name)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def latest(self) -> Optional[Tuple[int, str]]:
+        generations = self.generations()
+        if not generations:
+            return None
+        return generations[-1], os.path.join(self._path(generations[-1]), INDEX_FILENAME)
+
+    def save(self, storage: BaseEmbeddingStorage) -> int:
+        """
+        Atomically writes a new snapshot of `storage` and returns its generation.
+        """
+        with self._lock:
+            generations = self.generations()
+            generation = generations[-1] + 1 if generations else 1
+            final_path = self._path(generation)
+            tmp_path = final_path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+
+            # Rotating the log and capturing the index happen under the storage lock,
+            # so the snapshot holds exactly the adds in the covered segments. Only
+            # writers are held off where the lock allows it; searches carry on.
+            lock = getattr(storage, "lock", None)
+            with lock.read() if hasattr(lock, "read") else lock or nullcontext():
+                covered = self.wal.rotate() if self.wal is not None else None
+                revision = getattr(storage, "revision", None)
+                storage.save_index(os.path.join(tmp_path, INDEX_FILENAME))
+            with open(os.path.join(tmp_path, META_FILENAME), "w") as f:
+                json.dump({"wal_segment": covered, "created_at": time.time()}, f)
+
+            for name in os.listdir(tmp_path):
+                with open(os.path.join(tmp_path, name), "rb") as f:
+                    os.fsync(f.fileno())
+            _fsync_dir(tmp_path)
+
+            os.rename(tmp_path, final_path)
+            _fsync_dir(self.directory)
+            self._saved_revision = revision
+
+            if covered is not None:
+                self.wal.truncate(covered)
+            self._prune(generations + [generation])
+            return generation
+
+    def _prune(self, generations: List[int]):
+        # Unlinking is safe even if an index still maps the files; the pages stay
+        # valid until it is unmapped.
+        for generation in generations[: -self.keep]:
+            shutil.rmtree(self._path(generation), ignore_errors=True)
+
+    def load_latest(self, storage: BaseEmbeddingStorage, mmap: bool = True) -> Optional[int]:
+        """
+        Restores `storage` from the most recent snapshot, then replays the write-ahead
+        log written after it. Returns the snapshot generation, or `None` if there is no
+        snapshot yet.
+        """
+        latest = self.latest()
+        covered = 0
+        generation = None
+        if latest is not None:
+            generation, filepath = latest
+            storage.load_index(filepath, mmap=mmap)
+            meta_path = os.path.join(os.path.dirname(filepath), META_FILENAME)
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    covered = json.load(f).get("wal_segment") or 0
+
+        # Replayed records are not in a snapshot yet, so they count as changes
+        self._saved_revision = getattr(storage, "revision", None)
+        if self.wal is not None:
+            replayed = self._replay(storage, covered)
+            if replayed:
+                logger.info("Replayed %d write-ahead log records.", replayed)
+        return generation
+
+    def _replay(self, storage: BaseEmbeddingStorage, covered: int) -> int:
+        # Detach the log while replaying so the records are not logged a second time
+        wal = getattr(storage, "wal", None)
+        storage.wal = None
+        try:
+            replayed = 0
+            for op, item_id, expires_at, vector in self.wal.records(after=covered):
+                if op == OP_ADD:
+                    storage.add_item(item_id, vector, expires_at=expires_at or None)
+                elif op == OP_REMOVE:
+                    storage.remove_ids([item_id])
+                replayed += 1
+            return replayed
+        finally:
+            storage.wal = wal
+
+    def save_if_changed(self, storage: BaseEmbeddingStorage) -> Optional[int]:
+        """
+        Saves a snapshot unless the storage reports it has not changed since the last one.
+        """
+        revision = getattr(storage, "revision", None)
+        if revision is not None and revision == self._saved_revision:
+            return None
+        return self.save(storage)
+
+    def start(
+        self,
+        storage: BaseEmbeddingStorage,
+        interval_seconds: float,
+        compact_bytes: Optional[int] = None,
+    ):
+        """
+        Starts a background thread snapshotting `storage` every `interval_seconds`, and
+        as soon as the write-ahead log grows past `compact_bytes`.
+        """
+        if self._thread is not None:
+            raise RuntimeError("Periodic snapshots are already running.")
+
+        def run():
+            last = time.monotonic()
+            while not self._stop.wait(min(interval_seconds, 1.0)):
+                due = time.monotonic() - last >= interval_seconds
+                if (
+                    compact_bytes is not None
+                    and self.wal is not None
+                    and self.wal.pending_bytes >= compact_bytes
+                ):
+                    due = True
+                if not due:
+                    continue
+                try:
+                    self.save_if_changed(storage)
+                except Exception:
+                    logger.exception("An error occurred while snapshotting the index.")
+                last = time.monotonic()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="index-snapshotter", daemon=True)
+        self._thread.start()
+
+    def stop(self, storage: Optional[BaseEmbeddingStorage] = None):
+        """
+        Stops periodic snapshots, then writes a final snapshot of `storage` if given.
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if storage is not None:
+            self.save_if_changed(storage)
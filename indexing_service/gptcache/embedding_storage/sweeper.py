@@ -0,0 +1,83 @@
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from gptcache.embedding_storage import FaissEmbeddingStorage
+
+logger = logging.getLogger(__name__)
+
+
+class TTLSweeper:
+    """
+    Periodically removes expired entries from a storage in batches, and compacts the
+    index once tombstones make up more than `rebuild_threshold` of it.
+
+    Parameters:
+    - storage (FaissEmbeddingStorage): The storage to sweep.
+    - interval_seconds (float): Time between sweeps.
+    - batch_size (int): Maximum number of IDs removed per `remove_ids` call, so the
+    storage lock is never held for long.
+    - rebuild_threshold (float): Tombstone fraction that triggers `compact`.
+    - on_removed (callable, optional): Called with each batch of removed IDs.
+    """
+
+    def __init__(
+        self,
+        storage: FaissEmbeddingStorage,
+        interval_seconds: float = 30.0,
+        batch_size: int = 1024,
+        rebuild_threshold: float = 0.2,
+        on_removed: Optional[Callable[[List[int]], None]] = None,
+    ):
+        self.storage = storage
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.rebuild_threshold = rebuild_threshold
+        self.on_removed = on_removed
+        self.removed = 0
+        self.compactions = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Runs one sweep and returns the number of removed entries.
+        """
+        removed = 0
+        while True:
+            expired = self.storage.expired_ids(now, limit=self.batch_size)
+            if len(expired) == 0:
+                break
+            removed += self.storage.remove_ids(expired)
+            if self.on_removed is not None:
+                self.on_removed(expired.tolist())
+            if len(expired) < self.batch_size:
+                break
+        self.removed += removed
+
+        if self.storage.tombstone_ratio > self.rebuild_threshold:
+            self.storage.compact()
+            self.compactions += 1
+        return removed
+
+    def start(self):
+        if self._thread is not None:
+            raise RuntimeError("The sweeper is already running.")
+
+        def run():
+            while not self._stop.wait(self.interval_seconds):
+                try:
+                    self.sweep()
+                except Exception:
+                    logger.exception("An error occurred while sweeping expired entries.")
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="ttl-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,148 @@
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class VectorFile:
+    """
+    Full-precision float32 copies of the vectors, kept in a memory-mapped file rather
+    than in memory, so a compressed index can re-score its top candidates exactly.
+    Only the pages of vectors actually read are loaded, and the OS can drop them under
+    memory pressure.
+
+    Each ID owns a row; rows of removed IDs are recycled. The file is a working file
+    owned by this object: snapshots get a compact copy with `save`, and `load` copies
+    one back into a fresh working file.
+
+    Parameters:
+    - dimension (int): The dimension of the stored vectors.
+    - directory (str, optional): Where the working file is created. Defaults to the
+    system temporary directory.
+    - capacity (int): Initial number of rows; the file doubles when full.
+    """
+
+    def __init__(self, dimension: int, directory: Optional[str] = None, capacity: int = 1024):
+        self.dimension = dimension
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="vectors-", suffix=".f32", dir=directory)
+        os.close(fd)
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        self._vectors = None
+        self._resize(capacity)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._rows
+
+    def _resize(self, capacity: int):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self._vectors = np.memmap(
+            self.path, dtype="float32", mode="r+", shape=(capacity, self.dimension)
+        )
+
+    def ids(self) -> np.ndarray:
+        return np.fromiter(self._rows.keys(), dtype="int64", count=len(self._rows))
+
+    def put(self, item_ids: List[int], vectors: np.ndarray):
+        """
+        Stores an (N, d) matrix of vectors, replacing those of known IDs.
+        """
+        rows = np.empty(len(item_ids), dtype="int64")
+        for i, item_id in enumerate(item_ids):
+            row = self._rows.get(item_id)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                else:
+                    row = len(self._rows)
+                    if row >= len(self._vectors):
+                        self._resize(2 * len(self._vectors))
+                self._rows[item_id] = row
+            rows[i] = row
+        self._vectors[rows] = vectors
+
+    def get(self, item_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns a mask of the IDs that are stored, and the vectors of those IDs.
+        """
+        rows = np.fromiter(
+            (self._rows.get(int(item_id), -1) for item_id in item_ids),
+            dtype="int64",
+            count=len(item_ids),
+        )
+        found = rows >= 0
+        return found, np.asarray(self._vectors[rows[found]])
+
+    def remove(self, item_ids: List[int]):
+        for item_id in item_ids:
+            row = self._rows.pop(int(item_id), None)
+            if row is not None:
+                self._free.append(row)
+
+    def clear(self):
+        self._rows = {}
+        self._free = []
+
+    def save(self, filepath: str, chunk_size: int = 65536):
+        """
+        Writes the stored vectors to `filepath` (a .npy file) and their IDs next to it,
+        copying in chunks so the vectors are never all in memory.
+        """
+        ids = np.fromiter(self._rows.keys(), dtype="int64", count=len(self._rows))
+        rows = np.fromiter(self._rows.values(), dtype="int64", count=len(self._rows))
+        out = np.lib.format.open_memmap(
+            filepath, mode="w+", dtype="float32", shape=(len(ids), self.dimension)
+        )
+        for start in range(0, len(ids), chunk_size):
+            out[start : start + chunk_size] = self._vectors[rows[start : start + chunk_size]]
+        out.flush()
+        del out
+        np.save(filepath + ".ids.npy", ids)
+
+    def load(self, filepath: str, chunk_size: int = 65536, shared: bool = False):
+        """
+        Replaces the stored vectors with those written by `save`.
+
+        With `shared` the file is mapped read only in place of the working file rather
+        than copied, so processes loading it share its pages. Nothing can then be stored
+        until another file is loaded.
+        """
+        ids = np.load(filepath + ".ids.npy")
+        vectors = np.load(filepath, mmap_mode="r")
+        if vectors.shape[1:] != (self.dimension,):
+            raise ValueError("Vector dimension mismatch.")
+        self.clear()
+        if shared:
+            self._vectors = vectors
+            self._rows = {item_id: row for row, item_id in enumerate(ids.tolist())}
+            return
+        self._resize(max(1024, len(ids)))
+        for start in range(0, len(ids), chunk_size):
+            chunk = vectors[start : start + chunk_size]
+            self._vectors[start : start + len(chunk)] = chunk
+        self._rows = {item_id: row for row, item_id in enumerate(ids.tolist())}
+
+    def close(self):
+        """
+        Deletes the working file.
+        """
+        self._vectors = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,235 @@
+import logging
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_FILE = re.compile(r"^wal-(\d{12})\.log$")
+_MAGIC = b"GPTWAL02"
+_FILE_HEADER = struct.Struct("<8sI")  # magic, dimension
+_RECORD_KEY = struct.Struct("<Bqd")  # op, item id, expiry (0 for none)
+_RECORD_HEADER = struct.Struct("<BqdI")  # record key, crc32 of key and payload
+
+OP_ADD = 1  # Payload is the float32 vector
+OP_REMOVE = 2  # No payload
+
+
+class WriteAheadLog:
+    """
+    Append-only binary log of index mutations, so adds and removes made since the last
+    snapshot survive a crash without rewriting the whole index.
+
+    The log is split into numbered segment files. A snapshot rotates the log to a new
+    segment and records the last segment it covers; on startup only the segments after
+    it are replayed, and covered segments are deleted once the snapshot is on disk.
+
+    Writes are made durable with group commit: appends only write to the file buffer,
+    and a background thread fsyncs once `sync_batch` records are pending or
+    `sync_interval_ms` has passed, covering every append made so far in one fsync.
+
+    Parameters:
+    - directory (str): Where segment files are kept. Created if missing.
+    - dimension (int): Dimension of the logged vectors.
+    - sync_interval_ms (float): Longest time an append waits to be fsynced.
+    - sync_batch (int): Number of pending appends that triggers an immediate fsync.
+    - wait_for_sync (bool): Whether `commit` blocks until the append is durable. When
+    false, up to `sync_interval_ms` of adds can be lost on a crash.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dimension: int,
+        sync_interval_ms: float = 10.0,
+        sync_batch: int = 64,
+        wait_for_sync: bool = True,
+    ):
+        self.directory = directory
+        self.dimension = dimension
+        self.sync_interval = sync_interval_ms / 1000
+        self.sync_batch = sync_batch
+        self.wait_for_sync = wait_for_sync
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        # Held while syncing or rotating, so a segment is never closed mid-fsync
+        self._segment_lock = threading.Lock()
+        self._appended = 0  # Sequence number of the last append
+        self._synced = 0  # Sequence number of the last durable append
+        self._closed = False
+
+        # Never append to an existing segment; its tail may be torn by a crash
+        segments = self.segments()
+        self.segment = segments[-1] + 1 if segments else 1
+        self.pending_bytes = sum(
+            os.path.getsize(self._path(segment)) for segment in segments
+        )
+        self._file = self._open_segment(self.segment)
+
+        self._flusher = threading.Thread(target=self._run, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"wal-{segment:012d}.log")
+
+    def segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_FILE.match(name)
+            if match:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def _open_segment(self, segment: int):
+        f = open(self._path(segment), "ab")
+        f.write(_FILE_HEADER.pack(_MAGIC, self.dimension))
+        return f
+
+    def _encode(self, op: int, item_id: int, expires_at: float, payload: bytes) -> bytes:
+        crc = zlib.crc32(_RECORD_KEY.pack(op, item_id, expires_at) + payload)
+        return _RECORD_HEADER.pack(op, item_id, expires_at, crc) + payload
+
+    def append(self, item_id: int, vector, expires_at: Optional[float] = None) -> int:
+        """
+        Logs an added vector and returns a ticket to pass to `commit`.
+        """
+        payload = np.asarray(vector, dtype="float32").reshape(-1)
+        if payload.shape[0] != self.dimension:
+            raise ValueError("Vector dimension mismatch.")
+        return self._write(self._encode(OP_ADD, item_id, expires_at or 0, payload.tobytes()))
+
+    def append_remove(self, item_ids) -> int:
+        """
+        Logs removed IDs and returns a ticket to pass to `commit`.
+        """
+        records = b"".join(self._encode(OP_REMOVE, int(i), 0, b"") for i in item_ids)
+        return self._write(records, count=len(item_ids))
+
+    def _write(self, record: bytes, count: int = 1) -> int:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The write-ahead log is closed.")
+            self._file.write(record)
+            self.pending_bytes += len(record)
+            self._appended += count
+            if self._appended - self._synced >= self.sync_batch:
+                self._cond.notify_all()
+            return self._appended
+
+    def commit(self, ticket: int):
+        """
+        Blocks until the append identified by `ticket` is durable, unless the log was
+        created with `wait_for_sync=False`.
+        """
+        if not self.wait_for_sync:
+            return
+        with self._cond:
+            while self._synced < ticket and not self._closed:
+                self._cond.wait()
+
+    def _sync(self):
+        with self._segment_lock:
+            with self._cond:
+                target = self._appended
+                if target == self._synced or self._closed:
+                    return
+                self._file.flush()
+                fd = self._file.fileno()
+            # fsync outside the condition so appends keep flowing into the next group
+            os.fsync(fd)
+            with self._cond:
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._appended - self._synced < self.sync_batch:
+                    self._cond.wait(self.sync_interval)
+                if self._closed:
+                    return
+            try:
+                self._sync()
+            except Exception:
+                logger.exception("An error occurred while syncing the write-ahead log.")
+
+    def rotate(self) -> int:
+        """
+        Makes the current segment durable, starts a new one and returns the number of
+        the last complete segment. Call this while the storage is locked, at the point
+        the snapshot state is captured.
+        """
+        with self._segment_lock, self._cond:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._synced = self._appended
+            covered = self.segment
+            self.segment += 1
+            self._file = self._open_segment(self.segment)
+            self.pending_bytes = 0
+            self._cond.notify_all()
+            return covered
+
+    def truncate(self, covered: int):
+        """
+        Deletes the segments up to and including `covered`, once a snapshot holds them.
+        """
+        for segment in self.segments():
+            if segment <= covered:
+                os.remove(self._path(segment))
+
+    def records(self, after: int = 0) -> Iterator[Tuple[int, int, float, Optional[np.ndarray]]]:
+        """
+        Yields the (op, item id, expiry, vector) records of every segment after `after`,
+        in order. Remove records have no vector. A torn or corrupt record ends its segment, as only the tail can be
+        incomplete after a crash.
+        """
+        for segment in self.segments():
+            if segment <= after or segment == self.segment:
+                continue
+            with open(self._path(segment), "rb") as f:
+                header = f.read(_FILE_HEADER.size)
+                if len(header) < _FILE_HEADER.size:
+                    continue
+                magic, dimension = _FILE_HEADER.unpack(header)
+                if magic != _MAGIC or dimension != self.dimension:
+                    raise ValueError(f"Unexpected write-ahead log segment {segment}.")
+                yield from self._read_records(f)
+
+    def _read_records(self, f) -> Iterator[Tuple[int, int, float, Optional[np.ndarray]]]:
+        payload_sizes = {OP_ADD: self.dimension * 4, OP_REMOVE: 0}
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            op, item_id, expires_at, crc = _RECORD_HEADER.unpack(header)
+            if op not in payload_sizes:
+                return
+            payload = f.read(payload_sizes[op])
+            if len(payload) < payload_sizes[op]:
+                return
+            if zlib.crc32(_RECORD_KEY.pack(op, item_id, expires_at) + payload) != crc:
+                return
+            vector = np.frombuffer(payload, dtype="float32") if op == OP_ADD else None
+            yield op, item_id, expires_at, vector
+
+    def close(self):
+        with self._segment_lock, self._cond:
+            if self._closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._synced = self._appended
+            self._closed = True
+            self._file.close()
+            self._cond.notify_all()
+        self._flusher.join()
@@ -0,0 +1,3 @@
+from .exact import FingerprintTable
+from .simhash import SimHashIndex, simhash
+from .tier import FingerprintTier
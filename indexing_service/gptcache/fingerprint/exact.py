@@ -0,0 +1,81 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from gptcache.utils import normalize_text
+
+
+class FingerprintTable:
+    """
+    Maps a hash of each added text, once normalized, to the ID it was added with, so a
+    query repeating a cached prompt byte for byte, or up to whitespace or case, is
+    answered without the model or the index.
+
+    Only the 16-byte hashes are kept, not the texts. When full, the least recently
+    added or hit fingerprint is dropped first. When several IDs were added with the
+    same text, the last one is returned.
+
+    Parameters:
+    - max_entries (int): Maximum number of fingerprints.
+    - normalization (str): One of "exact", "whitespace" or "casefold", see
+    `gptcache.utils.normalize_text`. Texts that normalize alike must embed alike, so
+    "casefold" is only safe for uncased models.
+    """
+
+    def __init__(self, max_entries: int = 100000, normalization: str = "whitespace"):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        normalize_text("", normalization)  # Validate the mode early
+        self.max_entries = max_entries
+        self.normalization = normalization
+        self._ids: "OrderedDict[bytes, int]" = OrderedDict()  # In LRU order
+        self._keys: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _key(self, text: str) -> bytes:
+        normalized = normalize_text(text, self.normalization)
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+    def _discard(self, item_id: int):
+        key = self._keys.pop(item_id, None)
+        # The key may have been taken over by a later ID with the same text
+        if key is not None and self._ids.get(key) == item_id:
+            del self._ids[key]
+
+    def add(self, item_ids: List[int], texts: List[str]):
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            for item_id, key in zip(item_ids, keys):
+                item_id = int(item_id)
+                self._discard(item_id)
+                previous = self._ids.get(key)
+                if previous is not None:
+                    del self._keys[previous]
+                self._ids[key] = item_id
+                self._ids.move_to_end(key)
+                self._keys[item_id] = key
+            while len(self._ids) > self.max_entries:
+                _, evicted = self._ids.popitem(last=False)
+                del self._keys[evicted]
+
+    def lookup(self, text: str) -> Optional[int]:
+        key = self._key(text)
+        with self._lock:
+            item_id = self._ids.get(key)
+            if item_id is not None:
+                self._ids.move_to_end(key)
+            return item_id
+
+    def remove(self, item_ids: List[int]):
+        with self._lock:
+            for item_id in item_ids:
+                self._discard(int(item_id))
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._keys.clear()
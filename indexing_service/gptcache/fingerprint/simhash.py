@@ -0,0 +1,127 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+")
+_BITS = np.arange(64, dtype="uint64")
+
+
+@lru_cache(maxsize=65536)
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def simhash(text: str) -> int:
+    """
+    Returns the 64-bit SimHash of a text's case-folded words and word bigrams. Texts
+    sharing most of their features get signatures a few bits apart, and punctuation,
+    case and whitespace are ignored altogether.
+    """
+    words = _TOKEN.findall(text.casefold())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    if not features:
+        return 0
+    hashes = np.fromiter((_feature_hash(f) for f in features), dtype="uint64", count=len(features))
+    # Each bit is set if most features have it set
+    counts = ((hashes[:, None] >> _BITS) & np.uint64(1)).sum(axis=0)
+    bits = (2 * counts > len(features)).astype("uint64")
+    return int((bits << _BITS).sum())
+
+
+class SimHashIndex:
+    """
+    Finds the added text whose SimHash is within `max_distance` bits of a query's, for
+    texts that differ from a cached one only trivially, e.g. by punctuation or a typo.
+
+    The 64 bits are split into max_distance + 1 bands, each with a table from its
+    value to the IDs having it. Two signatures within max_distance bits differ in at
+    most max_distance bands, so they share at least one: only the IDs sharing a band
+    with the query are compared, rather than every signature.
+
+    When full, the least recently added or hit signature is dropped first.
+
+    Parameters:
+    - max_distance (int): The largest Hamming distance, in bits, of a match.
+    - max_entries (int): Maximum number of signatures.
+    """
+
+    def __init__(self, max_distance: int = 3, max_entries: int = 100000):
+        if not 0 <= max_distance < 16:
+            raise ValueError("max_distance must be between 0 and 15.")
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        bounds = np.linspace(0, 64, max_distance + 2).astype(int)
+        self._bands = [
+            (int(start), (1 << int(stop - start)) - 1)
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        self._tables = [dict() for _ in self._bands]
+        self._signatures: "OrderedDict[int, int]" = OrderedDict()  # In LRU order
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_values(self, signature: int) -> List[int]:
+        return [(signature >> shift) & mask for shift, mask in self._bands]
+
+    def _discard(self, item_id: int):
+        signature = self._signatures.pop(item_id, None)
+        if signature is None:
+            return
+        for table, value in zip(self._tables, self._band_values(signature)):
+            ids = table[value]
+            ids.discard(item_id)
+            if not ids:
+                del table[value]
+
+    def add(self, item_ids: List[int], texts: List[str]):
+        signatures = [simhash(text) for text in texts]
+        with self._lock:
+            for item_id, signature in zip(item_ids, signatures):
+                item_id = int(item_id)
+                self._discard(item_id)
+                self._signatures[item_id] = signature
+                for table, value in zip(self._tables, self._band_values(signature)):
+                    table.setdefault(value, set()).add(item_id)
+            while len(self._signatures) > self.max_entries:
+                self._discard(next(iter(self._signatures)))
+
+    def lookup(self, text: str) -> Optional[Tuple[int, int]]:
+        """
+        Returns the ID of the nearest signature within `max_distance` and its distance
+        in bits, or `None`.
+        """
+        signature = simhash(text)
+        with self._lock:
+            candidates: Set[int] = set()
+            for table, value in zip(self._tables, self._band_values(signature)):
+                candidates.update(table.get(value, ()))
+            best = None
+            for item_id in candidates:
+                distance = (self._signatures[item_id] ^ signature).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (item_id, distance)
+            if best is not None:
+                self._signatures.move_to_end(best[0])
+            return best
+
+    def remove(self, item_ids: List[int]):
+        with self._lock:
+            for item_id in item_ids:
+                self._discard(int(item_id))
+
+    def clear(self):
+        with self._lock:
+            self._signatures.clear()
+            for table in self._tables:
+                table.clear()
@@ -0,0 +1,116 @@
+import threading
+from typing import Container, List, Optional, Tuple
+
+from gptcache.fingerprint.exact import FingerprintTable
+from gptcache.fingerprint.simhash import SimHashIndex
+from gptcache.utils.metrics import FINGERPRINT_RESULTS, STAGE_SECONDS
+
+_LOOKUP_SECONDS = STAGE_SECONDS.labels("fingerprint")
+_EXACT = FINGERPRINT_RESULTS.labels("exact")
+_NEAR = FINGERPRINT_RESULTS.labels("near")
+_STALE = FINGERPRINT_RESULTS.labels("stale")
+_MISS = FINGERPRINT_RESULTS.labels("miss")
+
+
+class FingerprintStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.stale = 0
+
+    def record(self, exact_hits: int = 0, near_hits: int = 0, stale: int = 0, misses: int = 0):
+        with self._lock:
+            self.lookups += exact_hits + near_hits + misses
+            self.exact_hits += exact_hits
+            self.near_hits += near_hits
+            self.stale += stale
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            return {
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "stale": self.stale,
+            }
+
+
+class FingerprintTier:
+    """
+    The first tier of a query, ahead of the model and the index: a query whose text
+    was already added, up to normalization, is answered with its ID straight away, and
+    optionally so is one whose SimHash is within a few bits of an added text's.
+
+    Entries leave the index without the tier being told when they expire or are
+    evicted, so every hit is checked against the index first; hits on entries it no
+    longer holds are dropped and count as misses. Fingerprints are only held in
+    memory, so entries restored from a snapshot have none until they are added again.
+
+    Parameters:
+    - table (FingerprintTable): The exact fingerprints.
+    - near (SimHashIndex, optional): The near-identical tier, tried after the exact one.
+    """
+
+    def __init__(self, table: FingerprintTable, near: Optional[SimHashIndex] = None):
+        self.table = table
+        self.near = near
+        self.stats = FingerprintStats()
+
+    def add(self, item_ids: List[int], texts: List[str]):
+        self.table.add(item_ids, texts)
+        if self.near is not None:
+            self.near.add(item_ids, texts)
+
+    def remove(self, item_ids: List[int]):
+        self.table.remove(item_ids)
+        if self.near is not None:
+            self.near.remove(item_ids)
+
+    def lookup(self, text: str, index: Container[int]) -> Optional[Tuple[int, str]]:
+        """
+        Returns the ID matching `text` and whether the match was "exact" or "near", or
+        `None`. `index` is the storage the IDs must still be in. A near match is only a
+        candidate, which the caller checks against the query and then counts as a hit
+        or a miss with `record_near`.
+        """
+        with _LOOKUP_SECONDS.time():
+            stale = 0
+            item_id = self.table.lookup(text)
+            if item_id is not None:
+                if item_id in index:
+                    _EXACT.inc()
+                    self.stats.record(exact_hits=1)
+                    return item_id, "exact"
+                self.remove([item_id])
+                stale += 1
+            if self.near is not None:
+                match = self.near.lookup(text)
+                if match is not None:
+                    if match[0] in index:
+                        if stale:
+                            _STALE.inc(stale)
+                            self.stats.record(stale=stale)
+                        return match[0], "near"
+                    self.remove([match[0]])
+                    stale += 1
+            if stale:
+                _STALE.inc(stale)
+            _MISS.inc()
+            self.stats.record(stale=stale, misses=1)
+            return None
+
+    def record_near(self, hit: bool):
+        """
+        Counts a near match returned by `lookup` as a hit if the caller served it, or as
+        a miss if it was rejected.
+        """
+        if hit:
+            _NEAR.inc()
+            self.stats.record(near_hits=1)
+        else:
+            _MISS.inc()
+            self.stats.record(misses=1)
@@ -0,0 +1,6 @@
+from .base import BaseReranker
+from .text_store import TextStore
+from .exact import ExactReranker
+from .lexical import LexicalReranker
+from .cross_encoder import CrossEncoderReranker
+from .pipeline import RerankingSearch
@@ -0,0 +1,30 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+
+
+class BaseReranker(ABC):
+    """
+    Second stage of a query: re-scores the top-k candidates found by the index.
+
+    Candidates are dicts with the 'id', 'distance' and 'similarity' the index reported
+    and a 'score', higher is better. A reranker returns the candidates it kept, with
+    updated scores; dropping a candidate rejects it as a match.
+
+    `deadline` is a `time.monotonic()` by which the reranker should return. Candidates
+    it has not got to by then are returned unchanged, so a slow reranker degrades to
+    the index ranking instead of delaying the response.
+    """
+
+    @abstractmethod
+    def rerank(
+        self, query: str, query_vector: np.ndarray, candidates: List[dict], deadline: float
+    ) -> List[dict]:
+        pass
+
+    def forget(self, ids: List[int]):
+        """
+        Called when entries leave the index, for rerankers keeping per-entry state.
+        """
+        pass
@@ -0,0 +1,71 @@
+import time
+from typing import List
+
+import numpy as np
+
+from gptcache.rerank.base import BaseReranker
+from gptcache.rerank.text_store import TextStore
+
+
+class CrossEncoderReranker(BaseReranker):
+    """
+    Scores each (query, candidate text) pair with a cross-encoder, which reads both
+    texts together and is far more precise than comparing two independent embeddings,
+    at the cost of one model call per batch of candidates.
+
+    Candidates are scored in batches, highest similarity first, until the deadline;
+    the ones left, and those whose text is unknown, keep their similarity as score.
+
+    Parameters:
+    - texts (TextStore): The contexts the entries were added with.
+    - model_name (str): A sentence-transformers cross-encoder trained for semantic
+    similarity, scoring pairs between 0 and 1.
+    - min_score (float): Candidates scoring lower are rejected.
+    - batch_size (int): Number of pairs per model call.
+    - model (CrossEncoder, optional): An already loaded model, shared with other
+    rerankers, used instead of loading `model_name`.
+    """
+
+    def __init__(
+        self,
+        texts: TextStore,
+        model_name: str = "cross-encoder/stsb-distilroberta-base",
+        min_score: float = 0.5,
+        batch_size: int = 16,
+        model=None,
+    ):
+        self.texts = texts
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(model_name)
+        self.model = model
+        self.min_score = min_score
+        self.batch_size = batch_size
+
+    def rerank(
+        self, query: str, query_vector: np.ndarray, candidates: List[dict], deadline: float
+    ) -> List[dict]:
+        known, rescored = [], []
+        for candidate in candidates:
+            text = self.texts.get(candidate["id"])
+            if text is None:
+                rescored.append(candidate)
+            else:
+                known.append((candidate, text))
+
+        for start in range(0, len(known), self.batch_size):
+            if time.monotonic() >= deadline:
+                rescored.extend(candidate for candidate, _ in known[start:])
+                break
+            batch = known[start : start + self.batch_size]
+            scores = self.model.predict(
+                [(query, text) for _, text in batch], batch_size=self.batch_size
+            )
+            for (candidate, _), score in zip(batch, np.asarray(scores).tolist()):
+                if score >= self.min_score:
+                    rescored.append({**candidate, "score": score})
+        return sorted(rescored, key=lambda c: c["score"], reverse=True)
+
+    def forget(self, ids: List[int]):
+        self.texts.remove(ids)
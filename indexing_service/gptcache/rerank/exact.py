@@ -0,0 +1,83 @@
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.rerank.base import BaseReranker
+
+
+class ExactReranker(BaseReranker):
+    """
+    Rescores candidates against the vectors held by the storage, undoing the error of
+    approximate search (HNSW, IVF) and ranking by exact distance. Candidates removed
+    from the storage since they were found are dropped.
+
+    Parameters:
+    - storage (BaseEmbeddingStorage): The storage the candidates were found in. Its
+    `get_vectors` provides the stored vectors and its metric how distances are measured.
+    """
+
+    def __init__(self, storage: BaseEmbeddingStorage):
+        self.storage = storage
+
+    def rerank(
+        self, query: str, query_vector: np.ndarray, candidates: List[dict], deadline: float
+    ) -> List[dict]:
+        if not candidates or time.monotonic() >= deadline:
+            return candidates
+
+        candidates, vectors = self._vectors(candidates)
+        if not candidates:
+            return candidates
+        query_vector = np.asarray(query_vector, dtype="float32").reshape(-1)
+        distances = self._distances(query_vector, vectors)
+
+        rescored = []
+        for candidate, distance in zip(candidates, distances.tolist()):
+            similarity = self.storage.similarity(distance)
+            rescored.append(
+                {
+                    **candidate,
+                    "distance": distance,
+                    "similarity": similarity,
+                    "score": similarity,
+                }
+            )
+        return sorted(rescored, key=lambda c: c["score"], reverse=True)
+
+    def _vectors(self, candidates: List[dict]) -> Tuple[List[dict], np.ndarray]:
+        """
+        Returns the candidates still stored and their vectors.
+        """
+        try:
+            vectors = self.storage.get_vectors([c["id"] for c in candidates])
+            return candidates, np.asarray(vectors, dtype="float32")
+        except (KeyError, RuntimeError):
+            pass
+        # Some were removed since the search, so the others are fetched one by one
+        found, vectors = [], []
+        for candidate in candidates:
+            try:
+                vectors.append(self.storage.get_vectors([candidate["id"]])[0])
+            except (KeyError, RuntimeError):
+                continue
+            found.append(candidate)
+        return found, np.asarray(vectors, dtype="float32")
+
+    def _distances(self, query_vector: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        metric = getattr(self.storage, "metric", "l2")
+        if metric == "l2":
+            return ((vectors - query_vector) ** 2).sum(axis=1)
+
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector)
+        cosines = vectors @ query_vector / np.maximum(norms, 1e-12)
+        if metric == "cosine":
+            return 1.0 - cosines
+        if metric in ("angular", "euclidean"):
+            # Annoy normalizes the vectors, so both are sqrt(2 - 2 cos(a, b))
+            return np.sqrt(np.maximum(2.0 - 2.0 * cosines, 0.0))
+        if metric == "dot":
+            # The inner product of the normalized vectors, as Annoy measures it
+            return cosines
+        raise ValueError(f"Exact rescoring does not support the {metric} metric.")
@@ -0,0 +1,62 @@
+import re
+import time
+from typing import List, Set
+
+import numpy as np
+
+from gptcache.rerank.base import BaseReranker
+from gptcache.rerank.text_store import TextStore
+from gptcache.utils import normalize_text
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _tokens(text: str) -> Set[str]:
+    return set(_TOKEN.findall(normalize_text(text, "casefold")))
+
+
+class LexicalReranker(BaseReranker):
+    """
+    Checks that a candidate shares enough words with the query, catching near
+    neighbours that are semantically close but ask for something different, e.g. the
+    same question about a different product or number.
+
+    The overlap is the Jaccard index of the two sets of casefolded words. Candidates
+    whose text is unknown are left as they are.
+
+    Parameters:
+    - texts (TextStore): The contexts the entries were added with.
+    - weight (float): Weight of the overlap in the score; the rest is the similarity.
+    - min_overlap (float): Candidates with a lower overlap are rejected.
+    """
+
+    def __init__(self, texts: TextStore, weight: float = 0.5, min_overlap: float = 0.0):
+        self.texts = texts
+        self.weight = weight
+        self.min_overlap = min_overlap
+
+    def rerank(
+        self, query: str, query_vector: np.ndarray, candidates: List[dict], deadline: float
+    ) -> List[dict]:
+        query_tokens = _tokens(query)
+        rescored = []
+        for i, candidate in enumerate(candidates):
+            if time.monotonic() >= deadline:
+                rescored.extend(candidates[i:])
+                break
+            text = self.texts.get(candidate["id"])
+            if text is None:
+                rescored.append(candidate)
+                continue
+
+            tokens = _tokens(text)
+            union = len(query_tokens | tokens)
+            overlap = len(query_tokens & tokens) / union if union else 1.0
+            if overlap < self.min_overlap:
+                continue
+            score = (1 - self.weight) * candidate["similarity"] + self.weight * overlap
+            rescored.append({**candidate, "score": score})
+        return sorted(rescored, key=lambda c: c["score"], reverse=True)
+
+    def forget(self, ids: List[int]):
+        self.texts.remove(ids)
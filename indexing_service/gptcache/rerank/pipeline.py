@@ -0,0 +1,175 @@
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from gptcache.embedding_storage import BaseEmbeddingStorage
+from gptcache.rerank.base import BaseReranker
+from gptcache.rerank.text_store import TextStore
+from gptcache.utils.metrics import STAGE_SECONDS
+
+_RERANK_SECONDS = STAGE_SECONDS.labels("rerank")
+
+
+class RerankStats:
+    """
+    Running counters for the two query stages.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.candidate_time = 0.0
+        self.reranked = 0
+        self.rerank_time = 0.0
+        self.skipped = 0  # Not reranked because the candidate stage overran its budget
+        self.truncated = 0  # Reranking stopped at its deadline
+
+    def record(
+        self,
+        queries: int,
+        candidate_time: float,
+        reranked: int = 0,
+        rerank_time: float = 0.0,
+        skipped: int = 0,
+        truncated: int = 0,
+    ):
+        with self._lock:
+            self.queries += queries
+            self.candidate_time += candidate_time
+            self.reranked += reranked
+            self.rerank_time += rerank_time
+            self.skipped += skipped
+            self.truncated += truncated
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "avg_candidate_ms": (
+                    self.candidate_time / self.queries * 1000 if self.queries else 0.0
+                ),
+                "reranked": self.reranked,
+                "avg_rerank_ms": (
+                    self.rerank_time / self.reranked * 1000 if self.reranked else 0.0
+                ),
+                "skipped_over_budget": self.skipped,
+                "truncated_at_deadline": self.truncated,
+            }
+
+
+class RerankingSearch:
+    """
+    Two-stage query: a fast top-k candidate search in the index, then an optional
+    reranker over the candidates.
+
+    Each stage has a latency budget. The index search cannot be interrupted, so if it
+    overran its budget the candidates are returned without reranking. The reranker is
+    given a deadline and leaves the candidates it has not reached by then as they are.
+    Either way a slow stage degrades the ranking instead of the response time.
+
+    Candidates are dicts with the 'id', 'distance' and cosine 'similarity' of the
+    entry and a 'score', higher is better, sorted best first.
+
+    Parameters:
+    - storage (BaseEmbeddingStorage): The index to search.
+    - reranker (BaseReranker, optional): The second stage. Without it the candidates
+    are ranked by the index alone.
+    - k (int): Number of candidates fetched from the index per query.
+    - candidate_budget_ms (float, optional): Latency budget of the index search.
+    - rerank_budget_ms (float, optional): Latency budget of the reranker per query.
+    - texts (TextStore, optional): Where the contexts of added entries are kept, for
+    rerankers that compare texts.
+    """
+
+    def __init__(
+        self,
+        storage: BaseEmbeddingStorage,
+        reranker: Optional[BaseReranker] = None,
+        k: int = 10,
+        candidate_budget_ms: Optional[float] = None,
+        rerank_budget_ms: Optional[float] = None,
+        texts: Optional[TextStore] = None,
+    ):
+        if k < 1:
+            raise ValueError("k must be at least 1.")
+        self.storage = storage
+        self.reranker = reranker
+        self.k = k
+        self.candidate_budget = candidate_budget_ms / 1000 if candidate_budget_ms else None
+        self.rerank_budget = rerank_budget_ms / 1000 if rerank_budget_ms else None
+        self.texts = texts
+        self.stats = RerankStats()
+
+    def remember(self, ids: Sequence[int], contexts: Sequence[str]):
+        """
+        Records the contexts of added entries for text-based rerankers.
+        """
+        if self.texts is not None:
+            for item_id, context in zip(ids, contexts):
+                self.texts.add(item_id, context)
+
+    def forget(self, ids: Sequence[int]):
+        if self.texts is not None:
+            self.texts.remove(ids)
+        if self.reranker is not None:
+            self.reranker.forget(list(ids))
+
+    def search(self, query: str, query_vector) -> List[dict]:
+        return self.search_batch([query], [query_vector])[0]
+
+    def search_batch(self, queries: Sequence[str], query_vectors) -> List[List[dict]]:
+        """
+        Returns the ranked candidates of each query.
+        """
+        started = time.monotonic()
+        neighbours = self.storage.get_nns_by_vectors(query_vectors, n=self.k)
+        candidate_time = time.monotonic() - started
+
+        results = []
+        for ids, distances in neighbours:
+            candidates = []
+            for item_id, distance in zip(ids, distances):
+                similarity = self.storage.similarity(distance)
+                candidates.append(
+                    {
+                        "id": item_id,
+                        "distance": distance,
+                        "similarity": similarity,
+                        "score": similarity,
+                    }
+                )
+            results.append(candidates)
+
+        if self.reranker is None:
+            self.stats.record(len(results), candidate_time)
+            return results
+        if (
+            self.candidate_budget is not None
+            and candidate_time > self.candidate_budget * len(results)
+        ):
+            self.stats.record(len(results), candidate_time, skipped=len(results))
+            return results
+
+        started = time.monotonic()
+        truncated = 0
+        for i, (query, query_vector) in enumerate(zip(queries, query_vectors)):
+            if not results[i]:
+                continue
+            deadline = (
+                time.monotonic() + self.rerank_budget
+                if self.rerank_budget is not None
+                else float("inf")
+            )
+            results[i] = self.reranker.rerank(query, query_vector, results[i], deadline)
+            if time.monotonic() > deadline:
+                truncated += 1
+        rerank_time = time.monotonic() - started
+        _RERANK_SECONDS.observe(rerank_time)
+        self.stats.record(
+            len(results),
+            candidate_time,
+            reranked=len(results),
+            rerank_time=rerank_time,
+            truncated=truncated,
+        )
+        return results
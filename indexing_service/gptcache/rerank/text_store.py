@@ -0,0 +1,36 @@
+from collections import OrderedDict
+import threading
+from typing import List, Optional
+
+
+class TextStore:
+    """
+    Bounded map of entry ID to the context it was added with, for rerankers that compare
+    texts rather than vectors. The least recently added texts are dropped first.
+
+    Texts are only held in memory; entries restored from a snapshot have no text until
+    they are added again, and rerankers leave such candidates unscored.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._texts: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, item_id: int, text: str):
+        with self._lock:
+            self._texts[item_id] = text
+            self._texts.move_to_end(item_id)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+
+    def get(self, item_id: int) -> Optional[str]:
+        return self._texts.get(item_id)
+
+    def remove(self, item_ids: List[int]):
+        with self._lock:
+            for item_id in item_ids:
+                self._texts.pop(int(item_id), None)
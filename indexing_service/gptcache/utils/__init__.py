@@ -0,0 +1,2 @@
+from .text import normalize_text
+from .metrics import REGISTRY
@@ -0,0 +1,94 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """
+    A reader/writer lock: any number of readers, or a single writer.
+
+    Writers are preferred. Once a writer is waiting, new readers queue behind it, so a
+    writer waits at most for the reads already running rather than for a stream of
+    new ones, and readers wait at most for one write.
+
+    Both sides are reentrant, so methods holding the lock can call each other. A thread
+    holding the write lock may also take the read lock. The opposite, upgrading a read
+    lock to a write lock, would deadlock two readers upgrading at once, and raises
+    RuntimeError instead.
+
+    Used as a context manager, the lock is taken for writing, so it can replace a
+    `threading.RLock` whose callers expect exclusive access.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._write_depth = 0
+        self._waiting_writers = 0
+        # Read holds of the current thread, so its nested reads never queue
+        self._local = threading.local()
+
+    def acquire_read(self):
+        depth = getattr(self._local, "depth", 0)
+        with self._cond:
+            if not depth and self._writer != threading.get_ident():
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers += 1
+        self._local.depth = depth + 1
+
+    def release_read(self):
+        self._local.depth -= 1
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if getattr(self._local, "depth", 0):
+                raise RuntimeError("A read lock cannot be upgraded to a write lock.")
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            if self._writer != threading.get_ident():
+                raise RuntimeError("The write lock is not held by this thread.")
+            self._write_depth -= 1
+            if self._write_depth == 0:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release_write()
@@ -0,0 +1,25 @@
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+
+NORMALIZATIONS = ("exact", "whitespace", "casefold")
+
+
+def normalize_text(text: str, mode: str = "whitespace") -> str:
+    """
+    Canonicalises text so that trivially different prompts share one cache key.
+
+    Modes:
+    - exact: the text is used as is.
+    - whitespace: leading/trailing whitespace is stripped and inner runs collapsed.
+    - casefold: as whitespace, and the text is also case folded. Only safe for
+    uncased models such as all-MiniLM-L6-v2, whose tokenizer lowercases anyway.
+    """
+    if mode == "exact":
+        return text
+    if mode not in NORMALIZATIONS:
+        raise ValueError(f"Unknown normalization mode: {mode}")
+    text = _WHITESPACE.sub(" ", text).strip()
+    if mode == "casefold":
+        text = text.casefold()
+    return text
@@ -0,0 +1,89 @@
+"""
+Exports a sentence-transformers model to ONNX for the onnx embedding backend.
+
+Writes model.onnx, model_quantized.onnx (int8 dynamic quantization, with --quantize)
+and tokenizer.json to the output directory, then checks the exported vectors against
+the original model's. Needs the full requirements.txt (PyTorch) plus onnxruntime; the
+service running the exported model only needs requirements-onnx.txt.
+
+Usage:
+    python scripts/export_onnx.py --model all-MiniLM-L6-v2 \
+        --output models/all-MiniLM-L6-v2-onnx --quantize
+"""
+import argparse
+import os
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from gptcache.embedding import OnnxEmbedding
+
+
+SAMPLE_TEXTS = [
+    "What is the capital of France?",
+    "Explain the difference between a process and a thread in a few sentences.",
+    "hi",
+    "Write a haiku about caching " * 40,  # Longer than the maximum sequence length
+]
+
+
+def export(model_name: str, output: str):
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    os.makedirs(output, exist_ok=True)
+    tokenizer.backend_tokenizer.save(os.path.join(output, "tokenizer.json"))
+
+    inputs = tokenizer(["an example"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in inputs]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(inputs[name] for name in names),
+            os.path.join(output, "model.onnx"),
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    return model
+
+
+def quantize(output: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(
+        os.path.join(output, "model.onnx"),
+        os.path.join(output, "model_quantized.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+
+
+def check(model: SentenceTransformer, output: str, model_file: str):
+    expected = model.encode(SAMPLE_TEXTS, normalize_embeddings=True)
+    actual = OnnxEmbedding(
+        output, model_file=model_file, max_length=model.max_seq_length
+    ).to_embeddings(SAMPLE_TEXTS)
+    cosines = np.sum(expected * actual, axis=1)
+    print(f"{model_file}: minimum cosine similarity to the original {cosines.min():.6f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--output", default="models/all-MiniLM-L6-v2-onnx")
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8 model")
+    args = parser.parse_args()
+
+    model = export(args.model, args.output)
+    check(model, args.output, "model.onnx")
+    if args.quantize:
+        quantize(args.output)
+        check(model, args.output, "model_quantized.onnx")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ from app.handlers.faiss_handler import FaissHandler
 
 from gptcache.embedding_storage import FaissEmbeddingStorage
 from gptcache.embedding import SentenceEmbedding
+from gptcache.rerank import ExactReranker, RerankingSearch
 
 
 def test_handle_add_integration():
@@ -102,3 +103,52 @@ def test_query_closest_match(setup_faiss_index):
 
     assert response["id"] == 1
     assert response["distance"] < 0.3
+
+
+def test_batch_add_and_query():
+    faiss = FaissEmbeddingStorage(dimension=384)
+    embedding = SentenceEmbedding(model_name="all-MiniLM-L6-v2")
+    handler = FaissHandler(embedding, faiss)
+
+    responses = handler.handle_add_batch(
+        [1, 2], ["Today is a sunny day.", "I love reading books about science."]
+    )
+    assert responses == [{"status": "success", "message": None}] * 2
+
+    results = handler.handle_query_batch(
+        ["I love reading books about science.", "Culinary skills are an art."], 0.01
+    )
+    assert results[0]["id"] == 2
+    assert results[1] == {"id": None, "distance": None, "similarity": None}
+
+
+def test_query_with_similarity_threshold(setup_faiss_index):
+    faiss, embedding = setup_faiss_index
+
+    handler = FaissHandler(embedding, faiss)
+
+    context = "The quick brown fox jumps over the dog who is lazy"
+
+    response = handler.handle_query(context, 0.0, similarity_threshold=0.8)
+    assert response["id"] == 1
+    assert response["similarity"] >= 0.8
+
+    response = handler.handle_query(context, 1.0, similarity_threshold=0.9999)
+    assert response["id"] is None
+
+
+def test_query_returns_reranked_candidates(setup_faiss_index):
+    faiss, embedding = setup_faiss_index
+
+    handler = FaissHandler(
+        embedding, faiss, RerankingSearch(faiss, reranker=ExactReranker(faiss), k=3)
+    )
+
+    response = handler.handle_query(
+        "Mathematics is the language of the universe.", 0.01, return_candidates=True
+    )
+
+    assert response["id"] == 5
+    assert len(response["candidates"]) == 3
+    assert response["candidates"][1]["id"] == 6
+    assert response["candidates"][0]["score"] >= response["candidates"][1]["score"]
@@ -0,0 +1,25 @@
+import pytest
+
+from gptcache.embedding import HashEmbedding
+from gptcache.embedding_storage import AnnoyEmbeddingStorage
+
+from app.handlers.annoy_handler import AnnoyHandler
+
+TEXTS = ["How do I sort a list?", "What is a monad?", "Where is the train station?"]
+
+
+@pytest.mark.parametrize("metric", ["angular", "euclidean", "dot"])
+@pytest.mark.parametrize("built", [False, True])
+def test_distance_thresholds_keep_close_neighbours(metric, built):
+    storage = AnnoyEmbeddingStorage(64, metric=metric, rebuild_threshold=None)
+    handler = AnnoyHandler(HashEmbedding(dimension=64), storage)
+    handler.handle_add_batch([1, 2, 3], TEXTS)
+    if built:
+        storage.build_index(num_trees=5)
+    # A tight threshold: at most a distance of 0.1, or an inner product of at least 0.9
+    threshold = 0.9 if metric == "dot" else 0.1
+
+    assert handler.handle_query(TEXTS[1], threshold)["id"] == 2
+    assert handler.handle_query("Totally unrelated words here", threshold)["id"] is None
+    results = handler.handle_query_batch([TEXTS[0], "Nothing alike at all"], threshold)
+    assert [result["id"] for result in results] == [1, None]
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.handlers.async_handler import AsyncHandler, HandlerSaturatedError
+
+
+class BlockingHandler:
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def handle_add(self, id: int, context: str) -> dict:
+        self.release.wait(timeout=5)
+        self.calls.append(("add", id, context))
+        return {"status": "success", "message": None}
+
+    def handle_query(self, context: str, distance_threshold: float) -> dict:
+        self.release.wait(timeout=5)
+        self.calls.append(("query", context, distance_threshold))
+        return {"id": 1, "distance": 0.0}
+
+
+def test_calls_are_forwarded_to_handler():
+    inner = BlockingHandler()
+    inner.release.set()
+    handler = AsyncHandler(inner, max_workers=2, max_pending=2)
+
+    async def run():
+        add = await handler.handle_add(1, "hello")
+        query = await handler.handle_query("hello", 0.2)
+        return add, query
+
+    add, query = asyncio.run(run())
+    handler.shutdown()
+
+    assert add == {"status": "success", "message": None}
+    assert query == {"id": 1, "distance": 0.0}
+    assert inner.calls == [("add", 1, "hello"), ("query", "hello", 0.2)]
+
+
+def test_event_loop_is_not_blocked():
+    inner = BlockingHandler()
+    handler = AsyncHandler(inner, max_workers=1, max_pending=1)
+
+    async def run():
+        task = asyncio.ensure_future(handler.handle_query("slow", 0.2))
+        # The loop keeps serving other coroutines while the query is blocked
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        inner.release.set()
+        return await task
+
+    assert asyncio.run(run()) == {"id": 1, "distance": 0.0}
+    handler.shutdown()
+
+
+def test_rejects_requests_when_saturated():
+    inner = BlockingHandler()
+    handler = AsyncHandler(inner, max_workers=1, max_pending=2)
+
+    async def run():
+        tasks = [
+            asyncio.ensure_future(handler.handle_query(str(i), 0.2)) for i in range(2)
+        ]
+        await asyncio.sleep(0.01)
+        assert handler.pending == 2
+        with pytest.raises(HandlerSaturatedError):
+            await handler.handle_query("rejected", 0.2)
+        inner.release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    handler.shutdown()
+
+    assert handler.pending == 0
+    assert ("query", "rejected", 0.2) not in inner.calls
+
+
+def test_max_pending_must_cover_workers():
+    with pytest.raises(ValueError):
+        AsyncHandler(BlockingHandler(), max_workers=4, max_pending=2)
+
+
+def test_batch_calls_are_forwarded_to_handler():
+    class BatchHandler:
+        def handle_add_batch(self, ids, contexts, ttl_seconds=None):
+            return [{"status": "success", "message": None} for _ in ids]
+
+        def handle_query_batch(self, contexts, distance_threshold):
+            return [{"id": None, "distance": None} for _ in contexts]
+
+    handler = AsyncHandler(BatchHandler(), max_workers=1, max_pending=1)
+
+    async def run():
+        added = await handler.handle_add_batch([1, 2], ["a", "b"], ttl_seconds=[None, 5])
+        queried = await handler.handle_query_batch(["a"], 0.2)
+        return added, queried
+
+    added, queried = asyncio.run(run())
+    handler.shutdown()
+
+    assert len(added) == 2 and queried == [{"id": None, "distance": None}]
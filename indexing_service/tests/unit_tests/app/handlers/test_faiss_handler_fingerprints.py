@@ -0,0 +1,150 @@
+import pytest
+
+from gptcache.embedding import BaseEmbedding, HashEmbedding
+from gptcache.embedding_storage import FaissEmbeddingStorage
+from gptcache.fingerprint import FingerprintTable, FingerprintTier, SimHashIndex
+
+from app.handlers.faiss_handler import FaissHandler
+
+
+class CountingEmbedding(BaseEmbedding):
+    def __init__(self):
+        self.embedding = HashEmbedding(dimension=64)
+        self.texts = 0
+
+    def to_embedding(self, text):
+        self.texts += 1
+        return self.embedding.to_embedding(text)
+
+    def to_embeddings(self, texts):
+        self.texts += len(texts)
+        return self.embedding.to_embeddings(texts)
+
+
+def handler_with_fingerprints():
+    embedding = CountingEmbedding()
+    storage = FaissEmbeddingStorage(64)
+    handler = FaissHandler(embedding, storage, fingerprints=FingerprintTier(FingerprintTable()))
+    handler.handle_add_batch([1, 2], ["How do I sort a list?", "What is a monad?"])
+    embedding.texts = 0
+    return handler, embedding
+
+
+def test_repeated_texts_skip_the_model_and_the_index():
+    handler, embedding = handler_with_fingerprints()
+
+    result = handler.handle_query(" How do I sort a  list?", 0.1, similarity_threshold=0.99)
+
+    assert result == {"id": 1, "distance": 0.0, "similarity": 1.0}
+    assert embedding.texts == 0
+    assert handler.fingerprints.stats.snapshot()["exact_hits"] == 1
+
+
+def test_other_texts_are_searched():
+    handler, embedding = handler_with_fingerprints()
+
+    result = handler.handle_query("How do I sort a list quickly?", 10.0)
+
+    assert result["id"] == 1
+    assert embedding.texts == 1
+
+
+def test_batches_only_encode_texts_without_fingerprint():
+    handler, embedding = handler_with_fingerprints()
+
+    results = handler.handle_query_batch(
+        ["What is a monad?", "What is a monad exactly?", "How do I sort a list?"], 10.0
+    )
+
+    assert [r["id"] for r in results] == [2, 2, 1]
+    assert embedding.texts == 1
+
+
+
+def handler_with_near_fingerprints():
+    handler, embedding = handler_with_fingerprints()
+    handler.fingerprints = FingerprintTier(FingerprintTable(), SimHashIndex(max_distance=8))
+    handler.fingerprints.add([1, 2], ["How do I sort a list?", "What is a monad?"])
+    return handler, embedding
+
+
+def test_near_matches_are_measured_and_thresholded():
+    handler, embedding = handler_with_near_fingerprints()
+    near = "how do i sort a list, please?"
+    vector = embedding.embedding.to_embedding(near)
+    expected = float(((handler.a.get_vectors([1])[0] - vector) ** 2).sum())
+
+    served = handler.handle_query(near, expected + 0.01)
+    rejected = handler.handle_query(near, expected / 2)
+
+    # Only the near match within the threshold counts as a hit of the tier
+    stats = handler.fingerprints.stats.snapshot()
+    assert stats["near_hits"] == 1 and stats["lookups"] == 2
+    assert served["id"] == 1
+    assert served["distance"] == pytest.approx(expected, rel=1e-4) and expected > 0
+    assert rejected["id"] is None
+
+
+def test_batches_measure_near_matches():
+    handler, _ = handler_with_near_fingerprints()
+
+    results = handler.handle_query_batch(
+        ["how do i sort a list, please?", "How do I sort a list?", "What is a monad?"],
+        10.0,
+        similarity_threshold=0.0,
+    )
+
+    assert [r["id"] for r in results] == [1, 1, 2]
+    assert results[0]["similarity"] < 1.0
+    assert results[1]["similarity"] == 1.0
+
+def test_removed_and_expired_entries_are_not_served():
+    handler, _ = handler_with_fingerprints()
+    handler.handle_remove([1])
+    # Removed behind the handler's back, as the TTL sweeper does
+    handler.a.remove_ids([2])
+
+    assert handler.handle_query("How do I sort a list?", 0.0)["id"] is None
+    assert handler.handle_query("What is a monad?", 0.0)["id"] is None
+    assert len(handler.fingerprints.table) == 0
+
+
+def test_candidates_bypass_the_fingerprint_tier():
+    handler, embedding = handler_with_fingerprints()
+
+    result = handler.handle_query("What is a monad?", 0.1, return_candidates=True)
+
+    assert result["id"] == 2 and result["candidates"]
+    assert embedding.texts == 1
+
+
+def test_precomputed_vectors_are_searched_for_texts_without_fingerprint():
+    handler, embedding = handler_with_fingerprints()
+    vectors = embedding.embedding.to_embeddings(["What is a monad?", "unused", "probe"])
+    vectors[1] = vectors[2] = embedding.embedding.to_embedding("How do I sort a list?")
+
+    results = handler.handle_query_batch(
+        ["What is a monad?", "", "probe text"], 1e-6, vectors=vectors
+    )
+
+    assert [r["id"] for r in results] == [2, 1, 1]
+    assert embedding.texts == 0
+    assert handler.fingerprints.stats.snapshot()["lookups"] == 2
+
+
+def test_scan_pages_through_entries_in_id_order():
+    storage = FaissEmbeddingStorage(64)
+    handler = FaissHandler(HashEmbedding(dimension=64), storage)
+    handler.handle_add_batch(
+        [9, 2, 5, 7], ["a", "b", "c", "d"], ttl_seconds=[None, 60.0, None, None]
+    )
+
+    first = handler.handle_scan(-1, 2)
+    second = handler.handle_scan(first["ids"][-1], 10)
+
+    assert first["ids"] == [2, 5]
+    assert first["ttl_seconds"][0] == pytest.approx(60.0, abs=5)
+    assert first["ttl_seconds"][1] is None
+    assert second["ids"] == [7, 9]
+    assert second["vectors"].shape == (2, 64)
+    assert handler.handle_scan(9, 10)["ids"] == []
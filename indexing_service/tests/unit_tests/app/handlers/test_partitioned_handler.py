@@ -0,0 +1,148 @@
+import threading
+
+from app.handlers.partitioned_handler import (
+    Partition,
+    PartitionedHandler,
+    partition_dirname,
+)
+
+
+class FakeStorage:
+    def __init__(self):
+        self.items = {}
+        self.evictions = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def drain_evictions(self, limit=None):
+        drained = self.evictions[:limit]
+        del self.evictions[: len(drained)]
+        return drained
+
+
+class FakeHandler:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def handle_add(self, id, context, ttl_seconds=None):
+        self.storage.items[id] = context
+        return {"status": "success", "message": None}
+
+    def handle_query(self, context, distance_threshold):
+        for id, text in self.storage.items.items():
+            if text == context:
+                return {"id": id, "distance": 0.0}
+        return {"id": None, "distance": None}
+
+    def handle_remove(self, ids):
+        removed = [i for i in ids if self.storage.items.pop(i, None) is not None]
+        return {"status": "success", "removed": len(removed)}
+
+
+class FakePartition(Partition):
+    def __init__(self, name):
+        storage = FakeStorage()
+        super().__init__(name, FakeHandler(storage), storage)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_handler(**kwargs):
+    built = []
+
+    def factory(name):
+        built.append(name)
+        return FakePartition(name)
+
+    return PartitionedHandler(factory, **kwargs), built
+
+
+def test_namespaces_are_isolated():
+    handler, built = make_handler()
+
+    handler.handle_add(1, "hello", namespace="model-a")
+    handler.handle_add(2, "hello", namespace="model-b")
+
+    assert handler.handle_query("hello", 0.2, namespace="model-a")["id"] == 1
+    assert handler.handle_query("hello", 0.2, namespace="model-b")["id"] == 2
+    assert handler.handle_query("hello", 0.2)["id"] is None
+    assert handler.handle_remove([1], namespace="model-b")["removed"] == 0
+    assert built == ["model-a", "model-b", "default"]
+
+
+def test_partitions_are_created_once():
+    handler, built = make_handler()
+    barrier = threading.Barrier(8)
+
+    def add(i):
+        barrier.wait()
+        handler.handle_add(i, str(i), namespace="shared")
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert built == ["shared"]
+    assert len(handler.partitions["shared"].storage) == 8
+
+
+def test_idle_partitions_are_unloaded_and_reloaded():
+    handler, built = make_handler(idle_seconds=60)
+    handler.handle_add(1, "hello", namespace="tenant")
+    handler.handle_add(2, "hello")
+    tenant = handler.partitions["tenant"]
+    tenant.storage.evictions = [7]
+
+    assert handler.unload_idle(now=tenant.last_used + 30) == []
+    # The default partition is never unloaded
+    assert handler.unload_idle(now=tenant.last_used + 120) == ["tenant"]
+    assert tenant.closed
+    assert set(handler.partitions) == {"default"}
+    # Evictions of unloaded partitions are still reported
+    assert handler.drain_evictions() == [7]
+
+    handler.handle_query("hello", 0.2, namespace="tenant")
+    assert built == ["tenant", "default", "tenant"]
+
+
+def test_partitions_in_use_are_not_unloaded():
+    handler, _ = make_handler(idle_seconds=0)
+
+    with handler.partition("busy") as partition:
+        assert handler.unload_idle() == []
+    assert handler.unload_idle() == ["busy"]
+    assert partition.closed
+
+
+def test_max_loaded_unloads_least_recently_used():
+    handler, _ = make_handler(max_loaded=2)
+    handler.handle_add(1, "a", namespace="a")
+    handler.handle_add(2, "b", namespace="b")
+    handler.handle_query("a", 0.2, namespace="a")
+    handler.handle_add(3, "c", namespace="c")
+
+    assert set(handler.partitions) == {"a", "c"}
+    assert handler.unloaded == 1
+
+
+def test_stop_closes_every_partition():
+    handler, _ = make_handler(idle_seconds=60)
+    handler.start(preload=["default"])
+    handler.handle_add(1, "hello", namespace="tenant")
+    partitions = handler.partitions
+
+    handler.stop()
+
+    assert all(p.closed for p in partitions.values())
+
+
+def test_partition_dirname():
+    assert partition_dirname("gpt-4o_v1.2") == "gpt-4o_v1.2"
+    assert partition_dirname("..").startswith("ns-")
+    assert partition_dirname("key/../../etc").startswith("ns-")
+    assert partition_dirname("a" * 65) != partition_dirname("a" * 66)
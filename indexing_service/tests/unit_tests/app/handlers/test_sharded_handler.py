@@ -0,0 +1,227 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from gptcache.embedding import HashEmbedding
+from gptcache.embedding_storage import FaissEmbeddingStorage
+
+from app.handlers.async_handler import AsyncHandler
+from app.handlers.faiss_handler import FaissHandler
+from app.handlers.partitioned_handler import Partition, PartitionedHandler
+from app.handlers.sharded_handler import ShardedHandler, ShardsUnavailableError
+from app.sharding import ClusterPlacement, HashPlacement
+from app.sharding.local import LocalShards
+from app.transport import BinaryServer
+
+EMBEDDING = HashEmbedding(dimension=32)
+TEXTS = [f"question {i} about topic {i % 5}" for i in range(60)]
+
+
+class Shard:
+    """
+    Runs a standalone shard's binary server on an event loop in a thread.
+    """
+
+    def __init__(self, socket_path):
+        self.partitions = PartitionedHandler(
+            lambda name: Partition(
+                name, FaissHandler(EMBEDDING, FaissEmbeddingStorage(32)), None
+            )
+        )
+        self.delay = 0.0
+        self.executor = AsyncHandler(self, max_workers=2, max_pending=8)
+        self.server = BinaryServer(self.executor, lambda: True, socket_path=socket_path)
+        self.address = f"unix:{socket_path}"
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(10)
+
+    def __getattr__(self, name):
+        # Handler methods of the partitions, slowed down by `delay`
+        method = getattr(self.partitions, name)
+
+        def delayed(*args, **kwargs):
+            time.sleep(self.delay)
+            return method(*args, **kwargs)
+
+        return delayed
+
+    def __len__(self):
+        return sum(len(p.handler.a) for p in self.partitions.partitions.values())
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+@pytest.fixture
+def shards(tmp_path):
+    started = [Shard(str(tmp_path / f"shard-{i}.sock")) for i in range(3)]
+    yield started
+    for shard in started:
+        shard.close()
+
+
+def sharded(shards, timeout_seconds=1.0):
+    placement = HashPlacement([shard.address for shard in shards])
+    return ShardedHandler(EMBEDDING, placement, timeout_seconds=timeout_seconds)
+
+
+def found(handler, namespace=None):
+    results = handler.handle_query_batch(TEXTS, 0.01, namespace=namespace)
+    return sum(result["id"] == i for i, result in enumerate(results))
+
+
+def test_entries_are_spread_over_the_shards_and_found(shards):
+    handler = sharded(shards[:2])
+
+    results = handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+
+    assert {r["status"] for r in results} == {"success"}
+    assert len(shards[0]) + len(shards[1]) == len(TEXTS)
+    assert min(len(shards[0]), len(shards[1])) > 10
+    assert found(handler) == len(TEXTS)
+    assert handler.handle_query(TEXTS[3], 0.01)["id"] == 3
+    handler.shutdown()
+
+
+def test_removals_are_routed_to_the_owner(shards):
+    handler = sharded(shards[:2])
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+
+    assert handler.handle_remove([0, 1, 2, 1000]) == {"status": "success", "removed": 3}
+    assert len(shards[0]) + len(shards[1]) == len(TEXTS) - 3
+    assert handler.handle_query(TEXTS[1], 0.01)["id"] is None
+    handler.shutdown()
+
+
+def test_a_slow_shard_only_costs_its_own_matches(shards):
+    handler = sharded(shards[:2], timeout_seconds=0.2)
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+    shards[1].delay = 1.0
+
+    started = time.monotonic()
+    hits = found(handler)
+
+    assert time.monotonic() - started < 0.9
+    assert hits == len(shards[0])
+    assert handler.snapshot()["shards"][shards[1].address]["timeouts"] >= 1
+    handler.shutdown()
+
+
+def test_a_query_fails_when_no_shard_answers(shards):
+    handler = sharded(shards[:1], timeout_seconds=0.2)
+    shards[0].delay = 1.0
+
+    with pytest.raises(ShardsUnavailableError):
+        handler.handle_query(TEXTS[0], 0.01)
+    handler.shutdown()
+
+
+def test_resharding_to_more_shards_keeps_every_entry(shards):
+    handler = sharded(shards[:2])
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+    handler.handle_add_batch([100, 101], TEXTS[:2], namespace="tenant")
+
+    status = handler.reshard(HashPlacement([shard.address for shard in shards]))
+
+    assert status["state"] == "done"
+    assert 0 < status["moved"] < len(TEXTS)
+    assert sum(len(shard) for shard in shards) == len(TEXTS) + 2
+    assert len(shards[2]) == status["moved"]
+    assert found(handler) == len(TEXTS)
+    assert handler.handle_query(TEXTS[0], 0.01, namespace="tenant")["id"] == 100
+    assert handler.snapshot()["draining"] == []
+    handler.shutdown()
+
+
+def test_entries_removed_during_a_reshard_stay_removed(shards):
+    handler = sharded(shards[:2])
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+    placement = HashPlacement([shard.address for shard in shards])
+    owners = placement.owners
+    removed = []
+
+    def remove_while_moving(ids, vectors):
+        # Removes the scanned entries after the scan but before they are copied
+        if vectors is not None and not removed:
+            removed.extend(ids)
+            handler.handle_remove(list(ids))
+        return owners(ids, vectors)
+
+    placement.owners = remove_while_moving
+    handler.reshard(placement, batch_size=len(TEXTS))
+
+    assert removed
+    assert sum(len(shard) for shard in shards) == len(TEXTS) - len(removed)
+    results = handler.handle_query_batch([TEXTS[i] for i in removed], 0.01)
+    assert {result["id"] for result in results} == {None}
+    handler.shutdown()
+
+
+def test_reshard_waits_for_removals_routed_before_it(shards):
+    handler = sharded(shards[:2])
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+    fan_out = handler._fan_out
+    routed, release = threading.Event(), threading.Event()
+
+    def slow(op, calls):
+        # Holds the first removal after it is routed but before it reaches the shards
+        if op == "remove" and not routed.is_set():
+            routed.set()
+            release.wait(timeout=10)
+        return fan_out(op, calls)
+
+    handler._fan_out = slow
+    remover = threading.Thread(target=handler.handle_remove, args=(list(range(0, 60, 3)),))
+    remover.start()
+    assert routed.wait(timeout=5)
+    placement = HashPlacement([shard.address for shard in shards])
+    resharder = threading.Thread(target=handler.reshard, args=(placement,))
+    resharder.start()
+
+    # No entry is scanned until the removal has landed
+    resharder.join(timeout=0.5)
+    assert resharder.is_alive()
+    release.set()
+    remover.join()
+    resharder.join()
+
+    assert sum(len(shard) for shard in shards) == len(TEXTS) - 20
+    results = handler.handle_query_batch(TEXTS[0::3], 0.01)
+    assert {result["id"] for result in results} == {None}
+    handler.shutdown()
+
+
+def test_resharding_to_a_cluster_placement(shards):
+    handler = sharded(shards)
+    handler.handle_add_batch(list(range(len(TEXTS))), TEXTS)
+    addresses = [shard.address for shard in shards]
+
+    placement = ClusterPlacement.fit(addresses, handler.sample_vectors(len(TEXTS)), probe=3)
+    handler.reshard(placement)
+
+    assert sum(len(shard) for shard in shards) == len(TEXTS)
+    assert found(handler) == len(TEXTS)
+    # Entries are now where their placement says, so removals reach them
+    assert handler.handle_remove([5])["removed"] == 1
+    handler.shutdown()
+
+
+def test_shards_run_as_local_processes(tmp_path):
+    with LocalShards(str(tmp_path)) as local:
+        # The shards' hash backend
+        embedding = HashEmbedding(dimension=384)
+        handler = ShardedHandler(embedding, HashPlacement(local.start(2)))
+        handler.handle_add_batch(list(range(len(TEXTS))), TEXTS, ttl_seconds=[60.0] * len(TEXTS))
+
+        assert found(handler) == len(TEXTS)
+        status = handler.reshard(HashPlacement(local.addresses + local.start(1)))
+        assert status["moved"] > 0
+        assert found(handler) == len(TEXTS)
+        handler.shutdown()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from app.sharding import ClusterPlacement, HashPlacement
+
+SHARDS = ["unix:/run/shard-0.sock", "unix:/run/shard-1.sock", "unix:/run/shard-2.sock"]
+
+
+def test_hash_placement_is_balanced():
+    owners = HashPlacement(SHARDS).owners(np.arange(30000))
+
+    counts = np.bincount(owners, minlength=3)
+    assert counts.min() > 9000
+
+
+def test_adding_a_shard_only_moves_entries_to_it():
+    ids = np.arange(20000)
+    before = HashPlacement(SHARDS).owners(ids)
+    after = HashPlacement(SHARDS + ["unix:/run/shard-3.sock"]).owners(ids)
+
+    moved = before != after
+    assert (after[moved] == 3).all()
+    assert 0.2 < moved.mean() < 0.3
+
+
+def test_shards_must_be_distinct_and_present():
+    with pytest.raises(ValueError):
+        HashPlacement([])
+    with pytest.raises(ValueError):
+        HashPlacement(SHARDS[:1] * 2)
+
+
+def test_cluster_placement_owns_by_nearest_centroid():
+    rng = np.random.default_rng(0)
+    centers = np.eye(3, 8, dtype="float32") * 10
+    vectors = np.concatenate([c + rng.normal(size=(100, 8)).astype("float32") for c in centers])
+
+    placement = ClusterPlacement.fit(SHARDS, vectors, probe=2)
+    owners = placement.owners(list(range(300)), vectors)
+
+    # Each blob lands whole on one shard, and each on a different one
+    assert [len(set(owners[i : i + 100])) for i in (0, 100, 200)] == [1, 1, 1]
+    assert len(set(owners)) == 3
+    targets = placement.targets(vectors[:5])
+    assert targets.sum(axis=1).tolist() == [2] * 5
+    assert targets[np.arange(5), owners[:5]].all()
+
+
+def test_cluster_placement_round_trips_its_centroids(tmp_path):
+    placement = ClusterPlacement(SHARDS, np.eye(3, 4))
+    placement.save(str(tmp_path / "centroids.npy"))
+
+    loaded = ClusterPlacement.load(str(tmp_path / "centroids.npy"), SHARDS)
+
+    np.testing.assert_array_equal(loaded.centroids, placement.centroids)
+    with pytest.raises(ValueError):
+        ClusterPlacement(SHARDS, np.eye(2, 4))
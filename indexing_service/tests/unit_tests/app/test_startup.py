@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+from app.startup import FAILED, READY, STARTING, Startup
+
+
+def test_steps_run_concurrently_before_finishing():
+    startup = Startup()
+    # Each step waits for the other, so they only finish if they run concurrently
+    barrier = threading.Barrier(2, timeout=5)
+    finished = []
+
+    asyncio.run(
+        startup.run(
+            {"model": barrier.wait, "index": barrier.wait},
+            then=lambda: finished.append(startup.state),
+        )
+    )
+
+    assert finished == [STARTING]
+    assert startup.ready
+    assert set(startup.snapshot()["steps"]) == {"model", "index", "finish"}
+
+
+def test_failed_step_marks_startup_failed():
+    startup = Startup()
+    finished = []
+
+    def fail():
+        raise RuntimeError("model not found")
+
+    asyncio.run(startup.run({"model": fail}, then=lambda: finished.append(True)))
+
+    assert startup.state == FAILED
+    assert startup.error == "model not found"
+    assert not startup.ready
+    assert finished == []
+
+
+def test_snapshot_reports_state():
+    startup = Startup()
+    assert startup.snapshot()["status"] == STARTING
+
+    asyncio.run(startup.run({}))
+
+    assert startup.snapshot()["status"] == READY
@@ -0,0 +1,147 @@
+import asyncio
+import socket
+import threading
+
+import numpy as np
+import pytest
+
+from gptcache.embedding import HashEmbedding
+from gptcache.embedding_storage import FaissEmbeddingStorage
+
+from app.handlers.async_handler import AsyncHandler
+from app.handlers.faiss_handler import FaissHandler
+from app.handlers.partitioned_handler import Partition, PartitionedHandler
+from app.transport import BinaryClient, BinaryProtocolError, BinaryServer
+from app.transport import protocol
+
+
+class Service:
+    """
+    Runs a binary server over partitioned Faiss handlers on an event loop in a thread.
+    """
+
+    def __init__(self, socket_path, **kwargs):
+        self.embedding = HashEmbedding(dimension=32)
+        self.partitions = PartitionedHandler(self.build_partition)
+        self.executor = AsyncHandler(self.partitions, max_workers=2, max_pending=4)
+        self.ready = True
+        self.server = BinaryServer(
+            self.executor, lambda: self.ready, socket_path=socket_path, port=0, **kwargs
+        )
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.call(self.server.start())
+        host, port = self.server.addresses[1].rsplit(":", 1)
+        self.tcp = (host, int(port))
+
+    def build_partition(self, name):
+        storage = FaissEmbeddingStorage(32)
+        return Partition(name, FaissHandler(self.embedding, storage), storage)
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(10)
+
+    def close(self):
+        self.call(self.server.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = Service(str(tmp_path / "index.sock"), max_in_flight=4, max_batch_size=8)
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize("transport", ["uds", "tcp"])
+def test_add_query_and_remove(service, transport):
+    address = service.server.socket_path if transport == "uds" else service.tcp
+    with BinaryClient(address) as client:
+        client.ping()
+        client.add([1, 2], ["How do I sort a list?", "What is a monad?"])
+
+        results = client.query(
+            ["How do I sort a list?", "Explain general relativity"], similarity_threshold=0.95
+        )
+        assert results[0]["id"] == 1 and results[0]["similarity"] == pytest.approx(1.0)
+        assert results[1] == {"id": None, "distance": None, "similarity": None}
+
+        assert client.remove([1, 3]) == 1
+        assert client.query(["How do I sort a list?"], distance_threshold=0.0)[0]["id"] is None
+
+
+def test_raw_vectors_skip_the_model(service):
+    vectors = service.embedding.to_embeddings(["first", "second"])
+    with BinaryClient(service.server.socket_path) as client:
+        client.add([10, 11], ["", ""], vectors=vectors)
+
+        results = client.query(["", ""], distance_threshold=1e-6, vectors=vectors[::-1])
+
+    assert [r["id"] for r in results] == [11, 10]
+    assert len(service.partitions.partitions["default"].storage) == 2
+
+
+def test_namespaces_are_separate(service):
+    with BinaryClient(service.server.socket_path) as client:
+        client.add([1], ["shared prompt"], namespace="a")
+
+        assert client.query(["shared prompt"], 0.0, namespace="a")[0]["id"] == 1
+        assert client.query(["shared prompt"], 0.0, namespace="b")[0]["id"] is None
+
+
+def test_pipelined_requests_are_matched_to_their_responses(service):
+    texts = [f"prompt number {i}" for i in range(20)]
+    with BinaryClient(service.server.socket_path) as client:
+        client.add(list(range(8)), texts[:8])
+        client.add(list(range(8, 16)), texts[8:16])
+        requests = [
+            (protocol.OP_QUERY, *BinaryClient.encode_query([text], 0.0)) for text in texts
+        ]
+
+        responses = client.pipeline(requests)
+
+    ids = [protocol.decode_query_results(response)[0]["id"] for response in responses]
+    assert ids == list(range(16)) + [None] * 4
+
+
+def test_errors_are_reported_per_request(service):
+    with BinaryClient(service.server.socket_path) as client:
+        with pytest.raises(BinaryProtocolError) as error:
+            client.query(["a"] * 9, distance_threshold=1.0)
+        assert error.value.status == protocol.STATUS_BAD_REQUEST
+
+        # The dimension is checked by the index
+        with pytest.raises(BinaryProtocolError) as error:
+            client.query([""], distance_threshold=1.0, vectors=np.zeros((1, 3), "float32"))
+        assert error.value.status == protocol.STATUS_BAD_REQUEST
+
+        service.ready = False
+        with pytest.raises(BinaryProtocolError) as error:
+            client.query(["a"], distance_threshold=1.0)
+        assert error.value.status == protocol.STATUS_UNAVAILABLE
+        client.ping()
+
+
+def test_oversized_frames_close_the_connection(service):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(5)
+        sock.connect(service.server.socket_path)
+        header = protocol.HEADER.pack(protocol.MAX_PAYLOAD_BYTES + 1, 9, protocol.OP_QUERY, 0, 0)
+        sock.sendall(header)
+
+        response = sock.recv(1024)
+        assert protocol.HEADER.unpack(response[: protocol.HEADER.size])[3] == (
+            protocol.STATUS_BAD_REQUEST
+        )
+        assert sock.recv(1024) == b""
+
+
+def test_encode_returns_the_model_embeddings(service):
+    texts = ["How do I sort a list?", "What is a monad?"]
+    with BinaryClient(service.server.socket_path) as client:
+        vectors = client.encode(texts)
+
+    np.testing.assert_allclose(vectors, service.embedding.to_embeddings(texts))
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from app.transport import protocol
+from app.transport.protocol import ProtocolError
+
+
+def test_query_round_trip_with_vectors():
+    vectors = np.arange(6, dtype="float32").reshape(2, 3)
+    payload = protocol.encode_query(["héllo", ""], 0.8, "tenant", vectors)
+
+    threshold, namespace, contexts, decoded = protocol.decode_query(
+        payload, protocol.FLAG_VECTORS
+    )
+
+    assert (threshold, namespace, contexts) == (0.8, "tenant", ["héllo", ""])
+    np.testing.assert_array_equal(decoded, vectors)
+    # The vectors are a view of the payload rather than a copy
+    assert not decoded.flags.writeable
+
+
+def test_add_round_trip():
+    payload = protocol.encode_add([1, 2**40], ["a", "b"], [None, 30.0])
+
+    namespace, ids, contexts, ttls, vectors = protocol.decode_add(payload, 0)
+
+    assert (namespace, ids, contexts, ttls) == ("", [1, 2**40], ["a", "b"], [None, 30.0])
+    assert vectors is None
+
+
+def test_results_and_removals_round_trip():
+    results = [
+        {"id": 7, "distance": 0.25, "similarity": 0.875},
+        {"id": None, "distance": None, "similarity": None},
+    ]
+
+    assert protocol.decode_query_results(protocol.encode_query_results(results)) == results
+    assert protocol.decode_remove(protocol.encode_remove([3, 4], "ns")) == ("ns", [3, 4])
+    assert protocol.decode_removed(protocol.encode_removed(2)) == 2
+
+
+def test_malformed_payloads_are_rejected():
+    payload = protocol.encode_query(["hello"], 0.8)
+
+    with pytest.raises(ProtocolError):
+        protocol.decode_query(payload[:-1], 0)
+    with pytest.raises(ProtocolError):
+        protocol.decode_query(payload + b"\0", 0)
+    # The flag promises vectors the payload does not have
+    with pytest.raises(ProtocolError):
+        protocol.decode_query(payload, protocol.FLAG_VECTORS)
+
+
+def test_frame_header():
+    frame = protocol.pack_frame(5, protocol.OP_PING, b"abc", protocol.STATUS_BUSY, 3)
+
+    assert protocol.HEADER.unpack(frame[: protocol.HEADER.size]) == (3, 5, 4, 3, 3)
+    assert frame[protocol.HEADER.size :] == b"abc"
+
+
+def test_encode_round_trip():
+    assert protocol.decode_texts(protocol.encode_texts(["a", "bé"])) == ["a", "bé"]
+
+    vectors = np.arange(6, dtype="float32").reshape(3, 2)
+    np.testing.assert_array_equal(
+        protocol.decode_embeddings(protocol.encode_embeddings(vectors)), vectors
+    )
+
+
+def test_scan_round_trip():
+    assert protocol.decode_scan(protocol.encode_scan(-1, 100, "tenant")) == ("tenant", -1, 100)
+
+    vectors = np.arange(4, dtype="float32").reshape(2, 2)
+    ids, ttls, decoded = protocol.decode_entries(
+        protocol.encode_entries([3, 7], [None, 30.0], vectors)
+    )
+    assert ids == [3, 7]
+    assert ttls == [None, 30.0]
+    np.testing.assert_array_equal(decoded, vectors)
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from gptcache.embedding import HashEmbedding
+from gptcache.embedding_storage import FaissEmbeddingStorage, SnapshotFollower, SnapshotManager
+
+from app.handlers.async_handler import AsyncHandler
+from app.handlers.faiss_handler import FaissHandler
+from app.handlers.partitioned_handler import Partition, PartitionedHandler
+from app.handlers.replica_handler import ReplicaHandler
+from app.transport import BinaryServer
+from app.transport.remote import ClientPool, RemoteEmbedding, parse_address
+
+
+class Writer:
+    """
+    Runs a writer's binary server on an event loop in a thread.
+    """
+
+    def __init__(self, socket_path):
+        self.embedding = HashEmbedding(dimension=32)
+        self.partitions = PartitionedHandler(self.build_partition)
+        self.executor = AsyncHandler(self.partitions, max_workers=2, max_pending=4)
+        self.server = BinaryServer(self.executor, lambda: True, socket_path=socket_path)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result(10)
+
+    def build_partition(self, name):
+        storage = FaissEmbeddingStorage(32)
+        return Partition(name, FaissHandler(self.embedding, storage), storage)
+
+    def storage(self, name="default"):
+        return self.partitions.partitions[name].storage
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = Writer(str(tmp_path / "writer.sock"))
+    yield writer
+    writer.close()
+
+
+def test_parse_address():
+    assert parse_address("unix:/run/index.sock") == "/run/index.sock"
+    assert parse_address("/run/index.sock") == "/run/index.sock"
+    assert parse_address("indexer:9000") == ("indexer", 9000)
+
+
+def test_remote_embedding_uses_the_writer_model(writer):
+    embedding = RemoteEmbedding(ClientPool(writer.server.socket_path))
+    texts = ["How do I sort a list?", "What is a monad?"]
+
+    vectors = embedding.to_embeddings(texts)
+
+    assert vectors.shape == (2, 32)
+    np.testing.assert_allclose(vectors, writer.embedding.to_embeddings(texts))
+    np.testing.assert_allclose(embedding.to_embedding(texts[0]), vectors[0])
+
+
+def test_pool_reconnects_a_broken_connection(writer):
+    pool = ClientPool(writer.server.socket_path)
+    pool.call(lambda client: client.ping())
+
+    pool.call(lambda client: client.sock.close())
+    pool.call(lambda client: client.ping())
+
+
+def test_replica_forwards_mutations_and_serves_published_queries(writer, tmp_path):
+    pool = ClientPool(writer.server.socket_path)
+    published = SnapshotManager(str(tmp_path / "published"))
+    replica = FaissEmbeddingStorage(32)
+    follower = SnapshotFollower(SnapshotManager(str(tmp_path / "published")), replica)
+    partitions = PartitionedHandler(
+        lambda name: Partition(
+            name, FaissHandler(RemoteEmbedding(pool), replica), replica, follower=follower
+        )
+    )
+    handler = ReplicaHandler(partitions, pool)
+
+    assert handler.handle_add(1, "How do I sort a list?")["status"] == "success"
+    results = handler.handle_add_batch([2, 3], ["What is a monad?", "Explain recursion"])
+    assert [r["status"] for r in results] == ["success", "success"]
+    assert len(writer.storage()) == 3
+    # Nothing is visible to the replica until the writer publishes
+    assert handler.handle_query("How do I sort a list?", 0.0)["id"] is None
+
+    published.save(writer.storage())
+    follower.poll()
+    assert handler.handle_query("How do I sort a list?", 0.0)["id"] == 1
+    assert replica.read_only
+
+    assert handler.handle_remove([1, 4]) == {"status": "success", "removed": 1}
+    assert len(writer.storage()) == 2
+
+
+def test_replica_reports_writer_errors(writer):
+    handler = ReplicaHandler(None, ClientPool(writer.server.socket_path))
+    writer.server.ready = lambda: False
+
+    result = handler.handle_add(1, "How do I sort a list?")
+
+    assert result["status"] == "error"
+    assert "warming up" in result["message"]
@@ -0,0 +1,92 @@
+import random
+
+import numpy as np
+import pytest
+
+from benchmarks.corpus import (
+    generate_paraphrase_pairs,
+    generate_prompts,
+    max_prompts,
+    paraphrase,
+)
+from benchmarks.results import compare, latency_summary
+from benchmarks.storage import bench_storage, create_storage, exact_neighbours
+
+
+def test_prompts_are_distinct_and_reproducible():
+    prompts = generate_prompts(500, seed=3)
+
+    assert len(set(prompts)) == 500
+    assert prompts == generate_prompts(500, seed=3)
+    assert prompts != generate_prompts(500, seed=4)
+
+
+def test_prompt_count_is_bounded_by_the_templates():
+    with pytest.raises(ValueError):
+        generate_prompts(max_prompts() + 1)
+
+
+def test_paraphrases_differ_from_their_original():
+    prompts = generate_prompts(50)
+    rng = random.Random(0)
+
+    assert all(paraphrase(prompt, rng) != prompt for prompt in prompts)
+
+    pairs = generate_paraphrase_pairs(prompts, 20, seed=1)
+    assert len(pairs) == 20
+    assert all(0 <= index < len(prompts) for index, _ in pairs)
+    assert pairs == generate_paraphrase_pairs(prompts, 20, seed=1)
+
+
+def test_exact_neighbours():
+    vectors = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 5.0]], dtype="float32")
+    queries = np.array([[0.9, 0.1], [0.0, 4.0]], dtype="float32")
+
+    np.testing.assert_array_equal(exact_neighbours(vectors, queries), [1, 2])
+
+
+def test_create_storage_rejects_unknown_backends():
+    with pytest.raises(ValueError):
+        create_storage("milvus", 8, 100)
+
+
+@pytest.mark.parametrize("backend", ["annoy", "faiss:flat", "faiss:ivf_flat"])
+def test_bench_storage(backend):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((400, 16), dtype="float32")
+    queries = vectors[:20] + 0.001
+
+    result = bench_storage(backend, vectors, queries, batch_size=64)
+
+    assert result["name"] == backend
+    assert result["add_per_second"] > 0
+    assert result["p50_ms"] <= result["p99_ms"]
+    if backend == "faiss:flat":
+        assert result["recall_at_1"] == 1.0
+
+
+def test_latency_summary_in_milliseconds():
+    summary = latency_summary([0.001, 0.002, 0.003])
+
+    assert summary["p50_ms"] == pytest.approx(2.0)
+    assert summary["max_ms"] == pytest.approx(3.0)
+    assert latency_summary([])["p99_ms"] is None
+
+
+def test_compare_flags_regressions_in_the_right_direction():
+    baseline = {
+        "results": {
+            "storage": [{"name": "faiss:flat", "query_per_second": 1000.0, "p99_ms": 1.0}]
+        }
+    }
+    candidate = {
+        "results": {
+            "storage": [{"name": "faiss:flat", "query_per_second": 1200.0, "p99_ms": 1.5}]
+        }
+    }
+
+    rows = {row["metric"]: row for row in compare(baseline, candidate, tolerance=0.1)}
+
+    assert not rows["storage/faiss:flat/query_per_second"]["regressed"]
+    assert rows["storage/faiss:flat/p99_ms"]["regressed"]
+    assert rows["storage/faiss:flat/p99_ms"]["change"] == pytest.approx(0.5)
@@ -0,0 +1,89 @@
+import json
+
+import numpy as np
+import pytest
+
+from gptcache.embedding import HashEmbedding
+
+from benchmarks.thresholds import evaluate, load_pairs, score, select_threshold
+
+
+def test_score_counts_wrong_entry_hits_as_false_positives():
+    similarities = np.array([0.95, 0.85, 0.9, 0.7, np.nan])
+    found_ids = np.array([1, 2, 7, 4, -1])
+    expected_ids = np.array([1, 2, 3, 4, 5])
+    should_hit = np.array([True, True, True, False, True])
+
+    scores = score(similarities, found_ids, expected_ids, should_hit, np.array([0.8, 0.9]))
+
+    # At 0.8: pairs 0 and 1 are right, pair 2 hit the wrong entry
+    np.testing.assert_array_equal(scores["tp"], [2, 1])
+    np.testing.assert_array_equal(scores["fp"], [1, 1])
+    np.testing.assert_array_equal(scores["fn"], [2, 3])
+    np.testing.assert_array_equal(scores["tn"], [1, 1])
+    np.testing.assert_allclose(scores["precision"], [2 / 3, 1 / 2])
+    np.testing.assert_allclose(scores["recall"], [2 / 4, 1 / 4])
+    np.testing.assert_allclose(scores["false_positive_rate"], [0.0, 0.0])
+
+
+def test_select_threshold_maximizes_recall_above_the_floor():
+    scores = {
+        "precision": np.array([0.5, 0.9, 0.97, 1.0, 1.0]),
+        "recall": np.array([1.0, 0.9, 0.8, 0.5, 0.0]),
+        "tp": np.array([10, 9, 8, 5, 0]),
+    }
+
+    assert select_threshold(scores, 0.95) == 2
+    assert select_threshold(scores, 0.99) == 3
+    # A threshold that never hits is not a choice, however precise
+    scores["tp"][3] = 0
+    assert select_threshold(scores, 0.99) is None
+
+
+def test_load_pairs_from_jsonl_and_csv(tmp_path):
+    jsonl = tmp_path / "pairs.jsonl"
+    jsonl.write_text(
+        json.dumps({"query": "a", "cached": "b", "should_hit": True})
+        + "\n\n"
+        + json.dumps({"query": "c", "cached": "d", "should_hit": False})
+        + "\n"
+    )
+    csv = tmp_path / "pairs.csv"
+    csv.write_text("query,cached,should_hit\na,b,yes\nc,d,0\n")
+
+    assert load_pairs(str(jsonl)) == [("a", "b", True), ("c", "d", False)]
+    assert load_pairs(str(csv)) == [("a", "b", True), ("c", "d", False)]
+
+    (tmp_path / "bad.jsonl").write_text(json.dumps({"query": "a"}) + "\n")
+    with pytest.raises(ValueError):
+        load_pairs(str(tmp_path / "bad.jsonl"))
+
+
+def test_evaluate_replays_pairs_through_the_handlers():
+    pairs = [
+        ("How can I sort a list in Python", "How do I sort a list in Python?", True),
+        ("How would I parse a file in Go", "How do I parse a file in Go?", True),
+        ("Deploy a container on Kubernetes", "How do I parse a file in Go?", False),
+    ]
+    distractors = ["What is a thread in Rust?", "Explain SQL joins"]
+
+    results, summary = evaluate(
+        HashEmbedding(dimension=64),
+        pairs,
+        configs=["faiss:flat", "annoy", "faiss:flat+lexical", "milvus"],
+        thresholds=np.array([0.3, 0.99]),
+        precision_floor=0.9,
+        extra_cached=distractors,
+        latency_queries=2,
+    )
+
+    flat, annoy, lexical, unknown = results
+    assert flat["params"]["cached"] == 4
+    assert flat["selected"]["threshold"] == 0.3
+    assert flat["selected"]["recall"] == 1.0
+    assert flat["curve"][1]["tp"] == 0
+    assert annoy["selected"]["recall"] == 1.0
+    assert lexical["selected"] is not None
+    assert "error" in unknown
+    assert summary["texts_encoded"] == 7
+    assert summary["recommended"]["config"] in ("faiss:flat", "annoy", "faiss:flat+lexical")
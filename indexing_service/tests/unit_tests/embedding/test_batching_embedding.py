@@ -0,0 +1,113 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gptcache.embedding import BaseEmbedding, BatchingEmbedding
+
+
+class RecordingEmbedding(BaseEmbedding):
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def to_embedding(self, text: str):
+        return self.to_embeddings([text])[0]
+
+    def to_embeddings(self, texts):
+        with self.lock:
+            self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.fixture
+def recording_embedding():
+    return RecordingEmbedding()
+
+
+def test_single_request_is_resolved(recording_embedding):
+    batching = BatchingEmbedding(recording_embedding, max_wait_ms=1)
+
+    assert batching.to_embedding("abc") == [3.0]
+    batching.close()
+
+
+def test_concurrent_requests_are_coalesced(recording_embedding):
+    batching = BatchingEmbedding(
+        recording_embedding, max_batch_size=8, max_wait_ms=200
+    )
+    texts = ["x" * i for i in range(1, 9)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(batching.to_embedding, texts))
+    batching.close()
+
+    assert results == [[float(i)] for i in range(1, 9)]
+    assert len(recording_embedding.batches) < len(texts)
+    stats = batching.stats.snapshot()
+    assert stats["items"] == 8
+    assert stats["max_batch_size"] > 1
+
+
+def test_batch_size_is_capped(recording_embedding):
+    batching = BatchingEmbedding(recording_embedding, max_batch_size=3, max_wait_ms=50)
+
+    futures = [batching.submit(str(i)) for i in range(7)]
+    assert [f.result() for f in futures] == [[1.0]] * 7
+    batching.close()
+
+    assert all(len(batch) <= 3 for batch in recording_embedding.batches)
+
+
+def test_errors_are_propagated_to_every_caller():
+    class FailingEmbedding(BaseEmbedding):
+        def to_embedding(self, text):
+            raise RuntimeError("model failure")
+
+        def to_embeddings(self, texts):
+            raise RuntimeError("model failure")
+
+    batching = BatchingEmbedding(FailingEmbedding(), max_wait_ms=20)
+    futures = [batching.submit("a"), batching.submit("b")]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model failure"):
+            future.result()
+    batching.close()
+
+
+def test_full_batches_are_encoded_in_one_call(recording_embedding):
+    batching = BatchingEmbedding(recording_embedding, max_batch_size=4, max_wait_ms=50)
+
+    assert batching.to_embeddings(["a", "bb", "ccc", "dddd", "e"]) == [
+        [1.0], [2.0], [3.0], [4.0], [1.0]
+    ]
+    batching.close()
+
+    assert recording_embedding.batches == [["a", "bb", "ccc", "dddd", "e"]]
+
+
+def test_submitting_after_close_raises(recording_embedding):
+    batching = BatchingEmbedding(recording_embedding, max_wait_ms=1)
+    batching.close()
+
+    with pytest.raises(RuntimeError, match="closed"):
+        batching.to_embedding("abc")
+    batching.close()
+
+
+def test_a_short_model_answer_fails_the_whole_batch():
+    class ShortEmbedding(BaseEmbedding):
+        def to_embedding(self, text):
+            return [0.0]
+
+        def to_embeddings(self, texts):
+            return [[0.0]] * (len(texts) - 1)
+
+    batching = BatchingEmbedding(ShortEmbedding(), max_wait_ms=50)
+    futures = [batching.submit("a"), batching.submit("b")]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="Expected [0-9]+ embeddings"):
+            future.result(timeout=5)
+    batching.close()
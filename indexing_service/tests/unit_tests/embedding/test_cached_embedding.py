@@ -0,0 +1,112 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from gptcache.embedding import BaseEmbedding, CachedEmbedding
+
+
+class CountingEmbedding(BaseEmbedding):
+    def __init__(self):
+        self.encoded = []
+
+    def to_embedding(self, text: str):
+        return self.to_embeddings([text])[0]
+
+    def to_embeddings(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts], dtype="float32")
+
+
+@pytest.fixture
+def counting_embedding():
+    return CountingEmbedding()
+
+
+def test_repeated_text_is_encoded_once(counting_embedding):
+    cached = CachedEmbedding(counting_embedding)
+
+    first = cached.to_embedding("How do I write to a file in Java?")
+    second = cached.to_embedding("How do I write to a file in Java?")
+
+    assert counting_embedding.encoded == ["How do I write to a file in Java?"]
+    np.testing.assert_array_equal(first, second)
+    assert second.dtype == np.float32
+    assert cached.stats.snapshot()["hits"] == 1
+    assert cached.stats.snapshot()["misses"] == 1
+
+
+def test_whitespace_normalization_shares_entries(counting_embedding):
+    cached = CachedEmbedding(counting_embedding, normalization="whitespace")
+
+    cached.to_embedding("hello   world")
+    cached.to_embedding("  hello world\n")
+    cached.to_embedding("Hello world")
+
+    assert counting_embedding.encoded == ["hello   world", "Hello world"]
+
+
+def test_casefold_normalization(counting_embedding):
+    cached = CachedEmbedding(counting_embedding, normalization="casefold")
+
+    cached.to_embedding("Hello World")
+    cached.to_embedding("hello world")
+
+    assert counting_embedding.encoded == ["Hello World"]
+
+
+def test_least_recently_used_entry_is_evicted(counting_embedding):
+    cached = CachedEmbedding(counting_embedding, max_entries=2)
+
+    cached.to_embedding("a")
+    cached.to_embedding("bb")
+    cached.to_embedding("a")  # "bb" is now the least recently used
+    cached.to_embedding("ccc")
+    cached.to_embedding("a")
+    cached.to_embedding("bb")
+
+    assert counting_embedding.encoded == ["a", "bb", "ccc", "bb"]
+    assert len(cached) == 2
+    assert cached.stats.snapshot()["evictions"] == 2
+
+
+def test_memory_budget_limits_capacity(counting_embedding):
+    # Two float32 values per vector, so 16 bytes hold two entries
+    cached = CachedEmbedding(counting_embedding, max_entries=100, max_bytes=16)
+
+    cached.to_embeddings(["a", "b", "c"])
+
+    assert cached.capacity == 2
+    assert len(cached) == 2
+
+
+def test_expired_entries_are_recomputed(counting_embedding):
+    cached = CachedEmbedding(counting_embedding, ttl_seconds=10)
+
+    with patch("gptcache.embedding.memo.time.monotonic", return_value=100.0):
+        cached.to_embedding("a")
+    with patch("gptcache.embedding.memo.time.monotonic", return_value=105.0):
+        cached.to_embedding("a")
+    with patch("gptcache.embedding.memo.time.monotonic", return_value=120.0):
+        cached.to_embedding("a")
+
+    assert counting_embedding.encoded == ["a", "a"]
+    assert cached.stats.snapshot()["expirations"] == 1
+
+
+def test_batch_only_encodes_missing_unique_texts(counting_embedding):
+    cached = CachedEmbedding(counting_embedding)
+    cached.to_embedding("a")
+
+    vectors = cached.to_embeddings(["a", "bb", "bb", "ccc"])
+
+    assert counting_embedding.encoded == ["a", "bb", "ccc"]
+    assert [v[0] for v in vectors] == [1.0, 2.0, 2.0, 3.0]
+
+
+def test_returned_vectors_do_not_alias_the_cache(counting_embedding):
+    cached = CachedEmbedding(counting_embedding)
+
+    cached.to_embedding("a")[0] = 42.0
+
+    assert cached.to_embedding("a")[0] == 1.0
@@ -0,0 +1,34 @@
+import numpy as np
+
+from gptcache.embedding import HashEmbedding
+
+
+def test_vectors_are_deterministic_and_normalized():
+    embedding = HashEmbedding(dimension=64)
+
+    vectors = embedding.to_embeddings(["How do I sort a list?", "Hello"])
+
+    assert vectors.shape == (2, 64)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), [1.0, 1.0], rtol=1e-6)
+    np.testing.assert_array_equal(
+        vectors[0], HashEmbedding(dimension=64).to_embedding("How do I sort a list?")
+    )
+
+
+def test_shared_words_give_close_vectors():
+    embedding = HashEmbedding()
+    query, paraphrase, other = embedding.to_embeddings(
+        [
+            "How do I sort a list in Python?",
+            "How can I sort a list in Python",
+            "Deploy a container on Kubernetes",
+        ]
+    )
+
+    assert query @ paraphrase > 0.5
+    assert query @ paraphrase > query @ other
+
+
+def test_empty_text_is_a_zero_vector():
+    assert not HashEmbedding(dimension=8).to_embedding("").any()
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from gptcache.embedding.onnx_embedding import l2_normalize, mean_pool
+
+
+def test_mean_pool_ignores_padding():
+    hidden_states = np.array(
+        [[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]], [[5.0, 6.0], [0.0, 0.0], [0.0, 0.0]]]
+    )
+    attention_mask = np.array([[1, 1, 0], [1, 0, 0]])
+
+    np.testing.assert_allclose(
+        mean_pool(hidden_states, attention_mask), [[2.0, 3.0], [5.0, 6.0]]
+    )
+
+
+def test_l2_normalize():
+    vectors = l2_normalize(np.array([[3.0, 4.0], [0.0, 0.0]]))
+
+    np.testing.assert_allclose(vectors, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_pooling_matches_sentence_transformers():
+    torch = pytest.importorskip("torch")
+    models = pytest.importorskip("sentence_transformers.models")
+    rng = np.random.default_rng(0)
+    hidden_states = rng.random((3, 7, 8), dtype="float32")
+    attention_mask = np.array([[1] * 7, [1] * 4 + [0] * 3, [1] + [0] * 6])
+
+    pooling = models.Pooling(8, pooling_mode="mean")
+    normalize = models.Normalize()
+    expected = normalize(
+        pooling(
+            {
+                "token_embeddings": torch.from_numpy(hidden_states),
+                "attention_mask": torch.from_numpy(attention_mask),
+            }
+        )
+    )["sentence_embedding"].numpy()
+
+    np.testing.assert_allclose(
+        l2_normalize(mean_pool(hidden_states, attention_mask)), expected, rtol=1e-5, atol=1e-6
+    )
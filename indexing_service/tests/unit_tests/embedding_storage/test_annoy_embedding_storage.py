@@ -1,55 +1,221 @@
+import threading
+
+import numpy as np
 import pytest
-from unittest.mock import MagicMock, patch
 from gptcache.embedding_storage import (
     AnnoyEmbeddingStorage,
 )
 
+DIMENSION = 16
+
 
 @pytest.fixture
-def mock_annoy_index():
-    with patch("annoy.AnnoyIndex") as mock:
-        yield mock()
+def vectors():
+    return np.random.default_rng(0).standard_normal((300, DIMENSION)).astype("float32")
 
 
-@pytest.fixture
-def embedding_storage(mock_annoy_index):
-    storage = AnnoyEmbeddingStorage(dimension=128, metric="angular")
-    storage.index = mock_annoy_index
-    return storage
+def exact_nearest(vectors, ids, query):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return ids[int(np.argmax(normalized @ (query / np.linalg.norm(query))))]
+
+
+def test_added_items_are_found_before_a_build(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(100)), vectors[:100])
+
+    ids, distances = storage.get_nns_by_vector(vectors[7], n=3)
+
+    assert storage.index is None
+    assert ids[0] == 7
+    assert distances[0] == pytest.approx(0.0, abs=1e-3)
+    assert len(ids) == 3
+
+
+def test_build_index_moves_the_delta_into_the_forest(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(100)), vectors[:100])
+    storage.build_index(num_trees=5)
+
+    assert storage.index is not None
+    assert storage.delta_size == 0
+    assert storage.get_nns_by_vector(vectors[42], n=1)[0] == [42]
+
+
+def test_forest_and_delta_results_are_merged(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(100)), vectors[:100])
+    storage.build_index(num_trees=10)
+    storage.add_items(list(range(100, 200)), vectors[100:200])
+
+    for query in vectors[:200:7]:
+        ids, distances = storage.get_nns_by_vector(query, n=5)
+        assert ids[0] == exact_nearest(vectors[:200], np.arange(200), query)
+        assert distances == sorted(distances)
+        assert len(set(ids)) == 5
+
+
+def test_ids_need_not_be_dense(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    ids = [10**12 + 3 * i for i in range(50)]
+    storage.add_items(ids, vectors[:50])
+    storage.build_index(num_trees=5)
+
+    assert storage.get_nns_by_vector(vectors[9], n=1)[0] == [ids[9]]
+    assert np.allclose(storage.get_vectors([ids[9]]), vectors[9:10])
+
+
+def test_removed_ids_are_filtered(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(10)), vectors[:10])
+    storage.build_index(num_trees=5)
+    storage.add_item(10, vectors[10])
+
+    assert storage.remove_ids([2, 10, 42]) == 2
+    assert storage.tombstones == {2}
+    assert 2 not in storage.get_nns_by_vector(vectors[2], n=10)[0]
+    assert 10 not in storage.get_nns_by_vector(vectors[10], n=10)[0]
+    assert len(storage) == 9
+
+
+def test_readded_ids_return_their_new_vector(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(10)), vectors[:10])
+    storage.build_index(num_trees=5)
+    storage.add_item(3, vectors[20])
+
+    ids, _ = storage.get_nns_by_vector(vectors[20], n=10)
+    assert ids[0] == 3
+    assert ids.count(3) == 1
+    assert storage.get_nns_by_vector(vectors[3], n=1)[0] != [3]
+    assert np.allclose(storage.get_vectors([3]), vectors[20:21])
+
+
+def test_delta_reaching_the_threshold_rebuilds_in_the_background(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, num_trees=5, rebuild_threshold=50)
+    for i, vector in enumerate(vectors[:60]):
+        storage.add_item(i, vector)
+    assert storage.wait_for_rebuild(timeout=30)
+
+    assert storage.index is not None
+    assert storage.delta_size < 50
+    assert len(storage) == 60
+    for i in range(0, 60, 5):
+        assert storage.get_nns_by_vector(vectors[i], n=1)[0] == [i]
+
+
+def test_searches_and_adds_run_during_background_rebuilds(vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, num_trees=5, rebuild_threshold=20)
+    errors = []
+    done = threading.Event()
+
+    def search():
+        while not done.is_set():
+            try:
+                # Every added item stays findable through every swap
+                added = len(storage)
+                if added:
+                    item = int(np.random.randint(added))
+                    ids, _ = storage.get_nns_by_vector(vectors[item], n=1)
+                    assert ids == [item], (item, ids)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    searchers = [threading.Thread(target=search) for _ in range(3)]
+    for thread in searchers:
+        thread.start()
+    for i, vector in enumerate(vectors):
+        storage.add_item(i, vector)
+    assert storage.wait_for_rebuild(timeout=30)
+    done.set()
+    for thread in searchers:
+        thread.join()
+
+    assert not errors
+    assert len(storage) == len(vectors)
+
+
+def test_save_and_load_round_trip(tmp_path, vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items(list(range(50)), vectors[:50])
+    storage.build_index(num_trees=5)
+    storage.add_items([50, 51], vectors[50:52])
+    storage.remove_ids([4])
+    filepath = str(tmp_path / "index.ann")
+    storage.save_index(filepath)
+
+    restored = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    restored.load_index(filepath)
+    (tmp_path / "index.ann").unlink()
+
+    assert restored.tombstones == {4}
+    assert restored.delta_size == 2
+    assert len(restored) == 51
+    assert restored.get_nns_by_vector(vectors[51], n=1)[0] == [51]
+    assert restored.get_nns_by_vector(vectors[30], n=1)[0] == [30]
+    assert 4 not in restored.get_nns_by_vector(vectors[4], n=5)[0]
+
+
+def test_an_unbuilt_storage_can_be_saved(tmp_path, vectors):
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.add_items([1, 2], vectors[:2])
+    filepath = str(tmp_path / "index.ann")
+    storage.save_index(filepath)
+
+    restored = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    restored.load_index(filepath)
+
+    assert restored.index is None
+    assert restored.get_nns_by_vector(vectors[1], n=1)[0] == [2]
+
+
+def test_indexes_saved_by_annoy_can_be_loaded(tmp_path, vectors):
+    from annoy import AnnoyIndex
+
+    index = AnnoyIndex(DIMENSION, "angular")
+    for i, vector in enumerate(vectors[:20]):
+        index.add_item(i, vector)
+    index.build(5)
+    filepath = str(tmp_path / "legacy.ann")
+    index.save(filepath)
+    np.save(filepath + ".tombstones.npy", np.array([3]))
+
+    storage = AnnoyEmbeddingStorage(DIMENSION, rebuild_threshold=None)
+    storage.load_index(filepath)
+
+    assert len(storage) == 19
+    assert storage.get_nns_by_vector(vectors[8], n=1)[0] == [8]
+    assert 3 not in storage.get_nns_by_vector(vectors[3], n=5)[0]
 
 
-def test_add_item(embedding_storage, mock_annoy_index):
-    item_id = 1
-    vector = [0.1, 0.2, 0.3]
-    embedding_storage.add_item(item_id, vector)
-    mock_annoy_index.add_item.assert_called_once_with(item_id, vector)
+@pytest.mark.parametrize("metric", ["angular", "euclidean", "dot"])
+def test_delta_distances_match_annoy(metric, vectors):
+    built = AnnoyEmbeddingStorage(DIMENSION, metric=metric, rebuild_threshold=None)
+    fresh = AnnoyEmbeddingStorage(DIMENSION, metric=metric, rebuild_threshold=None)
+    for storage in (built, fresh):
+        storage.add_items(list(range(20)), vectors[:20])
+    built.build_index(num_trees=50)
 
+    _, expected = built.get_nns_by_vector(vectors[25], n=20)
+    _, distances = fresh.get_nns_by_vector(vectors[25], n=20)
 
-def test_get_nns_by_vector(embedding_storage, mock_annoy_index):
-    vector = [0.1, 0.2, 0.3]
-    n = 5
-    mock_annoy_index.get_nns_by_vector.return_value = ([2, 3], [0.4, 0.5])
-    ids, distances = embedding_storage.get_nns_by_vector(vector, n)
-    mock_annoy_index.get_nns_by_vector.assert_called_once_with(
-        vector, n, include_distances=True
-    )
-    assert ids == [2, 3]
-    assert distances == [0.4, 0.5]
+    assert distances == pytest.approx(expected, rel=1e-3, abs=1e-3)
 
 
-def test_build_index(embedding_storage, mock_annoy_index):
-    num_trees = 10
-    embedding_storage.build_index(num_trees)
-    mock_annoy_index.build.assert_called_once_with(num_trees)
+@pytest.mark.parametrize("metric", ["angular", "euclidean", "dot"])
+@pytest.mark.parametrize("built", [False, True])
+def test_similarity_matches_cosine(metric, built):
+    storage = AnnoyEmbeddingStorage(dimension=2, metric=metric, rebuild_threshold=None)
+    storage.add_item(0, [3.0, 0.0])
+    if built:
+        storage.build_index(1)
 
+    _, distances = storage.get_nns_by_vector([2.0, 2.0], 1)
 
-def test_save_index(embedding_storage, mock_annoy_index):
-    filepath = "test.ann"
-    embedding_storage.save_index(filepath)
-    mock_annoy_index.save.assert_called_once_with(filepath)
+    assert storage.similarity(distances[0]) == pytest.approx(2**-0.5, abs=1e-5)
 
 
-def test_load_index(embedding_storage, mock_annoy_index):
-    filepath = "test.ann"
-    embedding_storage.load_index(filepath)
-    mock_annoy_index.load.assert_called_once_with(filepath)
+@pytest.mark.parametrize("metric", ["hamming", "manhattan"])
+def test_unsupported_metric_is_rejected(metric):
+    with pytest.raises(ValueError):
+        AnnoyEmbeddingStorage(DIMENSION, metric=metric)
@@ -0,0 +1,159 @@
+import threading
+
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import FaissEmbeddingStorage
+
+DIMENSION = 16
+
+
+def hammer(storage, vectors, exact, seconds=1.0):
+    """
+    Adds, removes, compacts and searches from several threads at once, and returns the
+    errors raised and the IDs returned by searches. With an `exact` index, searches for
+    stable vectors must find them.
+    """
+    errors = []
+    returned = set()
+    stop = threading.Event()
+    # IDs 0-99 are never removed; writers churn IDs from 1000 up
+    storage.add_items(list(range(100)), vectors[:100])
+
+    def run(step):
+        def loop():
+            try:
+                i = 0
+                while not stop.is_set():
+                    step(i)
+                    i += 1
+            except Exception as e:  # pragma: no cover - reported below
+                errors.append(e)
+                stop.set()
+
+        return threading.Thread(target=loop)
+
+    def add(i):
+        row = 100 + i % (len(vectors) - 100)
+        storage.add_items([1000 + i], vectors[row : row + 1])
+
+    def remove(i):
+        storage.remove_ids([1000 + i])
+
+    def compact(i):
+        storage.compact()
+
+    def search(i):
+        row = i % 100
+        ids, _ = storage.get_nns_by_vector(vectors[row], n=1)
+        assert len(ids) == 1
+        if exact:
+            assert ids == [row]
+        for result_ids, _ in storage.get_nns_by_vectors(vectors[100:110], n=5):
+            returned.update(result_ids)
+
+    def hit(i):
+        storage.record_hit(i % 100)
+        storage.get_vectors([i % 100])
+
+    threads = [run(add), run(remove), run(compact), run(hit)]
+    threads += [run(search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    stop.wait(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return errors, returned
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs, exact",
+    [
+        ("flat", {}, True),
+        ("hnsw", {"hnsw_m": 8, "ef_search": 64}, False),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 100}, True),
+    ],
+)
+def test_concurrent_adds_removes_and_searches(index_type, kwargs, exact):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((400, DIMENSION), dtype="float32")
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+
+    errors, returned = hammer(storage, vectors, exact)
+
+    assert errors == []
+    # Searches only ever return IDs that were added
+    assert all(0 <= i < 100 or i >= 1000 for i in returned)
+    assert set(storage.ids.tolist()) >= set(range(100))
+    assert len(storage) == len(storage.ids)
+
+
+def test_snapshot_does_not_block_searches(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = rng.random((200, DIMENSION), dtype="float32")
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.add_items(list(range(200)), vectors)
+    searched = threading.Event()
+
+    with storage.lock.read():
+        # A search from another thread runs while the read side is held, as it is
+        # during `save_index`
+        thread = threading.Thread(
+            target=lambda: (storage.get_nns_by_vector(vectors[0], n=1), searched.set())
+        )
+        thread.start()
+        assert searched.wait(timeout=5)
+        storage.save_index(str(tmp_path / "index"))
+    thread.join()
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs, build, step",
+    [
+        ("hnsw", {"hnsw_m": 8}, "compact", "_rebuild"),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 100}, "compact", "_compact_ivf"),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 1000}, "build_index", "_new_index"),
+    ],
+)
+def test_rebuilds_run_without_the_lock(index_type, kwargs, build, step):
+    vectors = np.random.default_rng(2).random((300, DIMENSION), dtype="float32")
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    storage.add_items(list(range(200)), vectors[:200])
+    storage.remove_ids(list(range(10)))
+    started, release = threading.Event(), threading.Event()
+    original = getattr(storage, step)
+
+    def blocked(*args):
+        started.set()
+        release.wait(timeout=10)
+        return original(*args)
+
+    setattr(storage, step, blocked)
+    thread = threading.Thread(target=getattr(storage, build))
+    thread.start()
+    assert started.wait(timeout=5)
+
+    # Searches and writes go on while the new index is built, without the lock
+    searched = threading.Event()
+    threading.Thread(
+        target=lambda: (storage.get_nns_by_vector(vectors[50], n=1), searched.set())
+    ).start()
+    assert searched.wait(timeout=5)
+    storage.add_items(list(range(200, 250)), vectors[200:250])
+    storage.add_items([20, 21], vectors[250:252])
+    storage.remove_ids([30, 210])
+    release.set()
+    thread.join()
+
+    # They are replayed on the new index
+    assert storage.is_trained and not storage.tombstones
+    expected = set(range(10, 250)) - {30, 210}
+    assert sorted(storage.ids.tolist()) == sorted(expected)
+    assert len(storage) == len(expected)
+    for item_id, row in [(20, 250), (21, 251), (50, 50), (220, 220)]:
+        assert storage.get_nns_by_vector(vectors[row], n=1)[0] == [item_id]
+    for removed, row in [(30, 30), (210, 210), (20, 20)]:
+        assert removed not in storage.get_nns_by_vector(vectors[row], n=5)[0]
+    storage.compact()
+    assert sorted(storage.ids.tolist()) == sorted(expected)
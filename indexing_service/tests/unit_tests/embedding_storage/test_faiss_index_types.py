@@ -0,0 +1,407 @@
+import faiss
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import FaissEmbeddingStorage
+
+
+DIMENSION = 16
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((300, DIMENSION), dtype="float32")
+
+
+def add_all(storage, vectors, start_id=100):
+    for i, vector in enumerate(vectors):
+        storage.add_item(start_id + i, vector)
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs",
+    [
+        ("flat", {}),
+        ("hnsw", {"hnsw_m": 8, "ef_search": 32}),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 200}),
+        ("ivf_pq", {"nlist": 4, "nprobe": 4, "pq_m": 4, "pq_nbits": 4, "train_size": 200}),
+    ],
+)
+def test_exact_vector_is_nearest(vectors, index_type, kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    add_all(storage, vectors)
+
+    assert storage.is_trained
+    ids, distances = storage.get_nns_by_vector(vectors[42], n=1)
+    assert ids == [142]
+
+
+def test_factory_string_is_passed_through():
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="IVF2,Flat")
+
+    assert storage.factory_string == "IVF2,Flat"
+    assert not storage.is_trained
+
+
+def test_untrained_index_answers_from_staging(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="ivf_flat", nlist=4, train_size=1000)
+    add_all(storage, vectors[:10])
+
+    assert not storage.is_trained
+    ids, _ = storage.get_nns_by_vector(vectors[3], n=1)
+    assert ids == [103]
+
+
+def test_build_index_trains_on_accumulated_vectors(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="ivf_flat", nlist=4, nprobe=4, train_size=1000)
+    add_all(storage, vectors[:50])
+
+    storage.build_index()
+
+    assert storage.is_trained
+    assert storage.index.ntotal == 50
+    ids, _ = storage.get_nns_by_vector(vectors[7], n=1)
+    assert ids == [107]
+
+
+def test_build_index_needs_enough_vectors(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="ivf_flat", nlist=64)
+    add_all(storage, vectors[:10])
+
+    with pytest.raises(ValueError):
+        storage.build_index()
+
+
+def test_fewer_results_than_requested_are_not_padded(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    add_all(storage, vectors[:2])
+
+    ids, distances = storage.get_nns_by_vector(vectors[0], n=5)
+
+    assert ids == [100, 101]
+    assert len(distances) == 2
+
+
+def test_set_search_params(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="ivf_flat", nlist=4, train_size=200)
+    add_all(storage, vectors)
+
+    storage.set_search_params(nprobe=2)
+
+    assert storage.nprobe == 2
+    assert faiss.extract_index_ivf(storage.index).nprobe == 2
+
+
+def test_ids_are_returned_natively(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    large_id = 2**62 + 7  # Proxy IDs use the full int64 range
+    storage.add_item(large_id, vectors[0])
+    storage.add_item(5, vectors[1])
+
+    ids, _ = storage.get_nns_by_vector(vectors[0], n=2)
+
+    assert ids == [large_id, 5]
+    assert storage.ids.dtype == np.int64
+    assert len(storage) == 2
+
+
+def test_ids_survive_training(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="ivf_flat", nlist=4, nprobe=4, train_size=100)
+    add_all(storage, vectors[:150], start_id=7000)
+
+    assert sorted(storage.ids.tolist()) == list(range(7000, 7150))
+    assert storage.get_nns_by_vector(vectors[120], n=1)[0] == [7120]
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs",
+    [
+        ("flat", {}),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 100}),
+        ("hnsw", {"hnsw_m": 8}),
+    ],
+)
+def test_removed_ids_are_never_returned(vectors, index_type, kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    add_all(storage, vectors[:150])
+
+    assert storage.remove_ids([110, 111, 99999]) == 2
+
+    ids, _ = storage.get_nns_by_vector(vectors[10], n=3)
+    assert 110 not in ids and 111 not in ids
+    assert len(ids) == 3
+    assert len(storage) == 148
+    assert storage.remove_ids([110]) == 0
+
+
+def test_hnsw_tombstones_are_compacted(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    add_all(storage, vectors[:20])
+    storage.remove_ids(list(range(100, 110)))
+
+    assert storage.tombstone_ratio == 0.5
+    storage.compact()
+
+    assert storage.tombstone_ratio == 0
+    assert storage.index.ntotal == 10
+    assert storage.get_nns_by_vector(vectors[15], n=1)[0] == [115]
+
+
+def test_readding_a_tombstoned_id(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    add_all(storage, vectors[:5])
+    storage.remove_item(100)
+
+    storage.add_item(100, vectors[50])
+
+    assert storage.get_nns_by_vector(vectors[50], n=1)[0] == [100]
+    assert storage.get_nns_by_vector(vectors[0], n=1)[0] != [100]
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs",
+    [
+        ("flat", {}),
+        ("hnsw", {"hnsw_m": 8}),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 200}),
+    ],
+)
+def test_readding_a_live_id_replaces_its_vector(vectors, index_type, kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    add_all(storage, vectors[:250])
+
+    storage.add_items([100], vectors[260:261])
+    storage.add_items([101, 101], vectors[270:272])
+
+    assert len(storage) == 250
+    assert sorted(storage.ids.tolist()) == list(range(100, 350))
+    assert storage.get_nns_by_vector(vectors[260], n=1)[0] == [100]
+    assert storage.get_nns_by_vector(vectors[271], n=1)[0] == [101]
+    for old in (vectors[0], vectors[1], vectors[270]):
+        ids, distances = storage.get_nns_by_vector(old, n=1)
+        assert distances[0] > 1e-6
+
+
+def test_readding_ids_does_not_compact(vectors, tmp_path):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    add_all(storage, vectors[:20])
+    storage.remove_ids([101])
+
+    storage.add_items([100, 101], vectors[20:22])
+
+    # The previous vectors stay in the index, hidden, until compaction
+    assert storage.index.ntotal == 22
+    assert not storage.tombstones
+    assert storage.tombstone_ratio == pytest.approx(2 / 22)
+    assert storage.get_nns_by_vector(vectors[0], n=20)[0].count(100) == 1
+    storage.save_index(str(tmp_path / "index.bin"))
+    restored = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    restored.load_index(str(tmp_path / "index.bin"))
+    for checked in (storage, restored):
+        checked.compact()
+        assert checked.index.ntotal == 20 and len(checked) == 20
+        assert checked.get_nns_by_vector(vectors[20], n=1) == ([100], [0.0])
+        assert checked.get_nns_by_vector(vectors[21], n=1) == ([101], [0.0])
+
+
+def test_ivf_removal_keeps_the_id_map(vectors):
+    storage = FaissEmbeddingStorage(
+        DIMENSION, "ivf_pq", nlist=4, nprobe=4, pq_m=4, pq_nbits=4, train_size=200
+    )
+    add_all(storage, vectors)
+    storage.remove_ids([100, 150])
+
+    assert [storage.get_nns_by_vector(v, n=1)[0] for v in vectors[1:5]] == [
+        [101], [102], [103], [104]
+    ]
+    before = [storage.get_nns_by_vector(v, n=3) for v in vectors[:10]]
+    storage.compact()
+
+    # The kept codes are copied, not re-encoded, so results are unchanged
+    assert storage.index.ntotal == 298 and not storage.tombstones
+    assert [storage.get_nns_by_vector(v, n=3) for v in vectors[:10]] == before
+
+
+def test_expired_ids(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.add_item(1, vectors[0], expires_at=100.0)
+    storage.add_item(2, vectors[1], expires_at=200.0)
+    storage.add_item(3, vectors[2])
+
+    assert storage.expired_ids(now=150.0).tolist() == [1]
+    assert sorted(storage.expired_ids(now=250.0).tolist()) == [1, 2]
+    assert len(storage.expired_ids(now=250.0, limit=1)) == 1
+
+
+def test_capacity_evicts_least_recently_hit_in_batches(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, max_entries=10, eviction_batch=4)
+    add_all(storage, vectors[:10])
+    storage.record_hit(100)
+
+    evicted = storage.add_item(200, vectors[10])
+
+    assert len(evicted) == 4 and 100 not in evicted and 200 not in evicted
+    assert len(storage) == 7
+    assert storage.drain_evictions() == evicted
+    assert storage.drain_evictions() == []
+    for item_id in evicted:
+        assert storage.get_nns_by_vector(vectors[item_id - 100], n=1)[0] != [item_id]
+
+
+def test_lfu_evicts_fewest_hits(vectors):
+    storage = FaissEmbeddingStorage(
+        DIMENSION, max_entries=3, eviction_policy="lfu", eviction_batch=1
+    )
+    add_all(storage, vectors[:3])
+    storage.record_hit(100)
+    storage.record_hit(101)
+
+    assert storage.add_item(103, vectors[3]) == [102]
+
+
+def test_byte_budget_bounds_the_index(vectors):
+    storage = FaissEmbeddingStorage(
+        DIMENSION, max_bytes=8 * 1024, eviction_batch=1
+    )
+    add_all(storage, vectors[:100])
+
+    assert len(storage) == storage.capacity
+    assert len(storage) * storage.entry_bytes <= 8 * 1024
+    assert storage.evicted == 100 - storage.capacity
+
+
+@pytest.mark.parametrize(
+    "index_type, kwargs",
+    [
+        ("flat", {}),
+        ("hnsw", {"hnsw_m": 8, "ef_search": 32}),
+        ("ivf_flat", {"nlist": 4, "nprobe": 4, "train_size": 200}),
+    ],
+)
+def test_batch_add_and_search_match_single_calls(vectors, index_type, kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type, **kwargs)
+    storage.add_items(np.arange(100, 400), vectors, expires_at=500.0)
+    storage.remove_ids([100])
+
+    assert len(storage) == 299 and storage.is_trained
+    assert storage.expired_ids(now=600.0).shape == (299,)
+    results = storage.get_nns_by_vectors(vectors[:5], n=3)
+    assert results == [storage.get_nns_by_vector(vector, n=3) for vector in vectors[:5]]
+    assert [ids[0] for ids, _ in results[1:]] == [101, 102, 103, 104]
+    assert 100 not in results[0][0]
+
+
+def test_batch_add_checks_shapes(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+
+    with pytest.raises(ValueError):
+        storage.add_items([1, 2], vectors[:3])
+    with pytest.raises(ValueError):
+        storage.add_items([1], vectors[:1, :8])
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat"])
+def test_cosine_metric_reports_cosine_distance(vectors, index_type):
+    storage = FaissEmbeddingStorage(
+        DIMENSION, index_type, metric="cosine", nlist=4, nprobe=4, hnsw_m=8, train_size=200
+    )
+    add_all(storage, vectors)
+    query = vectors[7] * 3.0  # Scaling does not change the cosine
+
+    ids, distances = storage.get_nns_by_vector(query, n=2)
+
+    assert ids[0] == 107
+    assert distances[0] == pytest.approx(0.0, abs=1e-5)
+    expected = vectors[ids[1] - 100] @ vectors[7] / (
+        np.linalg.norm(vectors[ids[1] - 100]) * np.linalg.norm(vectors[7])
+    )
+    assert storage.similarity(distances[1]) == pytest.approx(expected, abs=1e-5)
+
+
+def test_similarity_is_consistent_across_metrics(vectors):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    l2 = FaissEmbeddingStorage(DIMENSION)
+    cosine = FaissEmbeddingStorage(DIMENSION, metric="cosine")
+    add_all(l2, unit[:50])
+    add_all(cosine, unit[:50])
+
+    l2_ids, l2_distances = l2.get_nns_by_vector(unit[60], n=5)
+    cosine_ids, cosine_distances = cosine.get_nns_by_vector(unit[60], n=5)
+
+    assert l2_ids == cosine_ids
+    assert [l2.similarity(d) for d in l2_distances] == pytest.approx(
+        [cosine.similarity(d) for d in cosine_distances], abs=1e-5
+    )
+
+
+def test_loading_an_index_built_for_another_metric_fails(vectors, tmp_path):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    add_all(storage, vectors[:10])
+    storage.save_index(str(tmp_path / "index.bin"))
+
+    with pytest.raises(ValueError, match="cosine"):
+        FaissEmbeddingStorage(DIMENSION, metric="cosine").load_index(
+            str(tmp_path / "index.bin")
+        )
+
+
+@pytest.mark.parametrize(
+    "index_type, uncompressed, kwargs",
+    [
+        ("sq_fp16", "flat", {}),
+        ("sq8", "flat", {"train_size": 200}),
+        ("pq", "flat", {"pq_m": 4, "pq_nbits": 4, "train_size": 200}),
+        ("hnsw_sq8", "hnsw", {"hnsw_m": 8, "train_size": 200}),
+    ],
+)
+def test_compressed_encodings_shrink_entries(vectors, index_type, uncompressed, kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    add_all(storage, vectors)
+
+    assert storage.is_trained
+    baseline = FaissEmbeddingStorage(DIMENSION, index_type=uncompressed, **kwargs)
+    assert storage.entry_bytes < baseline.entry_bytes
+    assert 142 in storage.get_nns_by_vector(vectors[42], n=5)[0]
+
+
+@pytest.mark.parametrize("metric", ["l2", "cosine"])
+def test_rescoring_reports_exact_distances(vectors, metric, tmp_path):
+    exact = FaissEmbeddingStorage(DIMENSION, metric=metric)
+    storage = FaissEmbeddingStorage(
+        DIMENSION,
+        "pq",
+        metric=metric,
+        pq_m=4,
+        pq_nbits=4,
+        train_size=200,
+        rescore_k=50,
+        vector_dir=str(tmp_path),
+    )
+    add_all(exact, vectors)
+    add_all(storage, vectors)
+
+    query = vectors[42] + 0.01
+    ids, distances = storage.get_nns_by_vector(query, n=3)
+    exact_ids, exact_distances = exact.get_nns_by_vector(query, n=3)
+
+    assert ids == exact_ids
+    assert distances == pytest.approx(exact_distances, abs=1e-5)
+    np.testing.assert_allclose(storage.get_vectors([142]), exact.get_vectors([142]), atol=1e-6)
+
+
+def test_rescoring_vectors_follow_removal_and_snapshots(vectors, tmp_path):
+    kwargs = dict(index_type="sq8", train_size=200, rescore_k=20, vector_dir=str(tmp_path))
+    storage = FaissEmbeddingStorage(DIMENSION, **kwargs)
+    add_all(storage, vectors)
+    storage.remove_ids([142])
+    storage.save_index(str(tmp_path / "index.bin"))
+
+    restored = FaissEmbeddingStorage(DIMENSION, **kwargs)
+    restored.load_index(str(tmp_path / "index.bin"))
+
+    assert len(restored.vectors) == len(vectors) - 1
+    ids, distances = restored.get_nns_by_vector(vectors[43], n=1)
+    assert ids == [143]
+    assert distances[0] == pytest.approx(0.0, abs=1e-6)
+    assert 142 not in restored.get_nns_by_vector(vectors[42], n=5)[0]
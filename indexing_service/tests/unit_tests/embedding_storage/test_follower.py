@@ -0,0 +1,105 @@
+import faiss
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import (
+    FaissEmbeddingStorage,
+    SnapshotFollower,
+    SnapshotManager,
+)
+
+
+DIMENSION = 8
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((400, DIMENSION), dtype="float32")
+
+
+@pytest.mark.parametrize(
+    "index_type,kwargs",
+    [
+        ("flat", {}),
+        ("hnsw", {}),
+        ("sq8", {"train_size": 100}),
+        ("ivf_flat", {"nlist": 4, "train_size": 200}),
+        ("flat", {"rescore_k": 4}),
+    ],
+)
+def test_follower_loads_published_generations(tmp_path, vectors, index_type, kwargs):
+    writer = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    reader = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    published = SnapshotManager(str(tmp_path), keep=2)
+    follower = SnapshotFollower(SnapshotManager(str(tmp_path), keep=2), reader)
+
+    assert not follower.poll()
+    writer.add_items(list(range(300)), vectors[:300])
+    published.save(writer)
+    assert follower.poll()
+    assert follower.generation == 1
+    assert not follower.poll()
+
+    writer.add_items(list(range(300, 400)), vectors[300:])
+    published.save(writer)
+    assert follower.poll()
+    assert follower.generation == 2 and follower.reloads == 2
+    assert len(reader) == 400
+    ids, _ = reader.get_nns_by_vector(vectors[350], n=1)
+    assert ids == [350]
+
+
+def test_shared_storage_rejects_mutations(tmp_path, vectors):
+    writer = FaissEmbeddingStorage(DIMENSION, rescore_k=4)
+    writer.add_items(list(range(10)), vectors[:10])
+    writer.remove_ids([9])
+    writer.save_index(str(tmp_path / "index.bin"))
+
+    reader = FaissEmbeddingStorage(DIMENSION, rescore_k=4)
+    reader.load_index(str(tmp_path / "index.bin"), shared=True)
+
+    assert reader.read_only
+    with pytest.raises(RuntimeError):
+        reader.add_item(100, vectors[100])
+    with pytest.raises(RuntimeError):
+        reader.remove_ids([1])
+    ids, _ = reader.get_nns_by_vector(vectors[3], n=1)
+    assert ids == [3]
+
+    # Loading a private copy makes the storage writable again
+    reader.load_index(str(tmp_path / "index.bin"))
+    assert not reader.read_only
+    reader.add_item(100, vectors[100])
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat"])
+def test_shared_loads_without_in_place_mapping(tmp_path, vectors, monkeypatch, index_type):
+    kwargs = {"nlist": 4, "train_size": 200} if index_type == "ivf_flat" else {}
+    writer = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    writer.add_items(list(range(300)), vectors[:300])
+    writer.save_index(str(tmp_path / "index.bin"))
+    # As in FAISS releases before the flag was added
+    monkeypatch.delattr(faiss, "IO_FLAG_MMAP_IFC", raising=False)
+
+    reader = FaissEmbeddingStorage(DIMENSION, index_type=index_type, **kwargs)
+    reader.load_index(str(tmp_path / "index.bin"), shared=True)
+
+    assert reader.read_only
+    assert reader.get_nns_by_vector(vectors[42], n=1)[0] == [42]
+    with pytest.raises(RuntimeError):
+        reader.add_item(1000, vectors[0])
+
+
+def test_follower_skips_a_pruned_generation(tmp_path, vectors):
+    writer = FaissEmbeddingStorage(DIMENSION)
+    writer.add_items(list(range(10)), vectors[:10])
+    published = SnapshotManager(str(tmp_path))
+    published.save(writer)
+    follower = SnapshotFollower(SnapshotManager(str(tmp_path)), FaissEmbeddingStorage(DIMENSION))
+
+    generation, filepath = published.latest()
+    (tmp_path / f"snapshot-{generation:012d}" / "index.bin").unlink()
+
+    assert not follower.poll()
+    assert follower.generation is None
@@ -0,0 +1,82 @@
+import numpy as np
+
+from gptcache.embedding_storage.metadata import EntryMetadata
+
+
+def test_rows_are_recycled_and_grown():
+    metadata = EntryMetadata(capacity=2)
+    for i in range(5):
+        metadata.add(i, expires_at=float(i + 1))
+    metadata.remove([1, 3])
+    metadata.add(10, expires_at=100.0)
+
+    assert len(metadata) == 4
+    assert sorted(metadata.expired(now=50.0).tolist()) == [0, 2, 4]
+    assert metadata.expiry(10) == 100.0
+    assert metadata.expiry(1) is None
+
+
+def test_round_trip_through_arrays():
+    metadata = EntryMetadata()
+    metadata.add(7, expires_at=5.0)
+    metadata.add(8)
+
+    restored = EntryMetadata.from_arrays(metadata.to_arrays())
+
+    assert 7 in restored and 8 in restored
+    assert restored.expired(now=10.0).tolist() == [7]
+
+
+def test_victims_by_policy():
+    metadata = EntryMetadata()
+    metadata.add(1, now=0.0)
+    metadata.add(2, now=10.0)
+    metadata.add(3, now=20.0)
+    for _ in range(3):
+        metadata.record_hit(1, now=30.0)
+    metadata.record_hit(3, now=25.0)
+
+    assert metadata.victims(1, "lru", now=40.0).tolist() == [2]
+    assert metadata.victims(2, "lfu", now=40.0).tolist() == [2, 3]
+    # Hits long ago count for less than the same hits recently
+    metadata.add(4, now=10000.0)
+    metadata.record_hit(4, now=10000.0)
+    assert metadata.victims(1, "score", now=10000.0).tolist() == [2]
+    assert 4 not in metadata.victims(3, "score", now=10000.0).tolist()
+
+
+def test_hits_survive_round_trip():
+    metadata = EntryMetadata()
+    metadata.add(7, now=1.0)
+    metadata.record_hit(7, now=2.0)
+
+    assert EntryMetadata.from_arrays(metadata.to_arrays()).hit_count(7) == 1
+
+
+
+def test_negative_ids_can_be_evicted():
+    metadata = EntryMetadata(capacity=2)
+    for i, item_id in enumerate([-1, -5, 3]):
+        metadata.add(item_id, now=float(i))
+    metadata.remove([3])
+    restored = EntryMetadata.from_arrays(metadata.to_arrays())
+
+    assert metadata.victims(5, "lru", now=10.0).tolist() == [-1, -5]
+    assert restored.victims(1, "lfu", now=10.0).tolist() == [-1]
+
+
+def test_victims_are_the_least_valuable_of_many():
+    rng = np.random.default_rng(0)
+    metadata = EntryMetadata()
+    for item_id in range(1000):
+        metadata.add(item_id, now=float(rng.integers(100)))
+        for _ in range(int(rng.integers(3))):
+            metadata.record_hit(item_id, now=float(rng.integers(100, 200)))
+    hits, last_hit = metadata.hits[:1000], metadata.last_hit[:1000]
+
+    victims = metadata.victims(50, "lru", now=300.0)
+    assert last_hit[victims].tolist() == np.sort(last_hit)[:50].tolist()
+    victims = metadata.victims(50, "lfu", now=300.0)
+    expected = np.lexsort((last_hit, hits))[:50]
+    assert hits[victims].tolist() == hits[expected].tolist()
+    assert last_hit[victims].tolist() == last_hit[expected].tolist()
@@ -0,0 +1,151 @@
+import os
+
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import (
+    AnnoyEmbeddingStorage,
+    FaissEmbeddingStorage,
+    SnapshotManager,
+)
+
+
+DIMENSION = 8
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((200, DIMENSION), dtype="float32")
+
+
+def filled_storage(vectors, **kwargs):
+    storage = FaissEmbeddingStorage(DIMENSION, **kwargs)
+    for i, vector in enumerate(vectors):
+        storage.add_item(1000 + i, vector)
+    return storage
+
+
+def test_load_latest_without_snapshots(tmp_path):
+    snapshots = SnapshotManager(str(tmp_path))
+
+    assert snapshots.load_latest(FaissEmbeddingStorage(DIMENSION)) is None
+
+
+def test_snapshot_restores_index_and_ids(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    storage = filled_storage(vectors[:20])
+
+    assert snapshots.save(storage) == 1
+
+    restored = FaissEmbeddingStorage(DIMENSION)
+    assert snapshots.load_latest(restored) == 1
+    assert restored.ids.tolist() == storage.ids.tolist()
+    ids, _ = restored.get_nns_by_vector(vectors[5], n=1)
+    assert ids == [1005]
+
+
+def test_snapshots_are_atomic_and_pruned(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path), keep=2)
+    storage = filled_storage(vectors[:5])
+
+    for i in range(4):
+        storage.add_item(5000 + i, vectors[10 + i])
+        snapshots.save(storage)
+
+    assert snapshots.generations() == [3, 4]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_unfinished_snapshot_is_ignored(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    snapshots.save(filled_storage(vectors[:5]))
+    os.makedirs(tmp_path / "snapshot-000000000002.tmp")
+
+    restored = FaissEmbeddingStorage(DIMENSION)
+    assert snapshots.load_latest(restored) == 1
+    assert len(restored) == 5
+
+
+def test_unchanged_storage_is_not_snapshotted_again(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    storage = filled_storage(vectors[:5])
+
+    assert snapshots.save_if_changed(storage) == 1
+    assert snapshots.save_if_changed(storage) is None
+    storage.add_item(9, vectors[9])
+    assert snapshots.save_if_changed(storage) == 2
+
+
+def test_stop_writes_final_snapshot(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    storage = filled_storage(vectors[:5])
+
+    snapshots.start(storage, interval_seconds=3600)
+    snapshots.stop(storage)
+
+    assert snapshots.generations() == [1]
+
+
+def test_mmapped_ivf_index_accepts_new_items(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    kwargs = {"index_type": "ivf_flat", "nlist": 4, "nprobe": 4, "train_size": 100}
+    snapshots.save(filled_storage(vectors[:150], **kwargs))
+
+    restored = FaissEmbeddingStorage(DIMENSION, **kwargs)
+    snapshots.load_latest(restored, mmap=True)
+    restored.add_item(42, vectors[199])
+
+    assert restored.get_nns_by_vector(vectors[199], n=1)[0] == [42]
+    assert restored.get_nns_by_vector(vectors[3], n=1)[0] == [1003]
+
+
+def test_untrained_staged_vectors_survive_restart(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    kwargs = {"index_type": "ivf_flat", "nlist": 4, "train_size": 1000}
+    snapshots.save(filled_storage(vectors[:10], **kwargs))
+
+    restored = FaissEmbeddingStorage(DIMENSION, **kwargs)
+    snapshots.load_latest(restored)
+
+    assert not restored.is_trained
+    assert restored.get_nns_by_vector(vectors[4], n=1)[0] == [1004]
+
+
+def test_dimension_mismatch_is_rejected(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    snapshots.save(filled_storage(vectors[:5]))
+
+    with pytest.raises(ValueError):
+        snapshots.load_latest(FaissEmbeddingStorage(DIMENSION * 2))
+
+
+def test_annoy_snapshot_round_trip(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    storage = AnnoyEmbeddingStorage(DIMENSION)
+    for i, vector in enumerate(vectors[:20]):
+        storage.add_item(i, vector.tolist())
+    storage.build_index(num_trees=5)
+    snapshots.save(storage)
+
+    restored = AnnoyEmbeddingStorage(DIMENSION)
+    snapshots.load_latest(restored)
+
+    ids, _ = restored.get_nns_by_vector(vectors[7].tolist(), n=1)
+    assert ids == [7]
+
+
+def test_metadata_and_tombstones_survive_restart(tmp_path, vectors):
+    snapshots = SnapshotManager(str(tmp_path))
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    storage.add_item(1, vectors[1], expires_at=500.0)
+    storage.add_item(2, vectors[2])
+    storage.remove_ids([2])
+    snapshots.save(storage)
+
+    restored = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    snapshots.load_latest(restored)
+
+    assert restored.tombstones == {2}
+    assert restored.ids.tolist() == [1]
+    assert restored.expired_ids(now=600.0).tolist() == [1]
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import FaissEmbeddingStorage, TTLSweeper
+
+
+DIMENSION = 4
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((50, DIMENSION), dtype="float32")
+
+
+def test_sweep_removes_expired_entries_in_batches(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    for i in range(10):
+        storage.add_item(i, vectors[i], expires_at=100.0 if i < 7 else None)
+    batches = []
+    sweeper = TTLSweeper(storage, batch_size=3, on_removed=batches.append)
+
+    assert sweeper.sweep(now=150.0) == 7
+
+    assert sorted(storage.ids.tolist()) == [7, 8, 9]
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_sweep_compacts_past_tombstone_threshold(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION, index_type="hnsw", hnsw_m=8)
+    for i in range(10):
+        storage.add_item(i, vectors[i], expires_at=100.0 if i < 3 else None)
+    sweeper = TTLSweeper(storage, rebuild_threshold=0.2)
+
+    sweeper.sweep(now=150.0)
+
+    assert sweeper.compactions == 1
+    assert storage.tombstones == set()
+    assert storage.index.ntotal == 7
+
+
+def test_sweep_without_expired_entries(vectors):
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.add_item(1, vectors[1], expires_at=100.0)
+    sweeper = TTLSweeper(storage)
+
+    assert sweeper.sweep(now=50.0) == 0
+    assert sweeper.compactions == 0
@@ -0,0 +1,155 @@
+import os
+import threading
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import (
+    FaissEmbeddingStorage,
+    SnapshotManager,
+    WriteAheadLog,
+)
+
+
+DIMENSION = 4
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return rng.random((50, DIMENSION), dtype="float32")
+
+
+def test_records_are_replayed_by_the_next_process(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path), DIMENSION)
+    for i in range(3):
+        wal.commit(wal.append(10 + i, vectors[i]))
+    wal.close()
+
+    reopened = WriteAheadLog(str(tmp_path), DIMENSION)
+    records = list(reopened.records())
+    reopened.close()
+
+    assert [item_id for _, item_id, _, _ in records] == [10, 11, 12]
+    np.testing.assert_array_equal(records[1][3], vectors[1])
+
+
+def test_torn_tail_is_ignored(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path), DIMENSION)
+    wal.append(1, vectors[0])
+    wal.append(2, vectors[1])
+    wal.close()
+    path = os.path.join(tmp_path, "wal-000000000001.log")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    reopened = WriteAheadLog(str(tmp_path), DIMENSION)
+
+    assert [item_id for _, item_id, _, _ in reopened.records()] == [1]
+    reopened.close()
+
+
+def test_concurrent_commits_share_fsyncs(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path), DIMENSION, sync_interval_ms=20, sync_batch=1000)
+    fsyncs = []
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        fsyncs.append(fd)
+        real_fsync(fd)
+
+    with patch("gptcache.embedding_storage.wal.os.fsync", counting_fsync):
+        threads = [
+            threading.Thread(target=lambda i=i: wal.commit(wal.append(i, vectors[i])))
+            for i in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(fsyncs) < 20
+    wal.close()
+
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    wal = WriteAheadLog(str(tmp_path), DIMENSION)
+
+    with pytest.raises(ValueError):
+        wal.append(1, [0.0] * (DIMENSION + 1))
+    wal.close()
+
+
+def test_adds_after_snapshot_survive_a_crash(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    snapshots = SnapshotManager(str(tmp_path / "snapshots"), wal=wal)
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.wal = wal
+
+    for i in range(5):
+        storage.add_item(i, vectors[i])
+    snapshots.save(storage)
+    for i in range(5, 8):
+        storage.add_item(i, vectors[i])
+    wal.close()  # Simulate a crash: no final snapshot
+
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    restored = FaissEmbeddingStorage(DIMENSION)
+    SnapshotManager(str(tmp_path / "snapshots"), wal=wal).load_latest(restored)
+
+    assert restored.ids.tolist() == list(range(8))
+    assert restored.get_nns_by_vector(vectors[6], n=1)[0] == [6]
+    wal.close()
+
+
+def test_snapshot_truncates_covered_segments(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    snapshots = SnapshotManager(str(tmp_path / "snapshots"), wal=wal)
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.wal = wal
+
+    storage.add_item(1, vectors[1])
+    assert wal.pending_bytes > 0
+    snapshots.save(storage)
+
+    assert wal.segments() == [wal.segment]
+    assert wal.pending_bytes == 0
+    assert list(wal.records()) == []
+    wal.close()
+
+
+def test_log_size_triggers_compaction(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    snapshots = SnapshotManager(str(tmp_path / "snapshots"), wal=wal)
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.wal = wal
+
+    snapshots.start(storage, interval_seconds=3600, compact_bytes=1)
+    storage.add_item(1, vectors[1])
+    for _ in range(150):
+        if snapshots.generations():
+            break
+        threading.Event().wait(0.02)
+    snapshots.stop()
+    wal.close()
+
+    assert snapshots.generations() == [1]
+
+
+def test_removes_and_expiry_are_replayed(tmp_path, vectors):
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.wal = wal
+    storage.add_item(1, vectors[1], expires_at=12345.0)
+    storage.add_item(2, vectors[2])
+    storage.remove_ids([2])
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path / "wal"), DIMENSION)
+    restored = FaissEmbeddingStorage(DIMENSION)
+    SnapshotManager(str(tmp_path / "snapshots"), wal=wal).load_latest(restored)
+    wal.close()
+
+    assert restored.ids.tolist() == [1]
+    assert restored.metadata.expiry(1) == 12345.0
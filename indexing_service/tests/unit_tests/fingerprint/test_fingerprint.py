@@ -0,0 +1,127 @@
+import pytest
+
+from gptcache.fingerprint import FingerprintTable, FingerprintTier, SimHashIndex, simhash
+
+
+def test_table_matches_texts_up_to_whitespace():
+    table = FingerprintTable()
+    table.add([1, 2], ["How do I sort a list?", "What is Python?"])
+
+    assert table.lookup("  How do I   sort a list? ") == 1
+    assert table.lookup("how do I sort a list?") is None
+    assert table.lookup("How do I sort a dict?") is None
+
+
+def test_table_casefold_ignores_case():
+    table = FingerprintTable(normalization="casefold")
+    table.add([1], ["How do I sort a list?"])
+
+    assert table.lookup("HOW DO I SORT A LIST?") == 1
+
+
+def test_table_rejects_unknown_normalization():
+    with pytest.raises(ValueError):
+        FingerprintTable(normalization="stemmed")
+
+
+def test_table_drops_least_recently_used_fingerprints():
+    table = FingerprintTable(max_entries=2)
+    table.add([1, 2], ["a", "b"])
+    assert table.lookup("a") == 1
+    table.add([3], ["c"])
+
+    assert len(table) == 2
+    assert table.lookup("b") is None
+    assert table.lookup("a") == 1
+
+
+def test_table_removal_and_readds():
+    table = FingerprintTable()
+    table.add([1], ["first"])
+    table.add([1], ["second"])
+    assert table.lookup("first") is None
+    assert table.lookup("second") == 1
+
+    # A later ID with the same text takes the fingerprint over, and keeps it when the
+    # earlier one is removed
+    table.add([2], ["second"])
+    table.remove([1])
+    assert table.lookup("second") == 2
+    table.remove([2])
+    assert table.lookup("second") is None
+    assert len(table) == 0
+
+
+def test_simhash_is_stable_and_ignores_punctuation_and_case():
+    text = "How do I reverse a linked list in Python without recursion"
+
+    assert simhash(text) == simhash(text)
+    assert simhash(text) == simhash(text.upper() + "?!")
+    assert simhash("") == 0
+
+
+def test_simhash_of_near_identical_texts_are_close():
+    text = "How do I reverse a linked list in Python without using recursion or extra memory"
+    typo = "How do I reverse a linked list in Python without using recursion or extra memroy"
+    other = "What are the best hiking trails near Seattle for a weekend trip"
+
+    assert (simhash(text) ^ simhash(typo)).bit_count() < (simhash(text) ^ simhash(other)).bit_count()
+    assert (simhash(text) ^ simhash(other)).bit_count() > 10
+
+
+def test_simhash_index_finds_signatures_within_the_distance():
+    index = SimHashIndex(max_distance=3)
+    text = "How do I reverse a linked list in Python without recursion"
+    index.add([7, 8], [text, "What are the best hiking trails near Seattle"])
+
+    assert index.lookup(text + "!") == (7, 0)
+    assert index.lookup("Explain the theory of general relativity simply") is None
+
+
+def test_simhash_index_matches_exactly_the_signatures_within_the_distance():
+    index = SimHashIndex(max_distance=3)
+    texts = [f"question number {i} about topic {i * 7} and detail {i * 13}" for i in range(200)]
+    index.add(list(range(200)), texts)
+    signatures = [simhash(t) for t in texts]
+
+    for probe in ("question number 5 about topic 35 and detail 66", "unrelated words here"):
+        signature = simhash(probe)
+        distances = [(s ^ signature).bit_count() for s in signatures]
+        best = min(range(200), key=lambda i: distances[i])
+        match = index.lookup(probe)
+        if distances[best] <= 3:
+            assert match is not None and match[1] == distances[best]
+        else:
+            assert match is None
+
+
+def test_simhash_index_removal_and_bound():
+    index = SimHashIndex(max_distance=2, max_entries=2)
+    index.add([1, 2, 3], ["alpha beta gamma", "delta epsilon zeta", "eta theta iota"])
+
+    assert len(index) == 2
+    assert index.lookup("alpha beta gamma") is None
+    index.remove([2])
+    assert index.lookup("delta epsilon zeta") is None
+    assert index.lookup("eta theta iota") == (3, 0)
+
+
+def test_tier_checks_hits_against_the_index():
+    tier = FingerprintTier(FingerprintTable(), near=SimHashIndex())
+    tier.add([1, 2], ["cached prompt one here", "cached prompt two here"])
+    live = {1}
+
+    assert tier.lookup("cached prompt one here", live) == (1, "exact")
+    assert tier.lookup("Cached prompt one here!", live) == (1, "near")
+    # Near matches count once the caller has checked them
+    assert tier.stats.snapshot()["lookups"] == 1
+    tier.record_near(hit=True)
+    # Entry 2 left the index, e.g. expired, so it is dropped from the tier
+    assert tier.lookup("cached prompt two here", live) is None
+    assert len(tier.table) == 1 and len(tier.near) == 1
+
+    stats = tier.stats.snapshot()
+    assert stats["lookups"] == 3
+    assert stats["exact_hits"] == 1 and stats["near_hits"] == 1
+    assert stats["stale"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+
+from gptcache.embedding_storage import FaissEmbeddingStorage
+from gptcache.rerank import BaseReranker, RerankingSearch, TextStore
+
+
+DIMENSION = 8
+
+
+class ReversingReranker(BaseReranker):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def rerank(self, query, query_vector, candidates, deadline):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [{**c, "score": -c["score"]} for c in reversed(candidates)]
+
+
+def storage_with_vectors(count=20):
+    vectors = np.random.default_rng(0).random((count, DIMENSION), dtype="float32")
+    storage = FaissEmbeddingStorage(DIMENSION)
+    storage.add_items(np.arange(count), vectors)
+    return storage, vectors
+
+
+def test_candidates_are_ranked_by_the_index_without_reranker():
+    storage, vectors = storage_with_vectors()
+    search = RerankingSearch(storage, k=3)
+
+    candidates = search.search("", vectors[4])
+
+    assert len(candidates) == 3 and candidates[0]["id"] == 4
+    assert candidates[0]["score"] == candidates[0]["similarity"] == storage.similarity(0.0)
+    assert search.stats.snapshot()["queries"] == 1
+
+
+def test_reranker_reorders_each_query_of_a_batch():
+    storage, vectors = storage_with_vectors()
+    reranker = ReversingReranker()
+    search = RerankingSearch(storage, reranker=reranker, k=3)
+
+    results = search.search_batch(["a", "b"], vectors[:2])
+
+    assert reranker.calls == 2
+    assert [r[-1]["id"] for r in results] == [0, 1]
+    assert search.stats.snapshot()["reranked"] == 2
+
+
+def test_reranking_is_skipped_when_candidate_stage_overruns():
+    storage, vectors = storage_with_vectors()
+    reranker = ReversingReranker()
+    search = RerankingSearch(storage, reranker=reranker, k=3, candidate_budget_ms=1e-6)
+
+    candidates = search.search("", vectors[4])
+
+    assert reranker.calls == 0 and candidates[0]["id"] == 4
+    assert search.stats.snapshot()["skipped_over_budget"] == 1
+
+
+def test_slow_reranker_is_counted_as_truncated():
+    storage, vectors = storage_with_vectors()
+    search = RerankingSearch(
+        storage, reranker=ReversingReranker(delay=0.01), k=3, rerank_budget_ms=1
+    )
+
+    search.search("", vectors[4])
+
+    assert search.stats.snapshot()["truncated_at_deadline"] == 1
+
+
+def test_texts_are_remembered_and_forgotten():
+    storage, _ = storage_with_vectors()
+    search = RerankingSearch(storage, texts=TextStore())
+
+    search.remember([1, 2], ["one", "two"])
+    search.forget([1])
+
+    assert search.texts.get(1) is None and search.texts.get(2) == "two"
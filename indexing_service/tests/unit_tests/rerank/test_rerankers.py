@@ -0,0 +1,115 @@
+import time
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from gptcache.embedding_storage import AnnoyEmbeddingStorage, FaissEmbeddingStorage
+from gptcache.rerank import (
+    CrossEncoderReranker,
+    ExactReranker,
+    LexicalReranker,
+    TextStore,
+)
+
+
+def candidate(item_id, similarity):
+    return {
+        "id": item_id,
+        "distance": 1 - similarity,
+        "similarity": similarity,
+        "score": similarity,
+    }
+
+
+def test_exact_reranker_fixes_approximate_distances():
+    rng = np.random.default_rng(0)
+    vectors = rng.random((4, 8), dtype="float32")
+    storage = FaissEmbeddingStorage(8)
+    storage.add_items([10, 11, 12, 13], vectors)
+    query = vectors[2] + 0.01
+
+    # Candidates in the wrong order with made-up distances, as an ANN index might return
+    candidates = [candidate(10, 0.9), candidate(12, 0.8)]
+    reranked = ExactReranker(storage).rerank("", query, candidates, float("inf"))
+
+    assert [c["id"] for c in reranked] == [12, 10]
+    assert reranked[0]["distance"] == pytest.approx(((vectors[2] - query) ** 2).sum(), rel=1e-4)
+    assert reranked[0]["score"] == storage.similarity(reranked[0]["distance"])
+
+
+@pytest.mark.parametrize("metric", ["angular", "euclidean", "dot"])
+def test_exact_reranker_measures_annoy_metrics(metric):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((4, 8), dtype="float32")
+    storage = AnnoyEmbeddingStorage(8, metric=metric, rebuild_threshold=None)
+    storage.add_items([10, 11, 12, 13], vectors)
+    ids, distances = storage.get_nns_by_vector(vectors[0], n=4)
+
+    candidates = [candidate(i, 0.5) for i in ids]
+    reranked = ExactReranker(storage).rerank("", vectors[0], candidates, float("inf"))
+
+    assert [c["id"] for c in reranked] == ids
+    assert [c["distance"] for c in reranked] == pytest.approx(distances, abs=1e-3)
+
+
+@pytest.mark.parametrize("storage", [AnnoyEmbeddingStorage(8), FaissEmbeddingStorage(8)])
+def test_exact_reranker_drops_removed_candidates(storage):
+    vectors = np.random.default_rng(0).random((3, 8), dtype="float32")
+    storage.add_items([10, 11, 12], vectors)
+    candidates = [candidate(10, 0.9), candidate(11, 0.8), candidate(12, 0.7)]
+    storage.remove_ids([11])
+
+    reranked = ExactReranker(storage).rerank("", vectors[2], candidates, float("inf"))
+
+    assert [c["id"] for c in reranked] == [12, 10]
+    storage.remove_ids([10, 12])
+    assert ExactReranker(storage).rerank("", vectors[2], candidates, float("inf")) == []
+
+
+def test_lexical_reranker_rejects_low_overlap():
+    texts = TextStore()
+    texts.add(1, "What is the capital of France?")
+    texts.add(2, "What is the capital of Germany?")
+    reranker = LexicalReranker(texts, weight=0.5, min_overlap=0.9)
+
+    candidates = [candidate(2, 0.95), candidate(1, 0.9)]
+    reranked = reranker.rerank("what is the  capital of france", None, candidates, float("inf"))
+
+    assert [c["id"] for c in reranked] == [1]
+    assert reranked[0]["score"] == pytest.approx(0.95)
+
+
+def test_lexical_reranker_keeps_candidates_without_text_or_time():
+    reranker = LexicalReranker(TextStore(), min_overlap=1.0)
+    candidates = [candidate(1, 0.9), candidate(2, 0.8)]
+
+    assert reranker.rerank("query", None, candidates, float("inf")) == candidates
+    reranker.texts.add(1, "something else")
+    assert reranker.rerank("query", None, candidates, time.monotonic() - 1) == candidates
+
+
+def test_cross_encoder_reranker_scores_pairs():
+    texts = TextStore()
+    texts.add(1, "a")
+    texts.add(2, "b")
+    model = Mock()
+    model.predict.side_effect = lambda pairs, batch_size: [
+        0.2 if text == "a" else 0.7 for _, text in pairs
+    ]
+    reranker = CrossEncoderReranker(texts, min_score=0.5, batch_size=1, model=model)
+
+    reranked = reranker.rerank(
+        "q", None, [candidate(1, 0.9), candidate(2, 0.8), candidate(3, 0.1)], float("inf")
+    )
+
+    assert [(c["id"], c["score"]) for c in reranked] == [(2, 0.7), (3, 0.1)]
+
+
+def test_text_store_is_bounded():
+    texts = TextStore(max_entries=2)
+    for i in range(3):
+        texts.add(i, str(i))
+    texts.remove([2])
+
+    assert len(texts) == 1 and texts.get(1) == "1" and texts.get(0) is None
@@ -0,0 +1,18 @@
+import json
+import logging
+
+from gptcache.utils.log import JsonFormatter
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord(
+        "gptcache.test", logging.INFO, __file__, 1, "Served %d queries", (3,), None
+    )
+    record.hit = True
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "gptcache.test"
+    assert entry["message"] == "Served 3 queries"
+    assert entry["hit"] is True
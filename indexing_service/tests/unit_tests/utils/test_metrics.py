@@ -0,0 +1,67 @@
+import pytest
+
+from gptcache.utils.metrics import Registry
+
+
+def test_counter_and_gauge_render():
+    registry = Registry()
+    results = registry.counter("results_total", "Query results.", ("result",))
+    size = registry.gauge("size", "Index size.")
+    results.labels("hit").inc()
+    results.labels("hit").inc(2)
+    results.labels("miss").inc()
+    size.set(42)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE results_total counter" in lines
+    assert 'results_total{result="hit"} 3' in lines
+    assert 'results_total{result="miss"} 1' in lines
+    assert "size 42" in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert 'latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_count 4" in lines
+    assert "latency_seconds_sum 2.65" in lines
+
+
+def test_histogram_times_blocks():
+    registry = Registry()
+    stage = registry.histogram("stage_seconds", "Stages.", ("stage",))
+
+    with stage.labels("encode").time():
+        pass
+
+    assert 'stage_seconds_count{stage="encode"} 1' in registry.render().splitlines()
+
+
+def test_metrics_are_registered_once():
+    registry = Registry()
+    first = registry.counter("hits_total", "Hits.")
+
+    assert registry.counter("hits_total", "Hits.") is first
+    with pytest.raises(ValueError):
+        registry.gauge("hits_total", "Hits.")
+
+
+def test_labels_are_checked_and_escaped():
+    registry = Registry()
+    gauge = registry.gauge("entries", "Entries.", ("namespace",))
+    gauge.labels('a"b').set(1)
+
+    assert 'entries{namespace="a\\"b"} 1' in registry.render().splitlines()
+    with pytest.raises(ValueError):
+        gauge.labels("a", "b")
+
+    gauge.clear()
+    assert "entries{" not in registry.render()
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from gptcache.utils.rwlock import RWLock
+
+
+def test_readers_share_the_lock():
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=5)
+
+    def reader():
+        with lock.read():
+            # Only passes if all three readers hold the lock at once
+            inside.wait()
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert not any(thread.is_alive() for thread in threads)
+
+
+def test_writer_excludes_readers_and_writers():
+    lock = RWLock()
+    active = []
+    overlaps = []
+
+    def enter(kind):
+        active.append(kind)
+        if "write" in active and len(active) > 1:
+            overlaps.append(list(active))
+        time.sleep(0.001)
+        active.remove(kind)
+
+    def writer():
+        for _ in range(50):
+            with lock.write():
+                enter("write")
+
+    def reader():
+        for _ in range(50):
+            with lock.read():
+                enter("read")
+
+    threads = [threading.Thread(target=writer) for _ in range(2)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == []
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    order = []
+    lock.acquire_read()
+
+    writer = threading.Thread(
+        target=lambda: (lock.acquire_write(), order.append("write"), lock.release_write())
+    )
+    writer.start()
+    while not lock._waiting_writers:
+        time.sleep(0.001)
+    reader = threading.Thread(
+        target=lambda: (lock.acquire_read(), order.append("read"), lock.release_read())
+    )
+    reader.start()
+    time.sleep(0.05)
+    # Neither may proceed while the first reader holds the lock
+    assert order == []
+
+    lock.release_read()
+    writer.join(timeout=5)
+    reader.join(timeout=5)
+    assert order == ["write", "read"]
+
+
+def test_nested_read_does_not_queue_behind_a_waiting_writer():
+    lock = RWLock()
+    lock.acquire_read()
+    writer = threading.Thread(target=lambda: (lock.acquire_write(), lock.release_write()))
+    writer.start()
+    while not lock._waiting_writers:
+        time.sleep(0.001)
+
+    with lock.read():
+        pass
+
+    lock.release_read()
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+
+
+def test_writer_is_reentrant_and_may_read():
+    lock = RWLock()
+    with lock:
+        with lock.write():
+            with lock.read():
+                pass
+    # Released entirely, so another thread can write
+    thread = threading.Thread(target=lambda: lock.write().__enter__())
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_upgrade_and_foreign_release_raise():
+    lock = RWLock()
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    with pytest.raises(RuntimeError):
+        lock.release_write()
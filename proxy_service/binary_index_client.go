@@ -0,0 +1,214 @@
+package main
+
+import (
+	"encoding/binary"
+	"errors"
+	"fmt"
+	"io"
+	"math"
+	"net"
+	"strings"
+	"sync"
+	"time"
+)
+
+// Ops, flags and statuses of the indexing service's binary protocol. The wire format
+// is described in indexing_service/app/transport/protocol.py.
+const (
+	binaryHeaderSize = 12
+
+	binaryOpQuery = 1
+	binaryOpAdd   = 2
+
+	binaryStatusOK          = 0
+	binaryStatusBusy        = 3
+	binaryStatusUnavailable = 4
+)
+
+type binaryResponse struct {
+	status  byte
+	payload []byte
+	err     error
+}
+
+// BinaryIndexConn is a persistent connection to the binary protocol of the index
+// service, over a Unix socket or TCP. It is shared by concurrent callers: their
+// requests are pipelined on the one connection, and each response is routed back to
+// its caller by request ID. A broken connection is dialled again by the next request.
+type BinaryIndexConn struct {
+	network string
+	address string
+	timeout time.Duration
+
+	mu      sync.Mutex // Guards the fields below and serialises writes
+	conn    net.Conn
+	nextID  uint32
+	pending map[uint32]chan binaryResponse
+}
+
+// ParseBinaryAddr splits "unix:/path/to.sock" or "host:port" into a network and an address.
+func ParseBinaryAddr(addr string) (string, string) {
+	if path, ok := strings.CutPrefix(addr, "unix:"); ok {
+		return "unix", path
+	}
+	return "tcp", addr
+}
+
+func NewBinaryIndexConn(addr string, timeout time.Duration) *BinaryIndexConn {
+	network, address := ParseBinaryAddr(addr)
+	return &BinaryIndexConn{
+		network: network,
+		address: address,
+		timeout: timeout,
+		pending: make(map[uint32]chan binaryResponse),
+	}
+}
+
+// QueryIndex has the same contract as IndexClient.QueryIndex.
+func (b *BinaryIndexConn) QueryIndex(context string, distanceThreshold float32) (QueryResponse, error) {
+	payload := binary.LittleEndian.AppendUint64(nil, math.Float64bits(float64(distanceThreshold)))
+	payload = appendBinaryString(payload, "") // Default namespace
+	payload = binary.LittleEndian.AppendUint32(payload, 1)
+	payload = appendBinaryString(payload, context)
+
+	resp, err := b.do(binaryOpQuery, payload)
+	if err != nil {
+		return QueryResponse{}, err
+	}
+	if len(resp) != 4+24 || binary.LittleEndian.Uint32(resp) != 1 {
+		return QueryResponse{}, errors.New("malformed query response from index service")
+	}
+
+	// No match has ID -1, returned as an empty response as over HTTP
+	id := int64(binary.LittleEndian.Uint64(resp[4:]))
+	if id < 0 {
+		return QueryResponse{}, nil
+	}
+	return QueryResponse{
+		Id:         id,
+		Distance:   float32(math.Float64frombits(binary.LittleEndian.Uint64(resp[12:]))),
+		Similarity: float32(math.Float64frombits(binary.LittleEndian.Uint64(resp[20:]))),
+	}, nil
+}
+
+// AddIndex has the same contract as IndexClient.AddIndex.
+func (b *BinaryIndexConn) AddIndex(id int64, context string) error {
+	payload := appendBinaryString(nil, "") // Default namespace
+	payload = binary.LittleEndian.AppendUint32(payload, 1)
+	payload = binary.LittleEndian.AppendUint64(payload, uint64(id))
+	payload = binary.LittleEndian.AppendUint64(payload, 0) // No TTL
+	payload = appendBinaryString(payload, context)
+
+	_, err := b.do(binaryOpAdd, payload)
+	return err
+}
+
+// Close closes the connection; pending requests fail.
+func (b *BinaryIndexConn) Close() {
+	b.mu.Lock()
+	conn := b.conn
+	b.mu.Unlock()
+	if conn != nil {
+		b.fail(conn, errors.New("connection to index service closed"))
+	}
+}
+
+func appendBinaryString(buf []byte, s string) []byte {
+	buf = binary.LittleEndian.AppendUint32(buf, uint32(len(s)))
+	return append(buf, s...)
+}
+
+// do sends a request and waits for the payload of its response.
+func (b *BinaryIndexConn) do(op byte, payload []byte) ([]byte, error) {
+	frame := make([]byte, binaryHeaderSize, binaryHeaderSize+len(payload))
+	binary.LittleEndian.PutUint32(frame[0:], uint32(len(payload)))
+	frame[8] = op
+	frame = append(frame, payload...)
+	ch := make(chan binaryResponse, 1)
+
+	b.mu.Lock()
+	if b.conn == nil {
+		conn, err := net.DialTimeout(b.network, b.address, b.timeout)
+		if err != nil {
+			b.mu.Unlock()
+			return nil, err
+		}
+		b.conn = conn
+		go b.readLoop(conn)
+	}
+	conn := b.conn
+	b.nextID++
+	id := b.nextID
+	binary.LittleEndian.PutUint32(frame[4:], id)
+	b.pending[id] = ch
+	conn.SetWriteDeadline(time.Now().Add(b.timeout))
+	_, err := conn.Write(frame)
+	b.mu.Unlock()
+	if err != nil {
+		b.fail(conn, err)
+	}
+
+	timer := time.NewTimer(b.timeout)
+	defer timer.Stop()
+	select {
+	case resp := <-ch:
+		if resp.err != nil {
+			return nil, resp.err
+		}
+		switch resp.status {
+		case binaryStatusOK:
+			return resp.payload, nil
+		case binaryStatusUnavailable:
+			return nil, ErrIndexUnavailable
+		case binaryStatusBusy:
+			return nil, fmt.Errorf("index service busy: %s", resp.payload)
+		default:
+			return nil, errors.New(string(resp.payload))
+		}
+	case <-timer.C:
+		b.mu.Lock()
+		delete(b.pending, id)
+		b.mu.Unlock()
+		return nil, errors.New("index service request timed out")
+	}
+}
+
+// readLoop routes the responses read from conn to their callers until it fails.
+func (b *BinaryIndexConn) readLoop(conn net.Conn) {
+	header := make([]byte, binaryHeaderSize)
+	for {
+		if _, err := io.ReadFull(conn, header); err != nil {
+			b.fail(conn, err)
+			return
+		}
+		payload := make([]byte, binary.LittleEndian.Uint32(header[0:]))
+		if _, err := io.ReadFull(conn, payload); err != nil {
+			b.fail(conn, err)
+			return
+		}
+
+		id := binary.LittleEndian.Uint32(header[4:])
+		b.mu.Lock()
+		ch, ok := b.pending[id]
+		delete(b.pending, id)
+		b.mu.Unlock()
+		// Callers that timed out are no longer waiting
+		if ok {
+			ch <- binaryResponse{status: header[9], payload: payload}
+		}
+	}
+}
+
+// fail closes conn and fails the requests waiting on it, unless it was already replaced.
+func (b *BinaryIndexConn) fail(conn net.Conn, err error) {
+	b.mu.Lock()
+	if b.conn == conn {
+		b.conn = nil
+		for id, ch := range b.pending {
+			ch <- binaryResponse{err: err}
+			delete(b.pending, id)
+		}
+	}
+	b.mu.Unlock()
+	conn.Close()
+}
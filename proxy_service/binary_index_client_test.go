@@ -0,0 +1,155 @@
+package main
+
+import (
+	"encoding/binary"
+	"errors"
+	"io"
+	"math"
+	"net"
+	"sync"
+	"testing"
+	"time"
+)
+
+type binaryFrame struct {
+	id      uint32
+	op      byte
+	payload []byte
+}
+
+// serveBinary answers the frames of each connection in batches of `batch`, in reverse
+// order, with the frames returned by `answer`.
+func serveBinary(t *testing.T, batch int, answer func(binaryFrame) (byte, []byte)) string {
+	listener, err := net.Listen("tcp", "127.0.0.1:0")
+	if err != nil {
+		t.Fatal(err)
+	}
+	t.Cleanup(func() { listener.Close() })
+
+	go func() {
+		for {
+			conn, err := listener.Accept()
+			if err != nil {
+				return
+			}
+			go func() {
+				defer conn.Close()
+				for {
+					var frames []binaryFrame
+					for len(frames) < batch {
+						header := make([]byte, binaryHeaderSize)
+						if _, err := io.ReadFull(conn, header); err != nil {
+							return
+						}
+						payload := make([]byte, binary.LittleEndian.Uint32(header))
+						if _, err := io.ReadFull(conn, payload); err != nil {
+							return
+						}
+						frames = append(frames, binaryFrame{binary.LittleEndian.Uint32(header[4:]), header[8], payload})
+					}
+					for i := len(frames) - 1; i >= 0; i-- {
+						status, payload := answer(frames[i])
+						header := make([]byte, binaryHeaderSize)
+						binary.LittleEndian.PutUint32(header, uint32(len(payload)))
+						binary.LittleEndian.PutUint32(header[4:], frames[i].id)
+						header[8] = frames[i].op
+						header[9] = status
+						conn.Write(append(header, payload...))
+					}
+				}
+			}()
+		}
+	}()
+	return listener.Addr().String()
+}
+
+// queryContext decodes the single context of a query payload.
+func queryContext(payload []byte) string {
+	namespaceLen := binary.LittleEndian.Uint32(payload[8:])
+	offset := 12 + namespaceLen + 4
+	contextLen := binary.LittleEndian.Uint32(payload[offset:])
+	return string(payload[offset+4 : offset+4+contextLen])
+}
+
+func queryResult(id int64, distance float64) []byte {
+	resp := binary.LittleEndian.AppendUint32(nil, 1)
+	resp = binary.LittleEndian.AppendUint64(resp, uint64(id))
+	resp = binary.LittleEndian.AppendUint64(resp, math.Float64bits(distance))
+	return binary.LittleEndian.AppendUint64(resp, math.Float64bits(1-distance/2))
+}
+
+func TestParseBinaryAddr(t *testing.T) {
+	if network, addr := ParseBinaryAddr("unix:/run/index.sock"); network != "unix" || addr != "/run/index.sock" {
+		t.Errorf("Expected a unix socket, got %v %v", network, addr)
+	}
+	if network, addr := ParseBinaryAddr("indexer:9000"); network != "tcp" || addr != "indexer:9000" {
+		t.Errorf("Expected a tcp address, got %v %v", network, addr)
+	}
+}
+
+func TestBinaryQueriesArePipelined(t *testing.T) {
+	// Two queries must be in flight at once for the server to answer either
+	addr := serveBinary(t, 2, func(frame binaryFrame) (byte, []byte) {
+		if queryContext(frame.payload) == "hit" {
+			return binaryStatusOK, queryResult(7, 0.25)
+		}
+		return binaryStatusOK, queryResult(-1, math.NaN())
+	})
+	conn := NewBinaryIndexConn(addr, 5*time.Second)
+	defer conn.Close()
+
+	var wg sync.WaitGroup
+	results := make([]QueryResponse, 2)
+	errs := make([]error, 2)
+	for i, context := range []string{"hit", "miss"} {
+		wg.Add(1)
+		go func(i int, context string) {
+			defer wg.Done()
+			results[i], errs[i] = conn.QueryIndex(context, 0.5)
+		}(i, context)
+	}
+	wg.Wait()
+
+	if errs[0] != nil || errs[1] != nil {
+		t.Fatalf("Expected no errors, got %v", errs)
+	}
+	if results[0].Id != 7 || results[0].Distance != 0.25 {
+		t.Errorf("Expected a hit on 7, got %+v", results[0])
+	}
+	if results[1] != (QueryResponse{}) {
+		t.Errorf("Expected an empty response for a miss, got %+v", results[1])
+	}
+}
+
+func TestBinaryErrorStatuses(t *testing.T) {
+	addr := serveBinary(t, 1, func(frame binaryFrame) (byte, []byte) {
+		if frame.op == binaryOpAdd {
+			return 1, []byte("add failed")
+		}
+		return binaryStatusUnavailable, []byte("Service is warming up")
+	})
+	client := NewIndexClient(IndexConfig{BinaryAddr: addr})
+
+	if _, err := client.QueryIndex("test context", 0.5); !errors.Is(err, ErrIndexUnavailable) {
+		t.Errorf("Expected ErrIndexUnavailable, got %v", err)
+	}
+	if err := client.AddIndex(1, "test context"); err == nil || err.Error() != "add failed" {
+		t.Errorf("Expected the server's error, got %v", err)
+	}
+}
+
+func TestBinaryConnectionIsRedialled(t *testing.T) {
+	addr := serveBinary(t, 1, func(frame binaryFrame) (byte, []byte) {
+		return binaryStatusOK, nil
+	})
+	conn := NewBinaryIndexConn(addr, 5*time.Second)
+
+	if err := conn.AddIndex(1, "first"); err != nil {
+		t.Fatalf("Expected no error, got %v", err)
+	}
+	conn.Close()
+	if err := conn.AddIndex(2, "second"); err != nil {
+		t.Errorf("Expected the connection to be dialled again, got %v", err)
+	}
+	conn.Close()
+}
@@ -2,6 +2,7 @@ package main
 
 import (
 	"context"
+	"errors"
 	"log"
 	"strings"
 )
@@ -41,6 +42,11 @@ func (c *CacheService) Get(ctx context.Context, context []string) ([]byte, error
 	// Step 1 - Get the cache key from index service
 	// TODO: make threshold configurable via injected service config
 	idRes, err := c.indexClient.QueryIndex(strings.Join(context, " "), c.config.Threshold)
+	if errors.Is(err, ErrIndexUnavailable) {
+		// The index is warming up, so treat it as a miss without waiting on it
+		log.Print("Index service unavailable, bypassing cache")
+		return []byte{}, nil
+	}
 	if err != nil {
 		return []byte{}, err
 	}
@@ -5,6 +5,7 @@ import (
 	"log"
 	"os"
 	"strconv"
+	"time"
 
 	"github.com/joho/godotenv"
 )
@@ -18,6 +19,10 @@ type RedisConfig struct {
 type IndexConfig struct {
 	BaseUrl string
 	Client  Client
+	// BinaryAddr is the index service's binary protocol address, "unix:/path/to.sock"
+	// or "host:port". When set, queries and adds use it instead of HTTP.
+	BinaryAddr    string
+	BinaryTimeout time.Duration
 }
 
 type CacheServiceConfig struct {
@@ -94,5 +99,17 @@ func NewConfig() *Config {
 		}
 	}
 
+	if addr := os.Getenv("INDEX_BINARY_ADDR"); addr != "" {
+		defaultConfig.Index.BinaryAddr = addr
+	}
+
+	if timeoutStr := os.Getenv("INDEX_BINARY_TIMEOUT_MS"); timeoutStr != "" {
+		if timeout, err := strconv.Atoi(timeoutStr); err == nil {
+			defaultConfig.Index.BinaryTimeout = time.Duration(timeout) * time.Millisecond
+		} else {
+			log.Printf("Failed to parse INDEX_BINARY_TIMEOUT_MS: %v, using default", err)
+		}
+	}
+
 	return defaultConfig
 }
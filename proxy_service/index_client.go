@@ -5,10 +5,13 @@ import (
 	"encoding/json"
 	"errors"
 	"net/http"
+	"time"
 )
 
 type IndexClient struct {
 	config IndexConfig
+	// Single queries and adds use the binary protocol when an address is configured
+	binary *BinaryIndexConn
 }
 
 type QueryRequest struct {
@@ -22,8 +25,9 @@ type AddRequest struct {
 }
 
 type QueryResponse struct {
-	Id       int64   `json:"id"`
-	Distance float32 `json:"distance"`
+	Id         int64   `json:"id"`
+	Distance   float32 `json:"distance"`
+	Similarity float32 `json:"similarity"`
 }
 
 type AddResponse struct {
@@ -35,10 +39,23 @@ type ErrResponse struct {
 	Detail string `json:"detail"`
 }
 
+// ErrIndexUnavailable is returned when the index service answers 503, e.g. while it is
+// still loading its model and index after a start. Callers should bypass the cache
+// rather than retry.
+var ErrIndexUnavailable = errors.New("index service unavailable")
+
 func NewIndexClient(config IndexConfig) *IndexClient {
-	return &IndexClient{
+	client := &IndexClient{
 		config: config,
 	}
+	if config.BinaryAddr != "" {
+		timeout := config.BinaryTimeout
+		if timeout == 0 {
+			timeout = 5 * time.Second
+		}
+		client.binary = NewBinaryIndexConn(config.BinaryAddr, timeout)
+	}
+	return client
 }
 
 // QueryIndex sends a query to the index microservice and returns the query response.
@@ -50,6 +67,10 @@ func NewIndexClient(config IndexConfig) *IndexClient {
 // Note: It is important for callers to check both the returned QueryResponse and error. An empty QueryResponse
 // with a nil error indicates a successful query with no matches found.
 func (i *IndexClient) QueryIndex(context string, distanceThreshold float32) (QueryResponse, error) {
+	if i.binary != nil {
+		return i.binary.QueryIndex(context, distanceThreshold)
+	}
+
 	endpoint := "/queryIndex"
 	query := QueryRequest{
 		Context:           context,
@@ -84,6 +105,10 @@ func (i *IndexClient) QueryIndex(context string, distanceThreshold float32) (Que
 		return QueryResponse{}, nil
 	}
 
+	if resp.StatusCode == http.StatusServiceUnavailable {
+		return QueryResponse{}, ErrIndexUnavailable
+	}
+
 	// If not OK, return error
 	if resp.StatusCode != http.StatusOK {
 		var errorResp ErrResponse
@@ -109,6 +134,10 @@ func (i *IndexClient) QueryIndex(context string, distanceThreshold float32) (Que
 // AddIndex adds an index with the specified ID and context to the index service.
 // It returns an `AddResponse` containing the result of the operation and an error, if any.
 func (i *IndexClient) AddIndex(id int64, context string) error {
+	if i.binary != nil {
+		return i.binary.AddIndex(id, context)
+	}
+
 	endpoint := "/addIndex"
 	query := AddRequest{
 		Id:      id,
@@ -134,6 +163,10 @@ func (i *IndexClient) AddIndex(id int64, context string) error {
 
 	defer resp.Body.Close()
 
+	if resp.StatusCode == http.StatusServiceUnavailable {
+		return ErrIndexUnavailable
+	}
+
 	// If not OK, return error
 	if resp.StatusCode != http.StatusOK {
 		var errorResp ErrResponse
@@ -154,3 +187,96 @@ func (i *IndexClient) AddIndex(id int64, context string) error {
 
 	return nil
 }
+
+type QueryBatchRequest struct {
+	Contexts          []string `json:"contexts"`
+	DistanceThreshold float32  `json:"distance_threshold"`
+}
+
+type QueryBatchResponse struct {
+	Results []QueryResponse `json:"results"`
+}
+
+type AddBatchRequest struct {
+	Items []AddRequest `json:"items"`
+}
+
+type AddBatchResponse struct {
+	Results []AddResponse `json:"results"`
+}
+
+// QueryIndexBatch queries the index microservice for several contexts in a single request.
+// The contexts are embedded and searched together, so this is much cheaper than one
+// QueryIndex call per context for bulk work such as backfills.
+// It returns one QueryResponse per context, in order. As with QueryIndex, an empty
+// QueryResponse means no match was found for that context.
+func (i *IndexClient) QueryIndexBatch(contexts []string, distanceThreshold float32) ([]QueryResponse, error) {
+	query := QueryBatchRequest{
+		Contexts:          contexts,
+		DistanceThreshold: distanceThreshold,
+	}
+
+	var queryResp QueryBatchResponse
+	if err := i.postBatch("/queryIndexBatch", query, &queryResp); err != nil {
+		return nil, err
+	}
+
+	return queryResp.Results, nil
+}
+
+// AddIndexBatch adds several (id, context) pairs to the index service in a single request.
+// It returns an error if the request failed, or if any item could not be added.
+func (i *IndexClient) AddIndexBatch(items []AddRequest) error {
+	var addResp AddBatchResponse
+	if err := i.postBatch("/addIndexBatch", AddBatchRequest{Items: items}, &addResp); err != nil {
+		return err
+	}
+
+	for _, result := range addResp.Results {
+		if result.Status != "success" {
+			return errors.New(result.Message)
+		}
+	}
+
+	return nil
+}
+
+// postBatch posts a JSON body to a batch endpoint and decodes the JSON response into out.
+func (i *IndexClient) postBatch(endpoint string, body any, out any) error {
+	reqBody, err := json.Marshal(body)
+	if err != nil {
+		return err
+	}
+
+	req, err := http.NewRequest("POST", i.config.BaseUrl+endpoint, bytes.NewBuffer(reqBody))
+	if err != nil {
+		return err
+	}
+
+	req.Header.Set("Content-Type", "application/json")
+
+	resp, err := i.config.Client.Do(req)
+	if err != nil {
+		return err
+	}
+
+	defer resp.Body.Close()
+
+	if resp.StatusCode == http.StatusServiceUnavailable {
+		return ErrIndexUnavailable
+	}
+
+	// If not OK, return error
+	if resp.StatusCode != http.StatusOK {
+		var errorResp ErrResponse
+
+		err = json.NewDecoder(resp.Body).Decode(&errorResp)
+		if err != nil {
+			return err
+		}
+
+		return errors.New(errorResp.Detail)
+	}
+
+	return json.NewDecoder(resp.Body).Decode(out)
+}
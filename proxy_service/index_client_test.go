@@ -3,6 +3,7 @@ package main
 import (
 	"bytes"
 	"encoding/json"
+	"errors"
 	"io"
 	"io/ioutil"
 	"net/http"
@@ -110,6 +111,29 @@ func TestQueryIndex(t *testing.T) {
 		}
 
 	})
+
+	t.Run("warming up", func(t *testing.T) {
+		client := &MockClient{
+			MockDo: func(req *http.Request) (*http.Response, error) {
+				respBody, _ := json.Marshal(ErrResponse{Detail: "Service is warming up"})
+				return &http.Response{
+					StatusCode: http.StatusServiceUnavailable,
+					Body:       io.NopCloser(bytes.NewReader(respBody)),
+				}, nil
+			},
+		}
+
+		config := IndexConfig{
+			BaseUrl: "http://example.com",
+			Client:  client,
+		}
+
+		indexClient := NewIndexClient(config)
+		_, err := indexClient.QueryIndex("test context", 0.5)
+		if !errors.Is(err, ErrIndexUnavailable) {
+			t.Errorf("Expected ErrIndexUnavailable, got %v", err)
+		}
+	})
 }
 
 func TestAddIndex(t *testing.T) {
@@ -140,3 +164,74 @@ func TestAddIndex(t *testing.T) {
 		}
 	})
 }
+
+func TestQueryIndexBatch(t *testing.T) {
+	client := &MockClient{
+		MockDo: func(req *http.Request) (*http.Response, error) {
+			if req.URL.Path != "/queryIndexBatch" {
+				t.Errorf("Expected /queryIndexBatch, got %v", req.URL.Path)
+			}
+			respBody := []byte(`{"results": [{"id": 7, "distance": 0.1}, {"id": null, "distance": null}]}`)
+			return &http.Response{
+				StatusCode: http.StatusOK,
+				Body:       io.NopCloser(bytes.NewReader(respBody)),
+			}, nil
+		},
+	}
+
+	indexClient := NewIndexClient(IndexConfig{BaseUrl: "http://example.com", Client: client})
+	results, err := indexClient.QueryIndexBatch([]string{"a", "b"}, 0.2)
+	if err != nil {
+		t.Errorf("Expected no error, got %v", err)
+	}
+	if len(results) != 2 || results[0].Id != 7 || results[1] != (QueryResponse{}) {
+		t.Errorf("Unexpected results %v", results)
+	}
+}
+
+func TestAddIndexBatch(t *testing.T) {
+	t.Run("success", func(t *testing.T) {
+		client := &MockClient{
+			MockDo: func(req *http.Request) (*http.Response, error) {
+				var body AddBatchRequest
+				json.NewDecoder(req.Body).Decode(&body)
+				if len(body.Items) != 2 || body.Items[1].Id != 2 {
+					t.Errorf("Unexpected request %v", body)
+				}
+				respBody, _ := json.Marshal(AddBatchResponse{
+					Results: []AddResponse{{Status: "success"}, {Status: "success"}},
+				})
+				return &http.Response{
+					StatusCode: http.StatusOK,
+					Body:       io.NopCloser(bytes.NewReader(respBody)),
+				}, nil
+			},
+		}
+
+		indexClient := NewIndexClient(IndexConfig{BaseUrl: "http://example.com", Client: client})
+		err := indexClient.AddIndexBatch([]AddRequest{{Id: 1, Context: "a"}, {Id: 2, Context: "b"}})
+		if err != nil {
+			t.Errorf("Expected no error, got %v", err)
+		}
+	})
+
+	t.Run("item error", func(t *testing.T) {
+		client := &MockClient{
+			MockDo: func(req *http.Request) (*http.Response, error) {
+				respBody, _ := json.Marshal(AddBatchResponse{
+					Results: []AddResponse{{Status: "error", Message: "model failure"}},
+				})
+				return &http.Response{
+					StatusCode: http.StatusOK,
+					Body:       io.NopCloser(bytes.NewReader(respBody)),
+				}, nil
+			},
+		}
+
+		indexClient := NewIndexClient(IndexConfig{BaseUrl: "http://example.com", Client: client})
+		err := indexClient.AddIndexBatch([]AddRequest{{Id: 1, Context: "a"}})
+		if err == nil || err.Error() != "model failure" {
+			t.Errorf("Expected model failure, got %v", err)
+		}
+	})
+}